@@ -0,0 +1,245 @@
+"""
+Модуль кэша ответов ассистента на типовые вопросы
+Похожие формулировки («Расскажи о ваших услугах» и «расскажите про ваши услуги»)
+сводятся к одной записи по сходству символьных n-грамм; ближайшая запись ищется
+через инвертированный индекс n-грамм. Записи живут TTL секунд и вытесняются по LRU.
+Сообщения с личными данными не кэшируются, а отрицание («не делаете») отличает вопрос
+от похожего утвердительного
+"""
+
+import logging
+import math
+import re
+import time
+from collections import Counter, OrderedDict, defaultdict
+from typing import Dict, FrozenSet, Optional, Set
+
+from log_pipeline import redact_pii
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r'\w+')
+
+# Начала сообщений, похожих на вопрос из FAQ
+QUESTION_WORDS = frozenset({
+    'что', 'как', 'какие', 'какой', 'какая', 'каким', 'сколько', 'где', 'когда', 'почему',
+    'зачем', 'кто', 'можно', 'есть', 'чем', 'расскажи', 'расскажите', 'подскажи',
+    'подскажите', 'покажи', 'покажите', 'объясни', 'объясните',
+})
+
+# Слова отрицания: «вы делаете» и «вы не делаете» близки по n-граммам, но ответы на них разные
+NEGATIONS = frozenset({'не', 'нет', 'ни', 'нельзя', 'no', 'not'})
+
+# Представление или адрес в Telegram: ответ на такое сообщение обращается к конкретному человеку
+_INTRODUCTION_RE = re.compile(
+    r'(?i:\b(?:меня\s+зовут|зовут\s+меня|мо[её]\s+имя|my\s+name)\b)'
+    r'|(?<!\w)[Яя]\s*[—–,-]?\s*[А-ЯЁ][а-яё]+'
+    r'|@\w'
+)
+
+
+def normalize(text: str) -> str:
+    """Приводит текст к ключу кэша: нижний регистр, ё → е, только слова через пробел"""
+    return ' '.join(_WORD_RE.findall(text.lower().replace('ё', 'е')))
+
+
+def ngrams(text: str, n: int = 3) -> Counter:
+    """
+    Символьные n-граммы нормализованного текста
+
+    Каждое слово обрамляется пробелами, поэтому окончания и короткие слова
+    тоже дают n-граммы, а перестановка слов почти не меняет набор.
+    """
+    grams: Counter = Counter()
+    for word in text.split():
+        padded = f" {word} "
+        for start in range(max(1, len(padded) - n + 1)):
+            grams[padded[start:start + n]] += 1
+    return grams
+
+
+def negations(text: str) -> FrozenSet[str]:
+    """Слова отрицания в нормализованном тексте"""
+    return frozenset(word for word in text.split() if word in NEGATIONS)
+
+
+def has_personal_data(text: str) -> bool:
+    """Есть ли в сообщении имя, телефон, email или ник пользователя"""
+    return bool(_INTRODUCTION_RE.search(text)) or redact_pii(text) != text
+
+
+class CachedAnswer:
+    """Сохраненный ответ ассистента"""
+
+    __slots__ = ('key', 'answer', 'grams', 'negations', 'norm', 'cost', 'created', 'hits')
+
+    def __init__(self, key: str, answer: str, grams: Counter, cost: float):
+        self.key = key
+        self.answer = answer
+        self.grams = grams
+        self.negations = negations(key)
+        self.norm = math.sqrt(sum(count * count for count in grams.values()))
+        self.cost = cost            # Сколько секунд занял ответ ассистента
+        self.created = time.monotonic()
+        self.hits = 0
+
+
+class AnswerCache:
+    """
+    Кэш ответов на короткие вопросы, не зависящие от истории диалога
+
+    Поиск: точное совпадение нормализованного текста, затем ближайшая запись
+    по косинусному сходству n-грамм среди записей с общими n-граммами и теми же
+    словами отрицания. Кэш привязан к ассистенту: смена OPENAI_ASSISTANT_ID очищает его.
+    """
+
+    def __init__(self, assistant_id: Optional[str], max_entries: int = 1000, ttl: float = 24 * 3600,
+                 threshold: float = 0.85, max_length: int = 200, n: int = 3):
+        """
+        Args:
+            assistant_id: Ассистент, чьи ответы хранятся в кэше
+            max_entries: Максимум записей (лишние вытесняются по LRU)
+            ttl: Время жизни записи (сек)
+            threshold: Минимальное сходство для попадания (0..1)
+            max_length: Сообщения длиннее не кэшируются
+            n: Длина n-граммы
+        """
+        self.assistant_id = assistant_id
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.max_length = max_length
+        self.n = n
+        self._entries: 'OrderedDict[str, CachedAnswer]' = OrderedDict()
+        self._index: Dict[str, Set[str]] = defaultdict(set)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.saved_seconds = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def accepts(self, text: Optional[str]) -> bool:
+        """Похоже ли сообщение на типовой вопрос: короткое, с вопросом и без личных данных"""
+        if not text or len(text) > self.max_length or has_personal_data(text):
+            return False
+        words = normalize(text).split()
+        return bool(words) and ('?' in text or words[0] in QUESTION_WORDS)
+
+    def lookup(self, text: str) -> Optional[CachedAnswer]:
+        """
+        Ищет ответ на такой же или похожий вопрос
+
+        Args:
+            text: Сообщение пользователя
+
+        Returns:
+            Optional[CachedAnswer]: Найденная запись или None
+        """
+        key = normalize(text)
+        entry = self._live(key)
+        if entry is None:
+            entry = self._nearest(ngrams(key, self.n), negations(key))
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(entry.key)
+        entry.hits += 1
+        self.hits += 1
+        return entry
+
+    def store(self, text: str, answer: str, cost: float) -> None:
+        """
+        Сохраняет ответ ассистента
+
+        Args:
+            text: Сообщение пользователя
+            answer: Ответ ассистента
+            cost: Сколько секунд занял ответ (для оценки сэкономленного времени)
+        """
+        key = normalize(text)
+        if not key or not answer:
+            return
+        self._remove(key)
+        entry = CachedAnswer(key, answer, ngrams(key, self.n), cost)
+        self._entries[key] = entry
+        for gram in entry.grams:
+            self._index[gram].add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def record_saving(self, seconds: float) -> None:
+        """Учитывает время, сэкономленное ответом из кэша"""
+        self.saved_seconds += max(0.0, seconds)
+
+    def invalidate(self, assistant_id: Optional[str] = None) -> int:
+        """
+        Очищает кэш (например, при смене ассистента)
+
+        Args:
+            assistant_id: Новый ассистент (None — оставить текущего)
+
+        Returns:
+            int: Сколько записей удалено
+        """
+        removed = len(self._entries)
+        self._entries.clear()
+        self._index.clear()
+        if assistant_id is not None:
+            self.assistant_id = assistant_id
+        self.invalidations += 1
+        return removed
+
+    def stats(self) -> dict:
+        """Размер кэша, доля попаданий и сэкономленное время ассистента"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'saved_seconds': round(self.saved_seconds, 2),
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+    def _expired(self, entry: CachedAnswer) -> bool:
+        return self.ttl > 0 and time.monotonic() - entry.created > self.ttl
+
+    def _live(self, key: str) -> Optional[CachedAnswer]:
+        entry = self._entries.get(key)
+        if entry is not None and self._expired(entry):
+            self._remove(key)
+            return None
+        return entry
+
+    def _nearest(self, grams: Counter, negated: FrozenSet[str]) -> Optional[CachedAnswer]:
+        if not grams:
+            return None
+        # Скалярные произведения только с записями, у которых есть общие n-граммы
+        dots: Dict[str, float] = defaultdict(float)
+        for gram, count in grams.items():
+            for key in self._index.get(gram, ()):
+                dots[key] += count * self._entries[key].grams[gram]
+        norm = math.sqrt(sum(count * count for count in grams.values()))
+        best, best_score = None, self.threshold
+        for key, dot in dots.items():
+            entry = self._entries[key]
+            score = dot / (norm * entry.norm)
+            if score >= best_score and entry.negations == negated and not self._expired(entry):
+                best, best_score = entry, score
+        return best
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for gram in entry.grams:
+            keys = self._index.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[gram]
@@ -5,33 +5,186 @@
 
 import re
 import logging
+from dataclasses import dataclass
+from functools import lru_cache
 from typing import Dict, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Заголовок финального блока заявки, который формирует ассистент
+APPLICATION_HEADER = '[Заявка в рабочий чат]'
+
+# Подписи полей заявки -> имя поля в LeadRecord
+_FIELD_LABELS = {
+    'Имя': 'name',
+    'Телефон': 'phone',
+    'Email': 'email',
+    'E-mail': 'email',
+    'Телеграм': 'telegram',
+    'Telegram': 'telegram',
+    'Запрос': 'request',
+}
+
+# Ключевые слова, косвенно указывающие на заявку (ищутся без учета регистра)
+_INDICATORS = ('заявка', 'заказ', 'консультация', 'сотрудничество', 'услуга', 'проект')
+
+# Один скомпилированный шаблон для всех подписей полей: текст сканируется regex-движком
+# один раз. Заголовок и ключевые слова проверяются поиском подстроки (на C), это
+# быстрее, чем добавлять их в альтернативу шаблона (см. benchmarks/bench_lead_extractor.py).
+_LABEL_SCANNER = re.compile(
+    r'(' + '|'.join(re.escape(label) for label in _FIELD_LABELS) + r'):[ \t]*([^\n]*)'
+)
+
+_NON_DIGITS = re.compile(r'\D+')
+_EMAIL_RE = re.compile(r'[^@\s<>]+@[^@\s<>]+\.[^@\s<>]+')
+
+
+def normalize_phone(phone: Optional[str]) -> Optional[str]:
+    """Приводит российский номер к виду +7XXXXXXXXXX, остальные — к +<цифры>"""
+    if not phone:
+        return None
+    digits = _NON_DIGITS.sub('', phone)
+    if len(digits) == 11 and digits[0] == '8':
+        digits = '7' + digits[1:]
+    elif len(digits) == 10:
+        digits = '7' + digits
+    if len(digits) < 10 or len(digits) > 15:
+        return None
+    return '+' + digits
+
+
+def normalize_email(email: Optional[str]) -> Optional[str]:
+    """Выделяет адрес электронной почты и приводит его к нижнему регистру"""
+    if not email:
+        return None
+    match = _EMAIL_RE.search(email)
+    return match.group(0).lower().rstrip('.,;') if match else None
+
+
+@dataclass(frozen=True)
+class LeadRecord:
+    """
+    Результат разбора текста на заявку
+    
+    Записи кэшируются extract_lead и разделяются между местами вызова, поэтому неизменяемы.
+    __slots__ объявлен явно (dataclass(slots=True) есть только с Python 3.10), поэтому
+    у полей нет значений по умолчанию; пустой результат — EMPTY_LEAD.
+    """
+
+    __slots__ = (
+        'has_header', 'labels', 'name', 'phone', 'email', 'telegram', 'request',
+        'phone_normalized', 'email_normalized', 'indicators', 'confidence',
+    )
+
+    has_header: bool
+    labels: frozenset                   # Какие подписи полей встретились (для is_complete — даже пустые)
+    name: Optional[str]
+    phone: Optional[str]
+    email: Optional[str]
+    telegram: Optional[str]
+    request: Optional[str]
+    phone_normalized: Optional[str]
+    email_normalized: Optional[str]
+    indicators: int                     # Сколько разных ключевых слов найдено
+    confidence: float
+
+    @property
+    def is_complete(self) -> bool:
+        """Финальный блок: заголовок, имя, телефон, запрос и Телеграм или Email"""
+        return (
+            self.has_header
+            and {'name', 'phone', 'request'} <= self.labels
+            and bool(self.labels & {'telegram', 'email'})
+        )
+
+    @property
+    def is_application(self) -> bool:
+        """Похоже на заявку: заголовок и 3 заполненных поля из имени, телефона, email и запроса, либо несколько ключевых слов"""
+        filled = sum(1 for field in ('name', 'phone', 'email', 'request') if getattr(self, field))
+        return (self.has_header and filled >= 3) or self.indicators >= 2
+
+    def as_dict(self) -> Dict[str, str]:
+        """Поля заявки в формате ApplicationHandler.parse_application"""
+        data = {}
+        if self.has_header:
+            data['header'] = APPLICATION_HEADER
+        for field in ('name', 'phone', 'email', 'telegram', 'request'):
+            value = getattr(self, field)
+            if value:
+                data[field] = value
+        return data
+
+
+# Результат разбора пустого текста
+EMPTY_LEAD = LeadRecord(
+    has_header=False, labels=frozenset(), name=None, phone=None, email=None, telegram=None,
+    request=None, phone_normalized=None, email_normalized=None, indicators=0, confidence=0.0,
+)
+
+
+@lru_cache(maxsize=512)
+def extract_lead(text: str) -> LeadRecord:
+    """
+    Разбирает текст за один проход и возвращает LeadRecord
+
+    Результат кэшируется, поэтому клиент OpenAI и бот, проверяющие один и тот же
+    ответ ассистента, сканируют его только один раз.
+    """
+    if not text:
+        return EMPTY_LEAD
+
+    has_header = APPLICATION_HEADER in text
+    values = {}
+    labels = set()
+    if ':' in text:
+        for label, value in _LABEL_SCANNER.findall(text):
+            field = _FIELD_LABELS[label]
+            labels.add(field)
+            value = value.strip()
+            if value and field not in values:
+                values[field] = value
+    text_lower = text.lower()
+    indicators = {word for word in _INDICATORS if word in text_lower}
+
+    if has_header:
+        confidence = min(1.0, 0.4 + 0.12 * len(values))
+    else:
+        confidence = min(0.5, 0.1 * len(indicators) + 0.05 * len(values))
+
+    return LeadRecord(
+        has_header=has_header,
+        labels=frozenset(labels),
+        name=values.get('name'),
+        phone=values.get('phone'),
+        email=values.get('email'),
+        telegram=values.get('telegram'),
+        request=values.get('request'),
+        phone_normalized=normalize_phone(values.get('phone')),
+        email_normalized=normalize_email(values.get('email')),
+        indicators=len(indicators),
+        confidence=round(confidence, 2),
+    )
+
+
 class ApplicationHandler:
     """Класс для обработки заявок от пользователей"""
     
     def __init__(self):
         """Инициализация обработчика заявок"""
-        # Паттерны для определения заявок
-        self.application_patterns = {
-            'header': r'\[Заявка в рабочий чат\]',
-            'name': r'Имя:\s*(.+)',
-            'phone': r'Телефон:\s*(.+)',
-            'email': r'Email:\s*(.+)',
-            'request': r'Запрос:\s*(.+)',
-        }
+        # Разбор выполняет общий однопроходный extract_lead
+        self.extract = extract_lead
+    
+    def parse_lead(self, text: str) -> LeadRecord:
+        """
+        Разбирает текст в типизированную запись заявки
         
-        # Дополнительные индикаторы заявки
-        self.application_indicators = [
-            'заявка',
-            'заказ',
-            'консультация',
-            'сотрудничество',
-            'услуга',
-            'проект'
-        ]
+        Args:
+            text: Текст ответа ассистента
+            
+        Returns:
+            LeadRecord: Поля заявки, нормализованные контакты и уверенность
+        """
+        return self.extract(text or "")
     
     def is_application(self, text: str) -> bool:
         """
@@ -46,46 +199,7 @@ class ApplicationHandler:
         if not text:
             return False
         
-        text_lower = text.lower()
-        
-        # Проверяем основные паттерны заявки
-        if self._check_main_patterns(text):
-            return True
-        
-        # Проверяем дополнительные индикаторы
-        if self._check_indicators(text_lower):
-            return True
-        
-        return False
-    
-    def _check_main_patterns(self, text: str) -> bool:
-        """Проверяет основные паттерны заявки"""
-        # Проверяем наличие заголовка
-        if not re.search(self.application_patterns['header'], text):
-            return False
-        
-        # Проверяем наличие основных полей
-        required_fields = ['name', 'phone', 'email', 'request']
-        found_fields = 0
-        
-        for field in required_fields:
-            if re.search(self.application_patterns[field], text):
-                found_fields += 1
-        
-        # Должно быть найдено минимум 3 поля из 4
-        return found_fields >= 3
-    
-    def _check_indicators(self, text_lower: str) -> bool:
-        """Проверяет дополнительные индикаторы заявки"""
-        # Ищем ключевые слова, указывающие на заявку
-        indicator_count = 0
-        
-        for indicator in self.application_indicators:
-            if indicator in text_lower:
-                indicator_count += 1
-        
-        # Если найдено несколько индикаторов, это может быть заявка
-        return indicator_count >= 2
+        return extract_lead(text).is_application
     
     def parse_application(self, text: str) -> Optional[Dict[str, str]]:
         """
@@ -98,16 +212,7 @@ class ApplicationHandler:
             Dict[str, str]: Словарь с полями заявки или None если парсинг не удался
         """
         try:
-            application_data = {}
-            
-            # Извлекаем данные по паттернам
-            for field, pattern in self.application_patterns.items():
-                match = re.search(pattern, text)
-                if match:
-                    if field == 'header':
-                        application_data[field] = match.group(0)
-                    else:
-                        application_data[field] = match.group(1).strip()
+            application_data = extract_lead(text).as_dict()
             
             # Проверяем, что получили достаточно данных
             if len(application_data) >= 4:  # header + 3 поля
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк аналитики заявок
+Заполняет базу синтетической воронкой и замеряет скорость записи, время
+отчетов (воронка по дням, перцентили времени до заявки) и потоковой выгрузки
+"""
+
+import argparse
+import io
+import json
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from lead_analytics import LeadAnalytics  # noqa: E402
+
+LEAD_TEXT = (
+    "[Заявка в рабочий чат]\nИмя: Иван\nТелефон: +7 900 123-45-67\n"
+    "Email: ivan@example.com\nЗапрос: чат-бот для продаж"
+)
+
+
+def synthetic_events(users: int, days: int, seed: int = 1):
+    """События шины: /start, «Начать диалог», несколько сообщений и иногда заявка"""
+    rnd = random.Random(seed)
+    origin = time.time() - days * 86400
+    for user_id in range(users):
+        ts = origin + rnd.random() * days * 86400
+        yield (ts, 'start', user_id, None)
+        if rnd.random() < 0.7:
+            yield (ts + 5, 'start_chat', user_id, None)
+            for index in range(rnd.randint(0, 6)):
+                yield (ts + 20 * (index + 1), 'message', user_id, None)
+            if rnd.random() < 0.15:
+                yield (ts + rnd.expovariate(1 / 900), 'lead', user_id, {'text': LEAD_TEXT})
+
+
+def _timed(call, repeat: int = 20) -> float:
+    """Медиана времени вызова в миллисекундах"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return round(samples[len(samples) // 2] * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк аналитики заявок")
+    parser.add_argument('--users', type=int, default=300_000, help="Пользователей в синтетической воронке")
+    parser.add_argument('--days', type=int, default=90, help="За сколько дней распределить события")
+    parser.add_argument('--batch', type=int, default=5000, help="Событий в одной транзакции записи")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        analytics = LeadAnalytics(str(Path(tmp) / 'analytics.db'))
+        print(f"🚀 Заполнение: {args.users} пользователей за {args.days} дней")
+        batch, written = [], 0
+        started = time.perf_counter()
+        for item in synthetic_events(args.users, args.days):
+            batch.append(item)
+            if len(batch) >= args.batch:
+                analytics.write_sync(batch)
+                written += len(batch)
+                batch = []
+        analytics.write_sync(batch)
+        written += len(batch)
+        write_seconds = time.perf_counter() - started
+
+        export_started = time.perf_counter()
+        exported = analytics.export_csv(io.StringIO(), 'events')
+        export_seconds = time.perf_counter() - export_started
+
+        results = {
+            **analytics.stats(),
+            'writes_per_s': round(written / write_seconds),
+            'conversion_by_day_ms': _timed(analytics.conversion_by_day),
+            'time_to_lead_ms': _timed(analytics.time_to_lead),
+            'time_to_lead': analytics.time_to_lead(),
+            'export_rows_per_s': round(exported / export_seconds),
+        }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Сквозной бенчмарк бота Synaplink на локальных заглушках API
+Гоняет SynaplinkBot с N синтетическими пользователями против benchmarks/fake_apis.py
+и сохраняет задержки, пропускную способность и память в сравнимом JSON
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_apis import FakeSettings, free_port, serve  # noqa: E402
+from load_generator import make_update, percentile  # noqa: E402
+
+# Метрики, которые сравниваются с базовым прогоном: имя -> True, если больше — лучше
+COMPARED_METRICS = {
+    'reply_p50_ms': False,
+    'reply_p95_ms': False,
+    'reply_p99_ms': False,
+    'start_p95_ms': False,
+    'updates_per_s': True,
+    'rss_per_user_kb': False,
+}
+
+# Начало ответов бота, которые считаются ошибкой обработки
+ERROR_REPLIES = ('Извините', 'Произошла ошибка')
+
+
+def _rss_bytes() -> int:
+    """Текущий RSS процесса (Linux), иначе пиковый по getrusage"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class ReplyWatcher:
+    """Сопоставляет сообщения, которые бот отправил в заглушку, с ожидающими пользователями"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, events):
+        self.loop = loop
+        self.events = events
+        self._waiters: Dict[str, tuple] = {}
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._thread.start()
+
+    def expect(self, chat_id: int, predicate) -> asyncio.Future:
+        """Будущее, которое получит (text_head, timestamp) первого подходящего сообщения"""
+        future = self.loop.create_future()
+        self._waiters[str(chat_id)] = (predicate, future)
+        return future
+
+    def _read(self) -> None:
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+            self.loop.call_soon_threadsafe(self._dispatch, event)
+
+    def _dispatch(self, event) -> None:
+        chat_id, method, has_markup, text_head, timestamp = event
+        waiter = self._waiters.get(str(chat_id))
+        if waiter is None:
+            return
+        predicate, future = waiter
+        if not future.done() and predicate(method, has_markup, text_head):
+            del self._waiters[str(chat_id)]
+            future.set_result((text_head, timestamp))
+
+    def close(self) -> None:
+        self.events.put(None)
+
+
+def _command_update(update_id: int, user_id: int, command: str) -> dict:
+    data = make_update(update_id, user_id, command)
+    data['message']['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+    return data
+
+
+def _callback_update(update_id: int, user_id: int, data: str) -> dict:
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': user,
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private', 'first_name': user['first_name']},
+                'from': {'id': 1, 'is_bot': True, 'first_name': 'Bench'},
+                'text': 'Добро пожаловать',
+            },
+        },
+    }
+
+
+async def run_benchmark(args, base_url: str, events) -> dict:
+    """Прогоняет сценарий пользователей через SynaplinkBot и собирает метрики"""
+    from telegram import Update
+    from bot import SynaplinkBot
+
+    logging.getLogger().setLevel(logging.WARNING)
+    for name in ('httpx', 'openai_client', 'conversation_queue', 'start_pipeline', 'media_cache'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    # Без логотипа бот на каждый /start предупреждает о текстовом баннере
+    logging.getLogger('bot').setLevel(logging.ERROR)
+
+    bot = SynaplinkBot()
+    application = bot.application
+    watcher = ReplyWatcher(asyncio.get_running_loop(), events)
+    update_ids = iter(range(1, 10 ** 9))
+    latencies: Dict[str, List[float]] = {'start': [], 'start_chat': [], 'reply': []}
+    counters = {'updates': 0, 'errors': 0, 'timeouts': 0}
+
+    async def inject(data: dict, chat_id: int, kind: str, predicate) -> None:
+        future = watcher.expect(chat_id, predicate)
+        sent_at = time.time()
+        await application.update_queue.put(Update.de_json(data, application.bot))
+        counters['updates'] += 1
+        try:
+            text_head, received_at = await asyncio.wait_for(future, timeout=args.reply_timeout)
+        except asyncio.TimeoutError:
+            counters['timeouts'] += 1
+            return
+        if text_head.startswith(ERROR_REPLIES):
+            counters['errors'] += 1
+        latencies[kind].append(received_at - sent_at)
+
+    async def user(index: int, delay: float = 0.0) -> None:
+        user_id = 500_000 + index
+        await asyncio.sleep(delay)
+        await inject(_command_update(next(update_ids), user_id, '/start'), user_id, 'start',
+                     lambda method, markup, _: method == 'sendMessage' and markup)
+        await inject(_callback_update(next(update_ids), user_id, 'start_chat'), user_id, 'start_chat',
+                     lambda method, *_: method == 'editMessageText')
+        for _ in range(args.messages):
+            await asyncio.sleep(args.think)
+            await inject(make_update(next(update_ids), user_id), user_id, 'reply',
+                         lambda method, *_: method == 'sendMessage')
+
+    async with application:
+        await bot._post_init(application)
+        await application.start()
+        # Прогревочный пользователь: первые запросы поднимают соединения и кэши
+        await user(-1)
+        for values in latencies.values():
+            values.clear()
+        counters.update(updates=0, errors=0, timeouts=0)
+        rss_base = _rss_bytes()
+        rss_peak = rss_base
+        done = asyncio.Event()
+
+        async def sample_memory():
+            nonlocal rss_peak
+            while not done.is_set():
+                rss_peak = max(rss_peak, _rss_bytes())
+                await asyncio.sleep(0.2)
+
+        sampler = asyncio.create_task(sample_memory())
+        started = time.perf_counter()
+        await asyncio.gather(*(user(i, args.ramp * i / args.users) for i in range(args.users)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await sampler
+        rss_active = _rss_bytes()
+        scheduler_stats = bot.send_scheduler.stats()
+        await application.stop()
+    await bot._post_shutdown(application)
+    watcher.close()
+
+    async with httpx.AsyncClient() as client:
+        fake_stats = (await client.get(f"{base_url}/stats")).json()
+
+    def ms(values: List[float], pct: float) -> float:
+        return round(percentile(values, pct) * 1000, 1)
+
+    metrics = {
+        'reply_p50_ms': ms(latencies['reply'], 50),
+        'reply_p95_ms': ms(latencies['reply'], 95),
+        'reply_p99_ms': ms(latencies['reply'], 99),
+        'start_p50_ms': ms(latencies['start'], 50),
+        'start_p95_ms': ms(latencies['start'], 95),
+        'start_chat_p50_ms': ms(latencies['start_chat'], 50),
+        'start_chat_p95_ms': ms(latencies['start_chat'], 95),
+        'updates': counters['updates'],
+        'replies': len(latencies['reply']),
+        'errors': counters['errors'],
+        'timeouts': counters['timeouts'],
+        'elapsed_s': round(elapsed, 2),
+        'updates_per_s': round(counters['updates'] / elapsed, 2) if elapsed else 0.0,
+        'rss_base_mb': round(rss_base / 2 ** 20, 1),
+        'rss_peak_mb': round(rss_peak / 2 ** 20, 1),
+        'rss_per_user_kb': round(max(0, rss_active - rss_base) / 1024 / max(1, args.users), 1),
+    }
+    return {'metrics': metrics, 'send_scheduler': scheduler_stats, 'fake_apis': fake_stats}
+
+
+def compare(result: dict, baseline: dict, max_regression: float) -> List[str]:
+    """
+    Сравнивает метрики с базовым прогоном и печатает таблицу
+
+    Returns:
+        List[str]: Метрики, ухудшившиеся больше чем на max_regression
+    """
+    regressions = []
+    print(f"\n📊 Сравнение с базой {baseline.get('name')} ({baseline.get('git_rev')}):")
+    for name, higher_is_better in COMPARED_METRICS.items():
+        old = baseline.get('metrics', {}).get(name)
+        new = result['metrics'].get(name)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        mark = '🔴' if worse > max_regression else ('🟢' if worse < -max_regression else '⚪')
+        print(f"   {mark} {name:<18} {old:>10} → {new:>10} ({change:+.1%})")
+        if worse > max_regression:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк SynaplinkBot на заглушках API")
+    parser.add_argument('--name', default='default', help="Имя прогона в JSON")
+    parser.add_argument('--users', type=int, default=50, help="Число синтетических пользователей")
+    parser.add_argument('--messages', type=int, default=3, help="Сообщений от каждого пользователя после /start")
+    parser.add_argument('--think', type=float, default=1.0, help="Пауза пользователя между сообщениями (сек)")
+    parser.add_argument('--ramp', type=float, default=2.0, help="За сколько секунд подключаются все пользователи")
+    parser.add_argument('--reply-timeout', type=float, default=60.0, help="Сколько ждать ответа бота (сек)")
+    parser.add_argument('--run-waiter', default='auto', choices=('auto', 'stream', 'poll'),
+                        help="RUN_WAITER_MODE бота")
+    parser.add_argument('--tg-latency', type=float, default=0.02)
+    parser.add_argument('--tg-error-rate', type=float, default=0.0, help="Доля ответов 429 от Bot API")
+    parser.add_argument('--openai-latency', type=float, default=0.05)
+    parser.add_argument('--openai-error-rate', type=float, default=0.0, help="Доля ответов 500 от OpenAI")
+    parser.add_argument('--run-duration', type=float, default=1.0, help="Время выполнения run ассистента (сек)")
+    parser.add_argument('--lead-every', type=int, default=0, help="Каждый N-й ответ — финальная заявка")
+    parser.add_argument('--output', default=None, help="Куда сохранить JSON (по умолчанию benchmarks/results/<name>.json)")
+    parser.add_argument('--baseline', default=None, help="JSON предыдущего прогона для сравнения")
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help="Допустимое ухудшение метрики относительно базы (доля)")
+    args = parser.parse_args()
+
+    settings = FakeSettings(tg_latency=args.tg_latency, tg_error_rate=args.tg_error_rate,
+                            openai_latency=args.openai_latency, openai_error_rate=args.openai_error_rate,
+                            run_duration=args.run_duration, lead_every=args.lead_every)
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+
+    # Заглушки работают в отдельном процессе, чтобы не делить с ботом CPU и память
+    ctx = multiprocessing.get_context('spawn')
+    events = ctx.Queue()
+    fakes = ctx.Process(target=serve, args=(port, settings, events), daemon=True)
+    fakes.start()
+
+    # Окружение бота задается до импорта config
+    os.environ.update({
+        'TELEGRAM_API_BASE_URL': f"{base_url}/bot",
+        'OPENAI_BASE_URL': f"{base_url}/v1",
+        'RUN_WAITER_MODE': args.run_waiter,
+        'LOGO_IMAGE_URL': '',
+        'CHECKLIST_URL': '',
+    })
+    for key, value in {
+        'TELEGRAM_BOT_TOKEN': '123456:bench',
+        'OPENAI_API_KEY': 'sk-bench',
+        'OPENAI_ASSISTANT_ID': 'asst_bench',
+        'WORKING_CHAT_ID': '-100500',
+        'SESSION_BACKEND': 'memory',
+        'METRICS_PORT': '0',
+    }.items():
+        os.environ.setdefault(key, value)
+
+    try:
+        deadline = time.monotonic() + 15
+        while True:
+            try:
+                httpx.get(f"{base_url}/stats", timeout=1)
+                break
+            except httpx.HTTPError:
+                if time.monotonic() > deadline or not fakes.is_alive():
+                    raise RuntimeError("Заглушки API не запустились")
+                time.sleep(0.1)
+
+        print(f"🚀 {args.users} пользователей × (/start + {args.messages} сообщений), "
+              f"run {args.run_duration} с, режим {args.run_waiter}")
+        measured = asyncio.run(run_benchmark(args, base_url, events))
+    finally:
+        fakes.terminate()
+        fakes.join(5)
+
+    result = {
+        'name': args.name,
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git_rev': _git_revision(),
+        'python': platform.python_version(),
+        'params': {
+            'users': args.users,
+            'messages': args.messages,
+            'think': args.think,
+            'ramp': args.ramp,
+            'run_waiter': args.run_waiter,
+            'session_backend': os.environ['SESSION_BACKEND'],
+            'fake': settings.as_dict(),
+        },
+        **measured,
+    }
+    output = Path(args.output) if args.output else Path(__file__).resolve().parent / 'results' / f"{args.name}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, ensure_ascii=False, indent=2))
+    print(json.dumps(result['metrics'], ensure_ascii=False, indent=2))
+    print(f"💾 Результат сохранен в {output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare(result, baseline, args.max_regression)
+        if regressions:
+            print(f"❌ Регрессия: {', '.join(regressions)}")
+            sys.exit(1)
+        print("✅ Регрессий нет")
+
+
+if __name__ == "__main__":
+    main()
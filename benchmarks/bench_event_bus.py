@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк шины событий воронки
+Замеряет стоимость события на пути обработчика (emit/publish) отдельно и под
+нагрузкой, когда фоновая запись отдает пачки в SQLite-аналитику, JSON-файл и
+локальный HTTP-сборщик; для сравнения — синхронная запись события в SQLite
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from event_bus import EventBus, EventCollector, FileSink, HttpSink  # noqa: E402
+from lead_analytics import LeadAnalytics  # noqa: E402
+
+
+def _per_call_us(seconds: float, calls: int) -> float:
+    return round(seconds / calls * 1e6, 3)
+
+
+def _percentile(samples: list, p: float) -> float:
+    samples.sort()
+    return round(samples[min(len(samples) - 1, int(len(samples) * p / 100))] / 1000, 3)
+
+
+async def bench_isolated(events: int) -> dict:
+    """emit и publish без фоновой записи: чистая стоимость добавления в буфер"""
+    results = {}
+    for policy in ('drop_oldest', 'drop_newest', 'block'):
+        bus = EventBus(capacity=events, batch_size=events + 1, policy=policy)
+        started = time.perf_counter()
+        for user_id in range(events):
+            bus.emit('message', user_id)
+        results[f'emit_us_{policy}'] = _per_call_us(time.perf_counter() - started, events)
+
+    bus = EventBus(capacity=events, batch_size=events + 1)
+    started = time.perf_counter()
+    for user_id in range(events):
+        await bus.publish('message', user_id)
+    results['publish_us'] = _per_call_us(time.perf_counter() - started, events)
+
+    # Полный буфер: каждое событие вытесняет самое старое
+    bus = EventBus(capacity=1000, batch_size=events + 1)
+    started = time.perf_counter()
+    for user_id in range(events):
+        bus.emit('message', user_id)
+    results['emit_us_overflow'] = _per_call_us(time.perf_counter() - started, events)
+    return results
+
+
+async def bench_loaded(tmp: str, events: int, handlers: int, batch: int, policy: str) -> dict:
+    """
+    Параллельные «обработчики» публикуют события, пока шина пишет в три приемника
+
+    Обработчики публикуют быстрее, чем пишут приемники, поэтому буфер
+    переполняется: drop_oldest теряет события, block придерживает обработчики.
+    """
+    collector = await EventCollector(port=0).start()
+    analytics = LeadAnalytics(str(Path(tmp) / f'analytics_{policy}.db'))
+    http = HttpSink(collector.url)
+    bus = EventBus([analytics, FileSink(str(Path(tmp) / f'events_{policy}.jsonl')), http],
+                   capacity=50_000, batch_size=batch, flush_interval=0.05, policy=policy, block_timeout=5)
+    bus.start()
+    samples = []
+    per_handler = events // handlers
+    kinds = ('start', 'start_chat', 'message', 'message', 'button')
+
+    async def handler(offset: int) -> None:
+        for index in range(per_handler):
+            user_id = offset * per_handler + index // len(kinds)
+            started = time.perf_counter_ns()
+            await bus.publish(kinds[index % len(kinds)], user_id)
+            samples.append(time.perf_counter_ns() - started)
+            if index % 8 == 0:
+                await asyncio.sleep(0)  # обработчик уступает циклу, как на реальных await
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(offset) for offset in range(handlers)))
+    publish_seconds = time.perf_counter() - started
+    await bus.close()
+    total_seconds = time.perf_counter() - started
+    await collector.stop()
+    stats = bus.stats()
+    return {
+        'events': len(samples),
+        'publish_us_p50': _percentile(samples, 50),
+        'publish_us_p99': _percentile(samples, 99),
+        'publish_us_mean': round(sum(samples) / len(samples) / 1000, 3),
+        'publish_phase_s': round(publish_seconds, 3),
+        'written_per_s': round(stats['sinks']['analytics']['written'] / total_seconds),
+        'dropped': stats['dropped'],
+        'sinks': stats['sinks'],
+        'collector_received': collector.received,
+    }
+
+
+def bench_sync_sqlite(tmp: str, events: int) -> dict:
+    """Для сравнения: запись каждого события в SQLite прямо в обработчике"""
+    analytics = LeadAnalytics(str(Path(tmp) / 'sync.db'))
+    started = time.perf_counter()
+    for user_id in range(events):
+        analytics.write_sync([(time.time(), 'message', user_id, None)])
+    seconds = time.perf_counter() - started
+    analytics._conn.close()
+    return {'sync_sqlite_us': _per_call_us(seconds, events)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк шины событий")
+    parser.add_argument('--events', type=int, default=200_000, help="Событий в замере под нагрузкой")
+    parser.add_argument('--handlers', type=int, default=100, help="Параллельных обработчиков")
+    parser.add_argument('--batch', type=int, default=500, help="Событий в пачке")
+    parser.add_argument('--sync-events', type=int, default=2000, help="Событий в замере синхронной записи")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {
+            'isolated': asyncio.run(bench_isolated(1_000_000)),
+            'loaded': {
+                policy: asyncio.run(bench_loaded(tmp, args.events, args.handlers, args.batch, policy))
+                for policy in ('drop_oldest', 'block')
+            },
+            'baseline': bench_sync_sqlite(tmp, args.sync_events),
+        }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
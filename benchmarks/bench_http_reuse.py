@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк переиспользования HTTP-соединений
+Сравнивает новый клиент на каждый запрос (как requests.get) с общим пулом
+http_transport для httpx, python-telegram-bot и OpenAI на локальных заглушках API
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_apis import FakeSettings, free_port, serve  # noqa: E402
+from http_transport import connection_stats, create_http_client, telegram_request  # noqa: E402
+from load_generator import percentile  # noqa: E402
+
+TOKEN = '123456:bench'
+
+
+async def _measure(name: str, call, requests: int, concurrency: int) -> dict:
+    """Выполняет requests вызовов с заданной параллельностью и собирает задержки"""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        **connection_stats(name).as_dict(),
+        'requests_per_s': round(requests / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+    }
+
+
+async def run_benchmark(base_url: str, requests: int, concurrency: int) -> dict:
+    from openai import AsyncOpenAI
+    from telegram import Bot
+
+    results = {}
+    url = f"{base_url}/bot{TOKEN}/getMe"
+
+    async def fresh():
+        # Новый клиент на каждый запрос — соединение не переиспользуется
+        async with create_http_client('fresh') as client:
+            (await client.get(url)).raise_for_status()
+
+    results['fresh_client'] = await _measure('fresh', fresh, requests, concurrency)
+
+    async with create_http_client('shared') as client:
+        async def shared():
+            (await client.get(url)).raise_for_status()
+        results['shared_client'] = await _measure('shared', shared, requests, concurrency)
+
+    async with Bot(TOKEN, base_url=f"{base_url}/bot", request=telegram_request('telegram_bench')) as bot:
+        results['telegram'] = await _measure('telegram_bench', bot.get_me, requests, concurrency)
+
+    openai = AsyncOpenAI(api_key='sk-bench', base_url=f"{base_url}/v1",
+                         http_client=create_http_client('openai_bench'))
+    try:
+        results['openai'] = await _measure('openai_bench', openai.beta.threads.create, requests, concurrency)
+    finally:
+        await openai.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк переиспользования HTTP-соединений")
+    parser.add_argument('--requests', type=int, default=500, help="Запросов на каждый клиент")
+    parser.add_argument('--concurrency', type=int, default=50, help="Одновременных запросов")
+    parser.add_argument('--latency', type=float, default=0.01, help="Задержка ответа заглушек (сек)")
+    args = parser.parse_args()
+
+    settings = FakeSettings(tg_latency=args.latency, openai_latency=args.latency)
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    ctx = multiprocessing.get_context('spawn')
+    fakes = ctx.Process(target=serve, args=(port, settings), daemon=True)
+    fakes.start()
+    try:
+        deadline = time.monotonic() + 15
+        while True:
+            try:
+                httpx.get(f"{base_url}/stats", timeout=1)
+                break
+            except httpx.HTTPError:
+                if time.monotonic() > deadline or not fakes.is_alive():
+                    raise RuntimeError("Заглушки API не запустились")
+                time.sleep(0.1)
+        print(f"🚀 {args.requests} запросов на клиент, параллельно {args.concurrency}")
+        results = asyncio.run(run_benchmark(base_url, args.requests, args.concurrency))
+    finally:
+        fakes.terminate()
+        fakes.join(5)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарк разбора заявок
+Сравнивает прежние многопроходные проверки с однопроходным extract_lead
+на корпусе типичных ответов ассистента
+"""
+
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from application_handler import extract_lead  # noqa: E402
+
+SMALL_TALK = [
+    "Здравствуйте! Меня зовут Сани, я ИИ-ассистент Synaplink. Как я могу к вам обращаться?",
+    "Отлично, Иван! Расскажите, пожалуйста, какая задача стоит перед вашим бизнесом?",
+    "Мы разрабатываем чат-ботов, внедряем ИИ в отдел продаж и автоматизируем поддержку. "
+    "Стоимость проекта зависит от объема работ, обычно первая консультация бесплатная.",
+    "Понял вас. Для расчета нам понадобится ваш телефон и удобный способ связи.",
+    "Мы используем Python, современные LLM, векторные базы данных и интеграции с CRM.",
+]
+
+FINAL_BLOCK = (
+    "Спасибо! Я передал вашу заявку менеджеру.\n\n"
+    "[Заявка в рабочий чат]\n"
+    "Имя: {name}\n"
+    "Телефон: {phone}\n"
+    "Телеграм: @{tg}\n"
+    "Email: {email}\n"
+    "Запрос: {request}\n"
+)
+
+
+def build_corpus(size: int, lead_share: float = 0.1, seed: int = 42) -> list:
+    """Корпус ответов ассистента: в основном диалог, часть — финальные заявки"""
+    rnd = random.Random(seed)
+    corpus = []
+    for i in range(size):
+        if rnd.random() < lead_share:
+            corpus.append(FINAL_BLOCK.format(
+                name=rnd.choice(["Иван Иванов", "Мария", "Алексей Петров"]),
+                phone=rnd.choice(["+7 999 123-45-67", "8 (916) 000-11-22", "9031234567"]),
+                tg=f"user{i}",
+                email=f"lead{i}@Example.com",
+                request="Нужен чат-бот для записи клиентов и интеграция с CRM",
+            ))
+        else:
+            # Длинные ответы из нескольких абзацев; номер делает каждый текст уникальным для кэша
+            paragraphs = rnd.sample(SMALL_TALK, k=rnd.randint(1, len(SMALL_TALK)))
+            corpus.append("\n\n".join(paragraphs) + f"\n\nНомер обращения: {i}")
+    return corpus
+
+
+# --- Прежняя реализация: по одному re.search на поле и отдельные подстрочные сканы ---
+
+_LEGACY_PATTERNS = {
+    'header': r'\[Заявка в рабочий чат\]',
+    'name': r'Имя:\s*(.+)',
+    'phone': r'Телефон:\s*(.+)',
+    'email': r'Email:\s*(.+)',
+    'request': r'Запрос:\s*(.+)',
+}
+_LEGACY_INDICATORS = ['заявка', 'заказ', 'консультация', 'сотрудничество', 'услуга', 'проект']
+
+
+def legacy_pipeline(text: str):
+    """OpenAIClient._is_application + _contains_final_application + is_application + parse_application"""
+    client_check = all(i in text for i in ["[Заявка в рабочий чат]", "Имя:", "Телефон:", "Email:", "Запрос:"])
+    bot_check = "[Заявка в рабочий чат]" in text and all(
+        f in text for f in ["Имя:", "Телефон:", "Телеграм:", "Запрос:"])
+    main = bool(re.search(_LEGACY_PATTERNS['header'], text)) and sum(
+        1 for f in ('name', 'phone', 'email', 'request') if re.search(_LEGACY_PATTERNS[f], text)) >= 3
+    lower = text.lower()
+    is_app = main or sum(1 for i in _LEGACY_INDICATORS if i in lower) >= 2
+    data = {}
+    for field, pattern in _LEGACY_PATTERNS.items():
+        match = re.search(pattern, text)
+        if match:
+            data[field] = match.group(0) if field == 'header' else match.group(1).strip()
+    return client_check, bot_check, is_app, data
+
+
+def new_pipeline(text: str):
+    """Те же четыре проверки: первая разбирает текст, остальные берут запись из кэша"""
+    client_check = extract_lead(text).is_complete
+    bot_check = extract_lead(text).is_complete
+    is_app = extract_lead(text).is_application
+    data = extract_lead(text).as_dict()
+    return client_check, bot_check, is_app, data
+
+
+def single_scan(text: str):
+    """Стоимость одного разбора без кэша"""
+    return extract_lead.__wrapped__(text)
+
+
+def bench(func, corpus, repeat: int) -> float:
+    """Лучшее время одного прохода по корпусу в микросекундах на текст"""
+    best = float('inf')
+    for _ in range(repeat):
+        extract_lead.cache_clear()
+        started = time.perf_counter()
+        for text in corpus:
+            func(text)
+        best = min(best, time.perf_counter() - started)
+    return best / len(corpus) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк разбора заявок")
+    parser.add_argument('--size', type=int, default=5000, help="Размер корпуса")
+    parser.add_argument('--repeat', type=int, default=5, help="Число повторов")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.size)
+    legacy = bench(legacy_pipeline, corpus, args.repeat)
+    shared = bench(new_pipeline, corpus, args.repeat)
+    single = bench(single_scan, corpus, args.repeat)
+    print(f"📚 Корпус: {len(corpus)} ответов ассистента")
+    print(f"🐢 Прежние проверки (все места вызова): {legacy:8.2f} мкс/ответ")
+    print(f"⚡ extract_lead (все места вызова):     {shared:8.2f} мкс/ответ (x{legacy / shared:.1f})")
+    print(f"🔎 Один разбор extract_lead без кэша:   {single:8.2f} мкс/ответ")
+
+
+if __name__ == "__main__":
+    main()
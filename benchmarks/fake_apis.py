@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+Локальные заглушки Telegram Bot API и OpenAI Assistants API для бенчмарков
+Одно ASGI-приложение обслуживает оба API с настраиваемой задержкой и долей ошибок
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import socket
+import time
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl
+
+LEAD_REPLY = (
+    "Спасибо! Передаю вашу заявку менеджеру.\n\n"
+    "[Заявка в рабочий чат]\n"
+    "Имя: Тест\n"
+    "Телефон: +7 900 000-00-00\n"
+    "Телеграм: @bench\n"
+    "Запрос: Нагрузочный тест"
+)
+
+
+class FakeSettings:
+    """Параметры поведения заглушек"""
+
+    __slots__ = ('tg_latency', 'tg_error_rate', 'tg_retry_after', 'openai_latency',
+                 'openai_error_rate', 'run_duration', 'stream_chunks', 'lead_every')
+
+    def __init__(self, tg_latency: float = 0.02, tg_error_rate: float = 0.0, tg_retry_after: int = 1,
+                 openai_latency: float = 0.05, openai_error_rate: float = 0.0, run_duration: float = 1.0,
+                 stream_chunks: int = 8, lead_every: int = 0):
+        """
+        Args:
+            tg_latency: Задержка ответа Bot API (сек)
+            tg_error_rate: Доля запросов Bot API, получающих 429
+            tg_retry_after: retry_after в ответах 429 (сек)
+            openai_latency: Задержка ответа OpenAI API (сек)
+            openai_error_rate: Доля запросов к OpenAI, получающих 500
+            run_duration: Сколько выполняется run ассистента (сек)
+            stream_chunks: На сколько дельт делится ответ в потоковом режиме
+            lead_every: Каждый N-й ответ ассистента содержит финальную заявку (0 — никогда)
+        """
+        self.tg_latency = tg_latency
+        self.tg_error_rate = tg_error_rate
+        self.tg_retry_after = tg_retry_after
+        self.openai_latency = openai_latency
+        self.openai_error_rate = openai_error_rate
+        self.run_duration = run_duration
+        self.stream_chunks = stream_chunks
+        self.lead_every = lead_every
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def _jitter(value: float) -> float:
+    """Задержка ±20%, чтобы запросы не шли строем"""
+    return value * random.uniform(0.8, 1.2) if value > 0 else 0.0
+
+
+class FakeApis:
+    """
+    ASGI-приложение с заглушками обоих API
+
+    /bot<token>/<method> — Telegram Bot API, /v1/... — OpenAI Assistants API.
+    О каждом исходящем сообщении бота сообщается через on_event.
+    """
+
+    def __init__(self, settings: FakeSettings, on_event=None):
+        """
+        Args:
+            settings: Параметры задержек и ошибок
+            on_event: Функция (chat_id, method, has_markup, text_head, timestamp) для сообщений бота
+        """
+        self.settings = settings
+        self.on_event = on_event
+        self.ids = itertools.count(1)
+        self.threads: Dict[str, List[dict]] = {}
+        self.runs: Dict[str, dict] = {}
+        self.replies = 0
+        self.requests = {'telegram': 0, 'openai': 0}
+        # Объем ответов messages.list: должен не зависеть от длины диалога
+        self.message_list = {'calls': 0, 'bytes': 0, 'max_bytes': 0}
+        self.injected_errors = {'telegram': 0, 'openai': 0}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            return
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        path = scope['path']
+        if path.startswith('/bot'):
+            await self._telegram(scope, body, send)
+        elif path.startswith('/v1/'):
+            await self._openai(scope, path[4:].strip('/').split('/'), body, send)
+        elif path == '/stats':
+            await _respond(send, 200, {'requests': self.requests, 'injected_errors': self.injected_errors,
+                                       'threads': len(self.threads), 'runs': len(self.runs),
+                                       'message_list': self.message_list})
+        else:
+            await _respond(send, 404, {'error': 'not found'})
+
+    # --- Telegram Bot API ---
+
+    async def _telegram(self, scope, body: bytes, send) -> None:
+        self.requests['telegram'] += 1
+        method = scope['path'].rsplit('/', 1)[-1]
+        params = _parse_telegram_params(scope, body)
+        await asyncio.sleep(_jitter(self.settings.tg_latency))
+
+        if method not in ('getMe', 'answerCallbackQuery') and random.random() < self.settings.tg_error_rate:
+            self.injected_errors['telegram'] += 1
+            await _respond(send, 429, {
+                'ok': False, 'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.settings.tg_retry_after}",
+                'parameters': {'retry_after': self.settings.tg_retry_after},
+            })
+            return
+
+        chat_id = params.get('chat_id')
+        result = True
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        elif method in ('sendMessage', 'editMessageText', 'sendPhoto', 'sendDocument'):
+            result = self._telegram_message(method, params)
+        if self.on_event is not None and method in ('sendMessage', 'editMessageText', 'sendPhoto', 'sendDocument'):
+            self.on_event(chat_id, method, 'reply_markup' in params, str(params.get('text', ''))[:40], time.time())
+        await _respond(send, 200, {'ok': True, 'result': result})
+
+    def _telegram_message(self, method: str, params: dict) -> dict:
+        chat_id = params.get('chat_id') or 0
+        message = {
+            'message_id': int(params.get('message_id') or next(self.ids)),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'private' if not str(chat_id).startswith('-') else 'group'},
+            'from': {'id': 1, 'is_bot': True, 'first_name': 'Bench'},
+        }
+        if method == 'sendPhoto':
+            message['photo'] = [{'file_id': 'photo-file', 'file_unique_id': 'photo', 'width': 1, 'height': 1}]
+        elif method == 'sendDocument':
+            message['document'] = {'file_id': 'doc-file', 'file_unique_id': 'doc'}
+        else:
+            message['text'] = params.get('text', '')
+        return message
+
+    # --- OpenAI Assistants API ---
+
+    async def _openai(self, scope, parts: List[str], body: bytes, send) -> None:
+        self.requests['openai'] += 1
+        await asyncio.sleep(_jitter(self.settings.openai_latency))
+        if random.random() < self.settings.openai_error_rate:
+            self.injected_errors['openai'] += 1
+            await _respond(send, 500, {'error': {'message': 'injected failure', 'type': 'server_error'}})
+            return
+
+        method = scope['method']
+        payload = json.loads(body) if body else {}
+        now = int(time.time())
+
+        if parts == ['threads'] and method == 'POST':
+            thread_id = f"thread_{next(self.ids)}"
+            self.threads[thread_id] = [
+                _message(f"msg_{next(self.ids)}", thread_id, item.get('role', 'user'), str(item.get('content', '')))
+                for item in payload.get('messages') or []
+            ]
+            await _respond(send, 200, {'id': thread_id, 'object': 'thread', 'created_at': now, 'metadata': {}})
+            return
+        if len(parts) < 2 or parts[0] != 'threads':
+            await _respond(send, 404, {'error': {'message': 'unknown endpoint'}})
+            return
+
+        thread_id = parts[1]
+        if len(parts) == 2 and method == 'DELETE':
+            self.threads.pop(thread_id, None)
+            await _respond(send, 200, {'id': thread_id, 'object': 'thread.deleted', 'deleted': True})
+            return
+        messages = self.threads.get(thread_id)
+        if messages is None:
+            await _respond(send, 404, {'error': {'message': f"No thread found with id '{thread_id}'"}})
+            return
+
+        resource = parts[2] if len(parts) > 2 else None
+        if resource == 'messages' and method == 'POST':
+            message = _message(f"msg_{next(self.ids)}", thread_id, payload.get('role', 'user'),
+                               str(payload.get('content', '')))
+            messages.append(message)
+            await _respond(send, 200, message)
+        elif resource == 'messages' and method == 'GET':
+            query = dict(parse_qsl(scope.get('query_string', b'').decode()))
+            data = list(reversed(messages)) if query.get('order', 'desc') == 'desc' else list(messages)
+            if query.get('after'):
+                # Курсор — позиция в thread, фильтр по run_id применяется после него
+                ids = [m['id'] for m in data]
+                data = data[ids.index(query['after']) + 1:] if query['after'] in ids else []
+            if query.get('run_id'):
+                data = [m for m in data if m.get('run_id') == query['run_id']]
+            limit = int(query.get('limit', 20))
+            payload = {
+                'object': 'list', 'data': data[:limit],
+                'first_id': data[0]['id'] if data else None,
+                'last_id': data[:limit][-1]['id'] if data else None,
+                'has_more': len(data) > limit,
+            }
+            size = await _respond(send, 200, payload)
+            self.message_list['calls'] += 1
+            self.message_list['bytes'] += size
+            self.message_list['max_bytes'] = max(self.message_list['max_bytes'], size)
+        elif resource == 'runs' and len(parts) == 3 and method == 'POST':
+            run = self._create_run(thread_id, payload.get('assistant_id', ''))
+            if payload.get('stream'):
+                await self._stream_run(run, send)
+            else:
+                await _respond(send, 200, self._run_object(run))
+        elif resource == 'runs' and len(parts) == 4 and method == 'GET':
+            run = self.runs.get(parts[3])
+            if run is None:
+                await _respond(send, 404, {'error': {'message': 'run not found'}})
+                return
+            self._advance(run)
+            await _respond(send, 200, self._run_object(run))
+        elif resource == 'runs' and len(parts) == 5 and parts[4] == 'cancel':
+            run = self.runs.get(parts[3])
+            if run is not None and run['status'] not in ('completed', 'cancelled'):
+                run['status'] = 'cancelled'
+            await _respond(send, 200, self._run_object(run) if run else {})
+        else:
+            await _respond(send, 404, {'error': {'message': 'unknown endpoint'}})
+
+    def _create_run(self, thread_id: str, assistant_id: str) -> dict:
+        run = {
+            'id': f"run_{next(self.ids)}",
+            'thread_id': thread_id,
+            'assistant_id': assistant_id,
+            'created_at': time.time(),
+            'done_at': time.time() + _jitter(self.settings.run_duration),
+            'status': 'queued',
+        }
+        self.runs[run['id']] = run
+        return run
+
+    def _next_reply(self, run: dict) -> str:
+        self.replies += 1
+        if self.settings.lead_every and self.replies % self.settings.lead_every == 0:
+            return LEAD_REPLY
+        return f"Ответ #{self.replies}: Synaplink поможет автоматизировать эту задачу с помощью ИИ."
+
+    def _advance(self, run: dict) -> None:
+        """Переводит run в completed, когда истекло его время, и добавляет ответ ассистента"""
+        if run['status'] in ('queued', 'in_progress'):
+            if time.time() >= run['done_at']:
+                self._complete(run, self._next_reply(run))
+            else:
+                run['status'] = 'in_progress'
+
+    def _complete(self, run: dict, text: str) -> dict:
+        run['status'] = 'completed'
+        message = _message(f"msg_{next(self.ids)}", run['thread_id'], 'assistant', text, run['id'])
+        self.threads.setdefault(run['thread_id'], []).append(message)
+        self.runs.pop(run['id'], None)
+        return message
+
+    def _run_object(self, run: dict) -> dict:
+        return {
+            'id': run['id'], 'object': 'thread.run', 'created_at': int(run['created_at']),
+            'thread_id': run['thread_id'], 'assistant_id': run['assistant_id'],
+            'status': run['status'], 'last_error': None, 'instructions': '', 'model': 'fake',
+            'tools': [], 'metadata': {}, 'parallel_tool_calls': False,
+        }
+
+    async def _stream_run(self, run: dict, send) -> None:
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream')]})
+
+        async def event(name: str, data: dict) -> None:
+            chunk = f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode()
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+        await event('thread.run.created', self._run_object(run))
+        run['status'] = 'in_progress'
+        await event('thread.run.in_progress', self._run_object(run))
+
+        text = self._next_reply(run)
+        message_id = f"msg_{next(self.ids)}"
+        await event('thread.message.created', _message(message_id, run['thread_id'], 'assistant', '', run['id']))
+        chunks = max(1, self.settings.stream_chunks)
+        step = max(1, -(-len(text) // chunks))
+        pause = max(0.0, run['done_at'] - time.time()) / chunks
+        for index, start in enumerate(range(0, len(text), step)):
+            await asyncio.sleep(pause)
+            if run['status'] == 'cancelled':
+                break
+            await event('thread.message.delta', {
+                'id': message_id, 'object': 'thread.message.delta',
+                'delta': {'content': [{'index': 0, 'type': 'text',
+                                       'text': {'value': text[start:start + step], 'annotations': []}}]},
+            })
+
+        if run['status'] != 'cancelled':
+            self._complete(run, text)
+        await event(f"thread.run.{run['status']}", self._run_object(run))
+        await send({'type': 'http.response.body', 'body': b'event: done\ndata: [DONE]\n\n'})
+
+
+def _message(message_id: str, thread_id: str, role: str, text: str, run_id: Optional[str] = None) -> dict:
+    return {
+        'id': message_id, 'object': 'thread.message', 'created_at': int(time.time()),
+        'thread_id': thread_id, 'role': role, 'run_id': run_id, 'assistant_id': None,
+        'status': 'completed', 'attachments': [], 'metadata': {},
+        'content': [{'type': 'text', 'text': {'value': text, 'annotations': []}}] if text else [],
+    }
+
+
+def _parse_telegram_params(scope, body: bytes) -> dict:
+    """Параметры запроса Bot API: form-urlencoded, JSON или multipart (без файлов)"""
+    headers = dict(scope.get('headers') or [])
+    content_type = headers.get(b'content-type', b'').decode()
+    if content_type.startswith('application/json'):
+        return json.loads(body or b'{}')
+    if content_type.startswith('multipart/form-data'):
+        params = {}
+        boundary = content_type.split('boundary=', 1)[-1].strip('"').encode()
+        for part in body.split(b'--' + boundary):
+            head, _, value = part.partition(b'\r\n\r\n')
+            marker = b'name="'
+            if marker not in head or b'filename=' in head:
+                continue
+            name = head.split(marker, 1)[1].split(b'"', 1)[0].decode()
+            params[name] = value.rstrip(b'\r\n').decode(errors='replace')
+        return params
+    return dict(parse_qsl(body.decode()))
+
+
+async def _respond(send, status: int, payload) -> int:
+    """Отправляет JSON-ответ и возвращает размер тела в байтах"""
+    body = json.dumps(payload, ensure_ascii=False).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'),
+                            (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+    return len(body)
+
+
+def free_port(host: str = '127.0.0.1') -> int:
+    """Свободный TCP-порт на локальном адресе"""
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def serve(port: int, settings: FakeSettings, events=None, host: str = '127.0.0.1') -> None:
+    """
+    Запускает заглушки в текущем процессе (блокирующий вызов)
+
+    Args:
+        port: Порт для прослушивания
+        settings: Параметры задержек и ошибок
+        events: multiprocessing.Queue для событий отправки сообщений ботом
+    """
+    import uvicorn
+
+    on_event = (lambda *item: events.put(item)) if events is not None else None
+    uvicorn.run(FakeApis(settings, on_event), host=host, port=port, log_level='warning',
+                lifespan='on', access_log=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушки Telegram Bot API и OpenAI Assistants API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--tg-latency', type=float, default=0.02)
+    parser.add_argument('--tg-error-rate', type=float, default=0.0)
+    parser.add_argument('--openai-latency', type=float, default=0.05)
+    parser.add_argument('--openai-error-rate', type=float, default=0.0)
+    parser.add_argument('--run-duration', type=float, default=1.0)
+    parser.add_argument('--lead-every', type=int, default=0)
+    args = parser.parse_args()
+
+    settings = FakeSettings(tg_latency=args.tg_latency, tg_error_rate=args.tg_error_rate,
+                            openai_latency=args.openai_latency, openai_error_rate=args.openai_error_rate,
+                            run_duration=args.run_duration, lead_every=args.lead_every)
+    print(f"🧪 Заглушки API: http://{args.host}:{args.port} "
+          f"(TELEGRAM_API_BASE_URL=http://{args.host}:{args.port}/bot, OPENAI_BASE_URL=http://{args.host}:{args.port}/v1)")
+    serve(args.port, settings, host=args.host)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,11 @@
 Обрабатывает команды, сообщения и интегрируется с OpenAI ассистентом
 """
 
+import asyncio
 import logging
-import re
+import signal
+import time
+from typing import Callable, Iterable, Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application, 
@@ -14,19 +17,41 @@ from telegram.ext import (
     filters,
     ContextTypes
 )
-from config import Config
-from openai_client import OpenAIClient
+from config import Config, ConfigWatcher
+from openai_client import OpenAIClient, PRIMING_MESSAGE
 from application_handler import ApplicationHandler
-import requests
-from io import BytesIO
+from session_store import create_session_store
+from conversation_queue import ConversationQueue, ConversationQueueFull
+from media_cache import MediaCache
+from start_pipeline import PipelineStep, StartPipeline, format_report
+from send_scheduler import SendScheduler
+from lead_outbox import LeadOutbox
+from event_bus import EventBus, FileSink, HttpSink
+from lead_analytics import LeadAnalytics
+from http_transport import connection_stats, get_updates_request, telegram_request
+from reply_streamer import ReplyStreamer
+from shutdown import InflightUpdateProcessor, cancel_tasks, start_watchdog, wait_for_tasks
+from log_pipeline import stop_logging
+from metrics import (
+    instrumented,
+    MetricsServer,
+    ACTIVE_CONVERSATIONS,
+    LEADS_DELIVERED,
+    LEADS_DETECTED,
+    LEADS_FAILED,
+    QUEUE_DEPTH,
+)
 
-# Настраиваем логирование
+# Настраиваем логирование (если run_bot.py уже настроил конвейер логов, basicConfig ничего не меняет)
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
 
+# Запас сторожевого таймера сверх SHUTDOWN_TIMEOUT на закрытие хранилищ и логов (сек)
+WATCHDOG_MARGIN = 5.0
+
 class SynaplinkBot:
     """Основной класс Telegram-бота Synaplink"""
     
@@ -36,19 +61,116 @@ class SynaplinkBot:
             logger.info("🔧 Инициализация бота...")
             logger.info(f"🔑 Создание Application с токеном: {Config.TELEGRAM_BOT_TOKEN[:10]}...")
             
-            self.application = Application.builder().token(Config.TELEGRAM_BOT_TOKEN).build()
+            # Планировщик исходящих запросов: лимиты Telegram и приоритет рабочего чата
+            self.send_scheduler = SendScheduler(
+                priority_chat_id=Config.WORKING_CHAT_ID,
+                global_rate=Config.TELEGRAM_GLOBAL_RATE,
+                private_chat_rate=Config.TELEGRAM_CHAT_RATE,
+                group_chat_rate=Config.TELEGRAM_GROUP_RATE,
+                chat_burst=Config.TELEGRAM_CHAT_BURST,
+                max_retries=Config.TELEGRAM_MAX_RETRIES,
+                max_chats=Config.TELEGRAM_MAX_CHATS
+            )
+            
+            # Обработчики обновлений в процессе: при остановке их дожидаются
+            self.update_processor = InflightUpdateProcessor(Config.CONCURRENT_UPDATES)
+            builder = (
+                Application.builder()
+                .token(Config.TELEGRAM_BOT_TOKEN)
+                .rate_limiter(self.send_scheduler)
+                # Общие настройки пула соединений и таймаутов; long polling — в отдельном пуле
+                .request(telegram_request())
+                .get_updates_request(get_updates_request())
+                .concurrent_updates(self.update_processor)
+                .post_init(self._post_init)
+                .post_shutdown(self._post_shutdown)
+            )
+            if Config.TELEGRAM_API_BASE_URL:
+                # Локальный Bot API сервер или заглушка (benchmarks/fake_apis.py); токен дописывается в конец
+                builder = builder.base_url(Config.TELEGRAM_API_BASE_URL)
+            self.application = builder.build()
             logger.info("✅ Application создан успешно")
             
+            logger.info(f"💾 Создание хранилища сессий ({Config.SESSION_BACKEND})...")
+            self.session_store = create_session_store(
+                Config.SESSION_BACKEND,
+                path=Config.SESSION_DB_PATH,
+                redis_url=Config.SESSION_REDIS_URL,
+                ttl=Config.SESSION_TTL,
+                max_entries=Config.SESSION_MAX_ENTRIES,
+                shards=Config.SESSION_SHARDS
+            )
+            logger.info("✅ Хранилище сессий создано")
+            
+            # Кэш логотипа и чек-листа: загружаются при старте, дальше отправляются по file_id
+            self.media_cache = MediaCache(
+                self.session_store,
+                refresh_interval=Config.MEDIA_REFRESH_INTERVAL,
+                timeout=Config.MEDIA_HTTP_TIMEOUT
+            )
+            self.media_cache.register('logo', Config.LOGO_IMAGE_URL, "logo.png")
+            self.media_cache.register('checklist', Config.CHECKLIST_URL, "5 точек роста с ИИ.pdf")
+            self.start_pipeline = StartPipeline(fanout=Config.START_PIPELINE_FANOUT)
+            
             logger.info("🤖 Создание OpenAI клиента...")
-            self.openai_client = OpenAIClient()
+            self.openai_client = OpenAIClient(self.session_store)
+            # Очередь перед ассистентом: один run на пользователя, склейка сообщений
+            self.conversation_queue = ConversationQueue(
+                self.openai_client.send_message,
+                max_depth=Config.CONVERSATION_QUEUE_DEPTH
+            )
             logger.info("✅ OpenAI клиент создан")
             
+            # Gauge очередей вычисляются при запросе /metrics
+            QUEUE_DEPTH.labels('conversation').set_function(self.conversation_queue.depth)
+            QUEUE_DEPTH.labels('telegram_send').set_function(lambda: len(self.send_scheduler.gate))
+            ACTIVE_CONVERSATIONS.set_function(self.conversation_queue.active)
+            # Фоновые стартовые run по пользователям (см. _start_chat)
+            self.priming_tasks = {}
+            self.metrics_server = None
+            # Корректная остановка: event loop бота, задача остановки, повторный сигнал, сторож
+            self._loop = None
+            self._shutdown_task = None
+            self._hurry = asyncio.Event()
+            self._watchdog = None
+            # События воронки: обработчики кладут их в буфер шины, приемники получают пачками в фоне
+            self.analytics = LeadAnalytics(Config.ANALYTICS_DB_PATH) if Config.ANALYTICS_DB_PATH else None
+            sinks = [self.analytics] if self.analytics is not None else []
+            if Config.EVENT_LOG_PATH:
+                sinks.append(FileSink(Config.EVENT_LOG_PATH))
+            if Config.EVENT_COLLECTOR_URL:
+                sinks.append(HttpSink(Config.EVENT_COLLECTOR_URL))
+            self.events = EventBus(
+                sinks,
+                capacity=Config.EVENT_BUFFER_SIZE,
+                batch_size=Config.EVENT_BATCH_SIZE,
+                flush_interval=Config.EVENT_FLUSH_INTERVAL,
+                policy=Config.EVENT_OVERFLOW_POLICY,
+                block_timeout=Config.EVENT_BLOCK_TIMEOUT
+            )
+            QUEUE_DEPTH.labels('events').set_function(lambda: len(self.events))
+            # Перезагрузка настроек по SIGHUP и при изменении .env
+            self.config_watcher = ConfigWatcher(interval=Config.CONFIG_WATCH_INTERVAL)
+            
             logger.info("📋 Создание ApplicationHandler...")
             self.application_handler = ApplicationHandler()
             logger.info("✅ ApplicationHandler создан")
             
-            self.user_states = {}  # Хранит состояние пользователей
-            logger.info("✅ Словарь состояний пользователей инициализирован")
+            # Заявки сначала сохраняются на диск, затем доставляются в рабочий чат с повторами
+            self.lead_outbox = LeadOutbox(
+                Config.LEAD_OUTBOX_PATH,
+                send=self._send_to_working_chat,
+                batch_size=Config.LEAD_OUTBOX_BATCH,
+                max_attempts=Config.LEAD_OUTBOX_MAX_ATTEMPTS,
+                base_delay=Config.LEAD_OUTBOX_BASE_DELAY,
+                max_delay=Config.LEAD_OUTBOX_MAX_DELAY
+            )
+            self.lead_outbox.on_delivered = LEADS_DELIVERED.inc
+            self.lead_outbox.on_failed = LEADS_FAILED.inc
+            QUEUE_DEPTH.labels('lead_outbox').set_function(lambda: self.lead_outbox.pending)
+            
+            self.user_states = self.session_store.namespace('user_state')  # Хранит состояние пользователей
+            logger.info("✅ Состояния пользователей подключены к хранилищу сессий")
             
             # Регистрируем обработчики
             logger.info("🔧 Регистрация обработчиков...")
@@ -84,61 +206,68 @@ class SynaplinkBot:
         
         logger.info("Все обработчики настроены успешно")
         
-    def _gdrive_to_direct(self, url: str) -> str:
-        """Если ссылка Google Drive вида /file/d/<id>/view, конвертируем в прямую загрузку."""
+    async def _send_media(self, name: str, send, media=None):
+        """
+        Отправляет медиафайл из кэша и запоминает его file_id
+        
+        Args:
+            name: Имя файла в MediaCache
+            send: Функция, принимающая file_id/буфер/ссылку и возвращающая корутину отправки
+            media: Заранее подготовленный MediaCache.get_input результат
+            
+        Returns:
+            Отправленное сообщение или None, если файл недоступен
+        """
+        if media is None:
+            media = await self.media_cache.get_input(name)
+        if media is None:
+            return None
         try:
-            match = re.search(r"drive\.google\.com/file/d/([^/]+)/", url)
-            if match:
-                file_id = match.group(1)
-                return f"https://drive.google.com/uc?export=download&id={file_id}"
-            return url
-        except Exception:
-            return url
+            message = await send(media)
+        except Exception as e:
+            if not isinstance(media, str) or media.startswith('http'):
+                raise
+            # Telegram не принял сохраненный file_id — отправляем содержимое заново
+            logger.warning(f"⚠️ file_id для {name} не принят ({e}), отправляем файл заново")
+            await self.media_cache.invalidate(name)
+            media = await self.media_cache.get_input(name)
+            if media is None:
+                raise
+            message = await send(media)
+        await self.media_cache.remember(name, message)
+        return message
 
-    async def _send_checklist(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Надёжная отправка чек-листа пользователю с красивым именем файла."""
-        if not getattr(Config, 'CHECKLIST_URL', None):
+    async def _send_checklist(self, update: Update, context: ContextTypes.DEFAULT_TYPE, media=None) -> None:
+        """Отправка чек-листа пользователю из кэша (file_id, затем байты, затем ссылка)."""
+        if 'checklist' not in self.media_cache.assets:
             logger.info("ℹ️ CHECKLIST_URL не задан — пропускаем отправку чек-листа")
             return
         chat_id = update.effective_chat.id
-        url = Config.CHECKLIST_URL
         caption = "Чек-лист «5 точек роста с ИИ»"
-        # 1) Пытаемся скачать (сначала сконвертированную GDrive ссылку) и отправить как байты с нужным именем
-        try:
-            direct = self._gdrive_to_direct(url)
-            resp = requests.get(direct, timeout=30)
-            if resp.status_code == 200 and resp.content:
-                buf = BytesIO(resp.content)
-                buf.name = "5 точек роста с ИИ.pdf"
-                await context.bot.send_document(chat_id=chat_id, document=buf, caption=caption)
-                logger.info("✅ Чек-лист отправлен как байты с именем '5 точек роста с ИИ.pdf'")
-                return
-            logger.warning(f"Не удалось скачать чек-лист: HTTP {resp.status_code}")
-        except Exception as e:
-            logger.warning(f"Ошибка скачивания чек-листа: {e}")
-        # 2) Фолбэк: отправляем по прямой/исходной ссылке (имя файла может задать источник)
         try:
-            await context.bot.send_document(chat_id=chat_id, document=self._gdrive_to_direct(url), caption=caption)
-            logger.info("✅ Чек-лист отправлен ссылкой (fallback)")
+            message = await self._send_media(
+                'checklist',
+                lambda media: context.bot.send_document(chat_id=chat_id, document=media, caption=caption),
+                media
+            )
+            if message is not None:
+                logger.info("✅ Чек-лист отправлен")
+            else:
+                logger.error("❌ Чек-лист недоступен для отправки")
         except Exception as e:
-            logger.error(f"❌ Не удалось отправить чек-лист ни одним способом: {e}")
+            logger.error(f"❌ Не удалось отправить чек-лист: {e}")
 
+    @instrumented('start_command')
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start - показывает стартовое меню и отправляет чек-лист"""
         logger.info("🚀 Команда /start вызвана!")
         user_id = update.effective_user.id if update.effective_user else None
-        self.user_states[user_id] = "start"
+        await self.events.publish('start', user_id)
+        await self.user_states.set(user_id, "start")
 
-        # 1) Баннер
-        try:
-            if update.message:
-                await self._send_logo(update, context)
-            elif update.callback_query:
-                await self._send_logo(update.callback_query, context)
-        except Exception as e:
-            logger.error(f"Ошибка при отправке логотипа: {e}")
-
-        # 2) Красивое приветствие
+        # 1) Баннер, 2) красивое приветствие, 3) чек-лист.
+        # Логотип и чек-лист готовятся параллельно, а доставляются по порядку,
+        # поэтому медленный чек-лист не задерживает кнопку приветствия.
         welcome_text = (
             "🎉 Добро пожаловать в Synaplink AI!\n\n"
             "Мы — инновационная компания, создающая и внедряющая передовые технологические решения для вашего бизнеса.\n\n"
@@ -150,36 +279,44 @@ class SynaplinkBot:
         keyboard = [[InlineKeyboardButton("✅ Начать диалог", callback_data="start_chat")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         target_message = update.message or (update.callback_query and update.callback_query.message)
-        try:
-            await target_message.reply_text(welcome_text, reply_markup=reply_markup)
-        except Exception as e:
-            logger.error(f"Ошибка при отправке приветствия: {e}")
+        logo_target = update if update.message else update.callback_query
 
-        # 3) Автосенд чек-листа (надёжный)
-        await self._send_checklist(update, context)
+        steps = [
+            PipelineStep(
+                'banner',
+                deliver=lambda media: self._send_logo(logo_target, context, media),
+                prepare=lambda: self.media_cache.get_input('logo'),
+                timeout=Config.START_STEP_TIMEOUT
+            ),
+            PipelineStep(
+                'welcome',
+                deliver=lambda _: target_message.reply_text(welcome_text, reply_markup=reply_markup),
+                timeout=Config.START_STEP_TIMEOUT
+            ),
+        ]
+        if 'checklist' in self.media_cache.assets:
+            steps.append(PipelineStep(
+                'checklist',
+                deliver=lambda media: self._send_checklist(update, context, media),
+                prepare=lambda: self.media_cache.get_input('checklist'),
+                timeout=Config.START_CHECKLIST_TIMEOUT
+            ))
+        report = await self.start_pipeline.run(steps)
+        logger.info(f"⏱️ /start для {user_id}: {format_report(report)}")
     
-    async def _send_logo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def _send_logo(self, update: Update, context: ContextTypes.DEFAULT_TYPE, media=None):
         """Отправляет логотип компании"""
         try:
-            logger.info(f"🖼️ Попытка отправить логотип: {Config.LOGO_IMAGE_URL}")
-            
-            if Config.LOGO_IMAGE_URL.startswith('http'):
-                # Если это URL, загружаем изображение
-                logger.info("📥 Загрузка логотипа по URL")
-                response = requests.get(Config.LOGO_IMAGE_URL)
-                if response.status_code == 200:
-                    photo = BytesIO(response.content)
-                    await update.message.reply_photo(photo=photo, caption="🏢 Synaplink")
-                    logger.info("✅ Логотип отправлен по URL")
-                else:
-                    logger.warning(f"⚠️ Ошибка загрузки логотипа: {response.status_code}")
-                    await update.message.reply_text("🏢 Synaplink")
+            message = await self._send_media(
+                'logo',
+                lambda media: update.message.reply_photo(photo=media, caption="🏢 Synaplink"),
+                media
+            )
+            if message is None:
+                logger.warning("⚠️ Логотип недоступен")
+                await update.message.reply_text("🏢 Synaplink")
             else:
-                # Если это путь к файлу
-                logger.info("📁 Загрузка логотипа из файла")
-                with open(Config.LOGO_IMAGE_URL, 'rb') as photo:
-                    await update.message.reply_photo(photo=photo, caption="🏢 Synaplink")
-                logger.info("✅ Логотип отправлен из файла")
+                logger.info("✅ Логотип отправлен")
         except Exception as e:
             logger.error(f"❌ Ошибка при отправке логотипа: {e}")
             await update.message.reply_text("🏢 Synaplink")
@@ -202,14 +339,14 @@ class SynaplinkBot:
             logger.warning(f'Не удалось проверить подписку пользователя {user_id}: {e}')
             return False
 
+    @instrumented('button_callback')
     async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик нажатий на inline кнопки"""
-        logger.info("🔘 button_callback вызван!")
         query = update.callback_query
-        logger.info(f"🔘 CallbackQuery получен: {query.data}")
         await query.answer()
         user_id = query.from_user.id
-        logger.info(f"🔘 Обработка кнопки: {query.data} от пользователя {user_id}")
+        await self.events.publish('button', user_id, {'button': query.data})
+        logger.debug(f"🔘 Обработка кнопки: {query.data} от пользователя {user_id}")
         if query.data == "start_chat":
             # Больше не проверяем подписку — сразу начинаем диалог
             logger.info(f"✅ Запуск диалога для пользователя {user_id}")
@@ -223,75 +360,122 @@ class SynaplinkBot:
     async def _start_chat(self, query, context: ContextTypes.DEFAULT_TYPE):
         """Начинает диалог с ассистентом"""
         user_id = query.from_user.id
+        await self.events.publish('start_chat', user_id)
         # Меняем состояние пользователя
-        self.user_states[user_id] = "chatting"
-        # Больше не показываем никаких кнопок
-        reply_markup = None
-        # Отправляем служебный стартовый сигнал ассистенту
+        await self.user_states.set(user_id, "chatting")
+        # Служебный стартовый сигнал ассистенту уходит в фоне — приветствие не ждет run
         try:
-            initial_message = "Пользователь вернулся после подписки. Начни диалог, представься и спроси имя."
-            _ = self.openai_client.send_message(user_id, initial_message)
-            # Обновлённое приветственное сообщение без упоминания подписки
-            welcome_message = (
-                "Сани готов помочь вам с любыми вопросами о наших услугах, технологиях и решениях. "
-                "Представьтесь пожалуйста! И расскажите что Вас интересует."
-            )
-            await query.edit_message_text(welcome_message, reply_markup=reply_markup)
+            self._start_priming(user_id)
         except Exception as e:
             logger.error(f"Ошибка при инициации диалога: {e}")
-            welcome_message = (
-                "Сани готов помочь вам с любыми вопросами о наших услугах, технологиях и решениях. "
-                "Представьтесь пожалуйста! И расскажите что Вас интересует."
-            )
-            await query.edit_message_text(welcome_message, reply_markup=reply_markup)
+        # Обновлённое приветственное сообщение без упоминания подписки, больше без кнопок
+        welcome_message = (
+            "Сани готов помочь вам с любыми вопросами о наших услугах, технологиях и решениях. "
+            "Представьтесь пожалуйста! И расскажите что Вас интересует."
+        )
+        await query.edit_message_text(welcome_message, reply_markup=None)
+    
+    def _start_priming(self, user_id: int):
+        """Запускает стартовый run пользователя фоновой задачей (повторный /start его не дублирует)"""
+        task = self.priming_tasks.get(user_id)
+        if task is not None and not task.done():
+            return
+        self.priming_tasks[user_id] = asyncio.create_task(self._prime(user_id))
+    
+    async def _prime(self, user_id: int):
+        """Отправляет ассистенту стартовый сигнал; ответ на него пользователю не показывается"""
+        try:
+            # Новому пользователю достается thread со стартовым сообщением — run не нужен
+            if not await self.openai_client.prime_conversation(user_id, PRIMING_MESSAGE):
+                _ = await self.conversation_queue.submit(user_id, PRIMING_MESSAGE)
+        except Exception as e:
+            logger.error(f"Ошибка при инициации диалога: {e}")
+        finally:
+            self.priming_tasks.pop(user_id, None)
+    
+    async def _wait_for_priming(self, user_id: int):
+        """Дожидается стартового run пользователя, если он еще выполняется"""
+        task = self.priming_tasks.get(user_id)
+        if task is not None and not task.done():
+            # shield: отмена обработчика сообщения не должна отменять стартовый run
+            await asyncio.shield(task)
     
     async def _reset_chat(self, query, context: ContextTypes.DEFAULT_TYPE):
         """Сбрасывает разговор с ассистентом"""
         user_id = query.from_user.id
         
-        # Сбрасываем разговор в OpenAI
-        self.openai_client.reset_conversation(user_id)
+        # Сбрасываем разговор в OpenAI (после стартового run, чтобы он не попал в новый thread)
+        await self._wait_for_priming(user_id)
+        await self.openai_client.reset_conversation(user_id)
         
         # Возвращаемся к стартовому меню
-        self.user_states[user_id] = "start"
+        await self.user_states.set(user_id, "start")
         
         await query.edit_message_text(
             "🔄 Разговор сброшен!\n\n"
             "Нажмите /start для начала нового диалога."
         )
     
+    @instrumented('handle_message')
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик текстовых сообщений от пользователя"""
-        logger.info("📩 handle_message вызван!")
         user_id = update.effective_user.id if update.effective_user else None
         message_text = update.message.text if update.message else None
-        logger.info(f"Пользователь: {user_id}, текст: {message_text}")
+        # Текст пользователя пишется только на DEBUG: он может быть длинным и содержать персональные данные
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"📩 Пользователь: {user_id}, текст: {message_text}")
 
         # Проверяем состояние пользователя
-        if user_id not in self.user_states or self.user_states[user_id] != "chatting":
+        if await self.user_states.get(user_id) != "chatting":
             if update.message:
                 await update.message.reply_text(
                     "Пожалуйста, начните с команды /start для начала работы с ботом."
                 )
             return
+        await self.events.publish('message', user_id)
 
         # Отправляем сообщение ассистенту OpenAI
         try:
             if update.message:
                 await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-            response = self.openai_client.send_message(user_id, message_text)
-            logger.info(f"Ответ ассистента: {response}")
+            # Первое сообщение идет ассистенту только после стартового сигнала
+            await self._wait_for_priming(user_id)
+            # В потоковом режиме ответ появляется в чате по мере генерации
+            streamer = None
+            if Config.STREAM_REPLIES and update.message:
+                streamer = ReplyStreamer(update.message.reply_text, interval=Config.STREAM_EDIT_INTERVAL)
+            try:
+                response = await self.conversation_queue.submit(
+                    user_id, message_text, on_delta=streamer.on_delta if streamer else None
+                )
+            except ConversationQueueFull:
+                if update.message:
+                    await update.message.reply_text(
+                        "⏳ Я ещё отвечаю на ваши предыдущие сообщения. Пожалуйста, подождите немного."
+                    )
+                return
+            if response is None:
+                # Сообщение склеено с более поздним — ответ получит последнее из них
+                logger.info(f"🧩 Сообщение пользователя {user_id} объединено со следующим")
+                return
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Ответ ассистента пользователю {user_id}: {response}")
             # Проверяем, содержит ли ответ ассистента финальный блок заявки
             is_final = self._contains_final_application(response)
-            logger.info(f"Результат проверки финального блока: {is_final}")
             if is_final:
-                logger.info("Пробую отправить заявку в рабочий чат...")
+                LEADS_DETECTED.inc()
+                await self.events.publish('lead', user_id, {'text': response})
+                logger.info(f"📨 Заявка пользователя {user_id}, отправляю в рабочий чат...")
                 await self._send_application_to_working_chat(context, response, user_id)
-                if update.message:
-                    await update.message.reply_text(response)
-            else:
-                if update.message:
-                    await update.message.reply_text(response)
+            # Итоговый текст (в том числе отформатированная заявка) заменяет потоковый;
+            # если потоковый показ сорвался, ответ уходит обычным сообщением
+            if streamer is not None and streamer.started and await streamer.finish(response):
+                logger.info(
+                    f"✍️ Потоковый ответ пользователю {user_id}: первый текст через "
+                    f"{streamer.first_visible:.2f} с, правок {streamer.edits}"
+                )
+            elif update.message:
+                await update.message.reply_text(response)
         except Exception as e:
             logger.error(f"Ошибка при обработке сообщения: {e}")
             if update.message:
@@ -303,19 +487,16 @@ class SynaplinkBot:
     
     def _contains_final_application(self, text: str) -> bool:
         """Проверяет, содержит ли текст финальный блок заявки по шаблону"""
-        logger.info(f"Проверка на финальный блок. Текст ассистента:\n{text}")
         if not text:
-            logger.info("❌ Текст пустой — не заявка")
             return False
-        if "[Заявка в рабочий чат]" not in text:
-            logger.info("❌ Нет заголовка [Заявка в рабочий чат] — не заявка")
+        lead = self.application_handler.parse_lead(text)
+        if not lead.has_header:
+            # Обычный ответ ассистента — самый частый случай, лог не нужен
+            return False
+        if not lead.is_complete:
+            logger.info(f"❌ Не хватает полей заявки (найдены: {', '.join(sorted(lead.labels)) or 'нет'}) — не заявка")
             return False
-        required_fields = ["Имя:", "Телефон:", "Телеграм:", "Запрос:"]
-        for field in required_fields:
-            if field not in text:
-                logger.info(f"❌ Нет поля {field} — не заявка")
-                return False
-        logger.info("✅ Найден валидный финальный блок заявки!")
+        logger.info(f"✅ Найден валидный финальный блок заявки! (уверенность {lead.confidence})")
         return True
     
 
@@ -326,44 +507,40 @@ class SynaplinkBot:
         return datetime.now().strftime("%d.%m.%Y %H:%M:%S")
     
     async def _send_application_to_working_chat(self, context: ContextTypes.DEFAULT_TYPE, application_text: str, user_id: int):
-        """Отправляет заявку в рабочий чат"""
+        """Сохраняет заявку в outbox — доставку в рабочий чат с повторами выполняет LeadOutbox"""
+        # Просто пересылаем блок заявки без изменений
+        working_chat_message = (
+            f"🚨 НОВАЯ ЗАЯВКА ОТ ПОЛЬЗОВАТЕЛЯ {user_id}\n\n"
+            f"{application_text}"
+        )
         try:
-            # Просто пересылаем блок заявки без изменений
-            working_chat_message = (
-                f"🚨 НОВАЯ ЗАЯВКА ОТ ПОЛЬЗОВАТЕЛЯ {user_id}\n\n"
-                f"{application_text}"
-            )
-            
-            # Отправляем в рабочий чат
-            await context.bot.send_message(
-                chat_id=Config.WORKING_CHAT_ID,
-                text=working_chat_message
-            )
-            
-            logger.info(f"Заявка от пользователя {user_id} отправлена в рабочий чат {Config.WORKING_CHAT_ID}")
-            
+            if await self.lead_outbox.enqueue(user_id, working_chat_message):
+                logger.info(f"📥 Заявка от пользователя {user_id} сохранена в outbox")
         except Exception as e:
-            logger.error(f"Ошибка при отправке заявки в рабочий чат: {e}")
-            # Пытаемся отправить простой текст в случае ошибки
+            # Диск недоступен — пробуем хотя бы отправить напрямую
+            logger.error(f"❌ Не удалось сохранить заявку в outbox: {e}")
             try:
-                simple_message = f"🚨 НОВАЯ ЗАЯВКА ОТ ПОЛЬЗОВАТЕЛЯ {user_id}\n\n{application_text}"
-                await context.bot.send_message(
-                    chat_id=Config.WORKING_CHAT_ID,
-                    text=simple_message
-                )
-                logger.info(f"Заявка отправлена простым текстом")
+                await self._send_to_working_chat(working_chat_message)
+                LEADS_DELIVERED.inc()
             except Exception as e2:
+                LEADS_FAILED.inc()
                 logger.error(f"Критическая ошибка при отправке заявки: {e2}")
     
+    async def _send_to_working_chat(self, text: str):
+        """Отправляет текст в рабочий чат"""
+        return await self.application.bot.send_message(chat_id=Config.WORKING_CHAT_ID, text=text)
+    
     async def reset_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /reset - сбрасывает разговор"""
         user_id = update.effective_user.id
+        await self.events.publish('reset', user_id)
         
-        # Сбрасываем разговор в OpenAI
-        self.openai_client.reset_conversation(user_id)
+        # Сбрасываем разговор в OpenAI (после стартового run, чтобы он не попал в новый thread)
+        await self._wait_for_priming(user_id)
+        await self.openai_client.reset_conversation(user_id)
         
         # Сбрасываем состояние пользователя
-        self.user_states[user_id] = "start"
+        await self.user_states.set(user_id, "start")
         
         await update.message.reply_text(
             "🔄 Разговор сброшен!\n\n"
@@ -388,11 +565,27 @@ class SynaplinkBot:
             # Добавляем обработчик ошибок
             self.application.add_error_handler(self._error_handler)
             
-            # Запускаем с подробным логированием
-            self.application.run_polling(
-                allowed_updates=Update.ALL_TYPES,
-                drop_pending_updates=True
-            )
+            if Config.BOT_MODE == 'webhook':
+                # Webhook: ASGI-сервер раздает обновления процессам-воркерам
+                from webhook_server import run_webhook
+                logger.info(f"🌐 Режим webhook, воркеров: {Config.WEBHOOK_WORKERS}")
+                run_webhook(Config.WEBHOOK_WORKERS)
+                return
+            
+            # SIGTERM/SIGINT запускают корректную остановку (shutdown) вместо мгновенного выхода
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._install_signal_handlers()
+            try:
+                self.application.run_polling(
+                    allowed_updates=Update.ALL_TYPES,
+                    drop_pending_updates=Config.DROP_PENDING_UPDATES,
+                    timeout=Config.GET_UPDATES_TIMEOUT,
+                    stop_signals=None
+                )
+            finally:
+                if self._watchdog is not None:
+                    self._watchdog.cancel()
             
         except Exception as e:
             logger.error(f"❌ Критическая ошибка при запуске бота: {e}")
@@ -401,6 +594,220 @@ class SynaplinkBot:
             logger.error(f"🔍 Stack trace: {traceback.format_exc()}")
             raise
     
+    async def process_update_queue(self, queue, processed=None) -> None:
+        """
+        Обрабатывает обновления из очереди процесса (режим воркера webhook)
+        
+        Args:
+            queue: multiprocessing.Queue с JSON-обновлениями Telegram (None — остановка)
+            processed: Общий счетчик обработанных обновлений (multiprocessing.Value)
+        """
+        self.application.add_error_handler(self._error_handler)
+        loop = self._loop = asyncio.get_running_loop()
+        limit = asyncio.Semaphore(Config.CONCURRENT_UPDATES)
+        tasks = set()
+        
+        async def process(update: Update):
+            try:
+                await self.application.process_update(update)
+            finally:
+                limit.release()
+                if processed is not None:
+                    with processed.get_lock():
+                        processed.value += 1
+        
+        async with self.application:
+            await self._post_init(self.application)
+            while True:
+                data = await loop.run_in_executor(None, queue.get)
+                if data is None:
+                    break
+                update = Update.de_json(data, self.application.bot)
+                # Обновления одного пользователя всегда попадают в этот воркер,
+                # а ConversationQueue сохраняет их порядок перед ассистентом
+                await limit.acquire()
+                task = asyncio.create_task(process(update))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            # Маршрутизатор больше ничего не пришлет: дорабатываем диалоги до дедлайна
+            await self.drain(lambda: tasks, time.monotonic() + Config.SHUTDOWN_TIMEOUT)
+        await self._post_shutdown(self.application)
+    
+    def _install_signal_handlers(self) -> None:
+        """Назначает shutdown обработчиком SIGTERM и SIGINT в event loop бота"""
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                self._loop.add_signal_handler(signum, self._on_stop_signal, signum)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Windows или не главный поток: сигнал передаст run_bot.signal_handler
+                pass
+    
+    def request_shutdown(self, signum: Optional[int] = None) -> bool:
+        """
+        Просит работающего бота корректно остановиться (можно вызывать из обработчика сигнала)
+        
+        Args:
+            signum: Номер полученного сигнала
+            
+        Returns:
+            bool: False, если бот не запущен и ждать нечего
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed() or not loop.is_running():
+            return False
+        loop.call_soon_threadsafe(self._on_stop_signal, signum)
+        return True
+    
+    def _on_stop_signal(self, signum: Optional[int] = None) -> None:
+        if self._shutdown_task is None:
+            self._shutdown_task = asyncio.ensure_future(self.shutdown(signum))
+        else:
+            logger.warning("⏩ Повторный сигнал остановки: не ждем диалоги, прерываем их")
+            self._hurry.set()
+    
+    async def shutdown(self, signum: Optional[int] = None) -> None:
+        """
+        Корректная остановка в режиме polling
+        
+        Прекращает получение обновлений, дорабатывает диалоги и доставку заявок
+        (drain) и останавливает Application, после чего _post_shutdown сохраняет
+        события, сессии и метрики. Если остановка не уложилась в SHUTDOWN_TIMEOUT
+        с запасом, сторожевой таймер дописывает логи и завершает процесс.
+        
+        Args:
+            signum: Сигнал, вызвавший остановку
+        """
+        reason = signal.Signals(signum).name if signum else "запрос"
+        deadline = time.monotonic() + Config.SHUTDOWN_TIMEOUT
+        self._watchdog = start_watchdog(Config.SHUTDOWN_TIMEOUT + WATCHDOG_MARGIN, on_timeout=stop_logging)
+        logger.info(f"🛑 Остановка ({reason}): новые обновления не принимаются")
+        try:
+            updater = self.application.updater
+            if updater is not None and updater.running:
+                # Последний get_updates подтверждает полученные обновления — Telegram их не повторит
+                await updater.stop()
+            update_queue = self.application.update_queue
+            await self.drain(lambda: self.update_processor.tasks, deadline, backlog=update_queue.qsize)
+            dropped = 0
+            while not update_queue.empty():
+                update_queue.get_nowait()
+                update_queue.task_done()
+                dropped += 1
+            if dropped:
+                logger.warning(f"⚠️ Не успели обработать обновлений: {dropped}")
+        except Exception as e:
+            logger.error(f"❌ Ошибка при остановке: {e}")
+        finally:
+            self.application.stop_running()
+    
+    async def drain(self, pending: Callable[[], Iterable[asyncio.Task]], deadline: float,
+                    backlog: Callable[[], int] = lambda: 0) -> dict:
+        """
+        Дорабатывает диалоги в процессе и досылает заявки перед остановкой
+        
+        Обработчики получают до SHUTDOWN_DRAIN_TIMEOUT секунд. Не успевшие
+        прерываются: сначала их run отменяются на сервере, затем отменяются
+        задачи. Оставшееся до deadline время уходит на доставку заявок из
+        outbox; недоставленные остаются в нем до следующего запуска.
+        
+        Args:
+            pending: Функция, возвращающая задачи обработчиков обновлений
+            deadline: Момент (time.monotonic), к которому все должно завершиться
+            backlog: Функция, возвращающая число еще не начатых обновлений
+            
+        Returns:
+            dict: Сколько обработчиков прервано, run отменено и заявок не доставлено
+        """
+        started = time.monotonic()
+        in_flight = lambda: {*pending(), *self.priming_tasks.values()}
+        busy = sum(1 for task in in_flight() if not task.done())
+        timeout = max(0.0, min(Config.SHUTDOWN_DRAIN_TIMEOUT, deadline - started))
+        if busy:
+            logger.info(f"⏳ Ждем обработчики в процессе: {busy} (до {timeout:.0f} с)")
+        leftover = await wait_for_tasks(in_flight, timeout, hurry=self._hurry, backlog=backlog)
+        runs = 0
+        if leftover:
+            # Run отменяются до задач: иначе они продолжили бы работать на сервере
+            runs = await self.openai_client.cancel_active_runs(timeout=max(0.5, min(5.0, deadline - time.monotonic())))
+            await cancel_tasks([*leftover, *self.conversation_queue.workers()])
+        await self.lead_outbox.stop(drain_timeout=max(0.0, deadline - time.monotonic()))
+        summary = {
+            'interrupted': len(leftover),
+            'runs_cancelled': runs,
+            'leads_pending': self.lead_outbox.pending,
+            'seconds': round(time.monotonic() - started, 2),
+        }
+        logger.info(
+            f"✅ Диалоги доработаны за {summary['seconds']} с: прервано {summary['interrupted']}, "
+            f"отменено run {runs}, заявок ждут доставки {summary['leads_pending']}"
+        )
+        return summary
+    
+    async def _post_init(self, application: Application) -> None:
+        """Предзагружает медиафайлы после запуска Application"""
+        await self.media_cache.preload()
+        logger.info("📦 Медиафайлы предзагружены")
+        self.lead_outbox.start()
+        self.openai_client.start()
+        self.events.start()
+        Config.subscribe(self._apply_config)
+        self.config_watcher.start()
+        if Config.METRICS_PORT:
+            try:
+                self.metrics_server = await MetricsServer(host=Config.METRICS_HOST, port=Config.METRICS_PORT).start()
+            except OSError as e:
+                logger.warning(f"⚠️ Не удалось запустить /metrics на порту {Config.METRICS_PORT}: {e}")
+    
+    async def _post_shutdown(self, application: Application) -> None:
+        """Сохраняет накопленные сессии при остановке бота"""
+        if self.priming_tasks:
+            await asyncio.gather(*self.priming_tasks.values(), return_exceptions=True)
+        await self.config_watcher.stop()
+        Config.unsubscribe(self._apply_config)
+        logger.info(f"📊 Очереди отправки: {self.send_scheduler.stats()}")
+        logger.info(f"🔌 HTTP-соединения: {connection_stats()}")
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+        await self.lead_outbox.close()
+        await self.events.close()
+        logger.info(f"📨 События: {self.events.stats()}")
+        await self.openai_client.close()
+        await self.media_cache.close()
+        await self.session_store.close()
+        logger.info("💾 Хранилище сессий закрыто")
+    
+    def _apply_config(self, changed: dict) -> None:
+        """
+        Переносит перезагруженные настройки в работающие компоненты
+        
+        Диалоги в процессе не прерываются: новые лимиты и таймауты действуют
+        со следующего запроса. Флаги, которые читаются на каждом сообщении
+        (STREAM_REPLIES, таймауты /start), применяются сами.
+        
+        Args:
+            changed: Изменившиеся параметры: имя -> (старое, новое значение)
+        """
+        self.send_scheduler.set_rates(
+            Config.TELEGRAM_GLOBAL_RATE,
+            Config.TELEGRAM_CHAT_RATE,
+            Config.TELEGRAM_GROUP_RATE,
+            chat_burst=Config.TELEGRAM_CHAT_BURST
+        )
+        self.send_scheduler.max_retries = Config.TELEGRAM_MAX_RETRIES
+        self.conversation_queue.max_depth = Config.CONVERSATION_QUEUE_DEPTH
+        self.media_cache.refresh_interval = Config.MEDIA_REFRESH_INTERVAL
+        self.lead_outbox.batch_size = Config.LEAD_OUTBOX_BATCH
+        self.lead_outbox.max_attempts = Config.LEAD_OUTBOX_MAX_ATTEMPTS
+        self.lead_outbox.base_delay = Config.LEAD_OUTBOX_BASE_DELAY
+        self.lead_outbox.max_delay = Config.LEAD_OUTBOX_MAX_DELAY
+        self.events.batch_size = Config.EVENT_BATCH_SIZE
+        self.events.flush_interval = Config.EVENT_FLUSH_INTERVAL
+        self.events.policy = Config.EVENT_OVERFLOW_POLICY
+        self.events.block_timeout = Config.EVENT_BLOCK_TIMEOUT
+        self.openai_client.apply_config()
+        if 'LOG_LEVEL' in changed:
+            logging.getLogger().setLevel(Config.LOG_LEVEL)
+    
     async def _error_handler(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Обработчик ошибок"""
         logger.error(f"❌ Ошибка в боте: {context.error}")
@@ -1,55 +1,574 @@
 """
 Модуль конфигурации для Telegram-бота Synaplink
-Загружает все необходимые переменные окружения
+Загружает переменные окружения, приводит их к нужным типам и проверяет значения.
+Часть параметров (лимиты, таймауты, TTL) перечитывается без перезапуска бота —
+по сигналу SIGHUP или при изменении файла .env (см. ConfigWatcher)
 """
 
+import asyncio
+import logging
 import os
-from dotenv import load_dotenv
+import signal
+import typing
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+from urllib.parse import urlsplit
+from dotenv import dotenv_values, find_dotenv, load_dotenv
+
+logger = logging.getLogger(__name__)
+
+# Файл .env (ENV_FILE задает другой путь); переменные окружения процесса важнее файла
+ENV_FILE = os.getenv('ENV_FILE') or find_dotenv()
+_PROCESS_KEYS = set(os.environ)
 
 # Загружаем переменные окружения из .env файла
-load_dotenv()
+if ENV_FILE:
+	load_dotenv(ENV_FILE)
+
+# Переменные, пришедшие из .env: при перезагрузке они читаются из файла заново
+_DOTENV_KEYS = set(os.environ) - _PROCESS_KEYS
+
+_TRUE = ('1', 'true', 'yes', 'on')
+_FALSE = ('0', 'false', 'no', 'off')
+
+# Колбэк перезагрузки получает изменившиеся параметры: имя -> (старое, новое значение)
+ReloadListener = Callable[[Dict[str, Tuple[Any, Any]]], None]
+
+
+class ConfigError(ValueError):
+	"""Некорректное или отсутствующее значение настройки"""
+
+
+class Url(str):
+	"""Адрес сервиса: проверяются схема и хост"""
+
+
+class Setting:
+	"""
+	Описание одной настройки: значение по умолчанию и правила проверки
+	
+	Тип берется из аннотации атрибута Config. Пустая переменная окружения
+	для строки означает пустую строку, для остальных типов — значение по умолчанию.
+	"""
+	
+	def __init__(self, default: Any = None, *, fallback: Tuple[str, ...] = (), required: bool = False,
+				 minimum: Optional[float] = None, maximum: Optional[float] = None, choices: Tuple[str, ...] = (),
+				 schemes: Tuple[str, ...] = ('http', 'https'), reloadable: bool = False):
+		"""
+		Args:
+			default: Значение по умолчанию
+			fallback: Запасные имена переменной окружения (например, PORT для WEBHOOK_PORT)
+			required: Без значения бот не запускается
+			minimum: Минимально допустимое число
+			maximum: Максимально допустимое число
+			choices: Допустимые строковые значения
+			schemes: Допустимые схемы адреса (для Url)
+			reloadable: Значение можно поменять без перезапуска
+		"""
+		self.default = default
+		self.fallback = fallback
+		self.required = required
+		self.minimum = minimum
+		self.maximum = maximum
+		self.choices = choices
+		self.schemes = schemes
+		self.reloadable = reloadable
+		self.name = ''
+		self.kind: type = str
+	
+	def bind(self, name: str, hint: Any) -> None:
+		"""Запоминает имя и тип настройки (Optional[X] разворачивается в X)"""
+		self.name = name
+		args = [arg for arg in typing.get_args(hint) if arg is not type(None)]
+		self.kind = args[0] if args else hint
+	
+	def parse(self, env: Mapping[str, str]) -> Any:
+		"""
+		Читает и проверяет значение из переменных окружения
+		
+		Raises:
+			ConfigError: Значение не приводится к типу или не проходит проверку
+		"""
+		for key in (self.name,) + self.fallback:
+			raw = env.get(key)
+			if raw is not None:
+				break
+		else:
+			return self.default
+		if self.kind is not str:
+			raw = raw.strip()
+			if not raw:
+				return self.default
+		try:
+			value = self._convert(raw)
+		except ValueError as e:
+			raise ConfigError(f"{self.name}: {e}") from None
+		if self.minimum is not None and value < self.minimum:
+			raise ConfigError(f"{self.name}: значение {value} меньше допустимого {self.minimum}")
+		if self.maximum is not None and value > self.maximum:
+			raise ConfigError(f"{self.name}: значение {value} больше допустимого {self.maximum}")
+		if self.choices and value not in self.choices:
+			raise ConfigError(f"{self.name}: {value!r} не входит в {', '.join(self.choices)}")
+		return value
+	
+	def _convert(self, raw: str) -> Any:
+		if self.kind is bool:
+			value = raw.lower()
+			if value not in _TRUE + _FALSE:
+				raise ValueError(f"ожидается true или false, получено {raw!r}")
+			return value in _TRUE
+		if self.kind in (int, float):
+			try:
+				return self.kind(raw)
+			except ValueError:
+				raise ValueError(f"ожидается число, получено {raw!r}") from None
+		if self.kind is Url:
+			parts = urlsplit(raw)
+			if parts.scheme not in self.schemes or not parts.netloc:
+				raise ValueError(f"ожидается адрес {'/'.join(self.schemes)}://…, получено {raw!r}")
+			return Url(raw)
+		return raw
+
 
 class Config:
-	"""Класс конфигурации с настройками бота"""
+	"""
+	Класс конфигурации с настройками бота
+	
+	Значения доступны как атрибуты класса (Config.RUN_TIMEOUT) уже приведенными
+	к типу из аннотации. Параметры с reloadable=True меняются методом reload().
+	"""
 	
 	# Telegram Bot Token
-	TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+	TELEGRAM_BOT_TOKEN: Optional[str] = Setting(required=True)
 	
 	# OpenAI API Key
-	OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+	OPENAI_API_KEY: Optional[str] = Setting(required=True)
 	
-	# OpenAI Assistant ID
-	OPENAI_ASSISTANT_ID = os.getenv('OPENAI_ASSISTANT_ID')
+	# OpenAI Assistant ID (смена без перезапуска очищает кэш ответов)
+	OPENAI_ASSISTANT_ID: Optional[str] = Setting(required=True, reloadable=True)
 	
 	# Telegram Channel Link
-	TELEGRAM_CHANNEL_LINK = os.getenv('TELEGRAM_CHANNEL_LINK')
+	TELEGRAM_CHANNEL_LINK: Optional[str] = Setting()
 	
-	# Telegram Working Chat ID (для отправки заявок)
-	WORKING_CHAT_ID = os.getenv('WORKING_CHAT_ID')
+	# Telegram Working Chat ID (для отправки заявок), число: у групп отрицательное
+	WORKING_CHAT_ID: Optional[int] = Setting(required=True)
 	
 	# Logo Image URL или путь к файлу
-	LOGO_IMAGE_URL = os.getenv('LOGO_IMAGE_URL')
+	LOGO_IMAGE_URL: Optional[str] = Setting(required=True)
 
 	# Checklist file URL (PDF)
-	CHECKLIST_URL = os.getenv('CHECKLIST_URL')
+	CHECKLIST_URL: Optional[str] = Setting()
+
+	# Ожидание run ассистента: auto (streaming с фолбэком на опрос), stream или poll
+	RUN_WAITER_MODE: str = Setting('auto', choices=('auto', 'stream', 'poll'))
+
+	# Дедлайн на один run ассистента (сек), после него run отменяется
+	RUN_TIMEOUT: float = Setting(60.0, minimum=1, reloadable=True)
+
+	# Начальная и максимальная пауза между опросами статуса run (сек)
+	RUN_POLL_INITIAL: float = Setting(0.1, minimum=0.01, reloadable=True)
+	RUN_POLL_MAX: float = Setting(2.0, minimum=0.01, reloadable=True)
+
+	# Автомат защиты OpenAI: размыкается, когда среди последних OPENAI_BREAKER_WINDOW вызовов
+	# (не меньше OPENAI_BREAKER_MIN_CALLS) доля отказов достигает OPENAI_BREAKER_FAILURE_RATE,
+	# и OPENAI_BREAKER_COOLDOWN секунд отвечает пользователям сразу, не обращаясь к API
+	OPENAI_BREAKER_FAILURE_RATE: float = Setting(0.5, minimum=0.05, maximum=1, reloadable=True)
+	OPENAI_BREAKER_MIN_CALLS: int = Setting(10, minimum=1, reloadable=True)
+	OPENAI_BREAKER_WINDOW: int = Setting(20, minimum=1, reloadable=True)
+	OPENAI_BREAKER_COOLDOWN: float = Setting(30.0, minimum=1, reloadable=True)
+
+	# Bulkhead: максимум одновременных run в процессе (0 — без ограничения) и ожидание слота (сек)
+	OPENAI_MAX_INFLIGHT_RUNS: int = Setting(64, minimum=0, reloadable=True)
+	OPENAI_BULKHEAD_WAIT: float = Setting(10.0, minimum=0, reloadable=True)
+
+	# Повторы чтений OpenAI (GET): попыток всего и доля повторов от числа запросов;
+	# OPENAI_HEDGE_DELAY — через сколько секунд дублировать медленное чтение (0 — выключено)
+	OPENAI_RETRY_ATTEMPTS: int = Setting(3, minimum=1, reloadable=True)
+	OPENAI_RETRY_BUDGET: float = Setting(0.2, minimum=0, maximum=1, reloadable=True)
+	OPENAI_HEDGE_DELAY: float = Setting(0.0, minimum=0, reloadable=True)
+
+	# Хранилище сессий (состояния пользователей и thread_id): memory, sqlite или redis
+	SESSION_BACKEND: str = Setting('sqlite', choices=('memory', 'sqlite', 'redis'))
+	SESSION_DB_PATH: str = Setting('data/sessions.db')
+	SESSION_REDIS_URL: Url = Setting(Url('redis://localhost:6379/0'), schemes=('redis', 'rediss'))
+	SESSION_SHARDS: int = Setting(1, minimum=1)
+
+	# Время жизни сессии без обращений (сек, продлевается при чтении) и лимит записей для хранилища в памяти
+	SESSION_TTL: float = Setting(7 * 24 * 3600.0, minimum=0)
+	SESSION_MAX_ENTRIES: int = Setting(100000, minimum=1)
+
+	# Как часто перепроверять логотип и чек-лист на изменения (сек) и таймаут их загрузки
+	MEDIA_REFRESH_INTERVAL: float = Setting(3600.0, minimum=0, reloadable=True)
+	MEDIA_HTTP_TIMEOUT: float = Setting(30.0, minimum=1)
+
+	# /start: параллельных подготовок, таймаут шага и отдельный таймаут чек-листа (сек)
+	START_PIPELINE_FANOUT: int = Setting(4, minimum=1)
+	START_STEP_TIMEOUT: float = Setting(10.0, minimum=1, reloadable=True)
+	START_CHECKLIST_TIMEOUT: float = Setting(60.0, minimum=1, reloadable=True)
+
+	# Лимиты исходящих запросов к Telegram (в секунду): общий, личный чат, группа,
+	# допустимый всплеск в личном чате и сколько чатов отслеживать в памяти
+	TELEGRAM_GLOBAL_RATE: float = Setting(30.0, minimum=0.01, reloadable=True)
+	TELEGRAM_CHAT_RATE: float = Setting(1.0, minimum=0.01, reloadable=True)
+	TELEGRAM_GROUP_RATE: float = Setting(20 / 60, minimum=0.01, reloadable=True)
+	TELEGRAM_CHAT_BURST: float = Setting(3.0, minimum=1, reloadable=True)
+	TELEGRAM_MAX_CHATS: int = Setting(10000, minimum=1)
+
+	# Сколько раз повторять запрос после ответа 429 (retry_after)
+	TELEGRAM_MAX_RETRIES: int = Setting(3, minimum=0, reloadable=True)
+
+	# Сколько обновлений Telegram обрабатывать одновременно
+	CONCURRENT_UPDATES: int = Setting(256, minimum=1)
+
+	# Максимум сообщений пользователя, ожидающих ответа ассистента
+	CONVERSATION_QUEUE_DEPTH: int = Setting(5, minimum=1, reloadable=True)
+
+	# Режим получения обновлений: polling или webhook
+	BOT_MODE: str = Setting('polling', choices=('polling', 'webhook'))
+
+	# Отбрасывать обновления, накопившиеся в Telegram, пока бот не работал
+	DROP_PENDING_UPDATES: bool = Setting(False)
+
+	# Остановка по SIGTERM: сколько ждать диалоги в процессе и предел всей остановки (сек)
+	SHUTDOWN_DRAIN_TIMEOUT: float = Setting(20.0, minimum=0, reloadable=True)
+	SHUTDOWN_TIMEOUT: float = Setting(25.0, minimum=1, reloadable=True)
+
+	# Настройки webhook: публичный URL, путь, адрес прослушивания и секрет
+	WEBHOOK_URL: Optional[Url] = Setting(schemes=('https',))
+	WEBHOOK_PATH: str = Setting('/webhook')
+	WEBHOOK_LISTEN: str = Setting('0.0.0.0')
+	WEBHOOK_PORT: int = Setting(8080, fallback=('PORT',), minimum=1)
+	WEBHOOK_SECRET: Optional[str] = Setting()
+
+	# Число процессов-воркеров в режиме webhook
+	WEBHOOK_WORKERS: int = Setting(2, minimum=1)
+
+	# Альтернативные адреса API (локальный Bot API сервер, прокси, заглушки бенчмарков)
+	TELEGRAM_API_BASE_URL: Optional[Url] = Setting()
+	OPENAI_BASE_URL: Optional[Url] = Setting()
+
+	# Эндпоинт /metrics в формате Prometheus (порт 0 — выключен; воркеры webhook берут следующие порты)
+	METRICS_HOST: str = Setting('127.0.0.1')
+	METRICS_PORT: int = Setting(9464, minimum=0)
+
+	# Thread ассистента: простой до вытеснения (сек, 0 — без ограничения), лимит живых thread
+	# в процессе (лишние вытесняются по LRU), размер пачки удаления на сервере и пауза проверок
+	THREAD_IDLE_TTL: float = Setting(24 * 3600.0, minimum=0, reloadable=True)
+	THREAD_MAX_LIVE: int = Setting(10000, minimum=1, reloadable=True)
+	THREAD_DELETE_BATCH: int = Setting(20, minimum=1, reloadable=True)
+	THREAD_SWEEP_INTERVAL: float = Setting(60.0, minimum=1, reloadable=True)
+
+	# Потоковые ответы: текст появляется в чате по мере генерации и дописывается правками
+	# не чаще раза в STREAM_EDIT_INTERVAL секунд (работает, когда run идет в режиме streaming)
+	STREAM_REPLIES: bool = Setting(False, reloadable=True)
+	STREAM_EDIT_INTERVAL: float = Setting(1.0, minimum=0.1, reloadable=True)
+
+	# Пул заранее созданных thread (0 — выключен) и сколько thread создавать одновременно;
+	# THREAD_POOL_PRIME=true добавляет стартовое сообщение в thread при создании вместо
+	# отдельного run при нажатии «Начать диалог»
+	THREAD_POOL_SIZE: int = Setting(5, minimum=0, reloadable=True)
+	THREAD_POOL_CONCURRENCY: int = Setting(4, minimum=1)
+	THREAD_POOL_PRIME: bool = Setting(False)
+
+	# Кэш ответов на типовые вопросы (выключен по умолчанию): записей, время жизни (сек),
+	# минимальное сходство формулировок (0..1) и максимальная длина кэшируемого сообщения
+	ANSWER_CACHE: bool = Setting(False)
+	ANSWER_CACHE_SIZE: int = Setting(1000, minimum=1)
+	ANSWER_CACHE_TTL: float = Setting(24 * 3600.0, minimum=0, reloadable=True)
+	ANSWER_CACHE_THRESHOLD: float = Setting(0.85, minimum=0.5, maximum=1, reloadable=True)
+	ANSWER_CACHE_MAX_LENGTH: int = Setting(200, minimum=1, reloadable=True)
+
+	# HTTP-транспорт (Telegram, OpenAI, медиафайлы): размер пула и keep-alive соединений,
+	# время жизни простаивающего соединения и таймауты (сек); HTTP_VERSION: auto, 1.1 или 2
+	# (HTTP/2 нужен пакет h2). GET_UPDATES_TIMEOUT — длительность long polling,
+	# GET_UPDATES_POOL_SIZE — отдельный пул для get_updates
+	HTTP_POOL_SIZE: int = Setting(100, minimum=1)
+	HTTP_KEEPALIVE_CONNECTIONS: int = Setting(50, minimum=0)
+	HTTP_KEEPALIVE_EXPIRY: float = Setting(60.0, minimum=0)
+	HTTP_CONNECT_TIMEOUT: float = Setting(5.0, minimum=0.1)
+	HTTP_READ_TIMEOUT: float = Setting(30.0, minimum=0.1)
+	HTTP_WRITE_TIMEOUT: float = Setting(10.0, minimum=0.1)
+	HTTP_POOL_TIMEOUT: float = Setting(5.0, minimum=0.1)
+	HTTP_VERSION: str = Setting('auto', choices=('auto', '1.1', '2'))
+	GET_UPDATES_TIMEOUT: int = Setting(30, minimum=0)
+	GET_UPDATES_POOL_SIZE: int = Setting(2, minimum=1)
+
+	# Outbox заявок: файл SQLite, заявок в одном сообщении, попыток до dead letter, паузы повторов (сек)
+	LEAD_OUTBOX_PATH: str = Setting('data/leads_outbox.db')
+	LEAD_OUTBOX_BATCH: int = Setting(10, minimum=1, reloadable=True)
+	LEAD_OUTBOX_MAX_ATTEMPTS: int = Setting(8, minimum=1, reloadable=True)
+	LEAD_OUTBOX_BASE_DELAY: float = Setting(2.0, minimum=0, reloadable=True)
+	LEAD_OUTBOX_MAX_DELAY: float = Setting(300.0, minimum=0, reloadable=True)
+
+	# Аналитика воронки и заявок: файл SQLite (пусто — выключена)
+	ANALYTICS_DB_PATH: str = Setting('data/analytics.db')
+
+	# Шина событий воронки: размер буфера, событий в пачке, период записи (сек), политика
+	# переполнения и ожидание места при политике block (сек)
+	EVENT_BUFFER_SIZE: int = Setting(10000, minimum=1)
+	EVENT_BATCH_SIZE: int = Setting(500, minimum=1, reloadable=True)
+	EVENT_FLUSH_INTERVAL: float = Setting(1.0, fallback=('ANALYTICS_FLUSH_INTERVAL',), minimum=0.05, reloadable=True)
+	EVENT_OVERFLOW_POLICY: str = Setting('drop_oldest', choices=('drop_oldest', 'drop_newest', 'block'), reloadable=True)
+	EVENT_BLOCK_TIMEOUT: float = Setting(0.05, minimum=0, reloadable=True)
+
+	# Дополнительные приемники событий: JSON-файл и HTTP-сборщик (пусто — выключены)
+	EVENT_LOG_PATH: str = Setting('')
+	EVENT_COLLECTOR_URL: Optional[Url] = Setting()
+
+	# Как часто проверять изменения файла .env (сек, 0 — только по сигналу SIGHUP)
+	CONFIG_WATCH_INTERVAL: float = Setting(5.0, minimum=0)
+
+	# Логирование: уровень, каталог, формат файла (json или text)
+	LOG_LEVEL: str = Setting('INFO', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'), reloadable=True)
+	LOG_DIR: str = Setting('logs')
+	LOG_FORMAT: str = Setting('json', choices=('json', 'text'))
+
+	# Ротация логов: size (LOG_MAX_BYTES) или time (LOG_ROTATE_WHEN), сколько файлов хранить
+	LOG_ROTATION: str = Setting('size', choices=('size', 'time'))
+	LOG_MAX_BYTES: int = Setting(10 * 1024 * 1024, minimum=1)
+	LOG_ROTATE_WHEN: str = Setting('midnight')
+	LOG_BACKUP_COUNT: int = Setting(5, minimum=0)
+
+	# Доля INFO-записей по логгерам, например "bot=0.2,openai_client=0.5" (WARNING и выше пишутся всегда)
+	LOG_SAMPLE_RATES: str = Setting('')
+
+	# Маскировать телефоны и email в логах
+	LOG_REDACT_PII: bool = Setting(True)
+	
+	_settings: Dict[str, Setting] = {}
+	_errors: Dict[str, str] = {}
+	_listeners: List[ReloadListener] = []
+	
+	@classmethod
+	def _bind(cls) -> None:
+		"""Собирает описания настроек из атрибутов класса"""
+		hints = typing.get_type_hints(cls)
+		cls._settings = {}
+		for name, value in list(vars(cls).items()):
+			if isinstance(value, Setting):
+				value.bind(name, hints[name])
+				cls._settings[name] = value
+	
+	@classmethod
+	def _parse(cls, env: Mapping[str, str]) -> Tuple[Dict[str, Any], Dict[str, str]]:
+		"""Разбирает все настройки; при ошибке остается значение по умолчанию"""
+		values, errors = {}, {}
+		for name, setting in cls._settings.items():
+			try:
+				values[name] = setting.parse(env)
+			except ConfigError as e:
+				values[name] = setting.default
+				errors[name] = str(e)
+		return values, errors
+	
+	@classmethod
+	def _consistency_errors(cls, values: Mapping[str, Any]) -> List[str]:
+		"""Проверки, затрагивающие несколько настроек сразу"""
+		errors = []
+		if values['BOT_MODE'] == 'webhook' and not values['WEBHOOK_URL']:
+			errors.append("BOT_MODE=webhook требует WEBHOOK_URL")
+		if values['RUN_POLL_INITIAL'] > values['RUN_POLL_MAX']:
+			errors.append("RUN_POLL_INITIAL больше RUN_POLL_MAX")
+		if values['LEAD_OUTBOX_BASE_DELAY'] > values['LEAD_OUTBOX_MAX_DELAY']:
+			errors.append("LEAD_OUTBOX_BASE_DELAY больше LEAD_OUTBOX_MAX_DELAY")
+		if values['OPENAI_BREAKER_MIN_CALLS'] > values['OPENAI_BREAKER_WINDOW']:
+			errors.append("OPENAI_BREAKER_MIN_CALLS больше OPENAI_BREAKER_WINDOW")
+		if values['SHUTDOWN_DRAIN_TIMEOUT'] > values['SHUTDOWN_TIMEOUT']:
+			errors.append("SHUTDOWN_DRAIN_TIMEOUT больше SHUTDOWN_TIMEOUT")
+		return errors
+	
+	@classmethod
+	def load(cls, env: Optional[Mapping[str, str]] = None) -> None:
+		"""
+		Читает все настройки (ошибки разбора сообщит validate)
+		
+		Args:
+			env: Переменные окружения (по умолчанию — окружение процесса)
+		"""
+		values, cls._errors = cls._parse(os.environ if env is None else env)
+		for name, value in values.items():
+			setattr(cls, name, value)
+	
+	@classmethod
+	def values(cls) -> Dict[str, Any]:
+		"""Текущие значения всех настроек"""
+		return {name: getattr(cls, name) for name in cls._settings}
 	
 	@classmethod
 	def validate(cls):
-		"""Проверяет, что все необходимые переменные окружения установлены"""
-		required_vars = [
-			'TELEGRAM_BOT_TOKEN',
-			'OPENAI_API_KEY', 
-			'OPENAI_ASSISTANT_ID',
-			'WORKING_CHAT_ID',
-			'LOGO_IMAGE_URL'
-		]
+		"""Проверяет, что все необходимые переменные окружения установлены и корректны"""
+		errors = list(cls._errors.values())
+		if errors:
+			raise ConfigError(f"Некорректные переменные окружения: {'; '.join(errors)}")
 		
 		missing_vars = []
-		for var in required_vars:
-			if not getattr(cls, var):
-				missing_vars.append(var)
+		for name, setting in cls._settings.items():
+			if setting.required and getattr(cls, name) in (None, ''):
+				missing_vars.append(name)
 		
 		if missing_vars:
-			raise ValueError(f"Отсутствуют обязательные переменные окружения: {', '.join(missing_vars)}")
+			raise ConfigError(f"Отсутствуют обязательные переменные окружения: {', '.join(missing_vars)}")
+		
+		errors = cls._consistency_errors(cls.values())
+		if errors:
+			raise ConfigError(f"Несовместимые настройки: {'; '.join(errors)}")
 		
 		return True
+	
+	@classmethod
+	def reload(cls, env: Optional[Mapping[str, str]] = None) -> Dict[str, Tuple[Any, Any]]:
+		"""
+		Перечитывает настройки и применяет изменившиеся параметры с reloadable=True
+		
+		Остальные параметры действуют до перезапуска: их изменение только
+		попадает в лог. Если хоть одно новое значение некорректно, не
+		применяется ничего. Подписчики (subscribe) получают список изменений.
+		
+		Args:
+			env: Переменные окружения (по умолчанию — окружение процесса и текущий .env)
+			
+		Returns:
+			Dict[str, Tuple[Any, Any]]: Примененные изменения: имя -> (старое, новое значение)
+			
+		Raises:
+			ConfigError: Новые значения не прошли проверку
+		"""
+		values, errors = cls._parse(read_env() if env is None else env)
+		current = cls.values()
+		changed = {}
+		for name, value in values.items():
+			setting = cls._settings[name]
+			if name in errors or value == current[name]:
+				continue
+			if setting.reloadable:
+				changed[name] = (current[name], value)
+			else:
+				logger.warning(f"⚠️ {name} изменен, новое значение применится после перезапуска")
+		
+		problems = [message for name, message in errors.items() if cls._settings[name].reloadable]
+		problems += cls._consistency_errors({**current, **{name: new for name, (_, new) in changed.items()}})
+		if problems:
+			raise ConfigError(f"Настройки не перезагружены: {'; '.join(problems)}")
+		
+		for name, (_, value) in changed.items():
+			setattr(cls, name, value)
+		if changed:
+			logger.info(f"🔄 Настройки обновлены: {', '.join(f'{name}={new}' for name, (_, new) in changed.items())}")
+			for listener in list(cls._listeners):
+				try:
+					listener(changed)
+				except Exception as e:
+					logger.error(f"❌ Ошибка применения новых настроек: {e}")
+		return changed
+	
+	@classmethod
+	def subscribe(cls, listener: ReloadListener) -> None:
+		"""Подписывает колбэк на изменения настроек при перезагрузке"""
+		cls._listeners.append(listener)
+	
+	@classmethod
+	def unsubscribe(cls, listener: ReloadListener) -> None:
+		"""Отписывает колбэк от изменений настроек"""
+		if listener in cls._listeners:
+			cls._listeners.remove(listener)
+
+
+Config._bind()
+Config.load()
+
+
+def read_env(path: Optional[str] = None) -> Dict[str, str]:
+	"""
+	Собирает переменные для перезагрузки: окружение процесса и текущее содержимое .env
+	
+	Переменные, заданные в окружении процесса, по-прежнему важнее файла, а
+	удаленные из файла возвращаются к значениям по умолчанию.
+	
+	Args:
+		path: Файл с переменными (по умолчанию — ENV_FILE)
+	"""
+	path = path or ENV_FILE
+	env = {key: value for key, value in os.environ.items() if key not in _DOTENV_KEYS}
+	if path and os.path.exists(path):
+		for key, value in dotenv_values(path).items():
+			if value is not None and key not in env:
+				env[key] = value
+	return env
+
+
+class ConfigWatcher:
+	"""
+	Перезагружает настройки по сигналу SIGHUP и при изменении файла .env
+	
+	Файл проверяется по времени изменения, поэтому наблюдение почти ничего
+	не стоит. Перезагрузка идет в event loop между обработкой обновлений:
+	текущие диалоги не прерываются, новые значения действуют со следующего запроса.
+	"""
+	
+	def __init__(self, path: Optional[str] = None, interval: float = 5.0):
+		"""
+		Args:
+			path: Файл для наблюдения (по умолчанию — найденный .env)
+			interval: Пауза между проверками файла (сек, 0 — только по сигналу)
+		"""
+		self.path = Path(path or ENV_FILE or Path(__file__).with_name('.env'))
+		self.interval = interval
+		self.reloads = 0
+		self.failures = 0
+		self._mtime = self._stat()
+		self._task: Optional[asyncio.Task] = None
+		self._signal = False
+	
+	def _stat(self) -> Optional[int]:
+		try:
+			return self.path.stat().st_mtime_ns
+		except OSError:
+			return None
+	
+	def reload(self) -> Dict[str, Tuple[Any, Any]]:
+		"""Перезагружает настройки, не пробрасывая ошибки проверки"""
+		try:
+			changed = Config.reload(read_env(str(self.path)))
+		except ConfigError as e:
+			self.failures += 1
+			logger.error(f"❌ {e}")
+			return {}
+		self.reloads += 1
+		if not changed:
+			logger.info("🔄 Настройки перечитаны, изменений нет")
+		return changed
+	
+	def start(self) -> None:
+		"""Подключает SIGHUP и запускает наблюдение за файлом (нужен работающий event loop)"""
+		loop = asyncio.get_running_loop()
+		if hasattr(signal, 'SIGHUP') and not self._signal:
+			try:
+				loop.add_signal_handler(signal.SIGHUP, self.reload)
+				self._signal = True
+			except (NotImplementedError, RuntimeError, ValueError) as e:
+				# Не главный поток или платформа без сигналов — остается наблюдение за файлом
+				logger.debug(f"SIGHUP недоступен: {e}")
+		if self.interval > 0 and self._task is None:
+			self._task = asyncio.create_task(self._watch())
+	
+	async def stop(self) -> None:
+		"""Отключает SIGHUP и останавливает наблюдение"""
+		if self._signal:
+			asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+			self._signal = False
+		if self._task is not None:
+			self._task.cancel()
+			try:
+				await self._task
+			except asyncio.CancelledError:
+				pass
+			self._task = None
+	
+	async def _watch(self) -> None:
+		while True:
+			await asyncio.sleep(self.interval)
+			mtime = self._stat()
+			if mtime != self._mtime:
+				self._mtime = mtime
+				logger.info(f"📝 Файл {self.path} изменен, перечитываем настройки")
+				self.reload()
@@ -0,0 +1,136 @@
+"""
+Модуль очереди сообщений пользователей перед ассистентом
+Сериализует run-ы в одном thread и склеивает сообщения, пришедшие во время активного run
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from run_waiter import DeltaCallback
+
+from metrics import QUEUE_DEPTH_ON_ENQUEUE
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationQueueFull(Exception):
+    """Очередь пользователя переполнена — новое сообщение не принято"""
+
+
+class _UserSlot:
+    """Состояние очереди одного пользователя"""
+
+    __slots__ = ('pending', 'worker')
+
+    def __init__(self):
+        self.pending: List[Tuple[str, asyncio.Future, Optional[DeltaCallback]]] = []
+        self.worker: Optional[asyncio.Task] = None
+
+
+class ConversationQueue:
+    """
+    Очередь сообщений пользователей перед ассистентом
+
+    Для каждого пользователя одновременно выполняется не больше одного run.
+    Сообщения, пришедшие во время run, копятся и уходят ассистенту одним
+    следующим ходом. Ответ на склеенный ход (и его фрагменты при потоковой
+    выдаче) получает последнее сообщение, остальным возвращается None.
+    """
+
+    def __init__(self, process: Callable[[int, str], Awaitable[str]], max_depth: int = 5):
+        """
+        Args:
+            process: Корутина, отправляющая текст ассистенту и возвращающая ответ
+            max_depth: Максимум сообщений, ожидающих своей очереди у одного пользователя
+        """
+        self.process = process
+        self.max_depth = max_depth
+        self._slots: Dict[int, _UserSlot] = {}
+        self.merged = 0     # Сколько сообщений было склеено с другими
+        self.rejected = 0   # Сколько сообщений отклонено из-за переполнения
+        self._depth_on_enqueue = QUEUE_DEPTH_ON_ENQUEUE.labels('conversation')
+
+    def depth(self, user_id: Optional[int] = None) -> int:
+        """Число ожидающих сообщений у пользователя или у всех пользователей"""
+        if user_id is not None:
+            slot = self._slots.get(user_id)
+            return len(slot.pending) if slot else 0
+        return sum(len(slot.pending) for slot in self._slots.values())
+
+    def active(self) -> int:
+        """Число пользователей, для которых сейчас выполняется или ожидает run"""
+        return len(self._slots)
+
+    def workers(self) -> List[asyncio.Task]:
+        """Задачи, которые сейчас обрабатывают очереди пользователей"""
+        return [slot.worker for slot in self._slots.values() if slot.worker and not slot.worker.done()]
+
+    def is_busy(self, user_id: int) -> bool:
+        """True, если для пользователя сейчас выполняется run"""
+        slot = self._slots.get(user_id)
+        return bool(slot and slot.worker and not slot.worker.done())
+
+    async def submit(self, user_id: int, text: str, on_delta: Optional[DeltaCallback] = None) -> Optional[str]:
+        """
+        Ставит сообщение в очередь пользователя и ждет ответа
+
+        Args:
+            user_id: ID пользователя Telegram
+            text: Текст сообщения
+            on_delta: Колбэк для фрагментов ответа по мере генерации
+
+        Returns:
+            Optional[str]: Ответ ассистента или None, если сообщение склеено с более поздним
+
+        Raises:
+            ConversationQueueFull: Если у пользователя уже max_depth ожидающих сообщений
+        """
+        slot = self._slots.get(user_id)
+        if slot is None:
+            slot = self._slots[user_id] = _UserSlot()
+
+        if len(slot.pending) >= self.max_depth:
+            self.rejected += 1
+            logger.warning(f"⚠️ Очередь пользователя {user_id} переполнена ({self.max_depth})")
+            raise ConversationQueueFull(user_id)
+
+        self._depth_on_enqueue.observe(len(slot.pending))
+        future = asyncio.get_running_loop().create_future()
+        slot.pending.append((text, future, on_delta))
+        if slot.worker is None or slot.worker.done():
+            slot.worker = asyncio.create_task(self._drain(user_id, slot))
+        return await future
+
+    async def _drain(self, user_id: int, slot: _UserSlot) -> None:
+        """Последовательно обрабатывает накопленные сообщения пользователя"""
+        try:
+            while slot.pending:
+                batch, slot.pending = slot.pending, []
+                if len(batch) > 1:
+                    self.merged += len(batch) - 1
+                    logger.info(f"🧩 Склеено {len(batch)} сообщений пользователя {user_id} в один ход")
+                text = "\n".join(item[0] for item in batch)
+                *earlier, (_, last, on_delta) = batch
+
+                try:
+                    if on_delta is not None:
+                        reply = await self.process(user_id, text, on_delta=on_delta)
+                    else:
+                        reply = await self.process(user_id, text)
+                except Exception as e:
+                    for _, future, _ in earlier:
+                        if not future.done():
+                            future.set_result(None)
+                    if not last.done():
+                        last.set_exception(e)
+                    continue
+
+                for _, future, _ in earlier:
+                    if not future.done():
+                        future.set_result(None)
+                if not last.done():
+                    last.set_result(reply)
+        finally:
+            if self._slots.get(user_id) is slot and not slot.pending:
+                del self._slots[user_id]
@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+"""
+Модуль шины событий воронки
+Обработчики кладут событие в ограниченный кольцевой буфер в памяти, а фоновая
+задача пачками отдает его приемникам: JSON-файлу, SQLite-аналитике или HTTP-сборщику.
+При переполнении буфера действует политика: вытеснить старое, отбросить новое
+или придержать обработчик до освобождения места
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, List, Optional, Sequence, Tuple
+
+from log_pipeline import redact_pii
+from metrics import EVENTS_DROPPED, EVENTS_WRITTEN
+
+logger = logging.getLogger(__name__)
+
+# Событие: (время unix, вид, user_id, доп. поля или None)
+Event = Tuple[float, str, Optional[int], Optional[dict]]
+
+# Что делать с новым событием, когда буфер полон
+POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+
+def event_to_dict(event: Event, redact: bool = True) -> dict:
+    """
+    Событие в виде JSON-объекта
+
+    Args:
+        event: Событие шины
+        redact: Маскировать телефоны и email в строковых полях
+    """
+    ts, kind, user_id, data = event
+    record = {'ts': ts, 'kind': kind, 'user_id': user_id}
+    if data:
+        for key, value in data.items():
+            record[key] = redact_pii(value) if redact and isinstance(value, str) else value
+    return record
+
+
+class EventSink:
+    """
+    Приемник пачек событий
+
+    Блокирующие приемники переопределяют write_sync — он выполняется в пуле
+    потоков; асинхронные переопределяют write. Исключение из write означает,
+    что пачку надо повторить.
+    """
+
+    name = 'sink'
+
+    async def write(self, batch: Sequence[Event]) -> None:
+        await asyncio.to_thread(self.write_sync, batch)
+
+    def write_sync(self, batch: Sequence[Event]) -> None:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class FileSink(EventSink):
+    """События построчно в JSON-файл (телефоны и email маскируются)"""
+
+    name = 'file'
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Путь к файлу (дописывается)
+        """
+        self.path = path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write_sync(self, batch: Sequence[Event]) -> None:
+        self._file.write(''.join(
+            json.dumps(event_to_dict(event), ensure_ascii=False) + '\n' for event in batch
+        ))
+        self._file.flush()
+
+    async def close(self) -> None:
+        self._file.close()
+
+
+class HttpSink(EventSink):
+    """Пачки событий POST-запросом {"events": [...]} на внешний сборщик"""
+
+    name = 'http'
+
+    def __init__(self, url: str, client=None):
+        """
+        Args:
+            url: Адрес сборщика
+            client: httpx.AsyncClient (по умолчанию — общий транспорт бота)
+        """
+        self.url = url
+        self._own_client = client is None
+        if client is None:
+            from http_transport import create_http_client
+            client = create_http_client('events', pool_size=2)
+        self.client = client
+
+    async def write(self, batch: Sequence[Event]) -> None:
+        response = await self.client.post(self.url, json={'events': [event_to_dict(event) for event in batch]})
+        response.raise_for_status()
+
+    async def close(self) -> None:
+        if self._own_client:
+            await self.client.aclose()
+
+
+class _SinkState:
+    """Приемник и пачки, которые ему не удалось записать"""
+
+    __slots__ = ('sink', 'backlog', 'backlog_size', 'written', 'failures')
+
+    def __init__(self, sink: EventSink):
+        self.sink = sink
+        self.backlog: Deque[List[Event]] = deque()
+        self.backlog_size = 0
+        self.written = 0
+        self.failures = 0
+
+
+class EventBus:
+    """
+    Шина событий с кольцевым буфером и пакетной записью
+
+    emit — синхронное добавление в буфер за доли микросекунды, без ожидания и
+    обращения к диску. publish — то же из асинхронного кода, но при политике
+    block ждет до block_timeout, пока фоновая запись освободит место. Каждый
+    приемник получает события в исходном порядке; пачка, которую приемник не
+    принял, повторяется перед следующими (не более max_backlog событий на приемник).
+    """
+
+    def __init__(self, sinks: Sequence[EventSink] = (), capacity: int = 10_000, batch_size: int = 500,
+                 flush_interval: float = 1.0, policy: str = 'drop_oldest', block_timeout: float = 0.05,
+                 max_backlog: Optional[int] = None):
+        """
+        Args:
+            sinks: Приемники событий
+            capacity: Размер буфера (событий)
+            batch_size: Событий в одной пачке; при таком размере буфера запись начинается сразу
+            flush_interval: Как часто записывать неполную пачку (сек)
+            policy: drop_oldest, drop_newest или block
+            block_timeout: Сколько publish ждет места при политике block (сек)
+            max_backlog: Сколько непринятых событий хранить для каждого приемника (по умолчанию capacity)
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Неизвестная политика переполнения: {policy}")
+        self._sinks = [_SinkState(sink) for sink in sinks]
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.max_backlog = capacity if max_backlog is None else max_backlog
+        self.emitted = 0
+        self.dropped = 0
+        self._buffer: Deque[Event] = deque()
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._flushing = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    @property
+    def sinks(self) -> List[EventSink]:
+        return [state.sink for state in self._sinks]
+
+    def emit(self, kind: str, user_id: Optional[int] = None, data: Optional[dict] = None) -> bool:
+        """
+        Добавляет событие в буфер (не ждет; при политике block и полном буфере событие отбрасывается)
+
+        Args:
+            kind: Вид события (start, start_chat, message, lead, button, reset...)
+            user_id: ID пользователя Telegram
+            data: Дополнительные поля события
+
+        Returns:
+            bool: Событие принято в буфер
+        """
+        buffer = self._buffer
+        if len(buffer) >= self.capacity:
+            if self.policy != 'drop_oldest':
+                self._drop('full')
+                return False
+            buffer.popleft()
+            self._drop('evicted')
+        buffer.append((time.time(), kind, user_id, data))
+        self.emitted += 1
+        if len(buffer) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    async def publish(self, kind: str, user_id: Optional[int] = None, data: Optional[dict] = None) -> bool:
+        """
+        Добавляет событие в буфер; при политике block и полном буфере ждет места
+
+        Args:
+            kind: Вид события
+            user_id: ID пользователя Telegram
+            data: Дополнительные поля события
+
+        Returns:
+            bool: Событие принято в буфер
+        """
+        if self.policy == 'block' and len(self._buffer) >= self.capacity:
+            deadline = time.monotonic() + self.block_timeout
+            while len(self._buffer) >= self.capacity:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._space.clear()
+                self._wakeup.set()
+                try:
+                    await asyncio.wait_for(self._space.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+        return self.emit(kind, user_id, data)
+
+    def _drop(self, reason: str) -> None:
+        self.dropped += 1
+        EVENTS_DROPPED.labels(reason).inc()
+
+    async def flush(self) -> int:
+        """
+        Отдает приемникам все накопленные события пачками по batch_size
+
+        Returns:
+            int: Сколько событий забрано из буфера
+        """
+        # Одна запись за раз, иначе пачки могли бы прийти в приемник не по порядку
+        async with self._flushing:
+            return await self._flush()
+
+    async def _flush(self) -> int:
+        # Сначала повторяем непринятые пачки; если приемник все еще недоступен,
+        # новые пачки встают за ними в очередь повторов, освобождая буфер
+        await self._deliver_backlog()
+        taken = 0
+        buffer = self._buffer
+        while buffer:
+            batch = [buffer.popleft() for _ in range(min(self.batch_size, len(buffer)))]
+            taken += len(batch)
+            self._space.set()
+            await asyncio.gather(*(self._deliver(state, batch) for state in self._sinks))
+        return taken
+
+    async def _deliver_backlog(self) -> None:
+        for state in self._sinks:
+            while state.backlog:
+                batch = state.backlog[0]
+                try:
+                    await state.sink.write(batch)
+                except Exception as e:
+                    state.failures += 1
+                    logger.warning(f"⚠️ Приемник событий {state.sink.name} недоступен: {e}")
+                    break
+                state.backlog.popleft()
+                state.backlog_size -= len(batch)
+                self._written(state, batch)
+
+    async def _deliver(self, state: _SinkState, batch: List[Event]) -> None:
+        if not state.backlog:
+            try:
+                await state.sink.write(batch)
+            except Exception as e:
+                state.failures += 1
+                logger.warning(f"⚠️ Приемник событий {state.sink.name} не принял {len(batch)} событий: {e}")
+            else:
+                self._written(state, batch)
+                return
+        state.backlog.append(batch)
+        state.backlog_size += len(batch)
+        while state.backlog_size > self.max_backlog and len(state.backlog) > 1:
+            lost = state.backlog.popleft()
+            state.backlog_size -= len(lost)
+            EVENTS_DROPPED.labels('backlog').inc(len(lost))
+
+    @staticmethod
+    def _written(state: _SinkState, batch: List[Event]) -> None:
+        state.written += len(batch)
+        EVENTS_WRITTEN.labels(state.sink.name).inc(len(batch))
+
+    def start(self) -> None:
+        """Запускает фоновую запись (нужен работающий event loop)"""
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Останавливает фоновую запись, отдает приемникам остаток буфера и закрывает их"""
+        if self._task is not None:
+            # Фоновая задача дописывает текущую пачку и выходит сама: отмена посреди
+            # записи в приемник повторила бы пачку
+            self._stopping = True
+            self._wakeup.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"❌ Не удалось записать события: {e}")
+        for state in self._sinks:
+            if state.backlog:
+                logger.warning(f"⚠️ Приемник {state.sink.name} не получил {state.backlog_size} событий")
+            try:
+                await state.sink.close()
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка закрытия приемника {state.sink.name}: {e}")
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            if len(self._buffer) < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            if self._stopping:
+                break
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка записи событий: {e}")
+
+    def stats(self) -> dict:
+        """Принято, отброшено, в буфере и записано каждым приемником"""
+        return {
+            'emitted': self.emitted,
+            'dropped': self.dropped,
+            'buffered': len(self._buffer),
+            'sinks': {
+                state.sink.name: {'written': state.written, 'backlog': state.backlog_size, 'failures': state.failures}
+                for state in self._sinks
+            },
+        }
+
+
+class EventCollector:
+    """
+    Локальный HTTP-сборщик событий — замена внешнего для разработки и бенчмарков
+
+    Принимает POST с {"events": [...]} и дописывает события в JSON-файл
+    (или только считает их, если файл не задан).
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8090, path: Optional[str] = None,
+                 fail_rate: float = 0.0):
+        """
+        Args:
+            host: Адрес для прослушивания
+            port: Порт (0 — выбрать свободный)
+            path: Файл для принятых событий
+            fail_rate: Доля запросов, получающих 503 (проверка повторов)
+        """
+        self.host = host
+        self.port = port
+        self.path = path
+        self.fail_rate = fail_rate
+        self.received = 0
+        self.batches = 0
+        self._server: Optional[asyncio.base_events.Server] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/events"
+
+    async def start(self) -> 'EventCollector':
+        """Запускает сервер"""
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"📥 Сборщик событий слушает {self.url}")
+        return self
+
+    async def stop(self) -> None:
+        """Останавливает сервер"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                length = 0
+                while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    name, _, value = line.decode('latin-1').partition(':')
+                    if name.strip().lower() == 'content-length':
+                        length = int(value.strip())
+                body = await reader.readexactly(length) if length else b''
+                if random.random() < self.fail_rate:
+                    status = '503 Service Unavailable'
+                else:
+                    status = '204 No Content'
+                    self._store(json.loads(body or b'{}').get('events', []))
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n\r\n".encode())
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def _store(self, events: List[Any]) -> None:
+        self.received += len(events)
+        self.batches += 1
+        if self.path:
+            with open(self.path, 'a', encoding='utf-8') as out:
+                out.write(''.join(json.dumps(event, ensure_ascii=False) + '\n' for event in events))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный сборщик событий воронки Synaplink")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--out', default=None, help="Файл для принятых событий (JSON по строкам)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    async def serve():
+        collector = await EventCollector(args.host, args.port, args.out).start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await collector.stop()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
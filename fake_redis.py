@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Локальный фейковый Redis-сервер для разработки и тестов
+Понимает подмножество протокола RESP, которое использует RedisSessionStore
+"""
+
+import argparse
+import asyncio
+import fnmatch
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class FakeRedisServer:
+    """Минимальный Redis-совместимый сервер в памяти"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        """
+        Args:
+            host: Адрес для прослушивания
+            port: Порт (0 — выбрать свободный)
+        """
+        self.host = host
+        self.port = port
+        self.data: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+        self.commands_processed = 0
+        self._server: Optional[asyncio.base_events.Server] = None
+
+    @property
+    def url(self) -> str:
+        return f"redis://{self.host}:{self.port}/0"
+
+    async def start(self) -> 'FakeRedisServer':
+        """Запускает сервер"""
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"🧪 Фейковый Redis слушает {self.host}:{self.port}")
+        return self
+
+    async def stop(self) -> None:
+        """Останавливает сервер"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _read_command(self, reader: asyncio.StreamReader) -> Optional[list]:
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            # Inline-команда (например, из redis-cli или telnet)
+            return line.strip().split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            header = await reader.readline()
+            length = int(header[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    def _get(self, key: bytes) -> Optional[bytes]:
+        item = self.data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    @staticmethod
+    def _bulk(value: Optional[bytes]) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def _execute(self, args: list) -> bytes:
+        self.commands_processed += 1
+        name = args[0].upper()
+        if name in (b'PING',):
+            return b"+PONG\r\n"
+        if name in (b'AUTH', b'SELECT'):
+            return b"+OK\r\n"
+        if name == b'GET':
+            return self._bulk(self._get(args[1]))
+        if name == b'MGET':
+            return b"*%d\r\n" % (len(args) - 1) + b"".join(self._bulk(self._get(k)) for k in args[1:])
+        if name == b'SET':
+            expires_at = None
+            if len(args) >= 5 and args[3].upper() == b'EX':
+                expires_at = time.monotonic() + int(args[4])
+            elif len(args) >= 5 and args[3].upper() == b'PX':
+                expires_at = time.monotonic() + int(args[4]) / 1000
+            self.data[args[1]] = (args[2], expires_at)
+            return b"+OK\r\n"
+        if name == b'PEXPIRE':
+            value = self._get(args[1])
+            if value is None:
+                return b":0\r\n"
+            self.data[args[1]] = (value, time.monotonic() + int(args[2]) / 1000)
+            return b":1\r\n"
+        if name == b'DEL':
+            removed = sum(1 for k in args[1:] if self.data.pop(k, None) is not None)
+            return b":%d\r\n" % removed
+        if name == b'SCAN':
+            # Весь ответ за одну итерацию: курсор сразу 0
+            pattern = args[args.index(b'MATCH') + 1].decode() if b'MATCH' in args else '*'
+            keys = [k for k in list(self.data) if self._get(k) is not None and fnmatch.fnmatchcase(k.decode(), pattern)]
+            return b"*2\r\n" + self._bulk(b'0') + b"*%d\r\n" % len(keys) + b"".join(self._bulk(k) for k in keys)
+        if name == b'FLUSHDB':
+            self.data.clear()
+            return b"+OK\r\n"
+        return b"-ERR unknown command '%s'\r\n" % name
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                if not args:
+                    continue
+                writer.write(self._execute(args))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def _serve(host: str, port: int) -> None:
+    server = await FakeRedisServer(host, port).start()
+    print(f"🧪 Фейковый Redis запущен: {server.url}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальный фейковый Redis для разработки")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    cli_args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_serve(cli_args.host, cli_args.port))
+    except KeyboardInterrupt:
+        print("\n👋 Фейковый Redis остановлен")
@@ -0,0 +1,154 @@
+"""
+Модуль общего HTTP-транспорта бота
+Единые настройки пулов соединений, keep-alive, HTTP/2 и таймаутов для Telegram Bot API,
+OpenAI и загрузки медиафайлов; учет переиспользования соединений
+"""
+
+import importlib.util
+import logging
+from typing import Callable, Dict, Optional
+
+import httpx
+from telegram.request import HTTPXRequest
+
+from config import Config
+from metrics import HTTP_CONNECTIONS, HTTP_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+def http2_enabled() -> bool:
+    """HTTP/2 включен в настройках и установлен пакет h2 (HTTP_VERSION=auto включает его, если он есть)"""
+    mode = Config.HTTP_VERSION
+    if mode == '1.1':
+        return False
+    available = importlib.util.find_spec('h2') is not None
+    if mode == '2' and not available:
+        logger.warning("⚠️ HTTP_VERSION=2, но пакет h2 не установлен (pip install 'httpx[http2]') — используется HTTP/1.1")
+    return available
+
+
+class ConnectionStats:
+    """
+    Счетчик запросов и новых соединений одного клиента
+
+    Новое соединение видно по событию трассировки connect_tcp, которое httpcore
+    генерирует только при открытии сокета; запрос по keep-alive его не дает.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.requests = 0
+        self.connections = 0
+        self._requests_metric = HTTP_REQUESTS.labels(name)
+        self._connections_metric = HTTP_CONNECTIONS.labels(name)
+
+    @property
+    def reuse_rate(self) -> float:
+        """Доля запросов, ушедших по уже открытому соединению"""
+        if not self.requests:
+            return 0.0
+        return max(0.0, 1 - self.connections / self.requests)
+
+    def as_dict(self) -> dict:
+        return {'requests': self.requests, 'connections': self.connections, 'reuse_rate': round(self.reuse_rate, 4)}
+
+    async def on_request(self, request: httpx.Request) -> None:
+        self.requests += 1
+        self._requests_metric.inc()
+        request.extensions['trace'] = self._trace
+
+    async def _trace(self, event: str, info: dict) -> None:
+        if event == 'connection.connect_tcp.complete':
+            self.connections += 1
+            self._connections_metric.inc()
+
+
+_STATS: Dict[str, ConnectionStats] = {}
+
+
+def connection_stats(name: Optional[str] = None):
+    """Статистика соединений клиента по имени или всех клиентов процесса"""
+    if name is not None:
+        return _STATS.setdefault(name, ConnectionStats(name))
+    return {key: stats.as_dict() for key, stats in _STATS.items()}
+
+
+def http_limits(pool_size: Optional[int] = None) -> httpx.Limits:
+    """Лимиты пула соединений из Config"""
+    return httpx.Limits(
+        max_connections=pool_size or Config.HTTP_POOL_SIZE,
+        max_keepalive_connections=min(pool_size or Config.HTTP_POOL_SIZE, Config.HTTP_KEEPALIVE_CONNECTIONS),
+        keepalive_expiry=Config.HTTP_KEEPALIVE_EXPIRY
+    )
+
+
+def http_timeout(read: Optional[float] = None) -> httpx.Timeout:
+    """Таймауты подключения, чтения, записи и ожидания пула из Config"""
+    return httpx.Timeout(
+        connect=Config.HTTP_CONNECT_TIMEOUT,
+        read=Config.HTTP_READ_TIMEOUT if read is None else read,
+        write=Config.HTTP_WRITE_TIMEOUT,
+        pool=Config.HTTP_POOL_TIMEOUT
+    )
+
+
+def create_http_client(name: str, pool_size: Optional[int] = None, read_timeout: Optional[float] = None,
+                       wrap: Optional[Callable[[httpx.AsyncBaseTransport], httpx.AsyncBaseTransport]] = None,
+                       **kwargs) -> httpx.AsyncClient:
+    """
+    Создает httpx-клиент с общими настройками транспорта
+
+    Args:
+        name: Имя клиента в статистике соединений и метриках
+        pool_size: Максимум соединений (по умолчанию HTTP_POOL_SIZE)
+        read_timeout: Таймаут чтения (по умолчанию HTTP_READ_TIMEOUT)
+        wrap: Обертка над транспортом с пулом соединений (например, ResilientTransport)
+        **kwargs: Дополнительные параметры httpx.AsyncClient
+
+    Returns:
+        httpx.AsyncClient: Клиент (закрывается владельцем через aclose)
+    """
+    stats = connection_stats(name)
+    if wrap is not None:
+        # Лимиты пула и HTTP/2 задаются транспорту: клиент с transport= их не применяет
+        kwargs['transport'] = wrap(httpx.AsyncHTTPTransport(limits=http_limits(pool_size), http2=http2_enabled()))
+    return httpx.AsyncClient(
+        limits=http_limits(pool_size),
+        timeout=http_timeout(read_timeout),
+        http2=http2_enabled(),
+        event_hooks={'request': [stats.on_request]},
+        **kwargs
+    )
+
+
+def telegram_request(name: str = 'telegram', pool_size: Optional[int] = None,
+                     read_timeout: Optional[float] = None) -> HTTPXRequest:
+    """
+    Транспорт python-telegram-bot с общими настройками
+
+    Args:
+        name: Имя клиента в статистике соединений
+        pool_size: Максимум соединений (по умолчанию HTTP_POOL_SIZE)
+        read_timeout: Таймаут чтения (для get_updates к нему добавляется timeout long polling)
+    """
+    stats = connection_stats(name)
+    return HTTPXRequest(
+        connection_pool_size=pool_size or Config.HTTP_POOL_SIZE,
+        read_timeout=Config.HTTP_READ_TIMEOUT if read_timeout is None else read_timeout,
+        write_timeout=Config.HTTP_WRITE_TIMEOUT,
+        connect_timeout=Config.HTTP_CONNECT_TIMEOUT,
+        pool_timeout=Config.HTTP_POOL_TIMEOUT,
+        http_version='2' if http2_enabled() else '1.1',
+        httpx_kwargs={'limits': http_limits(pool_size), 'event_hooks': {'request': [stats.on_request]}}
+    )
+
+
+def get_updates_request() -> HTTPXRequest:
+    """
+    Отдельный транспорт для get_updates
+
+    Long polling держит одно соединение до GET_UPDATES_TIMEOUT секунд, поэтому
+    ему нужен свой маленький пул, чтобы не занимать соединения исходящих сообщений.
+    """
+    return telegram_request('telegram_updates', pool_size=Config.GET_UPDATES_POOL_SIZE)
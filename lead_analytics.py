@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Модуль аналитики заявок и воронки
+Хранит разобранные заявки и события воронки (/start, «Начать диалог», первое
+сообщение, заявка) в SQLite; агрегаты по дням и гистограмма времени до заявки
+обновляются при записи, поэтому отчеты не сканируют сырые события
+"""
+
+import argparse
+import csv
+import logging
+import math
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, TextIO
+
+from application_handler import extract_lead
+from event_bus import Event, EventSink
+
+logger = logging.getLogger(__name__)
+
+# Этапы воронки по порядку; событие message засчитывается как first_message один раз
+FUNNEL_STAGES = ('start', 'start_chat', 'first_message', 'lead')
+EVENT_STAGES = {'start': 'start', 'start_chat': 'start_chat', 'message': 'first_message', 'lead': 'lead'}
+
+# Гистограмма времени до заявки: границы корзин растут в LATENCY_BASE раз (точность ~12%)
+LATENCY_BASE = 1.25
+LATENCY_MAX_BUCKET = 80           # ~57 суток; все, что дольше, попадает в последнюю корзину
+
+# Выгружаемые таблицы и их колонки
+EXPORT_COLUMNS = {
+    'events': ('id', 'ts', 'user_id', 'kind'),
+    'leads': ('id', 'ts', 'day', 'user_id', 'name', 'phone', 'email', 'telegram', 'request',
+              'confidence', 'text'),
+}
+
+
+def day_of(ts: float) -> str:
+    """День события по локальному времени сервера (YYYY-MM-DD)"""
+    return time.strftime('%Y-%m-%d', time.localtime(ts))
+
+
+def latency_bucket(seconds: float) -> int:
+    """Номер корзины гистограммы: корзина k покрывает (LATENCY_BASE**(k-1), LATENCY_BASE**k] секунд"""
+    if seconds <= 1:
+        return 0
+    return min(LATENCY_MAX_BUCKET, math.ceil(math.log(seconds) / math.log(LATENCY_BASE)))
+
+
+class LeadAnalytics(EventSink):
+    """
+    Хранилище аналитики в SQLite
+
+    Подключается к шине событий (event_bus.EventBus) как приемник: обработчики
+    только кладут событие в буфер шины, а пачки пишутся сюда одной транзакцией
+    в пуле потоков. Кроме сырых событий поддерживаются сводные таблицы: этап
+    воронки для каждого пользователя, число пользователей на этапе по дню
+    когорты (день первого события) и гистограмма времени от /start до заявки —
+    их размер не зависит от числа событий.
+    """
+
+    name = 'analytics'
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Путь к файлу базы данных
+        """
+        self.path = path
+        self.written = 0
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "id INTEGER PRIMARY KEY, ts REAL NOT NULL, user_id INTEGER, kind TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS events_ts ON events (ts);"
+            "CREATE INDEX IF NOT EXISTS events_user ON events (user_id, ts);"
+            "CREATE TABLE IF NOT EXISTS leads ("
+            "id INTEGER PRIMARY KEY, ts REAL NOT NULL, day TEXT NOT NULL, user_id INTEGER, name TEXT, "
+            "phone TEXT, email TEXT, telegram TEXT, request TEXT, confidence REAL, text TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS leads_day ON leads (day);"
+            "CREATE INDEX IF NOT EXISTS leads_user ON leads (user_id);"
+            "CREATE TABLE IF NOT EXISTS users ("
+            "user_id INTEGER PRIMARY KEY, cohort_day TEXT NOT NULL, start REAL, start_chat REAL, "
+            "first_message REAL, lead REAL);"
+            "CREATE TABLE IF NOT EXISTS funnel_daily ("
+            "day TEXT NOT NULL, stage TEXT NOT NULL, users INTEGER NOT NULL, "
+            "PRIMARY KEY (day, stage)) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS lead_latency ("
+            "day TEXT NOT NULL, bucket INTEGER NOT NULL, users INTEGER NOT NULL, "
+            "PRIMARY KEY (day, bucket)) WITHOUT ROWID;"
+        )
+
+    # --- Запись (приемник шины событий) ---
+
+    def write_sync(self, batch: Sequence[Event]) -> None:
+        """
+        Записывает пачку событий шины одной транзакцией
+
+        Событие lead с полем text сохраняется и как разобранная заявка.
+
+        Args:
+            batch: События (время, вид, user_id, поля)
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for ts, kind, user_id, data in batch:
+                    if kind == 'lead' and data and data.get('text'):
+                        self._insert_lead(ts, user_id, data['text'])
+                    self._insert_event(ts, user_id, kind)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        self.written += len(batch)
+
+    def _insert_lead(self, ts: float, user_id: int, text: str) -> None:
+        lead = extract_lead(text)
+        self._conn.execute(
+            "INSERT INTO leads (ts, day, user_id, name, phone, email, telegram, request, confidence, text) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (ts, day_of(ts), user_id, lead.name, lead.phone_normalized or lead.phone,
+             lead.email_normalized or lead.email, lead.telegram, lead.request, lead.confidence, text)
+        )
+
+    def _insert_event(self, ts: float, user_id: int, kind: str) -> None:
+        self._conn.execute("INSERT INTO events (ts, user_id, kind) VALUES (?, ?, ?)", (ts, user_id, kind))
+        stage = EVENT_STAGES.get(kind)
+        if stage is None or user_id is None:
+            return
+        self._conn.execute(
+            "INSERT OR IGNORE INTO users (user_id, cohort_day) VALUES (?, ?)", (user_id, day_of(ts))
+        )
+        # Этап засчитывается пользователю один раз — при первом достижении
+        reached = self._conn.execute(
+            f"UPDATE users SET {stage} = ? WHERE user_id = ? AND {stage} IS NULL", (ts, user_id)
+        ).rowcount
+        if not reached:
+            return
+        cohort_day, started = self._conn.execute(
+            "SELECT cohort_day, start FROM users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        self._conn.execute(
+            "INSERT INTO funnel_daily (day, stage, users) VALUES (?, ?, 1) "
+            "ON CONFLICT (day, stage) DO UPDATE SET users = users + 1",
+            (cohort_day, stage)
+        )
+        if stage == 'lead' and started is not None:
+            self._conn.execute(
+                "INSERT INTO lead_latency (day, bucket, users) VALUES (?, ?, 1) "
+                "ON CONFLICT (day, bucket) DO UPDATE SET users = users + 1",
+                (cohort_day, latency_bucket(ts - started))
+            )
+
+    async def close(self) -> None:
+        """Закрывает файл базы"""
+        with self._lock:
+            self._conn.close()
+
+    # --- Отчеты (синхронные: из async-кода вызывайте через asyncio.to_thread) ---
+
+    def conversion_by_day(self, since: Optional[str] = None, until: Optional[str] = None) -> List[dict]:
+        """
+        Воронка по дням когорты: сколько пользователей дошли до каждого этапа
+
+        Args:
+            since: Первый день (YYYY-MM-DD), включительно
+            until: Последний день (YYYY-MM-DD), включительно
+
+        Returns:
+            List[dict]: По строке на день: этапы и conversion (доля заявок от /start)
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT day, stage, users FROM funnel_daily WHERE day >= ? AND day <= ? ORDER BY day",
+                (since or '', until or '9999')
+            ).fetchall()
+        days: Dict[str, dict] = {}
+        for day, stage, users in rows:
+            days.setdefault(day, {'day': day, **{name: 0 for name in FUNNEL_STAGES}})[stage] = users
+        for row in days.values():
+            row['conversion'] = round(row['lead'] / row['start'], 4) if row['start'] else None
+        return list(days.values())
+
+    def time_to_lead(self, percentiles: Iterable[float] = (50, 90, 99), since: Optional[str] = None,
+                     until: Optional[str] = None) -> dict:
+        """
+        Перцентили времени от /start до заявки по гистограмме
+
+        Args:
+            percentiles: Нужные перцентили
+            since: Первый день когорты (YYYY-MM-DD), включительно
+            until: Последний день когорты (YYYY-MM-DD), включительно
+
+        Returns:
+            dict: count и p<N> — верхняя граница корзины в секундах (None, если заявок нет)
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT bucket, SUM(users) FROM lead_latency WHERE day >= ? AND day <= ? "
+                "GROUP BY bucket ORDER BY bucket",
+                (since or '', until or '9999')
+            ).fetchall()
+        total = sum(users for _, users in rows)
+        result = {'count': total}
+        for p in percentiles:
+            key = f"p{p:g}"
+            result[key] = None
+            if not total:
+                continue
+            rank, seen = math.ceil(total * p / 100), 0
+            for bucket, users in rows:
+                seen += users
+                if seen >= rank:
+                    result[key] = round(LATENCY_BASE ** bucket, 1)
+                    break
+        return result
+
+    def iter_batches(self, table: str = 'leads', since: Optional[float] = None, until: Optional[float] = None,
+                     batch_size: int = 10_000) -> Iterator[Dict[str, list]]:
+        """
+        Читает таблицу пачками по колонкам, не загружая ее целиком
+
+        Выгрузка идет через отдельное соединение только для чтения с постраничным
+        проходом по id, поэтому не мешает записи.
+
+        Args:
+            table: events или leads
+            since: Начало интервала (unix time), включительно
+            until: Конец интервала (unix time), не включительно
+            batch_size: Строк в пачке
+
+        Yields:
+            Dict[str, list]: Колонка -> значения строк пачки
+        """
+        columns = EXPORT_COLUMNS[table]
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30)
+        try:
+            last_id = 0
+            while True:
+                rows = conn.execute(
+                    f"SELECT {', '.join(columns)} FROM {table} WHERE id > ? AND ts >= ? AND ts < ? "
+                    f"ORDER BY id LIMIT ?",
+                    (last_id, since or 0, until or math.inf, batch_size)
+                ).fetchall()
+                if not rows:
+                    return
+                last_id = rows[-1][0]
+                yield {name: list(values) for name, values in zip(columns, zip(*rows))}
+        finally:
+            conn.close()
+
+    def export_csv(self, out: TextIO, table: str = 'leads', since: Optional[float] = None,
+                   until: Optional[float] = None, batch_size: int = 10_000) -> int:
+        """
+        Потоково выгружает таблицу в CSV
+
+        Args:
+            out: Текстовый поток для записи
+            table: events или leads
+            since: Начало интервала (unix time), включительно
+            until: Конец интервала (unix time), не включительно
+            batch_size: Строк в пачке
+
+        Returns:
+            int: Сколько строк выгружено
+        """
+        writer = csv.writer(out)
+        writer.writerow(EXPORT_COLUMNS[table])
+        count = 0
+        for batch in self.iter_batches(table, since, until, batch_size):
+            rows = list(zip(*batch.values()))
+            writer.writerows(rows)
+            count += len(rows)
+        return count
+
+    def stats(self) -> dict:
+        """Число событий, заявок и пользователей в базе"""
+        with self._lock:
+            return {
+                table: self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ('events', 'leads', 'users')
+            }
+
+
+def _timestamp(day: Optional[str]) -> Optional[float]:
+    return time.mktime(time.strptime(day, '%Y-%m-%d')) if day else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Аналитика заявок Synaplink: воронка и выгрузка")
+    parser.add_argument('--db', default=None, help="Файл аналитики (по умолчанию ANALYTICS_DB_PATH)")
+    sub = parser.add_subparsers(dest='command', required=True)
+    funnel = sub.add_parser('funnel', help="Воронка и конверсия по дням")
+    latency = sub.add_parser('latency', help="Перцентили времени от /start до заявки")
+    for command in (funnel, latency):
+        command.add_argument('--since', help="С дня YYYY-MM-DD")
+        command.add_argument('--until', help="По день YYYY-MM-DD")
+    export = sub.add_parser('export', help="Выгрузка в CSV")
+    export.add_argument('table', choices=sorted(EXPORT_COLUMNS), help="Что выгружать")
+    export.add_argument('--out', default='-', help="Файл CSV (по умолчанию stdout)")
+    export.add_argument('--since', help="С дня YYYY-MM-DD")
+    export.add_argument('--until', help="До дня YYYY-MM-DD (не включительно)")
+    args = parser.parse_args()
+
+    if args.db is None:
+        from config import Config
+        args.db = Config.ANALYTICS_DB_PATH
+    analytics = LeadAnalytics(args.db)
+
+    if args.command == 'funnel':
+        print(f"{'день':<12}{'start':>8}{'чат':>8}{'сообщ.':>8}{'заявки':>8}{'конверсия':>11}")
+        for row in analytics.conversion_by_day(args.since, args.until):
+            conversion = f"{row['conversion']:.1%}" if row['conversion'] is not None else "—"
+            print(f"{row['day']:<12}{row['start']:>8}{row['start_chat']:>8}{row['first_message']:>8}"
+                  f"{row['lead']:>8}{conversion:>11}")
+    elif args.command == 'latency':
+        result = analytics.time_to_lead(since=args.since, until=args.until)
+        print(f"⏱️ Заявок: {result.pop('count')}, " + ", ".join(
+            f"{key}: {value if value is not None else '—'} с" for key, value in result.items()))
+    elif args.command == 'export':
+        since, until = _timestamp(args.since), _timestamp(args.until)
+        if args.out == '-':
+            count = analytics.export_csv(sys.stdout, args.table, since, until)
+        else:
+            with open(args.out, 'w', newline='', encoding='utf-8') as out:
+                count = analytics.export_csv(out, args.table, since, until)
+        print(f"📤 Выгружено строк: {count}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
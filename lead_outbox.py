@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+Модуль надежной доставки заявок в рабочий чат (outbox)
+Заявка сначала сохраняется в SQLite, затем отправляется фоновой задачей с повторами;
+недоставленные заявки попадают в таблицу dead letter, откуда их можно повторить из CLI
+"""
+
+import argparse
+import asyncio
+import hashlib
+import logging
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Лимит длины сообщения Telegram: в один пакет собираем заявки, пока укладываемся
+MESSAGE_LIMIT = 4096
+BATCH_SEPARATOR = "\n\n———\n\n"
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """
+    Делит заявку длиннее лимита Telegram на пронумерованные части
+
+    Разрез ищется по строке во второй половине части, иначе режем ровно по лимиту;
+    к каждой части дописывается метка «(i/n)».
+    """
+    if len(text) <= limit:
+        return [text]
+    # Запас под метку вида «\n\n(12/12)»
+    size = limit - 16
+    parts = []
+    while len(text) > size:
+        cut = text.rfind("\n", size // 2, size)
+        if cut == -1:
+            cut = size
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip("\n")
+    if text:
+        parts.append(text)
+    return [f"{part}\n\n({index}/{len(parts)})" for index, part in enumerate(parts, 1)]
+
+
+def lead_hash(user_id, text: str) -> str:
+    """Ключ идемпотентности заявки: пользователь и текст без различий в пробелах"""
+    normalized = "\n".join(line.strip() for line in text.strip().splitlines() if line.strip())
+    return hashlib.sha256(f"{user_id}\n{normalized}".encode()).hexdigest()[:32]
+
+
+class LeadOutbox:
+    """
+    Outbox заявок в SQLite
+
+    Доставка «хотя бы один раз»: строка забирается в работу с арендой (lease),
+    поэтому несколько процессов могут обслуживать один файл, а упавший процесс
+    не теряет заявку — после истечения аренды ее отправит кто-то другой.
+    """
+
+    def __init__(self, path: str, send: Optional[Callable[[str], Awaitable[object]]] = None,
+                 batch_size: int = 10, max_attempts: int = 8, base_delay: float = 2.0,
+                 max_delay: float = 300.0, poll_interval: float = 5.0, lease: float = 60.0,
+                 retention: float = 30 * 24 * 3600):
+        """
+        Args:
+            path: Путь к файлу базы данных
+            send: Корутина отправки текста в рабочий чат
+            batch_size: Сколько заявок можно объединить в одно сообщение
+            max_attempts: После скольких неудачных попыток заявка уходит в dead letter
+            base_delay: Первая пауза перед повтором (сек), дальше растет вдвое
+            max_delay: Максимальная пауза перед повтором (сек)
+            poll_interval: Как часто проверять таблицу без явного сигнала (сек)
+            lease: На сколько строка закрепляется за отправителем (сек)
+            retention: Сколько хранить доставленные заявки для проверки дублей (сек)
+        """
+        self.path = path
+        self.send = send
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.retention = retention
+        self.pending = 0          # Заявок в очереди на момент последней проверки
+        self.delivered = 0
+        self.failed_attempts = 0
+        self.on_delivered: Optional[Callable[[int], None]] = None
+        self.on_failed: Optional[Callable[[int], None]] = None
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # Транзакции открываем сами (BEGIN IMMEDIATE), чтобы забор строк был атомарным между процессами
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, lead_hash TEXT NOT NULL UNIQUE, user_id TEXT, "
+            "message TEXT NOT NULL, created_at REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "next_attempt_at REAL NOT NULL, last_error TEXT, delivered_at REAL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS outbox_due ON outbox (delivered_at, next_attempt_at)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letter ("
+            "lead_hash TEXT PRIMARY KEY, user_id TEXT, message TEXT NOT NULL, created_at REAL NOT NULL, "
+            "attempts INTEGER NOT NULL, last_error TEXT, failed_at REAL NOT NULL)"
+        )
+
+    # --- Синхронная часть (выполняется в потоке) ---
+
+    @contextmanager
+    def _transaction(self):
+        """Пишущая транзакция: BEGIN IMMEDIATE сразу берет блокировку записи в файле"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _enqueue_sync(self, key: str, user_id, message: str) -> bool:
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO outbox (lead_hash, user_id, message, created_at, next_attempt_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, str(user_id), message, now, now)
+            )
+            return cursor.rowcount == 1
+
+    def _claim_sync(self) -> List[Tuple[int, str, int]]:
+        now = time.time()
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, message, attempts FROM outbox "
+                "WHERE delivered_at IS NULL AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                (now, self.batch_size)
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE outbox SET next_attempt_at = ? WHERE id = ?",
+                    [(now + self.lease, row[0]) for row in rows]
+                )
+        return rows
+
+    def _release_sync(self, ids: List[int]) -> None:
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany("UPDATE outbox SET next_attempt_at = ? WHERE id = ?",
+                             [(now, row_id) for row_id in ids])
+
+    def _mark_delivered_sync(self, ids: List[int]) -> None:
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany("UPDATE outbox SET delivered_at = ?, last_error = NULL WHERE id = ?",
+                             [(now, row_id) for row_id in ids])
+            # Попутно чистим старые доставленные заявки
+            conn.execute("DELETE FROM outbox WHERE delivered_at IS NOT NULL AND delivered_at < ?",
+                         (now - self.retention,))
+
+    def _mark_failed_sync(self, rows: List[Tuple[int, str, int]], error: str,
+                          retry_after: Optional[float]) -> int:
+        """Планирует повтор или переносит в dead letter; возвращает число перенесенных"""
+        now = time.time()
+        dead = 0
+        with self._transaction() as conn:
+            for row_id, _, attempts in rows:
+                attempts += 1
+                if attempts >= self.max_attempts:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO dead_letter "
+                        "(lead_hash, user_id, message, created_at, attempts, last_error, failed_at) "
+                        "SELECT lead_hash, user_id, message, created_at, ?, ?, ? FROM outbox WHERE id = ?",
+                        (attempts, error, now, row_id)
+                    )
+                    conn.execute("DELETE FROM outbox WHERE id = ?", (row_id,))
+                    dead += 1
+                    continue
+                delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+                delay = delay / 2 + random.uniform(0, delay / 2)
+                if retry_after is not None:
+                    delay = max(delay, retry_after)
+                conn.execute(
+                    "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                    (attempts, now + delay, error, row_id)
+                )
+        return dead
+
+    def _count_pending_sync(self) -> Tuple[int, Optional[float]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*), MIN(next_attempt_at) FROM outbox WHERE delivered_at IS NULL"
+            ).fetchone()
+
+    def stats(self) -> dict:
+        """Число заявок по состояниям"""
+        with self._lock:
+            pending, delivered = self._conn.execute(
+                "SELECT SUM(delivered_at IS NULL), SUM(delivered_at IS NOT NULL) FROM outbox"
+            ).fetchone()
+            dead = self._conn.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+        return {'pending': pending or 0, 'delivered': delivered or 0, 'dead': dead}
+
+    def list_pending(self) -> List[dict]:
+        """Недоставленные заявки"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT lead_hash, user_id, created_at, attempts, next_attempt_at, last_error "
+                "FROM outbox WHERE delivered_at IS NULL ORDER BY id"
+            ).fetchall()
+        keys = ('lead_hash', 'user_id', 'created_at', 'attempts', 'next_attempt_at', 'last_error')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def list_dead(self) -> List[dict]:
+        """Заявки в dead letter"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT lead_hash, user_id, message, created_at, attempts, last_error, failed_at "
+                "FROM dead_letter ORDER BY failed_at"
+            ).fetchall()
+        keys = ('lead_hash', 'user_id', 'message', 'created_at', 'attempts', 'last_error', 'failed_at')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def replay(self, key: Optional[str] = None) -> int:
+        """
+        Возвращает заявки из dead letter в очередь отправки
+
+        Args:
+            key: lead_hash заявки (None — все)
+
+        Returns:
+            int: Сколько заявок возвращено
+        """
+        now = time.time()
+        where, params = ("WHERE lead_hash = ?", (key,)) if key else ("", ())
+        with self._transaction() as conn:
+            rows = conn.execute(
+                f"SELECT lead_hash, user_id, message, created_at FROM dead_letter {where}", params
+            ).fetchall()
+            for lead_key, user_id, message, created_at in rows:
+                conn.execute("DELETE FROM outbox WHERE lead_hash = ?", (lead_key,))
+                conn.execute(
+                    "INSERT INTO outbox (lead_hash, user_id, message, created_at, next_attempt_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (lead_key, user_id, message, created_at, now)
+                )
+                conn.execute("DELETE FROM dead_letter WHERE lead_hash = ?", (lead_key,))
+        return len(rows)
+
+    # --- Асинхронная часть ---
+
+    async def enqueue(self, user_id, message: str, key: Optional[str] = None) -> bool:
+        """
+        Сохраняет заявку и будит отправителя
+
+        Args:
+            user_id: ID пользователя
+            message: Готовый текст для рабочего чата
+            key: Ключ идемпотентности (по умолчанию — хеш пользователя и текста)
+
+        Returns:
+            bool: False, если такая заявка уже была сохранена
+        """
+        key = key or lead_hash(user_id, message)
+        added = await asyncio.to_thread(self._enqueue_sync, key, user_id, message)
+        if added:
+            self.pending += 1
+            self._wakeup.set()
+        else:
+            logger.info(f"♻️ Заявка {key[:8]} пользователя {user_id} уже в outbox — дубль пропущен")
+        return added
+
+    def start(self) -> None:
+        """Запускает фоновую отправку"""
+        if self.send is None:
+            raise RuntimeError("Не задана функция отправки")
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, drain_timeout: float = 5.0) -> None:
+        """Пытается дослать готовые заявки и останавливает отправку"""
+        if self._task is None:
+            return
+        if drain_timeout > 0:
+            try:
+                await asyncio.wait_for(self.deliver_due(), timeout=drain_timeout)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось дослать заявки при остановке: {e}")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def close(self) -> None:
+        await self.stop()
+        with self._lock:
+            self._conn.close()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.deliver_due()
+                pending, next_at = await asyncio.to_thread(self._count_pending_sync)
+                self.pending = pending
+                wait = self.poll_interval
+                if next_at is not None:
+                    wait = min(wait, max(0.0, next_at - time.time()))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка outbox заявок: {e}")
+                wait = self.poll_interval
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def deliver_due(self) -> int:
+        """
+        Отправляет все заявки, срок которых подошел
+
+        После первой неудачной отправки проход прекращается — остальные
+        заявки дождутся следующей проверки, чтобы не долбить недоступный API.
+
+        Returns:
+            int: Сколько заявок доставлено
+        """
+        delivered = 0
+        while True:
+            rows = await asyncio.to_thread(self._claim_sync)
+            if not rows:
+                return delivered
+            batches = self._pack(rows)
+            for index, batch in enumerate(batches):
+                sent = await self._deliver_batch(batch)
+                if not sent:
+                    # Возвращаем аренду неотправленных пакетов, чтобы они не ждали ее истечения
+                    rest = [row[0] for later in batches[index + 1:] for row in later]
+                    if rest:
+                        await asyncio.to_thread(self._release_sync, rest)
+                    return delivered
+                delivered += sent
+
+    @staticmethod
+    def _pack(rows: List[Tuple[int, str, int]]) -> List[List[Tuple[int, str, int]]]:
+        """Объединяет заявки в сообщения не длиннее лимита Telegram (заявка длиннее лимита идет отдельно)"""
+        batches, current, length = [], [], 0
+        for row in rows:
+            extra = len(row[1]) + (len(BATCH_SEPARATOR) if current else 0)
+            if current and length + extra > MESSAGE_LIMIT:
+                batches.append(current)
+                current, length = [], 0
+                extra = len(row[1])
+            current.append(row)
+            length += extra
+        if current:
+            batches.append(current)
+        return batches
+
+    async def _deliver_batch(self, batch: List[Tuple[int, str, int]]) -> int:
+        text = BATCH_SEPARATOR.join(row[1] for row in batch)
+        try:
+            # Длинная заявка уходит несколькими сообщениями; при сбое повторяется целиком
+            for part in split_message(text):
+                await self.send(part)
+        except Exception as e:
+            retry_after = getattr(e, 'retry_after', None)
+            if retry_after is not None and hasattr(retry_after, 'total_seconds'):
+                retry_after = retry_after.total_seconds()
+            dead = await asyncio.to_thread(self._mark_failed_sync, batch, str(e), retry_after)
+            self.failed_attempts += len(batch)
+            if self.on_failed:
+                self.on_failed(len(batch))
+            logger.warning(f"⚠️ Не удалось доставить {len(batch)} заявок в рабочий чат: {e}")
+            if dead:
+                logger.error(f"💀 {dead} заявок перенесены в dead letter после {self.max_attempts} попыток")
+            return 0
+        await asyncio.to_thread(self._mark_delivered_sync, [row[0] for row in batch])
+        self.delivered += len(batch)
+        self.pending = max(0, self.pending - len(batch))
+        if self.on_delivered:
+            self.on_delivered(len(batch))
+        logger.info(f"📬 Доставлено заявок в рабочий чат: {len(batch)}")
+        return len(batch)
+
+
+def _format_time(value: Optional[float]) -> str:
+    return datetime.fromtimestamp(value).strftime("%d.%m.%Y %H:%M:%S") if value else "—"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Outbox заявок Synaplink: просмотр и повтор")
+    parser.add_argument('--db', default=None, help="Файл outbox (по умолчанию LEAD_OUTBOX_PATH)")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('stats', help="Число заявок по состояниям")
+    sub.add_parser('pending', help="Недоставленные заявки")
+    sub.add_parser('dead', help="Заявки в dead letter")
+    replay = sub.add_parser('replay', help="Вернуть заявки из dead letter в очередь")
+    target = replay.add_mutually_exclusive_group(required=True)
+    target.add_argument('lead_hash', nargs='?', help="Ключ заявки")
+    target.add_argument('--all', action='store_true', help="Все заявки из dead letter")
+    args = parser.parse_args()
+
+    if args.db is None:
+        from config import Config
+        args.db = Config.LEAD_OUTBOX_PATH
+    outbox = LeadOutbox(args.db)
+
+    if args.command == 'stats':
+        stats = outbox.stats()
+        print(f"📊 В очереди: {stats['pending']}, доставлено: {stats['delivered']}, dead letter: {stats['dead']}")
+    elif args.command == 'pending':
+        for item in outbox.list_pending():
+            print(f"⏳ {item['lead_hash']} пользователь {item['user_id']}, попыток {item['attempts']}, "
+                  f"следующая {_format_time(item['next_attempt_at'])}, ошибка: {item['last_error'] or '—'}")
+    elif args.command == 'dead':
+        for item in outbox.list_dead():
+            print(f"💀 {item['lead_hash']} пользователь {item['user_id']}, попыток {item['attempts']}, "
+                  f"{_format_time(item['failed_at'])}: {item['last_error']}")
+            print("   " + item['message'].replace("\n", "\n   "))
+    elif args.command == 'replay':
+        count = outbox.replay(None if args.all else args.lead_hash)
+        print(f"🔁 Возвращено в очередь: {count} (бот отправит их при следующей проверке)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Генератор нагрузки для webhook-режима бота Synaplink
+Отправляет синтетические обновления Telegram и измеряет пропускную способность
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import List, Optional
+
+import httpx
+
+SAMPLE_TEXTS = [
+    "Расскажи о ваших услугах",
+    "Какие технологии вы используете?",
+    "Сколько стоит разработка чат-бота?",
+    "Хочу автоматизировать отдел продаж",
+    "Меня зовут Иван",
+]
+
+
+def make_update(update_id: int, user_id: int, text: Optional[str] = None) -> dict:
+    """Создает синтетическое обновление Telegram с текстовым сообщением"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': f'User{user_id}'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+            'text': text or random.choice(SAMPLE_TEXTS),
+        },
+    }
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Перцентиль по отсортированному списку (ближайший ранг)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+async def run_load(url: str, users: int, updates: int, concurrency: int,
+                   secret: Optional[str] = None, wait_processed: float = 0.0) -> dict:
+    """
+    Отправляет updates обновлений от users пользователей с заданной конкурентностью
+
+    Returns:
+        dict: Итоговая статистика прогона
+    """
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(1, updates + 1))
+    base = url.split('/', 3)
+    stats_url = '/'.join(base[:3]) + '/stats'
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        stats_before = await _fetch_stats(client, stats_url)
+
+        async def worker():
+            nonlocal errors
+            for update_id in counter:
+                user_id = 100000 + update_id % users
+                started = time.perf_counter()
+                try:
+                    response = await client.post(url, json=make_update(update_id, user_id), headers=headers)
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+        result = {
+            'updates': updates,
+            'users': users,
+            'concurrency': concurrency,
+            'errors': errors,
+            'elapsed_s': round(elapsed, 3),
+            'accepted_per_s': round(updates / elapsed, 1) if elapsed else 0.0,
+            'ingest_p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'ingest_p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'ingest_p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        }
+
+        if wait_processed > 0 and stats_before is not None:
+            # Ждем, пока воркеры обработают все отправленное, и считаем сквозную пропускную способность
+            target = sum(stats_before['processed']) + updates - errors
+            deadline = time.perf_counter() + wait_processed
+            stats = stats_before
+            while time.perf_counter() < deadline:
+                stats = await _fetch_stats(client, stats_url) or stats
+                if sum(stats['processed']) >= target:
+                    break
+                await asyncio.sleep(0.1)
+            done = time.perf_counter() - started
+            processed = sum(stats['processed']) - sum(stats_before['processed'])
+            result['processed'] = processed
+            result['processed_per_s'] = round(processed / done, 1) if done else 0.0
+            result['per_worker_routed'] = stats['routed']
+
+    return result
+
+
+async def _fetch_stats(client: httpx.AsyncClient, stats_url: str) -> Optional[dict]:
+    try:
+        response = await client.get(stats_url)
+        return response.json() if response.status_code == 200 else None
+    except httpx.HTTPError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон webhook-режима Synaplink")
+    parser.add_argument('--url', default='http://127.0.0.1:8080/webhook', help="Адрес webhook")
+    parser.add_argument('--users', type=int, default=200, help="Число синтетических пользователей")
+    parser.add_argument('--updates', type=int, default=5000, help="Сколько обновлений отправить")
+    parser.add_argument('--concurrency', type=int, default=50, help="Одновременных запросов")
+    parser.add_argument('--secret', default=None, help="Секрет webhook (WEBHOOK_SECRET)")
+    parser.add_argument('--wait-processed', type=float, default=0.0,
+                        help="Сколько секунд ждать обработки воркерами (0 — не ждать)")
+    args = parser.parse_args()
+
+    print(f"🚀 Нагрузка: {args.updates} обновлений от {args.users} пользователей, конкурентность {args.concurrency}")
+    result = asyncio.run(run_load(args.url, args.users, args.updates, args.concurrency,
+                                  args.secret, args.wait_processed))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
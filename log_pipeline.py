@@ -0,0 +1,253 @@
+"""
+Модуль асинхронного логирования бота
+Записи уходят в очередь (QueueHandler), а форматирование в JSON, маскирование
+персональных данных и запись в файлы с ротацией выполняются в отдельном потоке
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Атрибуты LogRecord, которые не считаются дополнительными полями (extra)
+_RECORD_FIELDS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+_EMAIL_RE = re.compile(r'([A-Za-z0-9._%+-])[A-Za-z0-9._%+-]*@([A-Za-z0-9.-]+\.[A-Za-z]{2,})')
+# Телефон: международный номер с + либо российский с 8/7 и разделителями или кодом
+# в скобках. Голые числа (ID пользователей и чатов, unix-время) телефоном не считаются
+_PHONE_RE = re.compile(
+    r'(?<![\w+])\+\d(?:[\s\-()]*\d){9,14}(?!\w)'
+    r'|(?<![\w+\-])[78](?:[\s\-]+\(?\d{3}\)?|\s*\(\d{3}\))[\s\-]*\d{3}[\s\-]*\d{2}[\s\-]*\d{2}(?!\w)'
+)
+# Номер любого вида после подписи «Телефон:» (так его пишет заявка)
+_LABELED_PHONE_RE = re.compile(r'(?i)(\b(?:телефон|тел\.?|phone)\s*:?\s*)(\+?\d(?:[\s\-()]*\d){9,14})(?!\w)')
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Конвейер, настроенный последним вызовом setup_logging
+_active_pipeline: Optional['LogPipeline'] = None
+
+
+def redact_pii(text: str) -> str:
+    """
+    Маскирует телефоны и адреса электронной почты
+
+    Из телефона остаются две последние цифры, из адреса — первая буква и домен.
+    """
+    if '@' in text:
+        text = _EMAIL_RE.sub(r'\1***@\2', text)
+    text = _LABELED_PHONE_RE.sub(lambda match: match.group(1) + _mask_digits(match.group(2)), text)
+    return _PHONE_RE.sub(lambda match: _mask_digits(match.group(0)), text)
+
+
+def _mask_digits(phone: str) -> str:
+    digits = re.sub(r'\D', '', phone)
+    return '+***' + digits[-2:]
+
+
+class PiiRedactingFilter(logging.Filter):
+    """Маскирует персональные данные в тексте записи (ставится на обработчики в потоке записи)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        message = record.getMessage()
+        redacted = redact_pii(message)
+        if redacted is not message:
+            record.msg, record.args = redacted, None
+        if record.exc_text:
+            record.exc_text = redact_pii(record.exc_text)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает только долю записей уровня INFO и ниже для выбранных логгеров
+
+    WARNING и выше проходят всегда. Доля ищется по самому длинному совпадающему
+    префиксу имени логгера, результат кэшируется.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = dict(rates)
+        self._resolved: Dict[str, float] = {}
+        self.dropped = 0
+
+    def _rate(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate = 1.0
+            best = -1
+            for prefix, value in self.rates.items():
+                if (name == prefix or name.startswith(prefix + '.')) and len(prefix) > best:
+                    rate, best = value, len(prefix)
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        self.dropped += 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON с полями ts, level, logger, msg и extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload['exc'] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который при переполненной очереди отбрасывает запись, а не блокирует event loop"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """Запущенный конвейер логирования: обработчик очереди и поток записи"""
+
+    def __init__(self, queue_handler: DroppingQueueHandler, listener: logging.handlers.QueueListener,
+                 sampler: Optional[SamplingFilter]):
+        self.queue_handler = queue_handler
+        self.listener = listener
+        self.sampler = sampler
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def stats(self) -> dict:
+        """Сколько записей отброшено выборкой и из-за переполнения очереди"""
+        return {
+            'sampled_out': self.sampler.dropped if self.sampler else 0,
+            'queue_overflow': self.queue_handler.dropped,
+            'queued': self.queue_handler.queue.qsize(),
+        }
+
+    def stop(self) -> None:
+        """Дописывает очередь и останавливает поток записи"""
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+
+
+def parse_sample_rates(spec: Optional[str]) -> Dict[str, float]:
+    """Разбирает строку вида 'bot=0.1,openai_client=0.5'"""
+    rates = {}
+    for item in (spec or '').split(','):
+        if '=' not in item:
+            continue
+        name, _, value = item.partition('=')
+        try:
+            rates[name.strip()] = min(1.0, max(0.0, float(value)))
+        except ValueError:
+            continue
+    return rates
+
+
+def setup_logging(level: str = 'INFO', log_dir: Optional[str] = 'logs', filename: str = 'bot.log',
+                  json_format: bool = True, rotation: str = 'size', max_bytes: int = 10 * 2 ** 20,
+                  backup_count: int = 5, when: str = 'midnight', sample_rates: Optional[Dict[str, float]] = None,
+                  redact: bool = True, console: bool = True, queue_size: int = 10_000) -> LogPipeline:
+    """
+    Настраивает корневой логгер на запись через очередь
+
+    Args:
+        level: Уровень корневого логгера
+        log_dir: Каталог файлов логов (None — без файла)
+        filename: Имя файла лога
+        json_format: Писать файл в JSON (консоль всегда в текстовом виде)
+        rotation: 'size' — по размеру, 'time' — по времени
+        max_bytes: Размер файла для ротации по размеру
+        backup_count: Сколько старых файлов хранить
+        when: Интервал ротации по времени (как в TimedRotatingFileHandler)
+        sample_rates: Доля INFO-записей по префиксу имени логгера
+        redact: Маскировать телефоны и email
+        console: Дублировать логи в stderr
+        queue_size: Размер очереди записей
+
+    Returns:
+        LogPipeline: Конвейер (останавливается автоматически при выходе)
+    """
+    handlers: List[logging.Handler] = []
+    if log_dir:
+        path = Path(log_dir)
+        path.mkdir(parents=True, exist_ok=True)
+        if rotation == 'time':
+            file_handler = logging.handlers.TimedRotatingFileHandler(
+                path / filename, when=when, backupCount=backup_count, encoding='utf-8')
+        else:
+            file_handler = logging.handlers.RotatingFileHandler(
+                path / filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        file_handler.setFormatter(JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT, DATE_FORMAT))
+        handlers.append(file_handler)
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter(TEXT_FORMAT, DATE_FORMAT))
+        handlers.append(console_handler)
+    if redact:
+        # Маскирование — в потоке записи, до форматирования обработчиками
+        redactor = PiiRedactingFilter()
+        for handler in handlers:
+            handler.addFilter(redactor)
+
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    sampler = SamplingFilter(sample_rates) if sample_rates else None
+    if sampler:
+        queue_handler.addFilter(sampler)
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        if isinstance(handler, logging.handlers.QueueHandler):
+            handler.close()
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    listener.start()
+
+    global _active_pipeline
+    pipeline = LogPipeline(queue_handler, listener, sampler)
+    atexit.register(pipeline.stop)
+    _active_pipeline = pipeline
+    return pipeline
+
+
+def stop_logging() -> None:
+    """Дописывает очередь логов и останавливает поток записи (перед выходом из процесса)"""
+    if _active_pipeline is not None:
+        _active_pipeline.stop()
@@ -0,0 +1,231 @@
+"""
+Модуль кэша медиафайлов бота (логотип, чек-лист)
+Скачивает файлы один раз при старте, после первой отправки переиспользует file_id Telegram
+и перепроверяет источник по ETag / Last-Modified
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+from io import BytesIO
+from typing import Dict, Optional, Union
+
+import httpx
+
+from http_transport import create_http_client
+from session_store import SessionStore
+
+logger = logging.getLogger(__name__)
+
+
+def gdrive_to_direct(url: str) -> str:
+    """Если ссылка Google Drive вида /file/d/<id>/view, конвертируем в прямую загрузку."""
+    match = re.search(r"drive\.google\.com/file/d/([^/]+)/", url or "")
+    if match:
+        return f"https://drive.google.com/uc?export=download&id={match.group(1)}"
+    return url
+
+
+class MediaAsset:
+    """Описание медиафайла: откуда брать и под каким именем отправлять"""
+
+    __slots__ = ('name', 'source', 'filename')
+
+    def __init__(self, name: str, source: str, filename: str):
+        self.name = name
+        self.source = source
+        self.filename = filename
+
+    @property
+    def is_url(self) -> bool:
+        return self.source.startswith('http')
+
+
+class MediaCache:
+    """
+    Кэш медиафайлов для отправки в Telegram
+
+    Запись в хранилище сессий (namespace 'media') содержит file_id Telegram
+    и валидаторы источника (ETag, Last-Modified, sha256). Пока file_id
+    неизвестен, содержимое файла держится в памяти.
+    """
+
+    def __init__(self, store: SessionStore, refresh_interval: float = 3600.0, timeout: float = 30.0):
+        """
+        Args:
+            store: Хранилище сессий для file_id и валидаторов
+            refresh_interval: Как часто перепроверять источник (сек)
+            timeout: Таймаут HTTP-загрузки (сек)
+        """
+        self.records = store.namespace('media')
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.assets: Dict[str, MediaAsset] = {}
+        self._content: Dict[str, bytes] = {}
+        self._checked_at: Dict[str, float] = {}
+        self._refresh_tasks: Dict[str, asyncio.Task] = {}
+        self._http: Optional[httpx.AsyncClient] = None
+
+    def register(self, name: str, source: Optional[str], filename: str) -> None:
+        """Регистрирует медиафайл (пустой источник игнорируется)"""
+        if source:
+            self.assets[name] = MediaAsset(name, source, filename)
+
+    def _client(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = create_http_client('media', read_timeout=self.timeout, follow_redirects=True)
+        return self._http
+
+    async def preload(self) -> None:
+        """Загружает или перепроверяет все зарегистрированные файлы"""
+        results = await asyncio.gather(
+            *(self.revalidate(name) for name in self.assets),
+            return_exceptions=True
+        )
+        for name, result in zip(self.assets, results):
+            if isinstance(result, Exception):
+                logger.warning(f"⚠️ Не удалось предзагрузить {name}: {result}")
+
+    async def revalidate(self, name: str) -> bool:
+        """
+        Проверяет, изменился ли источник, и при необходимости скачивает файл
+
+        Returns:
+            bool: True, если содержимое изменилось и file_id сброшен
+        """
+        asset = self.assets[name]
+        record = await self.records.get(name) or {}
+        if record.get('source') != asset.source:
+            record = {'source': asset.source}
+
+        if asset.is_url:
+            content, validators = await self._fetch_url(asset, record)
+        else:
+            content, validators = await asyncio.to_thread(self._read_file, asset, record)
+        self._checked_at[name] = time.monotonic()
+
+        if content is None:
+            # 304 Not Modified или файл не менялся
+            return False
+
+        digest = hashlib.sha256(content).hexdigest()
+        changed = record.get('sha256') != digest
+        if changed and record.get('file_id'):
+            logger.info(f"🔄 Источник {name} изменился — file_id будет получен заново")
+            record.pop('file_id', None)
+        record.update(validators)
+        record['sha256'] = digest
+        if not record.get('file_id'):
+            self._content[name] = content
+        await self.records.set(name, record)
+        logger.info(f"📦 {name}: загружено {len(content)} байт")
+        return changed
+
+    async def _fetch_url(self, asset: MediaAsset, record: dict):
+        headers = {}
+        if record.get('file_id'):
+            if record.get('etag'):
+                headers['If-None-Match'] = record['etag']
+            if record.get('last_modified'):
+                headers['If-Modified-Since'] = record['last_modified']
+        response = await self._client().get(gdrive_to_direct(asset.source), headers=headers)
+        if response.status_code == 304:
+            return None, {}
+        response.raise_for_status()
+        validators = {
+            'etag': response.headers.get('etag'),
+            'last_modified': response.headers.get('last-modified'),
+        }
+        if record.get('file_id') and validators['etag'] and validators['etag'] == record.get('etag'):
+            # Сервер проигнорировал условный запрос, но ETag тот же
+            return None, {}
+        return response.content, validators
+
+    @staticmethod
+    def _read_file(asset: MediaAsset, record: dict):
+        stat = os.stat(asset.source)
+        stamp = f"{stat.st_mtime_ns}:{stat.st_size}"
+        if record.get('file_id') and record.get('last_modified') == stamp:
+            return None, {}
+        with open(asset.source, 'rb') as f:
+            return f.read(), {'last_modified': stamp, 'etag': None}
+
+    def _maybe_schedule_refresh(self, name: str) -> None:
+        checked_at = self._checked_at.get(name)
+        if checked_at is None or time.monotonic() - checked_at < self.refresh_interval:
+            return
+        task = self._refresh_tasks.get(name)
+        if task is None or task.done():
+            self._refresh_tasks[name] = asyncio.create_task(self._safe_revalidate(name))
+
+    async def _safe_revalidate(self, name: str) -> None:
+        try:
+            await self.revalidate(name)
+        except Exception as e:
+            self._checked_at[name] = time.monotonic()
+            logger.warning(f"⚠️ Не удалось перепроверить {name}: {e}")
+
+    async def get_input(self, name: str) -> Union[str, BytesIO, None]:
+        """
+        Возвращает то, что можно передать в send_photo/send_document
+
+        Returns:
+            file_id, буфер с содержимым, прямая ссылка или None, если файл недоступен
+        """
+        asset = self.assets.get(name)
+        if asset is None:
+            return None
+        self._maybe_schedule_refresh(name)
+
+        record = await self.records.get(name) or {}
+        if record.get('file_id') and record.get('source') == asset.source:
+            return record['file_id']
+
+        if name not in self._content:
+            try:
+                await self.revalidate(name)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось скачать {name}: {e}")
+        content = self._content.get(name)
+        if content is not None:
+            buffer = BytesIO(content)
+            buffer.name = asset.filename
+            return buffer
+        # Фолбэк: пусть Telegram сам скачает файл по ссылке
+        return gdrive_to_direct(asset.source) if asset.is_url else None
+
+    async def remember(self, name: str, message) -> None:
+        """Сохраняет file_id из отправленного сообщения"""
+        if message is None or name not in self.assets:
+            return
+        if getattr(message, 'photo', None):
+            file_id = message.photo[-1].file_id
+        elif getattr(message, 'document', None):
+            file_id = message.document.file_id
+        else:
+            return
+        record = await self.records.get(name) or {}
+        if record.get('file_id') == file_id:
+            return
+        record['file_id'] = file_id
+        record['source'] = self.assets[name].source
+        await self.records.set(name, record)
+        self._content.pop(name, None)
+        logger.info(f"💾 {name}: сохранен file_id, дальше отправляем без загрузки")
+
+    async def invalidate(self, name: str) -> None:
+        """Сбрасывает file_id (например, если Telegram его не принял)"""
+        record = await self.records.get(name)
+        if record and record.pop('file_id', None):
+            await self.records.set(name, record)
+
+    async def close(self) -> None:
+        """Закрывает HTTP-клиент и фоновые проверки"""
+        for task in self._refresh_tasks.values():
+            task.cancel()
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
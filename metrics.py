@@ -0,0 +1,374 @@
+"""
+Модуль метрик бота в формате Prometheus
+Счетчики, gauge и гистограммы без внешних зависимостей, декоратор замера обработчиков
+и HTTP-эндпоинт /metrics
+"""
+
+import asyncio
+import bisect
+import functools
+import logging
+import math
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм задержек (сек): от миллисекунд обработчика до минуты на run ассистента
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUEUE_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class _Metric:
+    """Общая часть метрик: имя, описание и дочерние серии по значениям меток"""
+
+    kind = 'untyped'
+    header_suffix = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwargs):
+        """
+        Возвращает серию для значений меток
+
+        Серию стоит получить один раз и сохранить: тогда замер в горячем пути —
+        это только арифметика без поиска в словаре.
+        """
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _samples(self) -> Iterable[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        header = self.name + self.header_suffix
+        lines = [f"# HELP {header} {self.documentation}", f"# TYPE {header} {self.kind}"]
+        for suffix, labels, value in self._samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+
+    kind = 'counter'
+    header_suffix = '_total'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._children[()].inc(amount)
+
+    def _samples(self):
+        for key, child in self._children.items():
+            yield '_total', _format_labels(self.labelnames, key), child.value
+
+
+class _GaugeChild:
+    __slots__ = ('value', 'function')
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Значение вычисляется при каждом запросе /metrics"""
+        self.function = function
+
+    def get(self) -> float:
+        if self.function is not None:
+            try:
+                return float(self.function())
+            except Exception as e:
+                logger.debug(f"Не удалось вычислить gauge: {e}")
+                return math.nan
+        return self.value
+
+
+class Gauge(_Metric):
+    """Значение, которое может расти и убывать"""
+
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float) -> None:
+        self._children[()].set(value)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._children[()].inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._children[()].dec(amount)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._children[()].set_function(function)
+
+    def _samples(self):
+        for key, child in self._children.items():
+            yield '', _format_labels(self.labelnames, key), child.get()
+
+
+class _HistogramChild:
+    __slots__ = ('upper_bounds', 'counts', 'sum')
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        # Счетчики хранятся по корзинам, накопительные суммы считаются только при выдаче
+        self.counts[bisect.bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными границами корзин"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.upper_bounds)
+
+    def observe(self, value: float) -> None:
+        self._children[()].observe(value)
+
+    def _samples(self):
+        for key, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.upper_bounds + (math.inf,), child.counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield '_bucket', _format_labels(self.labelnames, key, le), cumulative
+            labels = _format_labels(self.labelnames, key)
+            yield '_count', labels, cumulative
+            yield '_sum', labels, child.sum
+
+
+class MetricsRegistry:
+    """Набор метрик процесса и их выдача в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                raise ValueError(f"Метрика {metric.name} уже зарегистрирована с другим типом или метками")
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате exposition 0.0.4"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+HANDLER_LATENCY = REGISTRY.histogram(
+    'synaplink_handler_seconds', 'Время работы обработчика', ('handler',))
+HANDLER_ERRORS = REGISTRY.counter(
+    'synaplink_handler_errors', 'Исключения, вышедшие из обработчика', ('handler',))
+RUN_DURATION = REGISTRY.histogram(
+    'synaplink_assistant_run_seconds', 'Длительность run ассистента', ('status', 'mode'))
+RUN_TTFT = REGISTRY.histogram(
+    'synaplink_assistant_first_token_seconds', 'Время до первого токена ответа ассистента', ('mode',))
+TELEGRAM_SEND_LATENCY = REGISTRY.histogram(
+    'synaplink_telegram_request_seconds', 'Длительность запроса к Bot API (без ожидания в очереди)', ('method',))
+TELEGRAM_QUEUE_WAIT = REGISTRY.histogram(
+    'synaplink_telegram_queue_wait_seconds', 'Ожидание запроса к Bot API в планировщике', ('lane',))
+QUEUE_DEPTH = REGISTRY.gauge(
+    'synaplink_queue_depth', 'Текущая глубина очередей', ('queue',))
+QUEUE_DEPTH_ON_ENQUEUE = REGISTRY.histogram(
+    'synaplink_queue_depth_on_enqueue', 'Глубина очереди в момент постановки в нее', ('queue',),
+    buckets=QUEUE_BUCKETS)
+LEADS_DETECTED = REGISTRY.counter(
+    'synaplink_leads_detected', 'Найдено финальных заявок в ответах ассистента')
+LEADS_DELIVERED = REGISTRY.counter(
+    'synaplink_leads_delivered', 'Заявок доставлено в рабочий чат')
+LEADS_FAILED = REGISTRY.counter(
+    'synaplink_lead_delivery_failures', 'Неудачных попыток доставки заявки в рабочий чат')
+ACTIVE_CONVERSATIONS = REGISTRY.gauge(
+    'synaplink_active_conversations', 'Пользователи, для которых сейчас выполняется run')
+HTTP_REQUESTS = REGISTRY.counter(
+    'synaplink_http_requests', 'Исходящие HTTP-запросы', ('client',))
+HTTP_CONNECTIONS = REGISTRY.counter(
+    'synaplink_http_connections_opened', 'Открытые TCP-соединения (остальные запросы шли по keep-alive)', ('client',))
+THREAD_MAP_SIZE = REGISTRY.gauge(
+    'synaplink_threads', 'Thread ассистента, созданные и не сброшенные этим процессом')
+ANSWER_CACHE_LOOKUPS = REGISTRY.counter(
+    'synaplink_answer_cache_lookups', 'Поиски в кэше ответов ассистента', ('result',))
+ANSWER_CACHE_SAVED = REGISTRY.counter(
+    'synaplink_answer_cache_saved_seconds', 'Время ассистента, сэкономленное ответами из кэша')
+EVENTS_WRITTEN = REGISTRY.counter(
+    'synaplink_events_written', 'События воронки, записанные приемником', ('sink',))
+EVENTS_DROPPED = REGISTRY.counter(
+    'synaplink_events_dropped', 'Потерянные события воронки (полный буфер или очередь повторов)', ('reason',))
+UPSTREAM_CIRCUIT_STATE = REGISTRY.gauge(
+    'synaplink_upstream_circuit_state', 'Автомат защиты API: 0 — замкнут, 1 — пробный запрос, 2 — разомкнут', ('upstream',))
+UPSTREAM_REJECTED = REGISTRY.counter(
+    'synaplink_upstream_rejected', 'Вызовы API, отклоненные без обращения к нему', ('upstream', 'reason'))
+UPSTREAM_RETRIES = REGISTRY.counter(
+    'synaplink_upstream_retries', 'Повторные и дублирующие (hedge) запросы к API', ('upstream', 'kind'))
+UPSTREAM_INFLIGHT = REGISTRY.gauge(
+    'synaplink_upstream_inflight', 'Выполняющиеся вызовы API под ограничением bulkhead', ('upstream',))
+
+
+def instrumented(handler: str, histogram: Histogram = HANDLER_LATENCY, errors: Counter = HANDLER_ERRORS):
+    """
+    Декоратор асинхронной функции: длительность в histogram, исключения в errors
+
+    Серии метрик выбираются один раз при декорировании, поэтому накладные расходы
+    на вызов — два вызова perf_counter и одно наблюдение гистограммы.
+
+    Args:
+        handler: Значение метки handler
+    """
+    series = histogram.labels(handler)
+    failures = errors.labels(handler)
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except BaseException:
+                failures.inc()
+                raise
+            finally:
+                series.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+class MetricsServer:
+    """Минимальный HTTP-сервер, отдающий /metrics"""
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY, host: str = '127.0.0.1', port: int = 9464):
+        """
+        Args:
+            registry: Реестр метрик
+            host: Адрес для прослушивания
+            port: Порт (0 — выбрать свободный)
+        """
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.base_events.Server] = None
+
+    async def start(self) -> 'MetricsServer':
+        """Запускает сервер"""
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"📈 Метрики доступны на http://{self.host}:{self.port}/metrics")
+        return self
+
+    async def stop(self) -> None:
+        """Останавливает сервер"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Заголовки запроса не нужны, но их надо дочитать
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, content_type, body = '200 OK', 'text/plain; version=0.0.4; charset=utf-8', self.registry.render()
+            else:
+                status, content_type, body = '404 Not Found', 'text/plain; charset=utf-8', 'not found\n'
+            payload = body.encode()
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
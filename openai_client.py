@@ -3,113 +3,390 @@
 Обрабатывает диалоги и формирует заявки
 """
 
+import asyncio
+import time
+from typing import Optional
 import openai
-from openai import OpenAI
+from openai import AsyncOpenAI
 from config import Config
+from run_waiter import create_run_waiter, message_text, DeltaCallback, MESSAGE_SEPARATOR, TIMEOUT_STATUS
+from session_store import MemorySessionStore, SessionStore
+from application_handler import extract_lead
+from answer_cache import AnswerCache, CachedAnswer
+from metrics import (
+    instrumented,
+    ANSWER_CACHE_LOOKUPS,
+    ANSWER_CACHE_SAVED,
+    RUN_DURATION,
+    RUN_TTFT,
+    THREAD_MAP_SIZE,
+)
+from thread_manager import ThreadManager, ThreadPool
+from http_transport import create_http_client
+from resilience import Bulkhead, BulkheadFullError, CircuitBreaker, CircuitOpenError, ResilientTransport, RetryBudget
 import logging
 
 # Настраиваем логирование
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Служебный сигнал ассистенту при нажатии «Начать диалог»
+PRIMING_MESSAGE = "Пользователь вернулся после подписки. Начни диалог, представься и спроси имя."
+
+# Ответы, когда OpenAI недоступен (автомат защиты разомкнут) или занят каждый слот run
+UNAVAILABLE_REPLY = "Извините, ассистент сейчас недоступен. Попробуйте через пару минут."
+BUSY_REPLY = "Извините, сейчас очень много обращений. Попробуйте через минуту."
+
+# Ошибки run на стороне OpenAI, говорящие о его перегрузке (учитываются автоматом защиты)
+UPSTREAM_RUN_ERRORS = frozenset({'server_error', 'rate_limit_exceeded'})
+
 class OpenAIClient:
-    """Класс для работы с OpenAI API"""
+    """
+    Асинхронный клиент для работы с OpenAI API
     
-    def __init__(self):
-        """Инициализация клиента OpenAI"""
-        self.client = OpenAI(api_key=Config.OPENAI_API_KEY)
+    Все обращения к API выполняются через await, поэтому ожидание ответа
+    ассистента не блокирует event loop и остальные диалоги бота.
+    """
+    
+    def __init__(self, session_store: SessionStore = None):
+        """
+        Инициализация клиента OpenAI
+        
+        Args:
+            session_store: Хранилище сессий (по умолчанию — в памяти процесса)
+        """
+        # Устойчивость к сбоям API: автомат защиты и повторы чтений в HTTP-транспорте,
+        # ограничение одновременных run; повторы самого SDK выключены — они не различают
+        # идемпотентные запросы и не знают о бюджете
+        self.breaker = CircuitBreaker(
+            'openai',
+            failure_rate=Config.OPENAI_BREAKER_FAILURE_RATE,
+            min_calls=Config.OPENAI_BREAKER_MIN_CALLS,
+            window=Config.OPENAI_BREAKER_WINDOW,
+            cooldown=Config.OPENAI_BREAKER_COOLDOWN
+        )
+        self.retry_budget = RetryBudget(ratio=Config.OPENAI_RETRY_BUDGET)
+        self.bulkhead = Bulkhead('openai', Config.OPENAI_MAX_INFLIGHT_RUNS, Config.OPENAI_BULKHEAD_WAIT)
+        self.transport = None
+        self.client = AsyncOpenAI(
+            api_key=Config.OPENAI_API_KEY,
+            base_url=Config.OPENAI_BASE_URL,
+            http_client=create_http_client('openai', wrap=self._resilient_transport),
+            max_retries=0
+        )
         self.assistant_id = Config.OPENAI_ASSISTANT_ID
-        self.threads = {}  # Хранит thread_id для каждого пользователя
+        if session_store is None:
+            session_store = MemorySessionStore(max_entries=Config.SESSION_MAX_ENTRIES, ttl=Config.SESSION_TTL)
+        self.threads = session_store.namespace('thread')  # Хранит thread_id для каждого пользователя
+        # Последнее прочитанное сообщение каждого thread — курсор after для следующего хода
+        self.cursors = session_store.namespace('thread_cursor')
+        # Заранее созданные thread: новый диалог не ждет threads.create
+        self.thread_pool = ThreadPool(
+            self.client,
+            target_size=Config.THREAD_POOL_SIZE,
+            concurrency=Config.THREAD_POOL_CONCURRENCY,
+            prime_message=PRIMING_MESSAGE if Config.THREAD_POOL_PRIME else None
+        )
+        # Вытеснение простаивающих thread и их удаление на сервере
+        self.thread_manager = ThreadManager(
+            self.client,
+            self.threads,
+            idle_ttl=Config.THREAD_IDLE_TTL or None,
+            max_threads=Config.THREAD_MAX_LIVE,
+            delete_batch=Config.THREAD_DELETE_BATCH,
+            sweep_interval=Config.THREAD_SWEEP_INTERVAL,
+            pool=self.thread_pool,
+            last_used=session_store.namespace('thread_used')
+        )
+        THREAD_MAP_SIZE.set_function(lambda: len(self.thread_manager))
+        # Стратегия ожидания run: streaming или адаптивный опрос с дедлайном
+        self.run_waiter = create_run_waiter(
+            Config.RUN_WAITER_MODE,
+            deadline=Config.RUN_TIMEOUT,
+            poll_initial=Config.RUN_POLL_INITIAL,
+            poll_max=Config.RUN_POLL_MAX
+        )
+        # Кэш ответов на типовые вопросы (включается ANSWER_CACHE=true)
+        self.answer_cache = None
+        if Config.ANSWER_CACHE:
+            self.answer_cache = AnswerCache(
+                self.assistant_id,
+                max_entries=Config.ANSWER_CACHE_SIZE,
+                ttl=Config.ANSWER_CACHE_TTL,
+                threshold=Config.ANSWER_CACHE_THRESHOLD,
+                max_length=Config.ANSWER_CACHE_MAX_LENGTH
+            )
+        # Отметка «пользователь уже писал в thread»: в кэш попадают только ответы без истории диалога
+        self.turns = session_store.namespace('thread_turns')
         
-    def create_thread(self, user_id: int):
+    def _resilient_transport(self, transport):
+        """Оборачивает транспорт клиента OpenAI автоматом защиты, повторами и hedging"""
+        self.transport = ResilientTransport(
+            transport,
+            self.breaker,
+            self.retry_budget,
+            attempts=Config.OPENAI_RETRY_ATTEMPTS,
+            hedge_delay=Config.OPENAI_HEDGE_DELAY
+        )
+        return self.transport
+    
+    async def create_thread(self, user_id: int):
         """Создает новый thread для пользователя"""
         try:
-            thread = self.client.beta.threads.create()
-            self.threads[user_id] = thread.id
-            logger.info(f"Создан новый thread {thread.id} для пользователя {user_id}")
-            return thread.id
+            return await self.thread_manager.create(user_id)
         except Exception as e:
             logger.error(f"Ошибка при создании thread: {e}")
             raise
     
-    def get_or_create_thread(self, user_id: int):
+    async def get_or_create_thread(self, user_id: int):
         """Получает существующий thread или создает новый"""
-        if user_id not in self.threads:
-            return self.create_thread(user_id)
-        return self.threads[user_id]
+        return await self.thread_manager.get_or_create(user_id)
     
-    def send_message(self, user_id: int, message: str):
+    async def prime_conversation(self, user_id: int, message: str) -> bool:
+        """
+        Подставляет новому пользователю thread с уже добавленным стартовым сообщением
+        
+        Args:
+            user_id: ID пользователя Telegram
+            message: Стартовое сообщение
+            
+        Returns:
+            bool: True, если run для стартового сообщения не нужен — ассистент
+            ответит на него вместе с первым сообщением пользователя
+        """
+        if self.thread_pool.prime_message != message:
+            return False
+        if await self.threads.get(user_id) is not None:
+            return False
+        try:
+            await self.thread_manager.create(user_id, seeded=True)
+        except Exception as e:
+            logger.error(f"Ошибка при создании thread: {e}")
+            return False
+        return True
+    
+    def start(self):
+        """Запускает фоновую очистку thread и пополнение пула (нужен работающий event loop)"""
+        self.thread_manager.start()
+    
+    def apply_config(self):
+        """Применяет перезагруженные настройки: ассистента, дедлайн run, лимиты thread, кэш ответов и защиту API"""
+        if self.assistant_id != Config.OPENAI_ASSISTANT_ID:
+            self.assistant_id = Config.OPENAI_ASSISTANT_ID
+            if self.answer_cache is not None:
+                removed = self.answer_cache.invalidate(self.assistant_id)
+                logger.info(f"🗑️ Ассистент сменился, кэш ответов очищен ({removed} записей)")
+        if self.answer_cache is not None:
+            self.answer_cache.ttl = Config.ANSWER_CACHE_TTL
+            self.answer_cache.threshold = Config.ANSWER_CACHE_THRESHOLD
+            self.answer_cache.max_length = Config.ANSWER_CACHE_MAX_LENGTH
+        self.run_waiter.configure(Config.RUN_TIMEOUT, Config.RUN_POLL_INITIAL, Config.RUN_POLL_MAX)
+        self.thread_manager.idle_ttl = Config.THREAD_IDLE_TTL or None
+        self.thread_manager.max_threads = Config.THREAD_MAX_LIVE
+        self.thread_manager.delete_batch = Config.THREAD_DELETE_BATCH
+        self.thread_manager.sweep_interval = Config.THREAD_SWEEP_INTERVAL
+        if self.thread_pool.target_size != Config.THREAD_POOL_SIZE:
+            self.thread_pool.resize(Config.THREAD_POOL_SIZE)
+        self.breaker.configure(
+            Config.OPENAI_BREAKER_FAILURE_RATE,
+            Config.OPENAI_BREAKER_MIN_CALLS,
+            Config.OPENAI_BREAKER_WINDOW,
+            Config.OPENAI_BREAKER_COOLDOWN
+        )
+        self.bulkhead.resize(Config.OPENAI_MAX_INFLIGHT_RUNS, Config.OPENAI_BULKHEAD_WAIT)
+        self.retry_budget.ratio = Config.OPENAI_RETRY_BUDGET
+        if self.transport is not None:
+            self.transport.attempts = Config.OPENAI_RETRY_ATTEMPTS
+            self.transport.hedge_delay = Config.OPENAI_HEDGE_DELAY
+    
+    async def cancel_active_runs(self, timeout: float = 5.0) -> int:
+        """
+        Отменяет на сервере run, которые еще выполняются (при остановке бота)
+        
+        Args:
+            timeout: Сколько ждать ответов на отмену (сек)
+            
+        Returns:
+            int: Сколько run отменялось
+        """
+        try:
+            return await asyncio.wait_for(self.run_waiter.cancel_active(self.client), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Отмена run не уложилась в {timeout:.1f} с")
+            return len(self.run_waiter.active_runs())
+    
+    async def close(self):
+        """Останавливает очистку, досылая удаления thread на сервере"""
+        await self.thread_manager.stop()
+        logger.info(f"🧵 Thread: {self.thread_manager.stats()}")
+        if self.answer_cache is not None:
+            logger.info(f"💡 Кэш ответов: {self.answer_cache.stats()}")
+        logger.info(f"🛡️ Защита OpenAI: автомат {self.breaker.stats()}, run {self.bulkhead.stats()}")
+        await self.client.close()
+    
+    @instrumented('send_message')
+    async def send_message(self, user_id: int, message: str, on_delta: Optional[DeltaCallback] = None):
         """
         Отправляет сообщение ассистенту и получает ответ
         
         Args:
             user_id: ID пользователя Telegram
             message: Текст сообщения пользователя
+            on_delta: Колбэк для фрагментов ответа (вызывается только в потоковом режиме)
             
         Returns:
             str: Ответ ассистента
         """
+        if self.breaker.should_reject():
+            # OpenAI сбоит: пользователь сразу получает ответ, а не ждет дедлайна run
+            return UNAVAILABLE_REPLY
+        cache = self.answer_cache
+        faq = cache is not None and cache.accepts(message)
         try:
-            thread_id = self.get_or_create_thread(user_id)
-            
-            # Добавляем сообщение пользователя в thread
-            self.client.beta.threads.messages.create(
-                thread_id=thread_id,
-                role="user",
-                content=message
-            )
-            
-            # Запускаем ассистента
-            run = self.client.beta.threads.runs.create(
-                thread_id=thread_id,
-                assistant_id=self.assistant_id
-            )
-            
-            # Ждем завершения выполнения
-            while True:
-                run_status = self.client.beta.threads.runs.retrieve(
-                    thread_id=thread_id,
-                    run_id=run.id
-                )
+            # Thread защищен от вытеснения, пока идет run
+            async with self.thread_manager.use(user_id) as thread_id:
+                # Ответ на первое сообщение пользователя в thread не зависит от истории диалога,
+                # поэтому кэш и ищет, и сохраняет только такие ответы
+                first_turn = False
+                if cache is not None and message != PRIMING_MESSAGE:
+                    first_turn = not await self.turns.get(thread_id)
+                    if first_turn:
+                        await self.turns.set(thread_id, True)
+                faq = faq and first_turn
+                if faq:
+                    cached = cache.lookup(message)
+                    ANSWER_CACHE_LOOKUPS.labels('hit' if cached else 'miss').inc()
+                    if cached is not None:
+                        return await self._reply_from_cache(thread_id, message, cached)
+                started = time.monotonic()
                 
-                if run_status.status == 'completed':
-                    break
-                elif run_status.status == 'failed':
-                    logger.error(f"Ошибка выполнения ассистента: {run_status.last_error}")
-                    return "Извините, произошла ошибка. Попробуйте позже."
+                # Слот bulkhead занят от добавления сообщения до чтения ответа
+                async with self.bulkhead:
+                    # Добавляем сообщение пользователя в thread
+                    await self.client.beta.threads.messages.create(
+                        thread_id=thread_id,
+                        role="user",
+                        content=message
+                    )
                 
-                import time
-                time.sleep(1)
-            
-            # Получаем ответ ассистента
-            messages = self.client.beta.threads.messages.list(thread_id=thread_id)
-            
-            # Ищем последнее сообщение ассистента
-            for msg in messages.data:
-                if msg.role == "assistant":
-                    # Проверяем, содержит ли сообщение заявку
-                    content = msg.content[0].text.value if msg.content else ""
-                    if self._is_application(content):
-                        return self._format_application(content)
-                    return content
-            
-            return "Извините, не удалось получить ответ от ассистента."
+                    # Запускаем ассистента и ждем завершения run
+                    outcome = await self.run_waiter.run(self.client, thread_id, self.assistant_id, on_delta)
+                    if outcome.status == TIMEOUT_STATUS or self._upstream_error(outcome):
+                        self.breaker.record_failure()
+                    RUN_DURATION.labels(outcome.status, outcome.mode).observe(outcome.total)
+                    if outcome.ttft is not None:
+                        RUN_TTFT.labels(outcome.mode).observe(outcome.ttft)
+                    ttft = f"{outcome.ttft:.2f} с" if outcome.ttft is not None else "—"
+                    logger.info(
+                        f"⏱️ Run {outcome.run_id} ({outcome.mode}): {outcome.status}, "
+                        f"первый токен {ttft}, всего {outcome.total:.2f} с"
+                    )
+                
+                    if outcome.status == TIMEOUT_STATUS:
+                        logger.error(f"Ассистент не ответил за {self.run_waiter.deadline} с")
+                        return "Извините, ассистент отвечает слишком долго. Попробуйте позже."
+                    if not outcome.ok:
+                        logger.error(f"Ошибка выполнения ассистента ({outcome.status}): {outcome.last_error}")
+                        return "Извините, произошла ошибка. Попробуйте позже."
+                
+                    if outcome.text:
+                        # В потоковом режиме ответ уже собран из дельт
+                        content = outcome.text
+                    else:
+                        # Получаем только сообщения, созданные этим run
+                        content = await self._fetch_run_reply(thread_id, outcome.run_id)
+                if not content:
+                    return "Извините, не удалось получить ответ от ассистента."
+                
+                # Проверяем, содержит ли сообщение заявку
+                if self._is_application(content):
+                    return self._format_application(content)
+                if faq:
+                    cache.store(message, content, time.monotonic() - started)
+                return content
             
+        except BulkheadFullError:
+            logger.warning(f"⚠️ Нет свободного слота run для пользователя {user_id}: {self.bulkhead.stats()}")
+            return BUSY_REPLY
         except Exception as e:
+            if isinstance(e.__cause__, CircuitOpenError):
+                return UNAVAILABLE_REPLY
             logger.error(f"Ошибка при отправке сообщения: {e}")
             return "Произошла ошибка. Попробуйте позже."
     
+    async def _reply_from_cache(self, thread_id: str, message: str, cached: CachedAnswer) -> str:
+        """
+        Отвечает из кэша, дописывая вопрос и ответ в thread
+        
+        Ассистент видит этот обмен в истории при следующем run, поэтому диалог
+        продолжается так же, как после настоящего ответа.
+        
+        Args:
+            thread_id: ID thread пользователя
+            message: Сообщение пользователя
+            cached: Найденный ответ
+            
+        Returns:
+            str: Текст ответа
+        """
+        started = time.monotonic()
+        try:
+            await self.client.beta.threads.messages.create(thread_id=thread_id, role="user", content=message)
+            await self.client.beta.threads.messages.create(thread_id=thread_id, role="assistant", content=cached.answer)
+            await self.turns.set(thread_id, True)
+        except Exception as e:
+            # Пользователь все равно получает ответ, пострадает только контекст следующего run
+            logger.warning(f"⚠️ Не удалось добавить ответ из кэша в thread {thread_id}: {e}")
+        saved = max(0.0, cached.cost - (time.monotonic() - started))
+        self.answer_cache.record_saving(saved)
+        ANSWER_CACHE_SAVED.inc(saved)
+        logger.info(f"💡 Ответ из кэша (сэкономлено {saved:.2f} с, доля попаданий {self.answer_cache.stats()['hit_rate']})")
+        return cached.answer
+    
+    async def _fetch_run_reply(self, thread_id: str, run_id: str, page_size: int = 20) -> str:
+        """
+        Читает ответ ассистента, созданный одним run
+        
+        Запрос фильтруется по run_id и начинается после последнего прочитанного
+        сообщения thread, поэтому объем ответа не растет с длиной диалога.
+        
+        Args:
+            thread_id: ID thread
+            run_id: ID завершенного run
+            page_size: Размер страницы списка сообщений
+            
+        Returns:
+            str: Текст всех сообщений ассистента из run (пустая строка, если их нет)
+        """
+        after = await self.cursors.get(thread_id)
+        texts = []
+        last_id = None
+        while True:
+            params = {'thread_id': thread_id, 'run_id': run_id, 'order': 'asc', 'limit': page_size}
+            if after:
+                params['after'] = after
+            page = await self.client.beta.threads.messages.list(**params)
+            for msg in page.data:
+                last_id = msg.id
+                if msg.role == "assistant":
+                    text = message_text(msg)
+                    if text:
+                        texts.append(text)
+            if getattr(page, 'has_more', False) is not True or not page.data:
+                break
+            after = last_id
+        if isinstance(last_id, str):
+            await self.cursors.set(thread_id, last_id)
+        return MESSAGE_SEPARATOR.join(texts)
+    
+    @staticmethod
+    def _upstream_error(outcome) -> bool:
+        """Run завершился ошибкой перегрузки или сбоя OpenAI (а не, например, контента)"""
+        return outcome.status == 'failed' and getattr(outcome.last_error, 'code', None) in UPSTREAM_RUN_ERRORS
+    
     def _is_application(self, content: str) -> bool:
         """Проверяет, содержит ли сообщение заявку"""
-        application_indicators = [
-            "[Заявка в рабочий чат]",
-            "Имя:",
-            "Телефон:",
-            "Email:",
-            "Запрос:"
-        ]
-        
-        return all(indicator in content for indicator in application_indicators)
+        return extract_lead(content).is_complete
     
     def _format_application(self, content: str) -> str:
         """Форматирует заявку для отправки в рабочий чат"""
@@ -124,8 +401,7 @@ class OpenAIClient:
         
         return '\n'.join(formatted_lines)
     
-    def reset_conversation(self, user_id: int):
-        """Сбрасывает разговор для пользователя"""
-        if user_id in self.threads:
-            del self.threads[user_id]
+    async def reset_conversation(self, user_id: int):
+        """Сбрасывает разговор для пользователя (thread удаляется на сервере в фоне)"""
+        if await self.thread_manager.release(user_id):
             logger.info(f"Разговор сброшен для пользователя {user_id}")
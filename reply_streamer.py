@@ -0,0 +1,160 @@
+"""
+Модуль потоковой выдачи ответа ассистента в Telegram
+Первый фрагмент уходит отдельным сообщением, дальше оно дописывается через
+edit_message_text не чаще раза в interval секунд; длинный ответ делится на
+несколько сообщений по лимиту Telegram
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, List, Optional
+
+from telegram import Message
+from telegram.error import BadRequest
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 4096
+# Признак того, что ответ еще дописывается
+CURSOR = " ▌"
+
+
+def split_text(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """
+    Делит текст на части не длиннее limit
+
+    Разрез ищется по абзацу, затем по строке, затем по пробелу во второй
+    половине части; если их нет — режем ровно по лимиту.
+    """
+    chunks = []
+    while len(text) > limit:
+        cut = -1
+        for separator in ("\n\n", "\n", " "):
+            cut = text.rfind(separator, limit // 2, limit)
+            if cut != -1:
+                break
+        if cut == -1:
+            cut = limit
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text or not chunks:
+        chunks.append(text)
+    return chunks
+
+
+class ReplyStreamer:
+    """
+    Дописывает ответ ассистента в сообщения Telegram по мере генерации
+
+    Фрагменты копятся в буфере, а редактирования объединяются: между двумя
+    правками одного сообщения проходит не меньше interval секунд, поэтому
+    бот не упирается в лимиты Telegram на редактирование. Ошибка Telegram
+    останавливает только показ: run ассистента продолжается, а итоговый
+    ответ бот отправляет обычным сообщением.
+    """
+
+    def __init__(self, reply: Callable[[str], Awaitable[Message]], interval: float = 1.0,
+                 limit: int = MESSAGE_LIMIT):
+        """
+        Args:
+            reply: Корутина, отправляющая новое сообщение в чат пользователя
+            interval: Минимальная пауза между правками сообщения (сек)
+            limit: Максимальная длина одного сообщения
+        """
+        self.reply = reply
+        self.interval = interval
+        self.limit = limit
+        self.messages: List[Message] = []
+        self.shown: List[str] = []       # Текст, который сейчас виден в каждом сообщении
+        self.edits = 0
+        self.failed = False              # Telegram отклонил отправку или правку — показ остановлен
+        self.first_visible: Optional[float] = None
+        self._text = ""
+        self._started = time.monotonic()
+        self._last_edit = 0.0
+        self._flush_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def started(self) -> bool:
+        """Отправлено ли уже первое сообщение"""
+        return bool(self.messages)
+
+    async def on_delta(self, text: str) -> None:
+        """Принимает очередной фрагмент ответа (колбэк RunWaiter)"""
+        self._text += text
+        if self.failed:
+            return
+        if not self.messages:
+            await self._safe_flush()
+        elif self._flush_task is None or self._flush_task.done():
+            delay = max(0.0, self._last_edit + self.interval - time.monotonic())
+            self._flush_task = asyncio.create_task(self._delayed_flush(delay))
+
+    async def finish(self, text: str) -> List[Message]:
+        """
+        Приводит сообщения к окончательному тексту ответа
+
+        Args:
+            text: Итоговый текст (может отличаться от собранного из фрагментов)
+
+        Returns:
+            List[Message]: Сообщения с ответом (пустой список, если показать его не удалось —
+            тогда ответ нужно отправить обычным сообщением)
+        """
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        self._text = text
+        if not self.failed:
+            await self._safe_flush(partial=False)
+        if self.failed:
+            # Недописанные сообщения убираем, чтобы ответ не показался дважды
+            self.shown.clear()
+        # Итоговый текст короче потокового — лишние сообщения убираем
+        while len(self.messages) > len(self.shown):
+            extra = self.messages.pop()
+            try:
+                await extra.delete()
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось удалить лишнее сообщение потокового ответа: {e}")
+        return [] if self.failed else self.messages
+
+    async def _delayed_flush(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        await self._safe_flush()
+
+    async def _safe_flush(self, partial: bool = True) -> None:
+        try:
+            await self._flush(partial)
+        except Exception as e:
+            # Ошибка показа не должна прерывать run: ответ уйдет обычным сообщением
+            self.failed = True
+            logger.warning(f"⚠️ Потоковый ответ остановлен, ошибка Telegram: {e}")
+
+    async def _flush(self, partial: bool) -> None:
+        async with self._lock:
+            chunks = split_text(self._text, self.limit - len(CURSOR))
+            if partial:
+                chunks[-1] += CURSOR
+            for index, chunk in enumerate(chunks):
+                if index < len(self.messages):
+                    if self.shown[index] != chunk:
+                        await self._edit(index, chunk)
+                else:
+                    self.messages.append(await self.reply(chunk))
+                    self.shown.append(chunk)
+                    if self.first_visible is None:
+                        self.first_visible = time.monotonic() - self._started
+            del self.shown[len(chunks):]
+            self._last_edit = time.monotonic()
+
+    async def _edit(self, index: int, chunk: str) -> None:
+        try:
+            await self.messages[index].edit_text(chunk)
+        except BadRequest as e:
+            # Текст совпал с уже показанным — это не ошибка
+            if 'not modified' not in str(e).lower():
+                raise
+        self.shown[index] = chunk
+        self.edits += 1
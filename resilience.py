@@ -0,0 +1,461 @@
+"""
+Модуль устойчивости к сбоям внешнего API
+Автомат защиты (circuit breaker), ограничение одновременных вызовов (bulkhead),
+бюджет повторов и HTTP-транспорт, который повторяет и дублирует (hedge)
+идемпотентные запросы
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Callable, Deque, Optional
+
+import httpx
+
+from metrics import UPSTREAM_CIRCUIT_STATE, UPSTREAM_INFLIGHT, UPSTREAM_REJECTED, UPSTREAM_RETRIES
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+
+# Значения состояний в метрике synaplink_upstream_circuit_state
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Ответы, говорящие о перегрузке или сбое API: считаются отказом и повторяются
+TRANSIENT_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+# Запросы без побочных эффектов: их можно повторить и продублировать
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+
+
+class CircuitOpenError(Exception):
+    """Вызов отклонен: автомат защиты разомкнут"""
+
+
+class BulkheadFullError(Exception):
+    """Вызов отклонен: все слоты bulkhead заняты и место не освободилось вовремя"""
+
+
+class CircuitBreaker:
+    """
+    Автомат защиты по доле отказов среди последних вызовов
+
+    Когда среди последних window вызовов (но не меньше min_calls) доля отказов
+    достигает failure_rate, автомат размыкается и cooldown секунд отклоняет
+    вызовы сразу. Затем пропускает пробный запрос: успех замыкает автомат,
+    отказ размыкает снова.
+    """
+
+    def __init__(self, name: str, failure_rate: float = 0.5, min_calls: int = 10, window: int = 20,
+                 cooldown: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            name: Имя API в логах и метриках
+            failure_rate: Доля отказов, при которой автомат размыкается (0..1)
+            min_calls: Минимум вызовов в окне для решения
+            window: Сколько последних вызовов учитывать
+            cooldown: Сколько секунд отклонять вызовы после размыкания
+            clock: Источник времени (для тестов)
+        """
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self._clock = clock
+        self._outcomes: Deque[bool] = deque(maxlen=window)   # True — отказ
+        self._failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._probe_at: Optional[float] = None
+        self.rejected = 0
+        self.opened = 0
+        self._rejected_metric = UPSTREAM_REJECTED.labels(name, 'circuit_open')
+        UPSTREAM_CIRCUIT_STATE.labels(name).set_function(lambda: STATE_VALUES[self.current_state])
+
+    def configure(self, failure_rate: float, min_calls: int, window: int, cooldown: float) -> None:
+        """Меняет пороги (перезагрузка настроек); история вызовов сохраняется"""
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        if window != self._outcomes.maxlen:
+            self._outcomes = deque(self._outcomes, maxlen=window)
+            self._failures = sum(self._outcomes)
+
+    @property
+    def current_state(self) -> str:
+        """Состояние с учетом истекшей паузы: разомкнутый автомат после cooldown пускает пробу"""
+        if self.state == OPEN and self._clock() - self.opened_at >= self.cooldown:
+            return HALF_OPEN
+        return self.state
+
+    @property
+    def is_open(self) -> bool:
+        """True, если вызов сейчас будет отклонен"""
+        state = self.current_state
+        if state == HALF_OPEN:
+            return self._probe_at is not None and self._clock() - self._probe_at < self.cooldown
+        return state == OPEN
+
+    def should_reject(self) -> bool:
+        """
+        Проверка перед операцией из нескольких вызовов API (пробный запрос не тратится)
+
+        Returns:
+            bool: True — автомат разомкнут, операцию надо отклонить (отказ учитывается в метриках)
+        """
+        if not self.is_open:
+            return False
+        self.rejected += 1
+        self._rejected_metric.inc()
+        return True
+
+    def allow(self) -> bool:
+        """
+        Решает, можно ли выполнить вызов
+
+        Returns:
+            bool: False — вызов надо отклонить (отказ учитывается в метриках)
+        """
+        state = self.current_state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN:
+            self.state = HALF_OPEN
+            now = self._clock()
+            # Одна проба за раз; зависшая проба не держит автомат дольше cooldown
+            if self._probe_at is None or now - self._probe_at >= self.cooldown:
+                self._probe_at = now
+                return True
+        self.rejected += 1
+        self._rejected_metric.inc()
+        return False
+
+    def check(self) -> None:
+        """То же, что allow, но отказ выбрасывает CircuitOpenError"""
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name}: автомат защиты разомкнут")
+
+    def record_success(self) -> None:
+        if self.state == HALF_OPEN:
+            logger.info(f"✅ {self.name}: пробный запрос успешен, автомат защиты замкнут")
+            self._reset(CLOSED)
+        elif self.state == CLOSED:
+            self._record(False)
+
+    def record_failure(self) -> None:
+        if self.state == HALF_OPEN:
+            self._open("пробный запрос неудачен")
+        elif self.state == CLOSED:
+            self._record(True)
+            calls = len(self._outcomes)
+            if calls >= self.min_calls and self._failures / calls >= self.failure_rate:
+                self._open(f"отказов {self._failures} из {calls}")
+
+    def _record(self, failed: bool) -> None:
+        if len(self._outcomes) == self._outcomes.maxlen and self._outcomes[0]:
+            self._failures -= 1
+        self._outcomes.append(failed)
+        self._failures += failed
+
+    def _open(self, reason: str) -> None:
+        logger.warning(f"🔌 {self.name}: автомат защиты разомкнут ({reason}), вызовы отклоняются {self.cooldown:.0f} с")
+        self._reset(OPEN)
+        self.opened_at = self._clock()
+        self.opened += 1
+
+    def _reset(self, state: str) -> None:
+        self.state = state
+        self._probe_at = None
+        self._outcomes.clear()
+        self._failures = 0
+
+    def stats(self) -> dict:
+        return {'state': self.current_state, 'opened': self.opened, 'rejected': self.rejected}
+
+
+class Bulkhead:
+    """
+    Ограничение числа одновременных вызовов
+
+    Вызов, не получивший слот за max_wait секунд, отклоняется с
+    BulkheadFullError: пользователи не копятся в очереди к больному API.
+    """
+
+    def __init__(self, name: str, limit: int, max_wait: float = 5.0):
+        """
+        Args:
+            name: Имя API в логах и метриках
+            limit: Максимум одновременных вызовов (0 — без ограничения)
+            max_wait: Сколько ждать свободного слота (сек)
+        """
+        self.name = name
+        self.limit = limit
+        self.max_wait = max_wait
+        self.active = 0
+        self.rejected = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._rejected_metric = UPSTREAM_REJECTED.labels(name, 'bulkhead')
+        UPSTREAM_INFLIGHT.labels(name).set_function(lambda: self.active)
+
+    def resize(self, limit: int, max_wait: Optional[float] = None) -> None:
+        """Меняет лимит (перезагрузка настроек); при увеличении ожидающие получают слоты сразу"""
+        self.limit = limit
+        if max_wait is not None:
+            self.max_wait = max_wait
+        while self._waiters and self._has_slot():
+            self._hand_over()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _has_slot(self) -> bool:
+        return not self.limit or self.active < self.limit
+
+    def _hand_over(self) -> bool:
+        """Передает слот первому ожидающему"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.active += 1
+                waiter.set_result(None)
+                return True
+        return False
+
+    async def acquire(self) -> None:
+        if self._has_slot() and not self._waiters:
+            self.active += 1
+            return
+        if self.max_wait <= 0:
+            self._reject()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout=self.max_wait)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # Слот уже передан, но вызов отменен — возвращаем его
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject()
+            raise
+
+    def release(self) -> None:
+        self.active -= 1
+        if self._has_slot():
+            self._hand_over()
+
+    def _reject(self) -> None:
+        self.rejected += 1
+        self._rejected_metric.inc()
+        raise BulkheadFullError(f"{self.name}: занято {self.active} из {self.limit} слотов")
+
+    async def __aenter__(self) -> 'Bulkhead':
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.release()
+
+    def stats(self) -> dict:
+        return {'active': self.active, 'waiting': self.waiting, 'limit': self.limit, 'rejected': self.rejected}
+
+
+class RetryBudget:
+    """
+    Бюджет повторов: не больше ratio повторов на каждый исходный запрос
+
+    Каждый запрос добавляет в бюджет ratio токена, повтор или hedge тратит
+    один. Кроме того, бюджет пополняется на min_per_second токенов в секунду,
+    чтобы редкие запросы тоже можно было повторить. Когда API лежит, повторы
+    быстро исчерпывают бюджет и не умножают нагрузку на него.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, capacity: float = 10.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self._clock = clock
+        self.tokens = capacity
+        self._updated = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self) -> None:
+        """Учитывает исходный запрос"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """
+        Списывает токен на повтор
+
+        Returns:
+            bool: False — бюджет исчерпан, повторять нельзя
+        """
+        self._refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class ResilientTransport(httpx.AsyncBaseTransport):
+    """
+    HTTP-транспорт с автоматом защиты, повторами и hedging
+
+    Каждый запрос проходит через автомат защиты: разомкнутый автомат
+    отклоняет его с CircuitOpenError, не обращаясь к API. Сетевые ошибки и
+    ответы TRANSIENT_STATUSES считаются отказами. Идемпотентные запросы (GET)
+    повторяются с экспоненциальной паузой в пределах бюджета повторов, а с
+    hedge_delay > 0 медленный запрос дублируется: побеждает первый ответ.
+    Неидемпотентные запросы (создание сообщений и run) не повторяются никогда.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, breaker: CircuitBreaker,
+                 budget: Optional[RetryBudget] = None, attempts: int = 3, base_delay: float = 0.2,
+                 max_delay: float = 2.0, hedge_delay: float = 0.0):
+        """
+        Args:
+            transport: Транспорт, выполняющий запросы
+            breaker: Автомат защиты API
+            budget: Бюджет повторов (по умолчанию RetryBudget())
+            attempts: Максимум попыток идемпотентного запроса, включая первую
+            base_delay: Пауза перед первым повтором (сек), дальше удваивается
+            max_delay: Максимальная пауза между попытками (сек)
+            hedge_delay: Через сколько секунд дублировать медленный GET (0 — выключено)
+        """
+        self.transport = transport
+        self.breaker = breaker
+        self.budget = budget or RetryBudget()
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_delay = hedge_delay
+        name = breaker.name
+        self._retries = UPSTREAM_RETRIES.labels(name, 'retry')
+        self._hedges = UPSTREAM_RETRIES.labels(name, 'hedge')
+        self._hedges_won = UPSTREAM_RETRIES.labels(name, 'hedge_won')
+        self._no_budget = UPSTREAM_RETRIES.labels(name, 'no_budget')
+
+    def _delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        """Пауза перед повтором: Retry-After из ответа или full jitter от экспоненты"""
+        if response is not None:
+            try:
+                return min(self.max_delay, float(response.headers.get('retry-after', '')))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def _send(self, request: httpx.Request) -> httpx.Response:
+        """Одна попытка запроса с учетом результата в автомате защиты"""
+        try:
+            response = await self.transport.handle_async_request(request)
+        except httpx.TransportError:
+            self.breaker.record_failure()
+            raise
+        if response.status_code in TRANSIENT_STATUSES:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.breaker.check()
+        self.budget.deposit()
+        if request.method not in IDEMPOTENT_METHODS:
+            return await self._send(request)
+
+        attempt = 0
+        while True:
+            response = error = None
+            try:
+                if self.hedge_delay > 0:
+                    response = await self._hedged(request)
+                else:
+                    response = await self._send(request)
+            except httpx.TransportError as e:
+                error = e
+            if response is not None and response.status_code not in TRANSIENT_STATUSES:
+                return response
+            attempt += 1
+            # Пока автомат не замкнут, повторы только добавили бы нагрузки
+            if attempt >= self.attempts or self.breaker.state != CLOSED:
+                break
+            if not self.budget.withdraw():
+                self._no_budget.inc()
+                break
+            self._retries.inc()
+            delay = self._delay(attempt - 1, response)
+            if response is not None:
+                await response.aclose()
+            await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return response
+
+    async def _hedged(self, request: httpx.Request) -> httpx.Response:
+        """
+        Выполняет запрос; если он не ответил за hedge_delay, отправляет дубликат
+
+        Возвращается первый ответ без признаков сбоя; проигравший запрос
+        отменяется, а его ответ закрывается.
+        """
+        primary = asyncio.ensure_future(self._send(request))
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay)
+        if done:
+            return primary.result()
+        if not self.budget.withdraw():
+            self._no_budget.inc()
+            return await primary
+        self._hedges.inc()
+        backup = asyncio.ensure_future(self._send(request))
+        pending = {primary, backup}
+        fallback = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    error = task.exception()
+                    if error is None and task.result().status_code not in TRANSIENT_STATUSES:
+                        if task is backup:
+                            self._hedges_won.inc()
+                        if fallback is not None:
+                            self._discard(fallback)
+                        return task.result()
+                    if fallback is None or fallback.exception() is not None:
+                        if fallback is not None:
+                            self._discard(fallback)
+                        fallback = task
+                    else:
+                        self._discard(task)
+            # Обе попытки неудачны: отдаем ответ сбоя, если он есть, иначе ошибку
+            return fallback.result()
+        finally:
+            for task in pending:
+                self._discard(task)
+
+    @staticmethod
+    def _discard(task: asyncio.Future) -> None:
+        """Отменяет проигравшую попытку и закрывает ее ответ"""
+        def close(done: asyncio.Future) -> None:
+            if not done.cancelled() and done.exception() is None:
+                asyncio.ensure_future(done.result().aclose())
+        if task.done():
+            close(task)
+        else:
+            task.cancel()
+            task.add_done_callback(close)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
@@ -14,31 +14,29 @@ from pathlib import Path
 # Добавляем текущую директорию в путь для импортов
 sys.path.insert(0, str(Path(__file__).parent))
 
-def setup_logging():
-    """Настраивает логирование для бота"""
-    # Создаем директорию для логов если её нет
-    log_dir = Path("logs")
-    log_dir.mkdir(exist_ok=True)
-    
-    # Настраиваем форматирование
-    log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    date_format = '%Y-%m-%d %H:%M:%S'
-    
-    # Настраиваем логирование в файл
-    file_handler = logging.FileHandler(log_dir / "bot.log", encoding='utf-8')
-    file_handler.setLevel(logging.INFO)
-    file_handler.setFormatter(logging.Formatter(log_format, date_format))
-    
-    # Настраиваем логирование в консоль
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    console_handler.setFormatter(logging.Formatter(log_format, date_format))
-    
-    # Настраиваем корневой логгер
+def setup_logging(filename: str = "bot.log"):
+    """
+    Настраивает логирование для бота
+    
+    Записи уходят в очередь, а запись в файл (JSON, с ротацией) и в консоль
+    идет в отдельном потоке, не задерживая event loop.
+    """
+    from config import Config
+    from log_pipeline import parse_sample_rates, setup_logging as setup_log_pipeline
+    
+    setup_log_pipeline(
+        level=Config.LOG_LEVEL,
+        log_dir=Config.LOG_DIR or None,
+        filename=filename,
+        json_format=Config.LOG_FORMAT == 'json',
+        rotation=Config.LOG_ROTATION,
+        max_bytes=Config.LOG_MAX_BYTES,
+        backup_count=Config.LOG_BACKUP_COUNT,
+        when=Config.LOG_ROTATE_WHEN,
+        sample_rates=parse_sample_rates(Config.LOG_SAMPLE_RATES),
+        redact=Config.LOG_REDACT_PII
+    )
     root_logger = logging.getLogger()
-    root_logger.setLevel(logging.INFO)
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(console_handler)
     
     # Устанавливаем уровень для сторонних библиотек
     logging.getLogger('telegram').setLevel(logging.WARNING)
@@ -90,18 +88,25 @@ def check_dependencies():
     logger.info("✅ Все зависимости установлены")
     return True
 
+# Запущенный бот: сигнал остановки передается ему
+_bot = None
+
 def signal_handler(signum, frame):
     """Обработчик сигналов для корректного завершения работы"""
     logger = logging.getLogger(__name__)
     logger.info(f"📡 Получен сигнал {signum}, завершение работы...")
     
-    # Здесь можно добавить логику для корректного завершения
-    # например, закрытие соединений, сохранение состояния и т.д.
+    # Бот прекращает прием обновлений, дорабатывает диалоги и заявки
+    # и сохраняет состояние (SynaplinkBot.shutdown)
+    if _bot is not None and _bot.request_shutdown(signum):
+        return
     
+    # Бот еще не запущен или уже остановлен — сохранять нечего
     sys.exit(0)
 
 def main():
     """Основная функция запуска бота"""
+    global _bot
     # Настраиваем логирование
     logger = setup_logging()
     
@@ -128,7 +133,7 @@ def main():
         from bot import SynaplinkBot
         
         logger.info("🤖 Создание экземпляра бота...")
-        bot = SynaplinkBot()
+        bot = _bot = SynaplinkBot()
         
         logger.info("🚀 Запуск бота...")
         logger.info("📱 Бот готов к работе!")
@@ -136,6 +141,7 @@ def main():
         
         # Запускаем бота
         bot.run()
+        logger.info("👋 Бот остановлен")
         
     except ImportError as e:
         logger.error(f"❌ Ошибка импорта: {e}")
@@ -156,3 +162,7 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"❌ Неожиданная ошибка: {e}")
         sys.exit(1)
+    finally:
+        # Дописываем записи из очереди логов до выхода процесса
+        from log_pipeline import stop_logging
+        stop_logging()
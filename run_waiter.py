@@ -0,0 +1,352 @@
+"""
+Модуль ожидания завершения run ассистента OpenAI
+Поддерживает потоковый режим (streaming) и адаптивный опрос с backoff и дедлайном
+"""
+
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Статусы, после которых run больше не изменится (или требует вмешательства)
+TERMINAL_STATUSES = frozenset({
+    'completed',
+    'failed',
+    'cancelled',
+    'expired',
+    'incomplete',
+    'requires_action',
+})
+
+# Статус, который мы присваиваем run, не уложившемуся в дедлайн
+TIMEOUT_STATUS = 'timeout'
+
+# Разделитель между сообщениями ассистента, созданными одним run
+MESSAGE_SEPARATOR = "\n\n"
+
+DeltaCallback = Callable[[str], Awaitable[None]]
+
+
+def message_text(message) -> str:
+    """
+    Собирает текст сообщения ассистента из всех его частей
+
+    Текстовые части объединяются через перевод строки, нетекстовые
+    (изображения, файлы) пропускаются.
+    """
+    texts = []
+    for part in message.content or []:
+        value = getattr(getattr(part, 'text', None), 'value', None)
+        if value:
+            texts.append(value)
+    return "\n".join(texts)
+
+
+class RunOutcome:
+    """Результат выполнения run ассистента"""
+
+    __slots__ = ('run_id', 'status', 'text', 'last_error', 'ttft', 'total', 'mode')
+
+    def __init__(self, run_id: Optional[str], status: str, text: Optional[str] = None,
+                 last_error=None, ttft: Optional[float] = None, total: float = 0.0, mode: str = ''):
+        self.run_id = run_id
+        self.status = status
+        self.text = text            # Текст ответа (только в потоковом режиме)
+        self.last_error = last_error
+        self.ttft = ttft            # Время до первого токена, сек
+        self.total = total          # Полное время выполнения, сек
+        self.mode = mode            # 'stream' или 'poll'
+
+    @property
+    def ok(self) -> bool:
+        """True, если run завершился успешно"""
+        return self.status == 'completed'
+
+    def __repr__(self) -> str:
+        return (f"RunOutcome(run_id={self.run_id!r}, status={self.status!r}, mode={self.mode!r}, "
+                f"ttft={self.ttft}, total={self.total:.3f})")
+
+
+class RunWaiter:
+    """Базовый класс стратегии запуска run и ожидания его завершения"""
+
+    mode = ''
+
+    def __init__(self, deadline: float = 60.0):
+        """
+        Args:
+            deadline: Максимальное время выполнения одного run в секундах
+        """
+        self.deadline = deadline
+        self._active: Dict[str, str] = {}   # run_id -> thread_id выполняющихся run
+
+    def configure(self, deadline: float, poll_initial: Optional[float] = None,
+                  poll_max: Optional[float] = None) -> None:
+        """
+        Меняет дедлайн и паузы опроса для следующих run (перезагрузка настроек)
+
+        Args:
+            deadline: Дедлайн на один run в секундах
+            poll_initial: Начальная пауза опроса (None — без изменений)
+            poll_max: Максимальная пауза опроса (None — без изменений)
+        """
+        self.deadline = deadline
+
+    async def run(self, client, thread_id: str, assistant_id: str,
+                  on_delta: Optional[DeltaCallback] = None) -> RunOutcome:
+        """
+        Запускает run ассистента в thread и ждет его завершения
+
+        Args:
+            client: Экземпляр AsyncOpenAI
+            thread_id: ID thread
+            assistant_id: ID ассистента
+            on_delta: Необязательный колбэк для фрагментов текста по мере генерации
+
+        Returns:
+            RunOutcome: Итог выполнения run
+        """
+        raise NotImplementedError
+
+    def active_runs(self) -> Dict[str, str]:
+        """Run, которые сейчас выполняются: run_id -> thread_id"""
+        return dict(self._active)
+
+    async def cancel_active(self, client) -> int:
+        """
+        Отменяет на сервере все выполняющиеся run (при остановке бота)
+
+        Args:
+            client: Экземпляр AsyncOpenAI
+
+        Returns:
+            int: Сколько run отменялось
+        """
+        runs = self.active_runs()
+        await asyncio.gather(*(self._cancel(client, thread_id, run_id) for run_id, thread_id in runs.items()))
+        return len(runs)
+
+    async def _cancel(self, client, thread_id: str, run_id: Optional[str]) -> None:
+        """Отменяет run на сервере, не пробрасывая ошибки"""
+        if not run_id:
+            return
+        try:
+            await client.beta.threads.runs.cancel(run_id=run_id, thread_id=thread_id)
+            logger.warning(f"⏹️ Run {run_id} отменен")
+        except Exception as e:
+            logger.warning(f"Не удалось отменить run {run_id}: {e}")
+
+
+class PollingRunWaiter(RunWaiter):
+    """Опрос статуса run с экспоненциальным backoff и джиттером"""
+
+    mode = 'poll'
+
+    def __init__(self, deadline: float = 60.0, initial_delay: float = 0.1,
+                 max_delay: float = 2.0, factor: float = 2.0):
+        """
+        Args:
+            deadline: Максимальное время выполнения одного run в секундах
+            initial_delay: Первая пауза между опросами
+            max_delay: Максимальная пауза между опросами
+            factor: Множитель роста паузы
+        """
+        super().__init__(deadline)
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.factor = factor
+
+    def configure(self, deadline: float, poll_initial: Optional[float] = None,
+                  poll_max: Optional[float] = None) -> None:
+        super().configure(deadline)
+        if poll_initial is not None:
+            self.initial_delay = poll_initial
+        if poll_max is not None:
+            self.max_delay = poll_max
+
+    def _next_delay(self, attempt: int) -> float:
+        """Пауза перед очередным опросом (equal jitter: половина фиксирована, половина случайна)"""
+        delay = min(self.max_delay, self.initial_delay * (self.factor ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def run(self, client, thread_id: str, assistant_id: str,
+                  on_delta: Optional[DeltaCallback] = None) -> RunOutcome:
+        started = time.monotonic()
+        run = await client.beta.threads.runs.create(
+            thread_id=thread_id,
+            assistant_id=assistant_id
+        )
+        self._active[run.id] = thread_id
+        try:
+            return await self.wait(client, thread_id, run, started)
+        finally:
+            self._active.pop(run.id, None)
+
+    async def wait(self, client, thread_id: str, run, started: Optional[float] = None) -> RunOutcome:
+        """Ждет завершения уже созданного run"""
+        started = started if started is not None else time.monotonic()
+        deadline_at = started + self.deadline
+        attempt = 0
+        run_status = run
+
+        while getattr(run_status, 'status', None) not in TERMINAL_STATUSES:
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                await self._cancel(client, thread_id, run.id)
+                return RunOutcome(run.id, TIMEOUT_STATUS, total=time.monotonic() - started, mode=self.mode)
+            await asyncio.sleep(min(self._next_delay(attempt), remaining))
+            attempt += 1
+            run_status = await client.beta.threads.runs.retrieve(
+                thread_id=thread_id,
+                run_id=run.id
+            )
+
+        total = time.monotonic() - started
+        status = run_status.status
+        if status == 'requires_action':
+            # Инструменты у ассистента не настроены — run никогда не продолжится сам
+            await self._cancel(client, thread_id, run.id)
+        return RunOutcome(
+            run.id, status,
+            last_error=getattr(run_status, 'last_error', None),
+            # При опросе первый токен становится виден только вместе с полным ответом
+            ttft=total if status == 'completed' else None,
+            total=total,
+            mode=self.mode
+        )
+
+
+class StreamingRunWaiter(RunWaiter):
+    """Потоковое выполнение run: текст приходит по мере генерации"""
+
+    mode = 'stream'
+
+    async def run(self, client, thread_id: str, assistant_id: str,
+                  on_delta: Optional[DeltaCallback] = None) -> RunOutcome:
+        started = time.monotonic()
+        state = {'run_id': None, 'status': None, 'last_error': None, 'ttft': None, 'new_message': False}
+        parts = []
+
+        async def consume():
+            async with client.beta.threads.runs.stream(
+                thread_id=thread_id,
+                assistant_id=assistant_id
+            ) as stream:
+                async for event in stream:
+                    name = event.event
+                    if name.startswith('thread.run.') and not name.startswith('thread.run.step'):
+                        if state['run_id'] is None:
+                            self._active[event.data.id] = thread_id
+                        state['run_id'] = event.data.id
+                        state['status'] = event.data.status
+                        state['last_error'] = getattr(event.data, 'last_error', None)
+                        if event.data.status in TERMINAL_STATUSES:
+                            break
+                    elif name == 'thread.message.completed':
+                        # Следующее сообщение того же run отделяем пустой строкой
+                        state['new_message'] = True
+                    elif name == 'thread.message.delta':
+                        for block in event.data.delta.content or []:
+                            text = getattr(getattr(block, 'text', None), 'value', None)
+                            if not text:
+                                continue
+                            if state['ttft'] is None:
+                                state['ttft'] = time.monotonic() - started
+                            if state['new_message'] and parts:
+                                text = MESSAGE_SEPARATOR + text
+                            state['new_message'] = False
+                            parts.append(text)
+                            if on_delta:
+                                await on_delta(text)
+
+        try:
+            await asyncio.wait_for(consume(), timeout=self.deadline)
+        except asyncio.TimeoutError:
+            await self._cancel(client, thread_id, state['run_id'])
+            return RunOutcome(state['run_id'], TIMEOUT_STATUS, ttft=state['ttft'],
+                              total=time.monotonic() - started, mode=self.mode)
+        except Exception as e:
+            if state['run_id'] is None:
+                # Run на сервере не создан — ошибку обрабатывает вызывающий
+                raise
+            # Run уже выполняется: отменяем его, чтобы thread не остался занятым
+            logger.error(f"Ошибка потока run {state['run_id']}: {e}")
+            await self._cancel(client, thread_id, state['run_id'])
+            return RunOutcome(state['run_id'], 'failed', last_error=e, ttft=state['ttft'],
+                              total=time.monotonic() - started, mode=self.mode)
+        finally:
+            self._active.pop(state['run_id'], None)
+
+        status = state['status'] or 'failed'
+        if status == 'requires_action':
+            await self._cancel(client, thread_id, state['run_id'])
+        return RunOutcome(
+            state['run_id'], status,
+            text=''.join(parts) if status == 'completed' else None,
+            last_error=state['last_error'],
+            ttft=state['ttft'],
+            total=time.monotonic() - started,
+            mode=self.mode
+        )
+
+
+class AutoRunWaiter(RunWaiter):
+    """Пытается использовать streaming, при недоступности переходит на опрос"""
+
+    def __init__(self, streaming: StreamingRunWaiter, polling: PollingRunWaiter):
+        super().__init__(polling.deadline)
+        self.streaming = streaming
+        self.polling = polling
+        self._streaming_available = True
+
+    def configure(self, deadline: float, poll_initial: Optional[float] = None,
+                  poll_max: Optional[float] = None) -> None:
+        super().configure(deadline)
+        self.streaming.configure(deadline)
+        self.polling.configure(deadline, poll_initial, poll_max)
+
+    @property
+    def mode(self) -> str:
+        return self.streaming.mode if self._streaming_available else self.polling.mode
+
+    def active_runs(self) -> Dict[str, str]:
+        return {**self.streaming.active_runs(), **self.polling.active_runs()}
+
+    async def run(self, client, thread_id: str, assistant_id: str,
+                  on_delta: Optional[DeltaCallback] = None) -> RunOutcome:
+        if self._streaming_available and not hasattr(client.beta.threads.runs, 'stream'):
+            # Поддержка streaming определяется один раз по возможностям клиента: ошибка
+            # посреди потока не переключает режим и не запускает второй run в том же thread
+            logger.warning("⚠️ Клиент OpenAI не поддерживает streaming, переходим на опрос")
+            self._streaming_available = False
+        if self._streaming_available:
+            return await self.streaming.run(client, thread_id, assistant_id, on_delta)
+        return await self.polling.run(client, thread_id, assistant_id, on_delta)
+
+
+def create_run_waiter(mode: str = 'auto', deadline: float = 60.0,
+                      poll_initial: float = 0.1, poll_max: float = 2.0) -> RunWaiter:
+    """
+    Создает стратегию ожидания run по названию режима
+
+    Args:
+        mode: 'auto', 'stream' или 'poll'
+        deadline: Дедлайн на один run в секундах
+        poll_initial: Начальная пауза опроса
+        poll_max: Максимальная пауза опроса
+
+    Returns:
+        RunWaiter: Стратегия ожидания
+    """
+    polling = PollingRunWaiter(deadline=deadline, initial_delay=poll_initial, max_delay=poll_max)
+    if mode == 'poll':
+        return polling
+    streaming = StreamingRunWaiter(deadline=deadline)
+    if mode == 'stream':
+        return streaming
+    if mode == 'auto':
+        return AutoRunWaiter(streaming, polling)
+    raise ValueError(f"Неизвестный режим ожидания run: {mode}")
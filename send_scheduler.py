@@ -0,0 +1,301 @@
+"""
+Модуль планировщика исходящих запросов к Telegram Bot API
+Соблюдает глобальный лимит и лимиты на чат (token bucket), пропускает заявки в рабочий чат
+вне очереди и автоматически повторяет запросы после 429 (retry_after)
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict, deque
+from datetime import timedelta
+from typing import Any, Deque, Dict, Optional, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import QUEUE_DEPTH_ON_ENQUEUE, TELEGRAM_QUEUE_WAIT, TELEGRAM_SEND_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты очередей: меньше — раньше
+PRIORITY_LEAD = 0
+PRIORITY_DEFAULT = 1
+
+# Служебные методы, которые не упираются в лимиты сообщений
+UNLIMITED_ENDPOINTS = frozenset({
+    'getUpdates',
+    'getMe',
+    'setWebhook',
+    'deleteWebhook',
+    'getWebhookInfo',
+    'getChatMember',
+    'answerCallbackQuery',
+    'getFile',
+    'close',
+    'logOut',
+})
+
+
+class TokenBucket:
+    """Token bucket с резервированием: возвращает, сколько ждать до своего токена"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Args:
+            rate: Токенов в секунду
+            capacity: Размер всплеска
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self) -> float:
+        """Берет токен, если он есть; иначе возвращает время ожидания, ничего не беря"""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def reserve(self) -> float:
+        """Резервирует токен (допуская долг) и возвращает время ожидания"""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def pause(self, seconds: float) -> None:
+        """Запрещает выдачу токенов на указанное время (после 429)"""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    @property
+    def idle(self) -> bool:
+        """True, если ведро полное и его можно забыть"""
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class PriorityGate:
+    """Выдает токены общего ведра ожидающим строго по приоритету, затем по порядку"""
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._pump: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def depth(self, priority: int) -> int:
+        return sum(1 for item in self._heap if item[0] == priority)
+
+    async def acquire(self, priority: int) -> None:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), future))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run())
+        await future
+
+    async def _run(self) -> None:
+        while self._heap:
+            if self._heap[0][2].done():
+                # Ожидающий отменен
+                heapq.heappop(self._heap)
+                continue
+            wait = self.bucket.try_take()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, future = heapq.heappop(self._heap)
+            future.set_result(None)
+
+
+class LaneStats:
+    """Статистика ожидания в очереди одного приоритета"""
+
+    __slots__ = ('count', 'total_wait', 'max_wait', 'recent')
+
+    def __init__(self, window: int = 1000):
+        self.count = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.recent: Deque[float] = deque(maxlen=window)
+
+    def observe(self, wait: float) -> None:
+        self.count += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.recent.append(wait)
+
+    def snapshot(self) -> dict:
+        ordered = sorted(self.recent)
+        p95 = ordered[int(len(ordered) * 0.95) - 1] if len(ordered) >= 20 else (ordered[-1] if ordered else 0.0)
+        return {
+            'count': self.count,
+            'avg_wait_ms': round(self.total_wait / self.count * 1000, 2) if self.count else 0.0,
+            'p95_wait_ms': round(p95 * 1000, 2),
+            'max_wait_ms': round(self.max_wait * 1000, 2),
+        }
+
+
+class SendScheduler(BaseRateLimiter[Dict[str, Any]]):
+    """
+    Ограничитель исходящих запросов для Application.builder().rate_limiter(...)
+
+    Запросы к рабочему чату идут в приоритетной очереди. Для других запросов
+    можно задать приоритет через rate_limit_args={'priority': 0}.
+    """
+
+    def __init__(self, priority_chat_id: Union[int, str, None] = None, global_rate: float = 30.0,
+                 private_chat_rate: float = 1.0, group_chat_rate: float = 20 / 60,
+                 chat_burst: float = 3.0, max_retries: int = 3, max_chats: int = 10_000):
+        """
+        Args:
+            priority_chat_id: Чат, запросы в который идут вне очереди (рабочий чат заявок)
+            global_rate: Общий лимит запросов в секунду
+            private_chat_rate: Лимит сообщений в секунду для личного чата
+            group_chat_rate: Лимит сообщений в секунду для группы
+            chat_burst: Допустимый всплеск в одном чате
+            max_retries: Сколько раз повторять запрос после RetryAfter
+            max_chats: Сколько ведер чатов держать в памяти
+        """
+        self.priority_chat_id = str(priority_chat_id) if priority_chat_id is not None else None
+        self.private_chat_rate = private_chat_rate
+        self.group_chat_rate = group_chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.gate = PriorityGate(self.global_bucket)
+        self._chat_buckets: 'OrderedDict[str, TokenBucket]' = OrderedDict()
+        self.lanes = {PRIORITY_LEAD: LaneStats(), PRIORITY_DEFAULT: LaneStats()}
+        self.retries = 0
+        self._depth_on_enqueue = QUEUE_DEPTH_ON_ENQUEUE.labels('telegram_send')
+
+    def set_rates(self, global_rate: float, private_chat_rate: float, group_chat_rate: float,
+                  chat_burst: Optional[float] = None) -> None:
+        """
+        Меняет лимиты на лету (перезагрузка настроек), не теряя накопленных токенов
+
+        Args:
+            global_rate: Общий лимит запросов в секунду
+            private_chat_rate: Лимит сообщений в секунду для личного чата
+            group_chat_rate: Лимит сообщений в секунду для группы
+            chat_burst: Допустимый всплеск в одном чате (None — без изменений)
+        """
+        if chat_burst is not None:
+            self.chat_burst = chat_burst
+        self.private_chat_rate = private_chat_rate
+        self.group_chat_rate = group_chat_rate
+        self.global_bucket.rate = self.global_bucket.capacity = global_rate
+        for chat_id, bucket in self._chat_buckets.items():
+            is_group = chat_id.startswith('-')
+            bucket.rate = group_chat_rate if is_group else private_chat_rate
+            bucket.capacity = max(1.0, self.chat_burst if not is_group else 1.0)
+            bucket.tokens = min(bucket.tokens, bucket.capacity)
+
+    async def initialize(self) -> None:
+        """Инициализация не требуется"""
+
+    async def shutdown(self) -> None:
+        """Завершение не требуется"""
+
+    def _chat_bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            is_group = chat_id.startswith('-')
+            rate = self.group_chat_rate if is_group else self.private_chat_rate
+            bucket = TokenBucket(rate, max(1.0, self.chat_burst if not is_group else 1.0))
+            self._chat_buckets[chat_id] = bucket
+            if len(self._chat_buckets) > self.max_chats:
+                self._evict_idle()
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    def _evict_idle(self) -> None:
+        for chat_id in list(self._chat_buckets)[: len(self._chat_buckets) // 10 or 1]:
+            if self._chat_buckets[chat_id].idle:
+                del self._chat_buckets[chat_id]
+
+    def _priority(self, chat_id: Optional[str], rate_limit_args: Optional[Dict[str, Any]]) -> int:
+        if rate_limit_args and 'priority' in rate_limit_args:
+            return rate_limit_args['priority']
+        if chat_id is not None and chat_id == self.priority_chat_id:
+            return PRIORITY_LEAD
+        return PRIORITY_DEFAULT
+
+    @staticmethod
+    def _retry_seconds(retry_after: Union[int, float, timedelta]) -> float:
+        if isinstance(retry_after, timedelta):
+            return retry_after.total_seconds()
+        return float(retry_after)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint in UNLIMITED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+
+        chat_id = data.get('chat_id')
+        chat_id = str(chat_id) if chat_id is not None else None
+        priority = self._priority(chat_id, rate_limit_args)
+        lane = self.lanes.setdefault(priority, LaneStats())
+        queue_wait = TELEGRAM_QUEUE_WAIT.labels(self._lane_name(priority))
+        request_latency = TELEGRAM_SEND_LATENCY.labels(endpoint)
+
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            if chat_id is not None:
+                delay = self._chat_bucket(chat_id).reserve()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self._depth_on_enqueue.observe(len(self.gate))
+            await self.gate.acquire(priority)
+            waited = time.monotonic() - started
+            lane.observe(waited)
+            queue_wait.observe(waited)
+
+            sent_at = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                pause = self._retry_seconds(e.retry_after)
+                self.retries += 1
+                logger.warning(f"⏳ Telegram просит подождать {pause} с ({endpoint}, чат {chat_id})")
+                if chat_id is not None:
+                    self._chat_bucket(chat_id).pause(pause)
+                else:
+                    self.global_bucket.pause(pause)
+            finally:
+                request_latency.observe(time.perf_counter() - sent_at)
+
+    @staticmethod
+    def _lane_name(priority: int) -> str:
+        return 'lead' if priority == PRIORITY_LEAD else f'p{priority}'
+
+    def stats(self) -> dict:
+        """Метрики ожидания по очередям"""
+        return {
+            'queued': len(self.gate),
+            'retries': self.retries,
+            'tracked_chats': len(self._chat_buckets),
+            'lanes': {
+                self._lane_name(priority): lane.snapshot()
+                for priority, lane in self.lanes.items()
+            },
+        }
@@ -0,0 +1,561 @@
+"""
+Модуль хранилища сессий пользователей
+Хранит состояния пользователей и thread_id в памяти (LRU+TTL), SQLite (WAL) или Redis.
+TTL скользящий: чтение продлевает запись, поэтому истекают только заброшенные сессии
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """
+    Базовый класс хранилища сессий
+
+    Значения сериализуются в JSON. Конкурентные чтения, попавшие в один такт
+    event loop, объединяются в один запрос к бэкенду, а записи копятся
+    в буфере и сбрасываются пачкой раз в flush_interval секунд.
+    """
+
+    def __init__(self, flush_interval: float = 0.05, batch_reads: bool = True):
+        """
+        Args:
+            flush_interval: Пауза перед сбросом накопленных записей (0 — запись сразу)
+            batch_reads: Объединять ли конкурентные чтения в один запрос
+        """
+        self.flush_interval = flush_interval
+        self.batch_reads = batch_reads
+        self._pending: Dict[str, Optional[str]] = {}   # None означает удаление
+        self._inflight: Dict[str, Optional[str]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._read_waiters: Dict[str, asyncio.Future] = {}
+        self._read_scheduled = False
+
+    # --- Методы, которые реализуют бэкенды ---
+
+    async def _read_many(self, keys: List[str]) -> Dict[str, str]:
+        """Читает значения по ключам, отсутствующие ключи не возвращаются"""
+        raise NotImplementedError
+
+    async def _write_many(self, writes: Dict[str, Optional[str]]) -> None:
+        """Записывает значения пачкой (None — удалить ключ)"""
+        raise NotImplementedError
+
+    async def _scan(self, prefix: str) -> Dict[str, str]:
+        """Читает все ключи с префиксом (редкая операция: восстановление состояния при запуске)"""
+        raise NotImplementedError
+
+    async def _close(self) -> None:
+        """Освобождает ресурсы бэкенда"""
+
+    # --- Публичный интерфейс ---
+
+    def namespace(self, name: str) -> 'SessionNamespace':
+        """Возвращает представление хранилища с общим префиксом ключей"""
+        return SessionNamespace(self, name)
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        """Возвращает значение по ключу"""
+        values = await self.get_many([key])
+        return values.get(key, default)
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Возвращает словарь значений для найденных ключей"""
+        raw: Dict[str, Optional[str]] = {}
+        missing = []
+        for key in keys:
+            if key in self._pending:
+                raw[key] = self._pending[key]
+            elif key in self._inflight:
+                raw[key] = self._inflight[key]
+            else:
+                missing.append(key)
+
+        if missing:
+            if self.batch_reads:
+                raw.update(await self._batched_read(missing))
+            else:
+                raw.update(await self._read_many(missing))
+
+        return {key: json.loads(value) for key, value in raw.items() if value is not None}
+
+    async def scan(self, prefix: str) -> Dict[str, Any]:
+        """Возвращает все значения, ключи которых начинаются с prefix"""
+        await self.flush()
+        return {key: json.loads(value) for key, value in (await self._scan(prefix)).items()}
+
+    async def set(self, key: str, value: Any) -> None:
+        """Сохраняет значение по ключу"""
+        await self._write(key, json.dumps(value, ensure_ascii=False))
+
+    async def delete(self, key: str) -> None:
+        """Удаляет ключ"""
+        await self._write(key, None)
+
+    async def flush(self) -> None:
+        """Немедленно сбрасывает накопленные записи в бэкенд"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            self._inflight, self._pending = self._pending, {}
+            try:
+                await self._write_many(self._inflight)
+            except Exception as e:
+                # Возвращаем записи в буфер, не затирая более свежие
+                for key, value in self._inflight.items():
+                    self._pending.setdefault(key, value)
+                logger.error(f"❌ Ошибка сброса сессий в хранилище: {e}")
+                raise
+            finally:
+                self._inflight = {}
+
+    async def close(self) -> None:
+        """Сбрасывает буфер и закрывает хранилище"""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        try:
+            await self.flush()
+        finally:
+            await self._close()
+
+    # --- Внутренняя логика пакетирования ---
+
+    async def _write(self, key: str, value: Optional[str]) -> None:
+        self._pending[key] = value
+        if self.flush_interval <= 0:
+            await self.flush()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        try:
+            await self.flush()
+        except Exception:
+            # Ошибка уже залогирована, повторим при следующей записи
+            pass
+
+    async def _batched_read(self, keys: List[str]) -> Dict[str, Optional[str]]:
+        loop = asyncio.get_running_loop()
+        futures = {}
+        for key in keys:
+            future = self._read_waiters.get(key)
+            if future is None:
+                future = loop.create_future()
+                self._read_waiters[key] = future
+            futures[key] = future
+
+        if not self._read_scheduled:
+            # Даем остальным корутинам этого такта добавить свои ключи
+            self._read_scheduled = True
+            loop.call_soon(lambda: asyncio.ensure_future(self._run_read_batch()))
+
+        values = await asyncio.gather(*(asyncio.shield(f) for f in futures.values()))
+        return dict(zip(futures.keys(), values))
+
+    async def _run_read_batch(self) -> None:
+        waiters, self._read_waiters = self._read_waiters, {}
+        self._read_scheduled = False
+        try:
+            data = await self._read_many(list(waiters))
+        except Exception as e:
+            for future in waiters.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, future in waiters.items():
+            if not future.done():
+                future.set_result(data.get(key))
+
+
+class SessionNamespace:
+    """Представление хранилища с префиксом ключей (например, user_state или thread)"""
+
+    def __init__(self, store: SessionStore, name: str):
+        self.store = store
+        self.name = name
+
+    def _key(self, key) -> str:
+        return f"{self.name}:{key}"
+
+    async def get(self, key, default: Any = None) -> Any:
+        return await self.store.get(self._key(key), default)
+
+    async def get_many(self, keys: Iterable) -> Dict[Any, Any]:
+        keys = list(keys)
+        values = await self.store.get_many(self._key(k) for k in keys)
+        return {k: values[self._key(k)] for k in keys if self._key(k) in values}
+
+    async def items(self) -> Dict[str, Any]:
+        """Все записи пространства (ключи — строки без префикса)"""
+        prefix = self._key('')
+        return {key[len(prefix):]: value for key, value in (await self.store.scan(prefix)).items()}
+
+    async def set(self, key, value: Any) -> None:
+        await self.store.set(self._key(key), value)
+
+    async def delete(self, key) -> None:
+        await self.store.delete(self._key(key))
+
+
+class MemorySessionStore(SessionStore):
+    """Хранилище в памяти процесса с вытеснением LRU и временем жизни записей"""
+
+    def __init__(self, max_entries: int = 100_000, ttl: Optional[float] = None):
+        """
+        Args:
+            max_entries: Максимальное число записей, самые старые вытесняются
+            ttl: Время жизни записи без обращений в секундах (None — бессрочно)
+        """
+        super().__init__(flush_interval=0, batch_reads=False)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: 'OrderedDict[str, tuple]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    async def _read_many(self, keys: List[str]) -> Dict[str, str]:
+        now = time.monotonic()
+        result = {}
+        for key in keys:
+            item = self._data.get(key)
+            if item is None:
+                continue
+            value, expires_at = item
+            if expires_at is not None and expires_at <= now:
+                del self._data[key]
+                continue
+            if expires_at is not None:
+                self._data[key] = (value, now + self.ttl)
+            self._data.move_to_end(key)
+            result[key] = value
+        return result
+
+    async def _scan(self, prefix: str) -> Dict[str, str]:
+        now = time.monotonic()
+        return {
+            key: value for key, (value, expires_at) in self._data.items()
+            if key.startswith(prefix) and (expires_at is None or expires_at > now)
+        }
+
+    async def _write_many(self, writes: Dict[str, Optional[str]]) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        for key, value in writes.items():
+            if value is None:
+                self._data.pop(key, None)
+                continue
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+
+class SQLiteSessionStore(SessionStore):
+    """Хранилище в SQLite в режиме WAL (переживает перезапуски, общее для процессов)"""
+
+    def __init__(self, path: str, ttl: Optional[float] = None, flush_interval: float = 0.05):
+        """
+        Args:
+            path: Путь к файлу базы данных
+            ttl: Время жизни записи без обращений в секундах (None — бессрочно)
+            flush_interval: Пауза перед пакетной записью
+        """
+        super().__init__(flush_interval=flush_interval)
+        self.path = path
+        self.ttl = ttl
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+        self._conn.commit()
+
+    def _read_sync(self, keys: List[str]) -> Dict[str, str]:
+        placeholders = ",".join("?" * len(keys))
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key, value, expires_at FROM sessions WHERE key IN ({placeholders}) "
+                f"AND (expires_at IS NULL OR expires_at > ?)",
+                (*keys, now)
+            ).fetchall()
+            # Продлеваем записи, прожившие больше половины TTL: активная сессия
+            # не истекает, а запись на каждое чтение не нужна
+            renew = [(now + self.ttl, key) for key, _, expires_at in rows
+                     if self.ttl and expires_at is not None and expires_at - now < self.ttl / 2]
+            if renew:
+                with self._conn:
+                    self._conn.executemany("UPDATE sessions SET expires_at = ? WHERE key = ?", renew)
+        return {key: value for key, value, _ in rows}
+
+    def _write_sync(self, writes: Dict[str, Optional[str]]) -> None:
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl else None
+        upserts = [(k, v, expires_at) for k, v in writes.items() if v is not None]
+        deletes = [(k,) for k, v in writes.items() if v is None]
+        with self._lock, self._conn:
+            if upserts:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO sessions (key, value, expires_at) VALUES (?, ?, ?)",
+                    upserts
+                )
+            if deletes:
+                self._conn.executemany("DELETE FROM sessions WHERE key = ?", deletes)
+            # Попутно чистим протухшие записи
+            self._conn.execute("DELETE FROM sessions WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+
+    def _scan_sync(self, prefix: str) -> Dict[str, str]:
+        # Диапазон по первичному ключу: [prefix, prefix с увеличенным последним символом)
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM sessions WHERE key >= ? AND key < ? "
+                "AND (expires_at IS NULL OR expires_at > ?)",
+                (prefix, upper, time.time())
+            ).fetchall()
+        return dict(rows)
+
+    async def _read_many(self, keys: List[str]) -> Dict[str, str]:
+        return await asyncio.to_thread(self._read_sync, keys)
+
+    async def _scan(self, prefix: str) -> Dict[str, str]:
+        return await asyncio.to_thread(self._scan_sync, prefix)
+
+    async def _write_many(self, writes: Dict[str, Optional[str]]) -> None:
+        await asyncio.to_thread(self._write_sync, writes)
+
+    async def _close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class RedisSessionStore(SessionStore):
+    """Хранилище в Redis (или совместимом сервере) по протоколу RESP без внешних зависимостей"""
+
+    def __init__(self, url: str = 'redis://localhost:6379/0', ttl: Optional[float] = None,
+                 prefix: str = 'synaplink:', flush_interval: float = 0.05):
+        """
+        Args:
+            url: Адрес сервера вида redis://[:password@]host:port/db
+            ttl: Время жизни записи без обращений в секундах (None — бессрочно)
+            prefix: Префикс всех ключей бота
+            flush_interval: Пауза перед пакетной записью
+        """
+        super().__init__(flush_interval=flush_interval)
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.ttl = ttl
+        self.prefix = prefix
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    @staticmethod
+    def _encode(*args) -> bytes:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis закрыл соединение")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            raise RuntimeError(f"Ошибка Redis: {payload.decode()}")
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length == -1:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2].decode()
+        if kind == b'*':
+            count = int(payload)
+            if count == -1:
+                return None
+            return [await self._read_reply() for _ in range(count)]
+        raise RuntimeError(f"Неизвестный ответ Redis: {line!r}")
+
+    async def _pipeline(self, commands: List[tuple]) -> list:
+        """Отправляет команды одним пакетом и читает все ответы"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._writer is None:
+                await self._connect()
+            try:
+                self._writer.write(b"".join(self._encode(*cmd) for cmd in commands))
+                await self._writer.drain()
+                return [await self._read_reply() for _ in commands]
+            except (ConnectionError, asyncio.IncompleteReadError):
+                await self._disconnect()
+                raise
+
+    async def _connect(self) -> None:
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        handshake = []
+        if self.password:
+            handshake.append(('AUTH', self.password))
+        if self.db:
+            handshake.append(('SELECT', self.db))
+        if handshake:
+            self._writer.write(b"".join(self._encode(*cmd) for cmd in handshake))
+            await self._writer.drain()
+            for _ in handshake:
+                await self._read_reply()
+        logger.info(f"✅ Подключение к Redis {self.host}:{self.port}/{self.db}")
+
+    async def _disconnect(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+        self._reader = self._writer = None
+
+    async def _read_many(self, keys: List[str]) -> Dict[str, str]:
+        commands = [('MGET', *(self.prefix + k for k in keys))]
+        if self.ttl:
+            # Продление в том же пакете: лишнего сетевого круга нет
+            commands.extend(('PEXPIRE', self.prefix + k, self._ttl_ms) for k in keys)
+        values = (await self._pipeline(commands))[0]
+        return {k: v for k, v in zip(keys, values) if v is not None}
+
+    @property
+    def _ttl_ms(self) -> int:
+        # Миллисекунды: EX округлял бы TTL меньше секунды до недопустимого 0
+        return max(1, int(self.ttl * 1000))
+
+    async def _scan(self, prefix: str) -> Dict[str, str]:
+        keys, cursor = [], '0'
+        while True:
+            (reply,) = await self._pipeline([('SCAN', cursor, 'MATCH', self.prefix + prefix + '*', 'COUNT', 1000)])
+            cursor, found = reply
+            keys.extend(key[len(self.prefix):] for key in found)
+            if cursor == '0':
+                break
+        result = {}
+        for start in range(0, len(keys), 1000):
+            result.update(await self._read_many(keys[start:start + 1000]))
+        return result
+
+    async def _write_many(self, writes: Dict[str, Optional[str]]) -> None:
+        commands = []
+        for key, value in writes.items():
+            if value is None:
+                commands.append(('DEL', self.prefix + key))
+            elif self.ttl:
+                commands.append(('SET', self.prefix + key, value, 'PX', self._ttl_ms))
+            else:
+                commands.append(('SET', self.prefix + key, value))
+        await self._pipeline(commands)
+
+    async def _close(self) -> None:
+        await self._disconnect()
+
+
+class ShardedSessionStore(SessionStore):
+    """Распределяет ключи по нескольким хранилищам по стабильному хешу"""
+
+    def __init__(self, shards: List[SessionStore], flush_interval: float = 0.05):
+        """
+        Args:
+            shards: Хранилища-шарды (их собственная буферизация не используется)
+            flush_interval: Пауза перед пакетной записью
+        """
+        super().__init__(flush_interval=flush_interval)
+        self.shards = shards
+
+    def _shard_index(self, key: str) -> int:
+        return zlib.crc32(key.encode()) % len(self.shards)
+
+    def _group(self, keys: Iterable[str]) -> Dict[int, List[str]]:
+        groups: Dict[int, List[str]] = {}
+        for key in keys:
+            groups.setdefault(self._shard_index(key), []).append(key)
+        return groups
+
+    async def _read_many(self, keys: List[str]) -> Dict[str, str]:
+        groups = self._group(keys)
+        results = await asyncio.gather(*(self.shards[i]._read_many(ks) for i, ks in groups.items()))
+        merged = {}
+        for result in results:
+            merged.update(result)
+        return merged
+
+    async def _scan(self, prefix: str) -> Dict[str, str]:
+        merged = {}
+        for result in await asyncio.gather(*(shard._scan(prefix) for shard in self.shards)):
+            merged.update(result)
+        return merged
+
+    async def _write_many(self, writes: Dict[str, Optional[str]]) -> None:
+        groups = self._group(writes)
+        await asyncio.gather(*(
+            self.shards[i]._write_many({k: writes[k] for k in ks}) for i, ks in groups.items()
+        ))
+
+    async def _close(self) -> None:
+        for shard in self.shards:
+            await shard._close()
+
+
+def create_session_store(backend: str = 'memory', path: str = 'data/sessions.db',
+                         redis_url: str = 'redis://localhost:6379/0', ttl: Optional[float] = None,
+                         max_entries: int = 100_000, shards: int = 1) -> SessionStore:
+    """
+    Создает хранилище сессий по названию бэкенда
+
+    Args:
+        backend: 'memory', 'sqlite' или 'redis'
+        path: Путь к файлу SQLite (для нескольких шардов добавляется номер)
+        redis_url: Адрес Redis
+        ttl: Время жизни записей без обращений в секундах
+        max_entries: Лимит записей для хранилища в памяти
+        shards: Число шардов SQLite
+
+    Returns:
+        SessionStore: Хранилище сессий
+    """
+    if backend == 'memory':
+        return MemorySessionStore(max_entries=max_entries, ttl=ttl)
+    if backend == 'sqlite':
+        if shards <= 1:
+            return SQLiteSessionStore(path, ttl=ttl)
+        base = Path(path)
+        return ShardedSessionStore([
+            SQLiteSessionStore(str(base.with_name(f"{base.stem}-{i}{base.suffix}")), ttl=ttl)
+            for i in range(shards)
+        ])
+    if backend == 'redis':
+        return RedisSessionStore(redis_url, ttl=ttl)
+    raise ValueError(f"Неизвестный бэкенд хранилища сессий: {backend}")
@@ -0,0 +1,112 @@
+"""
+Модуль корректной остановки бота
+Учет обработчиков обновлений в процессе, ожидание их завершения с дедлайном
+и сторожевой таймер, который завершает процесс, если остановка зависла
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Iterable, Optional, Set
+
+from telegram.ext import SimpleUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class InflightUpdateProcessor(SimpleUpdateProcessor):
+    """
+    Обработчик обновлений PTB, который помнит задачи, обрабатывающие обновления
+
+    Ведет себя как concurrent_updates(N), но позволяет при остановке дождаться
+    (или отменить) именно обработчики, а не все задачи event loop.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self.tasks: Set[asyncio.Task] = set()
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            await coroutine
+        finally:
+            self.tasks.discard(task)
+
+
+async def wait_for_tasks(pending: Callable[[], Iterable[asyncio.Task]], timeout: float,
+                         hurry: Optional[asyncio.Event] = None, backlog: Callable[[], int] = lambda: 0,
+                         poll: float = 0.1) -> Set[asyncio.Task]:
+    """
+    Ждет, пока завершатся задачи, не дольше timeout
+
+    Набор задач перечитывается каждые poll секунд: обработчики обновлений,
+    которые еще лежали в очереди, тоже успевают попасть в ожидание.
+
+    Args:
+        pending: Функция, возвращающая задачи, которые надо дождаться
+        timeout: Сколько ждать (сек)
+        hurry: Событие, прерывающее ожидание (повторный сигнал остановки)
+        backlog: Функция, возвращающая число еще не начатых обновлений
+        poll: Как часто перечитывать набор задач (сек)
+
+    Returns:
+        Set[asyncio.Task]: Задачи, не завершившиеся к дедлайну
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        tasks = {task for task in pending() if not task.done()}
+        remaining = deadline - time.monotonic()
+        if (not tasks and not backlog()) or remaining <= 0 or (hurry is not None and hurry.is_set()):
+            return tasks
+        if tasks:
+            await asyncio.wait(tasks, timeout=min(poll, remaining))
+        else:
+            await asyncio.sleep(min(poll, remaining))
+
+
+async def cancel_tasks(tasks: Iterable[asyncio.Task], timeout: float = 1.0) -> int:
+    """
+    Отменяет задачи и дает им до timeout секунд на блоки finally
+
+    Returns:
+        int: Сколько задач отменено
+    """
+    tasks = {task for task in tasks if not task.done()}
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        await asyncio.wait(tasks, timeout=timeout)
+    return len(tasks)
+
+
+def start_watchdog(timeout: float, on_timeout: Optional[Callable[[], None]] = None) -> threading.Timer:
+    """
+    Завершает процесс, если остановка не уложилась в timeout секунд
+
+    Таймер работает в отдельном потоке, поэтому срабатывает, даже если
+    event loop заблокирован.
+
+    Args:
+        timeout: Предел времени остановки (сек)
+        on_timeout: Что сделать перед выходом (например, дописать логи)
+
+    Returns:
+        threading.Timer: Таймер (cancel — остановка завершилась вовремя)
+    """
+    def expire():
+        logger.critical(f"💥 Остановка не завершилась за {timeout:.0f} с — принудительный выход")
+        if on_timeout is not None:
+            try:
+                on_timeout()
+            except Exception:
+                pass
+        os._exit(1)
+
+    timer = threading.Timer(timeout, expire)
+    timer.daemon = True
+    timer.start()
+    return timer
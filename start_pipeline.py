@@ -0,0 +1,99 @@
+"""
+Модуль конвейера отправки сообщений /start
+Подготовка шагов (загрузка медиа) идет параллельно, доставка — строго по порядку
+с таймаутом на каждый шаг и замером задержек
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineStep:
+    """Шаг конвейера: необязательная подготовка и доставка"""
+
+    __slots__ = ('name', 'deliver', 'prepare', 'timeout')
+
+    def __init__(self, name: str, deliver: Callable[[object], Awaitable[object]],
+                 prepare: Optional[Callable[[], Awaitable[object]]] = None, timeout: float = 10.0):
+        """
+        Args:
+            name: Имя шага для отчета
+            deliver: Корутина доставки, получает результат подготовки
+            prepare: Корутина подготовки (выполняется параллельно с другими шагами)
+            timeout: Сколько шаг может занять с момента, когда до него дошла очередь
+        """
+        self.name = name
+        self.deliver = deliver
+        self.prepare = prepare
+        self.timeout = timeout
+
+
+class StartPipeline:
+    """Конвейер: параллельная подготовка с ограничением, упорядоченная доставка"""
+
+    def __init__(self, fanout: int = 4):
+        """
+        Args:
+            fanout: Максимум одновременно выполняемых подготовок в одном запуске
+        """
+        self.fanout = fanout
+
+    async def run(self, steps: List[PipelineStep]) -> Dict[str, dict]:
+        """
+        Выполняет шаги и возвращает отчет по каждому
+
+        Returns:
+            Dict[str, dict]: {имя: {'status', 'prepare_ms', 'deliver_ms'}}
+        """
+        limit = asyncio.Semaphore(self.fanout)
+        prepare_ms: Dict[str, float] = {}
+
+        async def prepare(step: PipelineStep):
+            if step.prepare is None:
+                return None
+            async with limit:
+                started = time.perf_counter()
+                try:
+                    return await step.prepare()
+                finally:
+                    prepare_ms[step.name] = (time.perf_counter() - started) * 1000
+
+        tasks = [asyncio.create_task(prepare(step)) for step in steps]
+        report = {}
+        for step, task in zip(steps, tasks):
+            started = time.perf_counter()
+            status = 'ok'
+            try:
+                await asyncio.wait_for(self._deliver(step, task), timeout=step.timeout)
+            except asyncio.TimeoutError:
+                status = 'timeout'
+                logger.warning(f"⏱️ Шаг {step.name} не уложился в {step.timeout} с")
+            except Exception as e:
+                status = 'error'
+                logger.error(f"❌ Шаг {step.name} завершился ошибкой: {e}")
+            finally:
+                if not task.done():
+                    task.cancel()
+            report[step.name] = {
+                'status': status,
+                'prepare_ms': round(prepare_ms.get(step.name, 0.0), 1),
+                'deliver_ms': round((time.perf_counter() - started) * 1000, 1),
+            }
+        return report
+
+    @staticmethod
+    async def _deliver(step: PipelineStep, task: asyncio.Task):
+        prepared = await asyncio.shield(task)
+        return await step.deliver(prepared)
+
+
+def format_report(report: Dict[str, dict]) -> str:
+    """Компактная строка отчета для лога"""
+    return ", ".join(
+        f"{name}={item['status']} ({item['prepare_ms']:.0f}+{item['deliver_ms']:.0f} мс)"
+        for name, item in report.items()
+    )
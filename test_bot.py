@@ -5,7 +5,9 @@
 
 import os
 import sys
-from unittest.mock import Mock, patch
+import asyncio
+import logging
+from unittest.mock import Mock, AsyncMock, patch
 from config import Config
 from openai_client import OpenAIClient
 from application_handler import ApplicationHandler
@@ -29,15 +31,14 @@ def test_config():
         for key, value in test_env.items():
             os.environ[key] = value
         
-        # Перезагружаем конфигурацию
-        import importlib
-        import config
-        importlib.reload(config)
+        # Перечитываем конфигурацию (перезагружать модуль не нужно)
+        Config.load()
         
         # Проверяем загрузку
-        assert config.Config.TELEGRAM_BOT_TOKEN == 'test_token_123'
-        assert config.Config.OPENAI_API_KEY == 'test_openai_key_456'
-        assert config.Config.OPENAI_ASSISTANT_ID == 'test_assistant_789'
+        assert Config.TELEGRAM_BOT_TOKEN == 'test_token_123'
+        assert Config.OPENAI_API_KEY == 'test_openai_key_456'
+        assert Config.OPENAI_ASSISTANT_ID == 'test_assistant_789'
+        assert Config.WORKING_CHAT_ID == -1001234567890
         
         print("✅ Конфигурация загружается корректно")
         return True
@@ -94,8 +95,10 @@ def test_openai_client_mock():
     print("\n🧪 Тестирование клиента OpenAI (мок)...")
     
     try:
-        # Полностью мокаем OpenAI клиент
-        with patch('openai.OpenAI') as mock_openai_class:
+        import time
+        
+        # Полностью мокаем асинхронный OpenAI клиент
+        with patch('openai_client.AsyncOpenAI') as mock_openai_class:
             # Создаем мок-клиент
             mock_client = Mock()
             mock_openai_class.return_value = mock_client
@@ -103,21 +106,21 @@ def test_openai_client_mock():
             # Мокаем создание thread
             mock_thread = Mock()
             mock_thread.id = "test_thread_123"
-            mock_client.beta.threads.create.return_value = mock_thread
+            mock_client.beta.threads.create = AsyncMock(return_value=mock_thread)
             
             # Мокаем создание сообщения
             mock_message = Mock()
-            mock_client.beta.threads.messages.create.return_value = mock_message
+            mock_client.beta.threads.messages.create = AsyncMock(return_value=mock_message)
             
             # Мокаем запуск ассистента
             mock_run = Mock()
             mock_run.id = "test_run_456"
-            mock_client.beta.threads.runs.create.return_value = mock_run
+            mock_client.beta.threads.runs.create = AsyncMock(return_value=mock_run)
             
             # Мокаем статус выполнения
             mock_run_status = Mock()
             mock_run_status.status = 'completed'
-            mock_client.beta.threads.runs.retrieve.return_value = mock_run_status
+            mock_client.beta.threads.runs.retrieve = AsyncMock(return_value=mock_run_status)
             
             # Мокаем получение сообщений
             mock_assistant_message = Mock()
@@ -128,22 +131,39 @@ def test_openai_client_mock():
             
             mock_messages = Mock()
             mock_messages.data = [mock_assistant_message]
-            mock_client.beta.threads.messages.list.return_value = mock_messages
+            mock_client.beta.threads.messages.list = AsyncMock(return_value=mock_messages)
             
             # Создаем клиент с мок-конфигурацией
             with patch('config.Config.OPENAI_API_KEY', 'test_key'):
-                with patch('config.Config.OPENAI_ASSISTANT_ID', 'test_assistant'):
+                with patch('config.Config.OPENAI_ASSISTANT_ID', 'test_assistant'), \
+                        patch('openai_client.Config.RUN_WAITER_MODE', 'poll'):
                     client = OpenAIClient()
                     
                     # Тестируем создание thread
-                    thread_id = client.create_thread(12345)
+                    thread_id = asyncio.run(client.create_thread(12345))
                     assert thread_id == "test_thread_123"
                     print("✅ Thread создается корректно")
                     
                     # Тестируем отправку сообщения
-                    response = client.send_message(12345, "Привет!")
+                    response = asyncio.run(client.send_message(12345, "Привет!"))
                     assert "Саня" in response
                     print("✅ Сообщения обрабатываются корректно")
+                    
+                    # Несколько диалогов ждут ассистента одновременно: каждый опрос статуса
+                    # занимает 0.2 с, и последовательно 10 диалогов шли бы не меньше 2 с
+                    async def slow_retrieve(**kwargs):
+                        await asyncio.sleep(0.2)
+                        return mock_run_status
+                    mock_client.beta.threads.runs.retrieve = AsyncMock(side_effect=slow_retrieve)
+                    
+                    async def _concurrent():
+                        return await asyncio.gather(*(client.send_message(uid, "Привет!") for uid in range(10)))
+                    started = time.perf_counter()
+                    responses = asyncio.run(_concurrent())
+                    elapsed = time.perf_counter() - started
+                    assert all("Саня" in r for r in responses)
+                    assert elapsed < 1.0, f"диалоги выполнялись последовательно ({elapsed:.2f} с)"
+                    print(f"✅ Параллельные диалоги не блокируют друг друга (10 × 0.2 с за {elapsed:.2f} с)")
             
             return True
             
@@ -151,6 +171,1647 @@ def test_openai_client_mock():
         print(f"❌ Ошибка в клиенте OpenAI: {e}")
         return False
 
+def test_run_waiter():
+    """Тестирует стратегии ожидания run ассистента"""
+    print("\n🧪 Тестирование ожидания run...")
+    
+    try:
+        from run_waiter import PollingRunWaiter, StreamingRunWaiter, TIMEOUT_STATUS, create_run_waiter
+        
+        def make_run(status):
+            run = Mock()
+            run.id = "run_1"
+            run.status = status
+            run.last_error = None
+            return run
+        
+        # Тест 1: Опрос доходит до завершения и не ждет лишнюю секунду
+        client = Mock()
+        client.beta.threads.runs.create = AsyncMock(return_value=make_run('queued'))
+        client.beta.threads.runs.retrieve = AsyncMock(side_effect=[
+            make_run('in_progress'), make_run('in_progress'), make_run('completed')
+        ])
+        waiter = PollingRunWaiter(deadline=5, initial_delay=0.01, max_delay=0.05)
+        outcome = asyncio.run(waiter.run(client, "thread_1", "asst_1"))
+        assert outcome.ok and outcome.total < 1
+        print(f"✅ Опрос завершился за {outcome.total:.3f} с")
+        
+        # Тест 2: Зависший run отменяется по дедлайну
+        client.beta.threads.runs.create = AsyncMock(return_value=make_run('queued'))
+        client.beta.threads.runs.retrieve = AsyncMock(return_value=make_run('in_progress'))
+        client.beta.threads.runs.cancel = AsyncMock()
+        waiter = PollingRunWaiter(deadline=0.1, initial_delay=0.01, max_delay=0.02)
+        outcome = asyncio.run(waiter.run(client, "thread_1", "asst_1"))
+        assert outcome.status == TIMEOUT_STATUS
+        assert client.beta.threads.runs.cancel.await_count == 1
+        print("✅ Run отменен по дедлайну")
+        
+        # Тест 3: requires_action считается терминальным и отменяется
+        client.beta.threads.runs.create = AsyncMock(return_value=make_run('requires_action'))
+        client.beta.threads.runs.cancel = AsyncMock()
+        outcome = asyncio.run(waiter.run(client, "thread_1", "asst_1"))
+        assert outcome.status == 'requires_action' and not outcome.ok
+        assert client.beta.threads.runs.cancel.await_count == 1
+        print("✅ requires_action не зацикливает опрос")
+        
+        # Тест 4: Streaming собирает текст из дельт и измеряет время до первого токена
+        def event(name, data):
+            ev = Mock()
+            ev.event = name
+            ev.data = data
+            return ev
+        
+        def delta(text):
+            block = Mock()
+            block.text.value = text
+            data = Mock()
+            data.delta.content = [block]
+            return data
+        
+        class FakeStream:
+            def __init__(self, events):
+                self.events = events
+            async def __aenter__(self):
+                return self
+            async def __aexit__(self, *args):
+                return False
+            async def __aiter__(self):
+                for ev in self.events:
+                    yield ev
+        
+        events = [
+            event('thread.run.created', make_run('queued')),
+            event('thread.message.delta', delta("Привет, ")),
+            event('thread.message.delta', delta("я Сани!")),
+            event('thread.run.completed', make_run('completed')),
+        ]
+        client.beta.threads.runs.stream = Mock(return_value=FakeStream(events))
+        outcome = asyncio.run(StreamingRunWaiter(deadline=5).run(client, "thread_1", "asst_1"))
+        assert outcome.ok and outcome.text == "Привет, я Сани!"
+        assert outcome.ttft is not None
+        print(f"✅ Streaming собрал ответ: {outcome.text}")
+        
+        events = [
+            event('thread.message.delta', delta("Первое.")),
+            event('thread.message.completed', Mock()),
+            event('thread.message.delta', delta("Второе.")),
+            event('thread.run.completed', make_run('completed')),
+        ]
+        client.beta.threads.runs.stream = Mock(return_value=FakeStream(events))
+        outcome = asyncio.run(StreamingRunWaiter(deadline=5).run(client, "thread_1", "asst_1"))
+        assert outcome.text == "Первое.\n\nВторое."
+        print("✅ Несколько сообщений одного run разделяются пустой строкой")
+        
+        # Тест 5: Ошибка посреди потока не запускает второй run опросом и не выключает streaming
+        class BrokenStream(FakeStream):
+            async def __aiter__(self):
+                yield event('thread.run.created', make_run('queued'))
+                raise AttributeError("неожиданное событие")
+        
+        client.beta.threads.runs.stream = Mock(return_value=BrokenStream([]))
+        client.beta.threads.runs.create = AsyncMock()
+        client.beta.threads.runs.cancel = AsyncMock()
+        auto = create_run_waiter('auto', deadline=5)
+        outcome = asyncio.run(auto.run(client, "thread_1", "asst_1"))
+        assert outcome.status == 'failed' and not outcome.ok and auto.mode == 'stream'
+        assert client.beta.threads.runs.create.await_count == 0
+        assert client.beta.threads.runs.cancel.await_count == 1
+        print("✅ Сбой потока завершает run ошибкой без повторного run опросом")
+        
+        runs = Mock(spec=['create', 'retrieve', 'cancel'])
+        runs.create = AsyncMock(return_value=make_run('completed'))
+        legacy = Mock()
+        legacy.beta.threads.runs = runs
+        outcome = asyncio.run(auto.run(legacy, "thread_1", "asst_1"))
+        assert outcome.ok and outcome.mode == 'poll' and auto.mode == 'poll'
+        print("✅ Клиент без streaming сразу работает опросом")
+        
+        # Тест 6: Ошибка Telegram при показе потокового ответа не прерывает run
+        from reply_streamer import ReplyStreamer
+        from telegram.error import NetworkError
+        
+        reply = AsyncMock(side_effect=NetworkError("Flood control exceeded"))
+        streamer = ReplyStreamer(reply, interval=0.01)
+        events = [
+            event('thread.run.created', make_run('queued')),
+            event('thread.message.delta', delta("Привет, ")),
+            event('thread.message.delta', delta("я Сани!")),
+            event('thread.run.completed', make_run('completed')),
+        ]
+        client.beta.threads.runs.stream = Mock(return_value=FakeStream(events))
+        client.beta.threads.runs.cancel = AsyncMock()
+        
+        async def _failed_display():
+            outcome = await StreamingRunWaiter(deadline=5).run(client, "thread_1", "asst_1", streamer.on_delta)
+            return outcome, await streamer.finish(outcome.text)
+        
+        outcome, messages = asyncio.run(_failed_display())
+        assert outcome.ok and outcome.text == "Привет, я Сани!"
+        assert client.beta.threads.runs.cancel.await_count == 0
+        # Показ остановлен после первой ошибки, итог бот отправит обычным сообщением
+        assert streamer.failed and not streamer.started and messages == [] and reply.await_count == 1
+        print("✅ Ошибка Telegram останавливает показ, а run завершается с ответом")
+        
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка в ожидании run: {e}")
+        return False
+
+def test_run_reply_fetch():
+    """Тестирует чтение ответа run по курсору"""
+    print("\n🧪 Тестирование чтения ответа run...")
+    
+    try:
+        from run_waiter import message_text
+        
+        def part(text=None):
+            block = Mock(spec=['text', 'type'] if text is not None else ['image_file', 'type'])
+            if text is not None:
+                block.text.value = text
+            return block
+        
+        def msg(msg_id, role, *parts):
+            return Mock(id=msg_id, role=role, content=list(parts))
+        
+        assert message_text(msg("m", "assistant", part("Первая часть"), part(), part("вторая"))) == "Первая часть\nвторая"
+        
+        with patch('openai_client.AsyncOpenAI') as mock_openai_class:
+            client = Mock()
+            mock_openai_class.return_value = client
+            pages = [
+                Mock(data=[msg("msg_2", "assistant", part("Привет!"))], has_more=True),
+                Mock(data=[msg("msg_3", "assistant", part("Чем помочь?"))], has_more=False),
+                Mock(data=[msg("msg_5", "assistant", part("Записал."))], has_more=False),
+            ]
+            client.beta.threads.messages.list = AsyncMock(side_effect=pages)
+            openai_client = OpenAIClient()
+            
+            async def scenario():
+                first = await openai_client._fetch_run_reply("thread_1", "run_1", page_size=1)
+                second = await openai_client._fetch_run_reply("thread_1", "run_2")
+                return first, second
+            
+            first, second = asyncio.run(scenario())
+            assert first == "Привет!\n\nЧем помочь?" and second == "Записал."
+            calls = [call.kwargs for call in client.beta.threads.messages.list.await_args_list]
+            assert calls[0] == {'thread_id': "thread_1", 'run_id': "run_1", 'order': 'asc', 'limit': 1}
+            assert calls[1]['after'] == "msg_2" and calls[2]['after'] == "msg_3"
+            assert calls[2]['run_id'] == "run_2"
+            print("✅ Сообщения читаются только для текущего run, начиная с курсора")
+        
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка в чтении ответа run: {e}")
+        return False
+
+def test_session_store():
+    """Тестирует хранилища сессий"""
+    print("\n🧪 Тестирование хранилища сессий...")
+    
+    try:
+        import tempfile
+        from session_store import MemorySessionStore, SQLiteSessionStore, RedisSessionStore, create_session_store
+        from fake_redis import FakeRedisServer
+        
+        # Тест 1: LRU и TTL в памяти
+        async def _memory():
+            store = MemorySessionStore(max_entries=2, ttl=0.05)
+            states = store.namespace('user_state')
+            await states.set(1, "start")
+            await states.set(2, "chatting")
+            await states.set(3, "chatting")
+            assert await states.get(1) is None  # вытеснен LRU
+            assert await states.get(3) == "chatting"
+            await asyncio.sleep(0.06)
+            assert await states.get(3) is None  # истек TTL
+        asyncio.run(_memory())
+        print("✅ LRU и TTL в памяти работают")
+        
+        # Тест 2: SQLite переживает перезапуск и объединяет чтения
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "sessions.db")
+            
+            async def _write():
+                store = SQLiteSessionStore(path)
+                threads = store.namespace('thread')
+                for uid in range(5):
+                    await threads.set(uid, f"thread_{uid}")
+                await store.close()
+            
+            async def _read():
+                store = SQLiteSessionStore(path)
+                calls = []
+                original = store._read_many
+                async def counting(keys):
+                    calls.append(len(keys))
+                    return await original(keys)
+                store._read_many = counting
+                threads = store.namespace('thread')
+                values = await asyncio.gather(*(threads.get(uid) for uid in range(5)))
+                await store.close()
+                return values, calls
+            
+            asyncio.run(_write())
+            values, calls = asyncio.run(_read())
+            assert values == [f"thread_{uid}" for uid in range(5)]
+            assert calls == [5]
+            print("✅ SQLite сохраняет сессии между запусками, 5 чтений объединены в 1 запрос")
+            
+            # Тест 3: Шардирование
+            async def _sharded():
+                store = create_session_store('sqlite', path=os.path.join(tmp, "s.db"), shards=3)
+                ns = store.namespace('user_state')
+                for uid in range(30):
+                    await ns.set(uid, uid)
+                await store.flush()
+                assert await ns.get_many(range(30)) == {uid: uid for uid in range(30)}
+                await store.namespace('thread').set(1, "thread_1")
+                assert await ns.items() == {str(uid): uid for uid in range(30)}
+                await store.close()
+            asyncio.run(_sharded())
+            print("✅ Шардированное хранилище работает")
+        
+        # Тест 4: Redis-бэкенд на фейковом сервере
+        async def _redis():
+            server = await FakeRedisServer().start()
+            store = RedisSessionStore(server.url, ttl=60)
+            ns = store.namespace('thread')
+            await ns.set(42, "thread_42")
+            await ns.set(43, "thread_43")
+            await ns.delete(43)
+            await store.flush()
+            assert await ns.get(42) == "thread_42"
+            assert await ns.get(43) is None
+            assert await ns.items() == {'42': "thread_42"}
+            await store.close()
+            await server.stop()
+        asyncio.run(_redis())
+        print("✅ Redis-бэкенд работает с фейковым сервером")
+
+        # Тест 5: TTL скользящий — активная сессия не истекает, заброшенная истекает
+        async def _sliding(store):
+            states = store.namespace('user_state')
+            await states.set(1, "chatting")
+            await states.set(2, "chatting")
+            await store.flush()
+            for _ in range(6):
+                await asyncio.sleep(0.1)
+                assert await states.get(1) == "chatting"
+            assert await states.get(2) is None
+            await asyncio.sleep(0.35)
+            assert await states.get(1) is None
+
+        async def _sliding_all(tmp):
+            server = await FakeRedisServer().start()
+            # TTL меньше секунды: Redis получает PX, а не недопустимый EX 0
+            stores = [MemorySessionStore(ttl=0.3), SQLiteSessionStore(os.path.join(tmp, "ttl.db"), ttl=0.3),
+                      RedisSessionStore(server.url, ttl=0.3)]
+            for store in stores:
+                await _sliding(store)
+                await store.close()
+            await server.stop()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            asyncio.run(_sliding_all(tmp))
+        print("✅ Чтение продлевает сессию во всех бэкендах, заброшенные записи истекают")
+
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка в хранилище сессий: {e}")
+        return False
+
+def test_webhook_routing():
+    """Тестирует маршрутизацию webhook-обновлений по воркерам"""
+    print("\n🧪 Тестирование webhook-маршрутизации...")
+    
+    try:
+        import queue
+        import httpx
+        from webhook_server import ConsistentHashRing, UpdateRouter, WebhookApp, extract_routing_key
+        from load_generator import make_update
+        
+        # Тест 1: Ключ маршрутизации — отправитель
+        assert extract_routing_key(make_update(1, 555)) == 555
+        assert extract_routing_key({'update_id': 7, 'callback_query': {'from': {'id': 9}}}) == 9
+        print("✅ user_id извлекается из сообщений и нажатий кнопок")
+        
+        # Тест 2: Добавление воркера перемещает лишь часть пользователей
+        ring = ConsistentHashRing([0, 1, 2, 3])
+        before = {uid: ring.get_node(uid) for uid in range(10000)}
+        ring.add_node(4)
+        moved = sum(1 for uid, node in before.items() if ring.get_node(uid) != node)
+        assert moved < 10000 * 0.35
+        print(f"✅ При добавлении воркера переехало {moved / 100:.1f}% пользователей")
+        
+        # Тест 3: ASGI-приложение проверяет секрет и сохраняет порядок для пользователя
+        queues = [queue.Queue() for _ in range(3)]
+        app = WebhookApp(UpdateRouter(queues), secret_token="s3cret")
+        
+        async def _post():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                denied = await client.post("/webhook", json=make_update(1, 1))
+                assert denied.status_code == 403
+                headers = {'X-Telegram-Bot-Api-Secret-Token': 's3cret'}
+                for update_id in range(1, 31):
+                    response = await client.post("/webhook", json=make_update(update_id, 777), headers=headers)
+                    assert response.status_code == 200
+                stats = await client.get("/stats")
+                return stats.json()
+        
+        stats = asyncio.run(_post())
+        owner = [q for q in queues if not q.empty()]
+        assert len(owner) == 1
+        ids = [owner[0].get_nowait()['update_id'] for _ in range(30)]
+        assert ids == list(range(1, 31)) and sum(stats['routed']) == 30
+        print("✅ Все обновления пользователя ушли одному воркеру по порядку")
+
+        # Тест 4: Упавший воркер перезапускается, а без перезапуска Telegram получает 503
+        class FakeProcess:
+            def __init__(self, alive=True):
+                self.alive = alive
+                self.exitcode = None if alive else -9
+
+            def is_alive(self):
+                return self.alive
+
+        queues = [queue.Queue() for _ in range(2)]
+        processes = [FakeProcess(), FakeProcess()]
+        spawned = []
+
+        def restart(index):
+            spawned.append(index)
+            return FakeProcess()
+
+        router = UpdateRouter(queues, processes=processes, restart=restart, restart_interval=60.0)
+        app = WebhookApp(router)
+        worker = router.ring.get_node(777)
+
+        async def _crash():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                results = []
+                processes[worker] = FakeProcess(alive=False)
+                results.append((await client.post("/webhook", json=make_update(1, 777))).status_code)
+                # Повторное падение в пределах restart_interval — воркер недоступен
+                processes[worker] = FakeProcess(alive=False)
+                results.append((await client.post("/webhook", json=make_update(2, 777))).status_code)
+                health = await client.get("/healthz")
+                results.append((health.status_code, health.json()['workers']))
+                return results
+
+        restarted, rejected, health = asyncio.run(_crash())
+        assert restarted == 200 and spawned == [worker] and router.restarts[worker] == 1
+        assert queues[worker].get_nowait()['update_id'] == 1
+        assert rejected == 503 and queues[worker].empty()
+        assert health[0] == 503 and health[1][worker] is False and health[1][1 - worker] is True
+        print("✅ Упавший воркер перезапускается, в цикле падений — 503 и /healthz сообщает о сбое")
+
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка в webhook-маршрутизации: {e}")
+        return False
+
+def test_conversation_queue():
+    """Тестирует очередь сообщений пользователей перед ассистентом"""
+    print("\n🧪 Тестирование очереди сообщений...")
+    
+    try:
+        from conversation_queue import ConversationQueue, ConversationQueueFull
+        
+        async def _scenario():
+            active = {}
+            calls = []
+            
+            async def fake_assistant(user_id, text):
+                # Ассистент не принимает сообщения во время активного run
+                assert not active.get(user_id), "run уже активен"
+                active[user_id] = True
+                calls.append((user_id, text))
+                await asyncio.sleep(0.05)
+                active[user_id] = False
+                return f"ответ на: {text}"
+            
+            queue = ConversationQueue(fake_assistant, max_depth=2)
+            
+            # Три быстрых сообщения: первое идет сразу, два других склеиваются
+            first = asyncio.create_task(queue.submit(1, "привет"))
+            await asyncio.sleep(0.01)
+            second = asyncio.create_task(queue.submit(1, "меня зовут Иван"))
+            third = asyncio.create_task(queue.submit(1, "нужен бот"))
+            await asyncio.sleep(0.01)
+            
+            # Четвертое не влезает в очередь глубины 2
+            try:
+                await queue.submit(1, "лишнее")
+                overflow = False
+            except ConversationQueueFull:
+                overflow = True
+            
+            # Другой пользователь не ждет первого
+            other = await queue.submit(2, "здравствуйте")
+            results = await asyncio.gather(first, second, third)
+            return calls, results, overflow, other, queue
+        
+        calls, results, overflow, other, queue = asyncio.run(_scenario())
+        assert results[0] == "ответ на: привет"
+        assert results[1] is None
+        assert results[2] == "ответ на: меня зовут Иван\nнужен бот"
+        assert len([c for c in calls if c[0] == 1]) == 2
+        print("✅ Три сообщения обработаны за два run без пересечений")
+        
+        assert overflow and queue.rejected == 1
+        print("✅ Переполнение очереди отклоняет сообщение")
+        
+        assert other == "ответ на: здравствуйте" and queue.depth() == 0
+        print("✅ Пользователи не блокируют друг друга")
+        
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка в очереди сообщений: {e}")
+        return False
+
+def test_media_cache():
+    """Тестирует кэш медиафайлов"""
+    print("\n🧪 Тестирование кэша медиафайлов...")
+    
+    try:
+        import httpx
+        from io import BytesIO
+        from media_cache import MediaCache, gdrive_to_direct
+        from session_store import MemorySessionStore
+        
+        assert gdrive_to_direct("https://drive.google.com/file/d/abc123/view?usp=sharing") == \
+            "https://drive.google.com/uc?export=download&id=abc123"
+        
+        source = {'etag': '"v1"', 'body': b"%PDF-1"}
+        downloads = []
+        
+        def handler(request):
+            if request.headers.get('if-none-match') == source['etag']:
+                return httpx.Response(304)
+            downloads.append(request.url)
+            return httpx.Response(200, content=source['body'], headers={'ETag': source['etag']})
+        
+        async def _scenario():
+            cache = MediaCache(MemorySessionStore())
+            cache._http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            cache.register('checklist', "https://example.com/checklist.pdf", "checklist.pdf")
+            await cache.preload()
+            
+            first = await cache.get_input('checklist')
+            assert isinstance(first, BytesIO) and first.name == "checklist.pdf"
+            
+            sent = Mock()
+            sent.photo = None
+            sent.document.file_id = "FILE_ID_1"
+            await cache.remember('checklist', sent)
+            assert await cache.get_input('checklist') == "FILE_ID_1"
+            
+            # Источник не менялся — условный запрос, без загрузки
+            assert not await cache.revalidate('checklist')
+            assert len(downloads) == 1
+            
+            # Источник изменился — file_id сбрасывается
+            source.update(etag='"v2"', body=b"%PDF-2")
+            assert await cache.revalidate('checklist')
+            again = await cache.get_input('checklist')
+            await cache.close()
+            return again
+        
+        again = asyncio.run(_scenario())
+        assert isinstance(again, BytesIO) and again.getvalue() == b"%PDF-2"
+        print("✅ Файл скачивается один раз, затем отправляется по file_id")
+        print("✅ Изменение ETag сбрасывает file_id")
+        
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка в кэше медиафайлов: {e}")
+        return False
+
+def test_start_pipeline():
+    """Тестирует конвейер отправки /start"""
+    print("\n🧪 Тестирование конвейера /start...")
+    
+    try:
+        import time
+        from start_pipeline import PipelineStep, StartPipeline
+        
+        async def _scenario():
+            delivered = []
+            
+            async def slow_prepare():
+                await asyncio.sleep(0.1)
+                return "media"
+            
+            async def failing_deliver(_):
+                raise RuntimeError("Telegram недоступен")
+            
+            async def record(name, _):
+                delivered.append((name, time.perf_counter()))
+            
+            async def hanging_prepare():
+                await asyncio.sleep(10)
+            
+            steps = [
+                PipelineStep('banner', lambda m: record('banner', m), prepare=slow_prepare, timeout=1),
+                PipelineStep('broken', failing_deliver, timeout=1),
+                PipelineStep('welcome', lambda m: record('welcome', m), timeout=1),
+                PipelineStep('checklist', lambda m: record('checklist', m), prepare=hanging_prepare, timeout=0.2),
+            ]
+            started = time.perf_counter()
+            report = await StartPipeline(fanout=4).run(steps)
+            return report, delivered, started
+        
+        report, delivered, started = asyncio.run(_scenario())
+        assert [name for name, _ in delivered] == ['banner', 'welcome']
+        assert delivered[1][1] - started < 0.2
+        assert report['broken']['status'] == 'error'
+        assert report['checklist']['status'] == 'timeout'
+        print("✅ Сообщения доставляются по порядку, ошибка шага не блокирует следующие")
+        print("✅ Зависший чек-лист отсекается по таймауту после приветствия")
+        
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка в конвейере /start: {e}")
+        return False
+
+def test_send_scheduler():
+    """Тестирует планировщик исходящих запросов"""
+    print("\n🧪 Тестирование планировщика отправки...")
+    
+    try:
+        import time
+        from telegram.error import RetryAfter
+        from send_scheduler import SendScheduler
+        
+        async def _scenario():
+            scheduler = SendScheduler(priority_chat_id=-100500, global_rate=20, private_chat_rate=100, chat_burst=100)
+            # Опустошаем общее ведро, чтобы образовалась очередь
+            scheduler.global_bucket.tokens = 0
+            order = []
+            
+            async def send(chat_id):
+                async def callback():
+                    order.append(chat_id)
+                    return True
+                return await scheduler.process_request(callback, (), {}, 'sendMessage', {'chat_id': chat_id}, None)
+            
+            users = [asyncio.create_task(send(uid)) for uid in range(1, 6)]
+            await asyncio.sleep(0)
+            lead = asyncio.create_task(send(-100500))
+            await asyncio.gather(*users, lead)
+            
+            # 429 повторяется автоматически
+            attempts = []
+            async def flaky():
+                attempts.append(time.monotonic())
+                if len(attempts) == 1:
+                    raise RetryAfter(0)
+                return True
+            ok = await scheduler.process_request(flaky, (), {}, 'sendMessage', {'chat_id': 7}, None)
+            return order, ok, attempts, scheduler.stats()
+        
+        order, ok, attempts, stats = asyncio.run(_scenario())
+        assert order.index(-100500) <= 1
+        print(f"✅ Заявка в рабочий чат обошла очередь: позиция {order.index(-100500) + 1} из {len(order)}")
+        assert ok and len(attempts) == 2 and stats['retries'] == 1
+        print("✅ RetryAfter обрабатывается повтором")
+        assert stats['lanes']['lead']['count'] == 1
+        print(f"✅ Метрики ожидания: {stats['lanes']}")
+        
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка в планировщике отправки: {e}")
+        return False
+
+def test_lead_extractor():
+    """Тестирует однопроходный разбор заявок"""
+    print("\n🧪 Тестирование разбора заявок...")
+    
+    try:
+        from application_handler import extract_lead, normalize_phone, normalize_email
+        
+        text = (
+            "[Заявка в рабочий чат]\n"
+            "Имя: Анна\n"
+            "Телефон: 8 (916) 000-11-22\n"
+            "Телеграм: @anna\n"
+            "Запрос: Чат-бот для салона"
+        )
+        lead = extract_lead(text)
+        assert lead.is_complete and lead.is_application
+        assert lead.phone_normalized == "+79160001122"
+        print(f"✅ Заявка с Телеграм распознана, телефон: {lead.phone_normalized}")
+        
+        with_email = text.replace("Телеграм: @anna", "Email: Anna@Example.com.")
+        assert extract_lead(with_email).is_complete
+        assert normalize_email("Почта: Anna@Example.com.") == "anna@example.com"
+        assert normalize_phone("123") is None
+        print("✅ Заявка с Email распознана, контакты нормализованы")
+        
+        incomplete = extract_lead("[Заявка в рабочий чат]\nИмя: Анна\nЗапрос: бот")
+        assert not incomplete.is_complete
+        hint = extract_lead("Хочу обсудить проект, нужна консультация")
+        assert hint.is_application and not hint.has_header
+        print(f"✅ Неполная заявка отклонена, ключевые слова найдены (уверенность {hint.confidence})")
+        
+        before = extract_lead.cache_info().hits
+        assert extract_lead(text) is lead
+        assert extract_lead.cache_info().hits == before + 1
+        try:
+            lead.name = "Петр"
+            assert False, "запись из кэша не должна изменяться"
+        except AttributeError:
+            pass
+        assert extract_lead(text).name == "Анна"
+        assert not hasattr(lead, '__dict__')
+        print("✅ Повторная проверка того же текста берется из кэша, запись неизменяема и без __dict__")
+        
+        # Подпись без значения не считается полем заявки, как и в прежней проверке по шаблонам
+        empty_phone = extract_lead("[Заявка в рабочий чат]\nИмя: Анна\nТелефон:\nEmail: \nЗапрос: бот")
+        assert {'phone', 'email'} <= empty_phone.labels and not empty_phone.is_application
+        filled = extract_lead("[Заявка в рабочий чат]\nИмя: Анна\nТелефон: +79160001122\nЗапрос: бот")
+        assert filled.is_application and not extract_lead("").is_application
+        print("✅ Для признака заявки считаются только заполненные поля")
+        
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка в разборе заявок: {e}")
+        return False
+
+def test_metrics():
+    """Тестирует метрики и эндпоинт /metrics"""
+    print("\n🧪 Тестирование метрик...")
+    
+    try:
+        import time
+        import httpx
+        from metrics import MetricsRegistry, MetricsServer, instrumented
+        
+        registry = MetricsRegistry()
+        latency = registry.histogram('test_handler_seconds', 'Тест', ('handler',), buckets=(0.01, 0.1))
+        errors = registry.counter('test_handler_errors', 'Тест', ('handler',))
+        depth = registry.gauge('test_depth', 'Тест')
+        depth.set_function(lambda: 7)
+        
+        @instrumented('demo', latency, errors)
+        async def handler(fail=False):
+            if fail:
+                raise RuntimeError("boom")
+            return "ok"
+        
+        async def _scenario():
+            assert await handler() == "ok"
+            try:
+                await handler(fail=True)
+            except RuntimeError:
+                pass
+            started = time.perf_counter()
+            for _ in range(10000):
+                await handler()
+            overhead = (time.perf_counter() - started) / 10000
+            server = await MetricsServer(registry, port=0).start()
+            try:
+                async with httpx.AsyncClient() as client:
+                    response = await client.get(f"http://127.0.0.1:{server.port}/metrics")
+                    missing = await client.get(f"http://127.0.0.1:{server.port}/other")
+            finally:
+                await server.stop()
+            return overhead, response, missing.status_code
+        
+        overhead, response, missing = asyncio.run(_scenario())
+        text = response.text
+        assert response.status_code == 200 and missing == 404
+        assert 'test_handler_seconds_count{handler="demo"} 10002' in text
+        assert 'test_handler_seconds_bucket{handler="demo",le="+Inf"} 10002' in text
+        assert 'test_handler_errors_total{handler="demo"} 1' in text
+        assert 'test_depth 7' in text
+        print("✅ Гистограмма, счетчик ошибок и gauge отдаются в формате Prometheus")
+        print(f"✅ Вызов через декоратор: {overhead * 1e6:.1f} мкс")
+        
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка в метриках: {e}")
+        return False
+
+def test_log_pipeline():
+    """Тестирует конвейер логирования"""
+    print("\n🧪 Тестирование конвейера логирования...")
+    
+    root = logging.getLogger()
+    saved_handlers, saved_level = list(root.handlers), root.level
+    try:
+        import json
+        import tempfile
+        from log_pipeline import redact_pii, setup_logging, parse_sample_rates
+        
+        masked = redact_pii("Телефон: 8 (916) 000-11-22, почта ivan.petrov@example.com, заказ 12345")
+        assert "000-11" not in masked and "+***22" in masked
+        assert "i***@example.com" in masked and "заказ 12345" in masked
+        print(f"✅ Персональные данные маскируются: {masked}")
+        
+        ids = "пользователю 5123456789 в чат -1001234567890, run 1712345678, пользователь 79160001122"
+        assert redact_pii(ids) == ids
+        assert redact_pii("звоните 8-916-000-11-22 или +7 900 123-45-67") == "звоните +***22 или +***67"
+        print("✅ ID пользователей, чатов и unix-время не принимаются за телефоны")
+        
+        assert parse_sample_rates("bot=0.1, openai_client=2, bad") == {'bot': 0.1, 'openai_client': 1.0}
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            pipeline = setup_logging(log_dir=tmp, console=False, max_bytes=2000, backup_count=5,
+                                     sample_rates={'noisy': 0.0})
+            log = logging.getLogger('test_pipeline')
+            log.info("Заявка: +7 999 123-45-67", extra={'user_id': 42})
+            for i in range(200):
+                logging.getLogger('noisy.child').info(f"шум {i}")
+            logging.getLogger('noisy').warning("важное предупреждение")
+            for i in range(50):
+                log.info(f"строка {i} " + "x" * 40)
+            pipeline.stop()
+            
+            files = sorted(os.listdir(tmp))
+            lines = []
+            for name in files:
+                with open(os.path.join(tmp, name), encoding='utf-8') as f:
+                    lines.extend(json.loads(line) for line in f if line.strip())
+            first = next(item for item in lines if item['msg'].startswith("Заявка"))
+            assert "+***67" in first['msg'] and first['user_id'] == 42 and first['level'] == 'INFO'
+            assert not any(item['msg'].startswith("шум") for item in lines)
+            assert any(item['msg'] == "важное предупреждение" for item in lines)
+            assert pipeline.stats()['sampled_out'] == 200
+            assert len(files) > 1
+            print(f"✅ JSON-записи, выборка и ротация работают (файлов: {len(files)})")
+        
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка в конвейере логирования: {e}")
+        return False
+    finally:
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        for handler in saved_handlers:
+            root.addHandler(handler)
+        root.setLevel(saved_level)
+
+def test_lead_outbox():
+    """Тестирует outbox заявок"""
+    print("\n🧪 Тестирование outbox заявок...")
+    
+    try:
+        import tempfile
+        from lead_outbox import MESSAGE_LIMIT, LeadOutbox
+        
+        async def scenario(path):
+            sent = []
+            fail = {'left': 1}
+            
+            async def send(text):
+                if fail['left']:
+                    fail['left'] -= 1
+                    raise RuntimeError("Telegram недоступен")
+                sent.append(text)
+            
+            outbox = LeadOutbox(path, send=send, max_attempts=2, base_delay=0, max_delay=0)
+            assert await outbox.enqueue(1, "Заявка\nИмя: Иван")
+            assert not await outbox.enqueue(1, "  Заявка  \n\nИмя: Иван ")  # дубль
+            assert await outbox.enqueue(2, "Заявка\nИмя: Петр")
+            
+            assert await outbox.deliver_due() == 0  # первая попытка падает
+            assert await outbox.deliver_due() == 2
+            assert len(sent) == 1 and "Иван" in sent[0] and "Петр" in sent[0]
+            print("✅ Дубли пропускаются, заявки объединяются и доставляются после ошибки")
+            
+            fail['left'] = 2
+            await outbox.enqueue(3, "Заявка\nИмя: Анна")
+            await outbox.deliver_due()
+            await outbox.deliver_due()
+            assert outbox.stats() == {'pending': 0, 'delivered': 2, 'dead': 1}
+            assert outbox.replay(outbox.list_dead()[0]['lead_hash']) == 1
+            assert await outbox.deliver_due() == 1 and "Анна" in sent[-1]
+            print("✅ Dead letter и повтор из него работают")
+            
+            # Заявка длиннее лимита Telegram доставляется частями, а не уходит в dead letter
+            long_lead = "Заявка\nИмя: Олег\nЗапрос: " + "\n".join(f"пункт {i}: чат-бот для продаж" for i in range(300))
+            assert len(long_lead) > MESSAGE_LIMIT
+            before = len(sent)
+            await outbox.enqueue(4, long_lead)
+            await outbox.enqueue(5, "Заявка\nИмя: Мария")
+            assert await outbox.deliver_due() == 2
+            parts = sent[before:]
+            assert all(len(part) <= MESSAGE_LIMIT for part in parts) and outbox.stats()['dead'] == 0
+            long_parts = [part for part in parts if "Олег" in part or "пункт" in part]
+            assert len(long_parts) >= 2 and long_parts[-1].endswith(f"({len(long_parts)}/{len(long_parts)})")
+            assert "пункт 299" in long_parts[-1] and any("Мария" in part for part in parts)
+            print(f"✅ Заявка длиной {len(long_lead)} символов доставлена {len(long_parts)} сообщениями")
+            await outbox.close()
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            asyncio.run(scenario(os.path.join(tmp, 'outbox.db')))
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка в outbox заявок: {e}")
+        return False
+
+def test_thread_manager():
+    """Тестирует жизненный цикл thread"""
+    print("\n🧪 Тестирование жизненного цикла thread...")
+    
+    try:
+        import tempfile
+        import time
+        from session_store import MemorySessionStore, SQLiteSessionStore
+        from thread_manager import ThreadManager, ThreadPool
+        
+        async def scenario():
+            counter = iter(range(1000))
+            client = Mock()
+            client.beta.threads.create = AsyncMock(side_effect=lambda: Mock(id=f"thread_{next(counter)}"))
+            client.beta.threads.delete = AsyncMock()
+            threads = MemorySessionStore().namespace('thread')
+            manager = ThreadManager(client, threads, idle_ttl=60, max_threads=3, delete_batch=2)
+            
+            for uid in range(3):
+                await manager.get_or_create(uid)
+            assert await manager.get_or_create(0) == "thread_0"
+            
+            # Пользователь 1 занят run — при превышении лимита вытесняется следующий по LRU
+            async with manager.use(1):
+                await manager.get_or_create(3)
+                assert await threads.get(1) == "thread_1" and await threads.get(2) is None
+            assert manager.stats()['evicted_lru'] == 1 and len(manager) == 3
+            print("✅ Лимит живых thread соблюдается, занятые thread не вытесняются")
+            
+            assert await manager.release(0) and not await manager.release(0)
+            manager._live[3] = (manager._live[3][0], time.monotonic() - 120)
+            manager._live.move_to_end(3, last=False)
+            assert await manager.evict_idle() == 1
+            assert await manager.delete_pending() == 3
+            deleted = {call.args[0] for call in client.beta.threads.delete.await_args_list}
+            assert deleted == {"thread_0", "thread_2", "thread_3"}
+            stats = manager.stats()
+            assert stats['live'] == 1 and stats['reused'] == 2 and stats['reset'] == 1
+            assert stats['evicted_idle'] == 1 and stats['delete_pending'] == 0
+            print(f"✅ Сброшенные и простаивающие thread удаляются на сервере: {stats}")
+            
+            # Привязка активного пользователя берется из _live, но в хранилище не истекает
+            store = MemorySessionStore(ttl=0.1)
+            active = ThreadManager(client, store.namespace('thread'), idle_ttl=60)
+            thread_id = await active.get_or_create(7)
+            for _ in range(4):
+                await asyncio.sleep(0.05)
+                async with active.use(7):
+                    pass
+            assert await store.namespace('thread').get(7) == thread_id
+            print("✅ Использование thread продлевает его привязку в хранилище")
+        
+        async def pool_scenario():
+            counter = iter(range(1000))
+            client = Mock()
+            client.beta.threads.create = AsyncMock(side_effect=lambda **kw: Mock(id=f"pooled_{next(counter)}"))
+            client.beta.threads.delete = AsyncMock()
+            pool = ThreadPool(client, target_size=2, prime_message="Привет")
+            manager = ThreadManager(client, MemorySessionStore().namespace('thread'), pool=pool)
+            manager.start()
+            await asyncio.sleep(0.01)
+            assert len(pool) == 2
+            assert client.beta.threads.create.await_args.kwargs['messages'][0]['content'] == "Привет"
+            
+            assert await manager.create(1, seeded=True) == "pooled_0"
+            await asyncio.sleep(0.01)
+            assert len(pool) == 2 and pool.stats()['hits'] == 1  # пул пополнен в фоне
+            await manager.create(2)  # без стартового сообщения — мимо пула
+            assert pool.stats()['hits'] == 1
+            
+            await manager.stop()
+            deleted = {call.args[0] for call in client.beta.threads.delete.await_args_list}
+            assert deleted == {"pooled_1", "pooled_2"}
+            print("✅ Пул thread пополняется в фоне, остаток удаляется при остановке")
+        
+        async def restart_scenario(path):
+            counter = iter(range(1000))
+            client = Mock()
+            client.beta.threads.create = AsyncMock(side_effect=lambda: Mock(id=f"thread_{next(counter)}"))
+            client.beta.threads.delete = AsyncMock()
+            
+            store = SQLiteSessionStore(path)
+            manager = ThreadManager(client, store.namespace('thread'), idle_ttl=60,
+                                    last_used=store.namespace('thread_used'))
+            for uid in (1, 2, 3):
+                await manager.get_or_create(uid)
+            await store.namespace('thread_used').set(1, time.time() - 120)  # простаивал до перезапуска
+            await store.close()
+            
+            store = SQLiteSessionStore(path)
+            manager = ThreadManager(client, store.namespace('thread'), idle_ttl=60,
+                                    last_used=store.namespace('thread_used'))
+            assert await manager.restore() == 3 and len(manager) == 3
+            # Пользователем 2 пользовался другой процесс: в памяти thread простаивает, в хранилище — нет
+            manager._live[2] = (manager._live[2][0], time.monotonic() - 120)
+            manager._live.move_to_end(2, last=False)
+            assert await manager.evict_idle() == 1
+            assert await manager.delete_pending() == 1
+            assert client.beta.threads.delete.await_args.args[0] == "thread_0"
+            assert await store.namespace('thread').get_many([1, 2, 3]) == {2: "thread_1", 3: "thread_2"}
+            await store.close()
+            print("✅ Thread прошлых запусков восстанавливаются из хранилища и вытесняются по простою")
+        
+        asyncio.run(scenario())
+        asyncio.run(pool_scenario())
+        with tempfile.TemporaryDirectory() as tmp:
+            asyncio.run(restart_scenario(os.path.join(tmp, "sessions.db")))
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка в жизненном цикле thread: {e}")
+        return False
+
+def test_background_priming():
+    """Тестирует фоновый стартовый run в _start_chat"""
+    print("\n🧪 Тестирование фонового стартового run...")
+    
+    try:
+        import time
+        from bot import SynaplinkBot
+        from conversation_queue import ConversationQueue
+        from event_bus import EventBus
+        from openai_client import PRIMING_MESSAGE
+        from session_store import MemorySessionStore
+        
+        async def scenario():
+            turns = []
+            
+            async def process(user_id, text):
+                turns.append(text)
+                await asyncio.sleep(0.1)
+                return "ответ"
+            
+            bot = SynaplinkBot.__new__(SynaplinkBot)
+            bot.priming_tasks = {}
+            bot.events = EventBus()
+            bot.user_states = MemorySessionStore().namespace('user_state')
+            bot.conversation_queue = ConversationQueue(process)
+            bot.openai_client = Mock(prime_conversation=AsyncMock(return_value=False))
+            query = Mock(from_user=Mock(id=7), edit_message_text=AsyncMock())
+            
+            started = time.perf_counter()
+            await bot._start_chat(query, None)
+            await bot._start_chat(query, None)  # повторное нажатие не запускает второй run
+            assert time.perf_counter() - started < 0.05
+            assert query.edit_message_text.await_count == 2 and 7 in bot.priming_tasks
+            assert await bot.user_states.get(7) == "chatting"
+            print("✅ Приветствие отправляется сразу, не дожидаясь run")
+            
+            await bot._wait_for_priming(7)
+            assert turns == [PRIMING_MESSAGE] and 7 not in bot.priming_tasks
+            await bot._wait_for_priming(7)  # без активного run возвращается сразу
+            print("✅ Первое сообщение ждет стартовый run, только пока он выполняется")
+        
+        asyncio.run(scenario())
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка в фоновом стартовом run: {e}")
+        return False
+
+def test_reply_streamer():
+    """Тестирует потоковую выдачу ответа"""
+    print("\n🧪 Тестирование потоковой выдачи ответа...")
+    
+    try:
+        from conversation_queue import ConversationQueue
+        from reply_streamer import ReplyStreamer, split_text, CURSOR
+        
+        chunks = split_text("абзац " * 10 + "\n\n" + "слово " * 30, limit=100)
+        assert len(chunks) == 3 and chunks[0] == ("абзац " * 10).strip() and all(len(c) <= 100 for c in chunks)
+        assert split_text("x" * 250, limit=100) == ["x" * 100, "x" * 100, "x" * 50]
+        
+        async def scenario():
+            sent = []
+            
+            async def reply(text):
+                message = Mock(delete=AsyncMock())
+                message.text = text
+                message.edit_text = AsyncMock(side_effect=lambda new_text: setattr(message, 'text', new_text))
+                sent.append(message)
+                return message
+            
+            streamer = ReplyStreamer(reply, interval=0.05, limit=60)
+            
+            async def process(user_id, text, on_delta=None):
+                for word in ["Привет", ", ", "это ", "Сани. "] + ["Длинный ответ. "] * 5:
+                    await on_delta(word)
+                    await asyncio.sleep(0.02)
+                return "Привет, это Сани. " + "Длинный ответ. " * 5
+            
+            queue = ConversationQueue(process)
+            response = await queue.submit(1, "Привет", on_delta=streamer.on_delta)
+            assert streamer.first_visible < 0.05
+            # Правок меньше, чем фрагментов — они объединяются
+            assert 0 < streamer.edits < 8
+            
+            messages = await streamer.finish(response)
+            texts = [m.text for m in messages]
+            assert len(messages) == 2 and all(len(t) <= 60 and CURSOR not in t for t in texts)
+            assert " ".join(texts).strip() == response.strip()
+            print(f"✅ Ответ появляется сразу и дописывается правками (правок: {streamer.edits})")
+            
+            # Итог короче потокового текста — лишнее сообщение удаляется
+            await streamer.finish("Коротко")
+            assert len(streamer.messages) == 1 and sent[0].text == "Коротко"
+            assert sent[1].delete.await_count == 1
+            print("✅ Длинный ответ делится по лимиту, лишние сообщения удаляются")
+            
+            # Сообщение удалили во время генерации — показ останавливается, недописанное убирается
+            from telegram.error import BadRequest
+            broken = ReplyStreamer(reply, interval=0.01)
+            await broken.on_delta("Начало")
+            broken.messages[0].edit_text = AsyncMock(side_effect=BadRequest("Message to edit not found"))
+            await broken.on_delta(" ответа")
+            await asyncio.sleep(0.05)
+            await broken.on_delta(" и конец")
+            assert broken.failed and await broken.finish("Начало ответа и конец") == []
+            assert sent[-1].delete.await_count == 1
+            print("✅ Ошибка правки не прерывает ответ: он уйдет обычным сообщением")
+        
+        asyncio.run(scenario())
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка в потоковой выдаче ответа: {e}")
+        return False
+
+def test_http_transport():
+    """Тестирует общий HTTP-транспорт"""
+    print("\n🧪 Тестирование HTTP-транспорта...")
+    
+    try:
+        import httpx
+        import http_transport
+        from http_transport import connection_stats, create_http_client, get_updates_request, telegram_request
+        
+        async def scenario():
+            with patch('http_transport.Config.HTTP_POOL_SIZE', 7), patch('http_transport.Config.HTTP_READ_TIMEOUT', 12.0):
+                client = create_http_client('test_client')
+                pool = client._transport._pool
+                assert pool._max_connections == 7 and client.timeout.read == 12.0
+                await client.aclose()
+                
+                request = telegram_request('test_telegram')
+                assert request._client_kwargs['limits'].max_connections == 7
+                assert request.read_timeout == 12.0
+                updates = get_updates_request()
+                assert updates._client_kwargs['limits'].max_connections == http_transport.Config.GET_UPDATES_POOL_SIZE
+            print("✅ Пулы и таймауты берутся из Config")
+            
+            stats = connection_stats('test_counter')
+            for index in range(4):
+                await stats.on_request(httpx.Request('GET', 'http://localhost/'))
+                if index == 0:
+                    await stats._trace('connection.connect_tcp.complete', {})
+            assert stats.as_dict() == {'requests': 4, 'connections': 1, 'reuse_rate': 0.75}
+            assert 'test_counter' in connection_stats()
+            print("✅ Доля переиспользованных соединений считается по событиям connect_tcp")
+        
+        asyncio.run(scenario())
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка в HTTP-транспорте: {e}")
+        return False
+
+def test_config_reload():
+    """Тестирует типизированные настройки и их перезагрузку"""
+    print("\n🧪 Тестирование перезагрузки настроек...")
+    
+    try:
+        from config import ConfigError
+        
+        base = dict(os.environ)
+        saved = Config.values()
+        changes = []
+        Config.subscribe(changes.append)
+        try:
+            Config.load({**base, 'WORKING_CHAT_ID': 'chat', 'RUN_TIMEOUT': '0', 'HTTP_VERSION': '3'})
+            try:
+                Config.validate()
+                raise AssertionError("некорректные значения прошли проверку")
+            except ConfigError as e:
+                assert 'WORKING_CHAT_ID' in str(e) and 'RUN_TIMEOUT' in str(e) and 'HTTP_VERSION' in str(e)
+            Config.load({**base, 'WEBHOOK_URL': 'http://example.com', 'STREAM_REPLIES': 'yes', 'PORT': '9000'})
+            assert Config.WEBHOOK_URL is None and 'WEBHOOK_URL' in Config._errors
+            assert Config.STREAM_REPLIES is True and Config.WEBHOOK_PORT == int(base.get('WEBHOOK_PORT', 9000))
+            print("✅ Значения приводятся к типам и проверяются")
+            
+            Config.load(base)
+            changed = Config.reload({**base, 'RUN_TIMEOUT': '15', 'TELEGRAM_CHAT_RATE': '2', 'HTTP_POOL_SIZE': '7'})
+            assert set(changed) == {'RUN_TIMEOUT', 'TELEGRAM_CHAT_RATE'}
+            assert Config.RUN_TIMEOUT == 15.0 and Config.TELEGRAM_CHAT_RATE == 2.0
+            assert Config.HTTP_POOL_SIZE == saved['HTTP_POOL_SIZE']
+            assert changes == [changed]
+            print("✅ Перезагрузка применяет только параметры, меняющиеся на лету")
+            
+            try:
+                Config.reload({**base, 'RUN_TIMEOUT': '30', 'RUN_POLL_INITIAL': '5', 'RUN_POLL_MAX': '1'})
+                raise AssertionError("несовместимые значения применены")
+            except ConfigError:
+                pass
+            assert Config.RUN_TIMEOUT == 15.0 and len(changes) == 1
+            print("✅ Некорректная перезагрузка не меняет ни одного значения")
+            
+            import tempfile
+            from config import ConfigWatcher
+            
+            async def watch(path):
+                watcher = ConfigWatcher(path, interval=0.02)
+                watcher.start()
+                await asyncio.sleep(0.05)
+                with open(path, 'w') as env_file:
+                    env_file.write("STREAM_EDIT_INTERVAL=2.5\n")
+                os.utime(path, ns=(0, 10 ** 9))
+                await asyncio.sleep(0.1)
+                await watcher.stop()
+                return watcher
+            
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, '.env')
+                open(path, 'w').close()
+                watcher = asyncio.run(watch(path))
+            assert watcher.reloads == 1 and Config.STREAM_EDIT_INTERVAL == 2.5
+            print("✅ Изменение файла .env подхватывается без перезапуска")
+        finally:
+            Config.unsubscribe(changes.append)
+            for name, value in saved.items():
+                setattr(Config, name, value)
+            Config._errors = {}
+        
+        from send_scheduler import SendScheduler
+        scheduler = SendScheduler(global_rate=30, private_chat_rate=1)
+        scheduler._chat_bucket('42')
+        scheduler._chat_bucket('-100')
+        scheduler.set_rates(10, 2, 0.5, chat_burst=5)
+        assert scheduler.global_bucket.rate == 10
+        assert scheduler._chat_buckets['42'].rate == 2 and scheduler._chat_buckets['42'].capacity == 5
+        assert scheduler._chat_buckets['-100'].rate == 0.5
+        print("✅ Новые лимиты применяются к уже известным чатам")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка в перезагрузке настроек: {e}")
+        return False
+
+def test_answer_cache():
+    """Тестирует кэш ответов на типовые вопросы"""
+    print("\n🧪 Тестирование кэша ответов...")
+    
+    try:
+        import time
+        from answer_cache import AnswerCache
+        
+        cache = AnswerCache('asst_1', max_entries=2, ttl=60, threshold=0.85)
+        assert cache.accepts("Какие технологии вы используете?") and cache.accepts("Расскажи о ваших услугах")
+        assert not cache.accepts("Меня зовут Иван") and not cache.accepts("Что " + "очень " * 60)
+        cache.store("Расскажи о ваших услугах", "Мы делаем ботов", cost=2.0)
+        cache.store("Какие технологии вы используете?", "GPT и Python", cost=3.0)
+        assert cache.lookup("расскажите о ваших услугах").answer == "Мы делаем ботов"
+        assert cache.lookup("Какие технологии используете").answer == "GPT и Python"
+        assert cache.lookup("Сколько стоит сайт?") is None
+        print("✅ Похожие формулировки находят один ответ, другие вопросы — нет")
+        
+        # Вопрос с отрицанием — другой вопрос, хотя n-граммы почти совпадают
+        negated = AnswerCache('asst_1', threshold=0.85)
+        negated.store("Вы делаете сайты?", "Да, делаем", cost=1.0)
+        negated.store("Какие технологии вы используете?", "GPT и Python", cost=1.0)
+        assert negated.lookup("Вы не делаете сайты?") is None
+        assert negated.lookup("Какие технологии вы не используете?") is None
+        assert negated.lookup("вы делаете сайты").answer == "Да, делаем"
+        # Сообщения с именем, телефоном или email не кэшируются и не ищутся
+        for text in ("Меня зовут Иван, какие у вас услуги?", "Я Петр, что вы умеете?",
+                     "Сколько стоит бот? Мой номер +7 900 123-45-67", "Что вы делаете? ivan@example.com"):
+            assert not cache.accepts(text), text
+        assert cache.accepts("Я хочу бота, сколько это стоит?")
+        print("✅ Отрицание и личные данные не дают чужого ответа")
+        
+        cache.store("Сколько стоит чат-бот?", "От 50 000 ₽", cost=2.0)
+        assert len(cache) == 2 and cache.evictions == 1
+        assert cache.lookup("Расскажи о ваших услугах") is None
+        cache._entries["сколько стоит чат бот"].created -= 120
+        assert cache.lookup("Сколько стоит чат-бот?") is None and len(cache) == 1
+        assert cache.invalidate('asst_2') == 1 and len(cache) == 0 and cache.assistant_id == 'asst_2'
+        print("✅ Записи вытесняются по LRU и TTL и очищаются при смене ассистента")
+        
+        with patch('openai_client.AsyncOpenAI') as mock_openai_class:
+            client = Mock()
+            mock_openai_class.return_value = client
+            client.beta.threads.create = AsyncMock(side_effect=[Mock(id=f"thread_{i}") for i in range(5)])
+            client.beta.threads.messages.create = AsyncMock()
+            client.beta.threads.runs.create = AsyncMock(return_value=Mock(id="run_1"))
+            client.beta.threads.runs.retrieve = AsyncMock(return_value=Mock(status='completed'))
+            answer = Mock(id="msg_1", role="assistant", content=[Mock(spec=['text', 'type'])])
+            answer.content[0].text.value = "Мы делаем ботов"
+            client.beta.threads.messages.list = AsyncMock(return_value=Mock(data=[answer], has_more=False))
+            
+            with patch('openai_client.Config.ANSWER_CACHE', True), \
+                    patch('openai_client.Config.RUN_WAITER_MODE', 'poll'), \
+                    patch('openai_client.Config.THREAD_POOL_SIZE', 0), \
+                    patch('openai_client.Config.OPENAI_ASSISTANT_ID', 'asst_1'):
+                openai_client = OpenAIClient()
+                
+                async def scenario():
+                    replies = [await openai_client.send_message(1, "Расскажи о ваших услугах")]
+                    replies.append(await openai_client.send_message(2, "Расскажите о ваших услугах?"))
+                    with patch('openai_client.Config.OPENAI_ASSISTANT_ID', 'asst_2'):
+                        openai_client.apply_config()
+                    replies.append(await openai_client.send_message(3, "Расскажи о ваших услугах"))
+                    # В середине диалога ответ зависит от истории: кэш не используется
+                    replies.append(await openai_client.send_message(3, "Расскажите о ваших услугах?"))
+                    # Ответ, обращенный к Ивану, не достается Петру
+                    replies.append(await openai_client.send_message(4, "Меня зовут Иван, какие у вас услуги?"))
+                    replies.append(await openai_client.send_message(5, "Меня зовут Петр, какие у вас услуги?"))
+                    return replies
+                
+                replies = asyncio.run(scenario())
+            assert replies == ["Мы делаем ботов"] * 6
+            assert client.beta.threads.runs.create.await_count == 5
+            roles = [call.kwargs['role'] for call in client.beta.threads.messages.create.await_args_list]
+            assert roles == ['user', 'user', 'assistant', 'user', 'user', 'user', 'user']
+            stats = openai_client.answer_cache.stats()
+            assert stats['hits'] == 1 and stats['misses'] == 2
+            assert stats['invalidations'] == 1 and stats['entries'] == 1
+            assert 0 < stats['hit_rate'] < 1
+            print(f"✅ Повторный вопрос не запускает run, ответ дописывается в thread ({stats})")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка в кэше ответов: {e}")
+        return False
+
+def test_lead_analytics():
+    """Тестирует аналитику воронки и заявок"""
+    print("\n🧪 Тестирование аналитики заявок...")
+    
+    try:
+        import csv
+        import io
+        import tempfile
+        from event_bus import EventBus
+        from lead_analytics import LeadAnalytics, day_of
+        
+        lead_text = (
+            "[Заявка в рабочий чат]\nИмя: Иван\nТелефон: +7 (900) 123-45-67\n"
+            "Email: IVAN@example.com\nЗапрос: чат-бот для продаж"
+        )
+        
+        async def scenario(path):
+            analytics = LeadAnalytics(path)
+            bus = EventBus([analytics])
+            day1 = 1_700_000_000.0
+            day2 = day1 + 86400
+            events = []
+            for user_id, ts in ((1, day1), (2, day1), (3, day2)):
+                events += [(ts, 'start', user_id, None), (ts + 5, 'start_chat', user_id, None)]
+            events += [(day1 + offset, 'message', 1, None) for offset in (10, 20, 30)]
+            events += [(day1 + 100, 'lead', 1, {'text': lead_text}), (day2 + 10, 'message', 3, None),
+                       (day2 + 1000, 'lead', 3, {'text': lead_text})]
+            bus._buffer.extend(events)
+            assert analytics.stats()['events'] == 0  # пока только в буфере шины
+            assert await bus.flush() == 12 and analytics.written == 12
+            
+            funnel = {row['day']: row for row in analytics.conversion_by_day()}
+            first = funnel[day_of(day1)]
+            assert (first['start'], first['start_chat'], first['first_message'], first['lead']) == (2, 2, 1, 1)
+            assert first['conversion'] == 0.5 and funnel[day_of(day2)]['conversion'] == 1.0
+            assert analytics.conversion_by_day(since=day_of(day2)) == [funnel[day_of(day2)]]
+            latency = analytics.time_to_lead(percentiles=(50, 100))
+            assert latency['count'] == 2
+            assert 100 <= latency['p50'] < 125 and 1000 <= latency['p100'] < 1250
+            print(f"✅ Воронка по дням и время до заявки считаются по сводным таблицам ({latency})")
+            
+            batches = list(analytics.iter_batches('events', batch_size=5))
+            assert [len(batch['id']) for batch in batches] == [5, 5, 2]
+            out = io.StringIO()
+            assert analytics.export_csv(out, 'leads') == 2
+            header, row = list(csv.reader(io.StringIO(out.getvalue())))[:2]
+            assert header[:7] == ['id', 'ts', 'day', 'user_id', 'name', 'phone', 'email']
+            assert row[4:7] == ['Иван', '+79001234567', 'ivan@example.com'] and row[-1] == lead_text
+            print("✅ Заявки сохраняются разобранными, выгрузка идет пачками")
+            await bus.close()
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            asyncio.run(scenario(os.path.join(tmp, 'analytics.db')))
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка в аналитике заявок: {e}")
+        return False
+
+def test_event_bus():
+    """Тестирует шину событий воронки"""
+    print("\n🧪 Тестирование шины событий...")
+    
+    try:
+        import json
+        import tempfile
+        import httpx
+        from event_bus import EventBus, EventCollector, EventSink, FileSink, HttpSink
+        
+        class FlakySink(EventSink):
+            name = 'flaky'
+            
+            def __init__(self):
+                self.down = False
+                self.received = []
+            
+            async def write(self, batch):
+                if self.down:
+                    raise ConnectionError("недоступен")
+                self.received.extend(kind for _, kind, _, _ in batch)
+        
+        async def scenario(tmp):
+            bus = EventBus(capacity=3, policy='drop_oldest')
+            for kind in ('a', 'b', 'c', 'd'):
+                assert bus.emit(kind, 1)
+            assert [event[1] for event in bus._buffer] == ['b', 'c', 'd'] and bus.dropped == 1
+            bus = EventBus(capacity=3, policy='drop_newest')
+            assert [bus.emit(kind) for kind in 'abcd'] == [True, True, True, False]
+            assert [event[1] for event in bus._buffer] == ['a', 'b', 'c']
+            print("✅ Переполнение: вытеснение старых или отказ новым событиям")
+            
+            sink = FlakySink()
+            bus = EventBus([sink], capacity=4, batch_size=2, flush_interval=10, policy='block', block_timeout=1)
+            bus.start()
+            for kind in 'abcd':
+                await bus.publish(kind)
+            assert await bus.publish('e')  # ждет, пока фоновая запись освободит место
+            await bus.flush()
+            assert sink.received == list('abcde')
+            print("✅ Политика block придерживает обработчик до освобождения буфера")
+            
+            sink.down = True
+            for kind in 'fgh':
+                bus.emit(kind)
+            await bus.flush()
+            assert len(bus) == 0 and bus.stats()['sinks']['flaky']['backlog'] == 3
+            sink.down = False
+            bus.emit('i')
+            await bus.flush()
+            assert sink.received == list('abcdefghi')
+            print("✅ Непринятые пачки повторяются в исходном порядке")
+            await bus.close()
+            
+            collector = await EventCollector(port=0).start()
+            path = os.path.join(tmp, 'events.jsonl')
+            async with httpx.AsyncClient() as client:
+                bus = EventBus([FileSink(path), HttpSink(collector.url, client=client)], batch_size=100)
+                bus.emit('lead', 5, {'text': 'Телефон: +7 900 123-45-67'})
+                bus.emit('reset', 5)
+                await bus.close()
+            await collector.stop()
+            with open(path, encoding='utf-8') as f:
+                records = [json.loads(line) for line in f]
+            assert [record['kind'] for record in records] == ['lead', 'reset']
+            assert '+***67' in records[0]['text'] and '123-45' not in records[0]['text']
+            assert collector.received == 2 and collector.batches == 1
+            print("✅ Файловый и HTTP-приемники получают пачки, телефоны маскируются")
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            asyncio.run(scenario(tmp))
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка в шине событий: {e}")
+        return False
+
+def test_graceful_shutdown():
+    """Тестирует корректную остановку с дорабатыванием диалогов"""
+    print("\n🧪 Тестирование корректной остановки...")
+    
+    try:
+        import signal
+        import time
+        from bot import SynaplinkBot
+        from run_waiter import PollingRunWaiter
+        from shutdown import InflightUpdateProcessor
+        
+        def make_bot():
+            bot = SynaplinkBot.__new__(SynaplinkBot)
+            bot.priming_tasks = {}
+            bot._hurry = asyncio.Event()
+            bot._shutdown_task = None
+            bot._watchdog = None
+            bot.update_processor = InflightUpdateProcessor(4)
+            bot.application = Mock(
+                updater=Mock(running=True, stop=AsyncMock()),
+                update_queue=asyncio.Queue(),
+                stop_running=Mock()
+            )
+            bot.openai_client = Mock(cancel_active_runs=AsyncMock(return_value=1))
+            bot.lead_outbox = Mock(stop=AsyncMock(), pending=0)
+            bot.conversation_queue = Mock(workers=Mock(return_value=[]))
+            return bot
+        
+        def handle(bot, seconds):
+            return asyncio.ensure_future(bot.update_processor.process_update(None, asyncio.sleep(seconds)))
+        
+        async def scenario():
+            bot = make_bot()
+            fast, slow = handle(bot, 0.05), handle(bot, 10)
+            bot.application.update_queue.put_nowait("необработанное обновление")
+            await asyncio.sleep(0)
+            started = time.perf_counter()
+            await bot.shutdown(signal.SIGTERM)
+            bot._watchdog.cancel()
+            assert time.perf_counter() - started < 1.5
+            assert fast.done() and not fast.cancelled() and slow.cancelled()
+            bot.application.updater.stop.assert_awaited_once()
+            bot.openai_client.cancel_active_runs.assert_awaited_once()
+            bot.lead_outbox.stop.assert_awaited_once()
+            bot.application.stop_running.assert_called_once()
+            assert bot.application.update_queue.empty()
+            print("✅ Быстрый диалог доработан, зависший прерван вместе с run, заявки дописаны")
+            
+            bot = make_bot()
+            bot.openai_client.cancel_active_runs = AsyncMock(return_value=0)
+            handler = handle(bot, 0.05)
+            await asyncio.sleep(0)
+            await bot.drain(lambda: bot.update_processor.tasks, time.monotonic() + 5)
+            assert handler.done() and not handler.cancelled()
+            bot.openai_client.cancel_active_runs.assert_not_awaited()
+            print("✅ Без зависших диалогов run не отменяются")
+            
+            bot = make_bot()
+            slow = handle(bot, 10)
+            await asyncio.sleep(0)
+            started = time.perf_counter()
+            bot._on_stop_signal(signal.SIGTERM)
+            await asyncio.sleep(0.05)
+            bot._on_stop_signal(signal.SIGTERM)
+            await bot._shutdown_task
+            bot._watchdog.cancel()
+            assert time.perf_counter() - started < 1 and slow.cancelled()
+            print("✅ Повторный сигнал прерывает ожидание")
+        
+        with patch('bot.Config.SHUTDOWN_DRAIN_TIMEOUT', 0.3), patch('bot.Config.SHUTDOWN_TIMEOUT', 2.0):
+            asyncio.run(scenario())
+        
+        async def registry():
+            run = Mock(id="run_1", status='in_progress', last_error=None)
+            client = Mock()
+            client.beta.threads.runs.create = AsyncMock(return_value=run)
+            client.beta.threads.runs.retrieve = AsyncMock(return_value=run)
+            client.beta.threads.runs.cancel = AsyncMock()
+            waiter = PollingRunWaiter(deadline=30, initial_delay=0.01, max_delay=0.02)
+            task = asyncio.create_task(waiter.run(client, "thread_1", "asst_1"))
+            await asyncio.sleep(0.05)
+            assert waiter.active_runs() == {"run_1": "thread_1"}
+            assert await waiter.cancel_active(client) == 1
+            client.beta.threads.runs.cancel.assert_awaited_once_with(run_id="run_1", thread_id="thread_1")
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            assert waiter.active_runs() == {}
+        
+        asyncio.run(registry())
+        print("✅ Выполняющиеся run учитываются и отменяются на сервере")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка в корректной остановке: {e}")
+        return False
+
+def test_resilience():
+    """Тестирует защиту от сбоев OpenAI: автомат защиты, bulkhead, повторы и hedging"""
+    print("\n🧪 Тестирование защиты от сбоев API...")
+    
+    try:
+        import time
+        import httpx
+        from openai_client import BUSY_REPLY, UNAVAILABLE_REPLY
+        from resilience import (
+            Bulkhead, BulkheadFullError, CircuitBreaker, CircuitOpenError, ResilientTransport, RetryBudget,
+            CLOSED, HALF_OPEN, OPEN
+        )
+        
+        now = [0.0]
+        breaker = CircuitBreaker('test', failure_rate=0.5, min_calls=4, window=4, cooldown=10, clock=lambda: now[0])
+        for failed in (False, True, False, True):
+            breaker.record_failure() if failed else breaker.record_success()
+        assert breaker.state == OPEN and not breaker.allow() and breaker.should_reject()
+        now[0] = 10
+        assert breaker.current_state == HALF_OPEN and not breaker.should_reject()
+        assert breaker.allow() and not breaker.allow()  # одна проба за раз
+        breaker.record_failure()
+        assert breaker.state == OPEN
+        now[0] = 20
+        assert breaker.allow()
+        breaker.record_success()
+        assert breaker.state == CLOSED and breaker.stats()['rejected'] == 3
+        print("✅ Автомат размыкается по доле отказов и замыкается после успешной пробы")
+        
+        budget = RetryBudget(ratio=0.5, min_per_second=0, capacity=2)
+        assert budget.withdraw() and budget.withdraw() and not budget.withdraw()
+        budget.deposit()
+        budget.deposit()
+        assert budget.withdraw() and not budget.withdraw()
+        print("✅ Бюджет повторов пополняется только исходными запросами")
+        
+        async def bulkhead_scenario():
+            bulkhead = Bulkhead('test', limit=1, max_wait=0.05)
+            await bulkhead.acquire()
+            try:
+                await bulkhead.acquire()
+                assert False, "слот не должен был освободиться"
+            except BulkheadFullError:
+                pass
+            waiter = asyncio.create_task(bulkhead.acquire())
+            await asyncio.sleep(0.01)
+            bulkhead.release()
+            await waiter
+            assert bulkhead.stats() == {'active': 1, 'waiting': 0, 'limit': 1, 'rejected': 1}
+        
+        asyncio.run(bulkhead_scenario())
+        print("✅ Bulkhead отклоняет вызов, если слот не освободился вовремя")
+        
+        async def transport_scenario():
+            calls = []
+            
+            async def handler(request):
+                calls.append(request.method)
+                if request.url.path == '/slow' and len(calls) == 1:
+                    await asyncio.sleep(1)
+                if request.url.path == '/flaky' and len(calls) < 3:
+                    return httpx.Response(503, headers={'retry-after': '0'})
+                if request.url.path == '/down':
+                    return httpx.Response(500)
+                return httpx.Response(200, json={'ok': True})
+            
+            def client(hedge_delay=0.0):
+                breaker = CircuitBreaker('test', min_calls=3, window=3, cooldown=60)
+                transport = ResilientTransport(httpx.MockTransport(handler), breaker, RetryBudget(),
+                                               attempts=3, base_delay=0, hedge_delay=hedge_delay)
+                return httpx.AsyncClient(transport=transport, base_url='http://api'), breaker
+            
+            http, breaker = client()
+            assert (await http.get('/flaky')).status_code == 200 and len(calls) == 3
+            calls.clear()
+            assert (await http.post('/down')).status_code == 500 and calls == ['POST']
+            print("✅ Чтения повторяются после 503, запись не повторяется")
+            
+            assert breaker.state == OPEN  # два отказа из трех последних вызовов
+            calls.clear()
+            try:
+                await http.get('/ok')
+                assert False, "запрос должен был быть отклонен"
+            except CircuitOpenError:
+                pass
+            assert calls == []
+            print("✅ Разомкнутый автомат отклоняет запросы, не обращаясь к API")
+            
+            http, breaker = client(hedge_delay=0.05)
+            calls.clear()
+            started = time.perf_counter()
+            assert (await http.get('/slow')).status_code == 200
+            assert time.perf_counter() - started < 0.5 and len(calls) == 2
+            print("✅ Медленное чтение дублируется, побеждает быстрый ответ")
+        
+        asyncio.run(transport_scenario())
+        
+        with patch('openai_client.AsyncOpenAI') as mock_openai_class:
+            client = Mock()
+            mock_openai_class.return_value = client
+            client.beta.threads.create = AsyncMock(return_value=Mock(id="thread_1"))
+            client.beta.threads.messages.create = AsyncMock()
+            with patch('openai_client.Config.THREAD_POOL_SIZE', 0):
+                openai_client = OpenAIClient()
+            
+            async def client_scenario():
+                openai_client.bulkhead.resize(1, max_wait=0)
+                openai_client.bulkhead.active = 1
+                assert await openai_client.send_message(1, "Привет") == BUSY_REPLY
+                for _ in range(openai_client.breaker.min_calls):
+                    openai_client.breaker.record_failure()
+                assert await openai_client.send_message(1, "Привет") == UNAVAILABLE_REPLY
+                assert client.beta.threads.messages.create.await_count == 0
+            
+            asyncio.run(client_scenario())
+        print("✅ Пользователь сразу получает понятный ответ при перегрузке и сбое API")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка в защите от сбоев API: {e}")
+        return False
+
 def run_all_tests():
     """Запускает все тесты"""
     print("🚀 Запуск тестов для бота Synaplink...\n")
@@ -158,7 +1819,29 @@ def run_all_tests():
     tests = [
         ("Конфигурация", test_config),
         ("Обработчик заявок", test_application_handler),
-        ("Клиент OpenAI", test_openai_client_mock)
+        ("Клиент OpenAI", test_openai_client_mock),
+        ("Ожидание run", test_run_waiter),
+        ("Чтение ответа run", test_run_reply_fetch),
+        ("Хранилище сессий", test_session_store),
+        ("Webhook-маршрутизация", test_webhook_routing),
+        ("Очередь сообщений", test_conversation_queue),
+        ("Кэш медиафайлов", test_media_cache),
+        ("Конвейер /start", test_start_pipeline),
+        ("Планировщик отправки", test_send_scheduler),
+        ("Разбор заявок", test_lead_extractor),
+        ("Метрики", test_metrics),
+        ("Конвейер логирования", test_log_pipeline),
+        ("Outbox заявок", test_lead_outbox),
+        ("Жизненный цикл thread", test_thread_manager),
+        ("Фоновый стартовый run", test_background_priming),
+        ("Потоковая выдача ответа", test_reply_streamer),
+        ("HTTP-транспорт", test_http_transport),
+        ("Перезагрузка настроек", test_config_reload),
+        ("Кэш ответов", test_answer_cache),
+        ("Аналитика заявок", test_lead_analytics),
+        ("Шина событий", test_event_bus),
+        ("Корректная остановка", test_graceful_shutdown),
+        ("Защита от сбоев API", test_resilience)
     ]
     
     passed = 0
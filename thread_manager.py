@@ -0,0 +1,491 @@
+"""
+Модуль управления жизненным циклом thread ассистента
+Следит за тем, какие thread используются, вытесняет простаивающие и лишние (LRU)
+и удаляет вытесненные и сброшенные thread на стороне OpenAI фоновыми пачками;
+новые thread берутся из заранее созданного пула
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, List, Optional, Tuple
+
+import openai
+
+from session_store import SessionNamespace
+
+logger = logging.getLogger(__name__)
+
+
+class ThreadPool:
+    """
+    Пул заранее созданных thread
+
+    Фоновая задача держит в пуле target_size пустых thread (или thread
+    с уже добавленным стартовым сообщением), поэтому новый диалог не ждет
+    создания thread. Пустой пул не ошибка — thread создается как раньше.
+    """
+
+    def __init__(self, client, target_size: int = 5, prime_message: Optional[str] = None,
+                 concurrency: int = 4, retry_delay: float = 5.0):
+        """
+        Args:
+            client: AsyncOpenAI клиент
+            target_size: Сколько thread держать наготове (0 — пул выключен)
+            prime_message: Стартовое сообщение, добавляемое в thread при создании
+            concurrency: Сколько thread создавать одновременно при пополнении
+            retry_delay: Пауза перед новой попыткой пополнения после ошибки (сек)
+        """
+        self.client = client
+        self.target_size = target_size
+        self.prime_message = prime_message
+        self.concurrency = concurrency
+        self.retry_delay = retry_delay
+        self._ready: Deque[str] = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+
+    def __len__(self) -> int:
+        return len(self._ready)
+
+    @property
+    def seeded(self) -> bool:
+        """Содержат ли thread пула стартовое сообщение"""
+        return self.prime_message is not None
+
+    def stats(self) -> dict:
+        return {'ready': len(self._ready), 'hits': self.hits, 'misses': self.misses, 'created': self.created}
+
+    async def create_thread(self) -> str:
+        """Создает thread на сервере (со стартовым сообщением, если оно задано)"""
+        if self.seeded:
+            thread = await self.client.beta.threads.create(
+                messages=[{'role': 'user', 'content': self.prime_message}]
+            )
+        else:
+            thread = await self.client.beta.threads.create()
+        self.created += 1
+        return thread.id
+
+    def take(self) -> Optional[str]:
+        """Забирает готовый thread без ожидания (None — пул пуст)"""
+        if self._ready:
+            self.hits += 1
+            thread_id = self._ready.popleft()
+        else:
+            self.misses += 1
+            thread_id = None
+        self._wakeup.set()
+        return thread_id
+
+    async def acquire(self) -> str:
+        """Возвращает готовый thread, а если пул пуст — создает новый"""
+        return self.take() or await self.create_thread()
+
+    async def fill(self) -> int:
+        """
+        Дозаполняет пул до target_size
+
+        Returns:
+            int: Сколько thread добавлено
+        """
+        added = 0
+        while len(self._ready) < self.target_size:
+            count = min(self.concurrency, self.target_size - len(self._ready))
+            results = await asyncio.gather(*(self.create_thread() for _ in range(count)), return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+                self._ready.append(result)
+                added += 1
+        return added
+
+    def resize(self, target_size: int) -> None:
+        """Меняет размер пула на лету; лишние готовые thread расходуются новыми диалогами"""
+        self.target_size = target_size
+        self._wakeup.set()
+        self.start()
+
+    def start(self) -> None:
+        """Запускает фоновое пополнение пула"""
+        if self.target_size > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> List[str]:
+        """
+        Останавливает пополнение
+
+        Returns:
+            List[str]: Неиспользованные thread (их нужно удалить на сервере)
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        leftover, self._ready = list(self._ready), deque()
+        return leftover
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                if await self.fill():
+                    logger.debug(f"🧵 Пул thread пополнен до {len(self._ready)}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось пополнить пул thread: {e}")
+                await asyncio.sleep(self.retry_delay)
+                continue
+            await self._wakeup.wait()
+
+
+class ThreadManager:
+    """
+    Реестр thread пользователей с вытеснением по простою и лимиту
+
+    Привязка пользователь → thread_id и время последнего использования хранятся
+    в хранилище сессий (переживают перезапуск), а порядок использования — в памяти
+    процесса; при запуске он восстанавливается из хранилища. Thread, занятые
+    выполняющимся run, не вытесняются. Удаление на сервере идет в фоне пачками
+    и не задерживает ответы пользователям.
+    """
+
+    def __init__(self, client, threads: SessionNamespace, idle_ttl: Optional[float] = 24 * 3600,
+                 max_threads: int = 10_000, delete_batch: int = 20, sweep_interval: float = 60.0,
+                 delete_attempts: int = 3, pool: Optional[ThreadPool] = None,
+                 last_used: Optional[SessionNamespace] = None):
+        """
+        Args:
+            client: AsyncOpenAI клиент
+            threads: Пространство хранилища сессий для thread_id
+            idle_ttl: Через сколько секунд простоя thread вытесняется (None — без ограничения)
+            max_threads: Максимум живых thread в процессе, лишние вытесняются по LRU
+            delete_batch: Сколько thread удалять на сервере одновременно
+            sweep_interval: Пауза между проверками простоя и удалениями (сек)
+            delete_attempts: Сколько раз пытаться удалить thread на сервере
+            pool: Пул заранее созданных thread
+            last_used: Пространство хранилища для времени последнего использования
+                (unix-время); без него thread из хранилища после перезапуска не вытесняются
+        """
+        self.client = client
+        self.threads = threads
+        self.idle_ttl = idle_ttl
+        self.max_threads = max_threads
+        self.delete_batch = delete_batch
+        self.sweep_interval = sweep_interval
+        self.delete_attempts = delete_attempts
+        self.pool = pool
+        self.last_used = last_used
+        # user_id → (thread_id, время последнего использования), от давних к свежим
+        self._live: 'OrderedDict[int, Tuple[str, float]]' = OrderedDict()
+        self._busy: Dict[int, int] = {}
+        self._delete_queue: Deque[Tuple[str, int]] = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.created = 0
+        self.reused = 0
+        self.evicted_idle = 0
+        self.evicted_lru = 0
+        self.reset = 0
+        self.restored = 0
+        self.deleted = 0
+        self.delete_failed = 0
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def stats(self) -> dict:
+        """Счетчики жизненного цикла thread"""
+        return {
+            'live': len(self._live),
+            'busy': len(self._busy),
+            'created': self.created,
+            'reused': self.reused,
+            'evicted_idle': self.evicted_idle,
+            'evicted_lru': self.evicted_lru,
+            'reset': self.reset,
+            'restored': self.restored,
+            'delete_pending': len(self._delete_queue),
+            'deleted': self.deleted,
+            'delete_failed': self.delete_failed,
+            'pool': self.pool.stats() if self.pool else None,
+        }
+
+    # --- Выдача thread ---
+
+    async def get_or_create(self, user_id: int) -> str:
+        """Возвращает thread пользователя, создавая новый при необходимости"""
+        entry = self._live.get(user_id)
+        if entry is not None:
+            thread_id = entry[0]
+            self.reused += 1
+        else:
+            thread_id = await self.threads.get(user_id)
+            if thread_id is None:
+                return await self.create(user_id)
+            # Thread из хранилища (например, после перезапуска) берем под учет
+            self.reused += 1
+        await self._touch(user_id, thread_id)
+        return thread_id
+
+    async def create(self, user_id: int, seeded: bool = False) -> str:
+        """
+        Привязывает к пользователю новый thread (из пула, если он подходит)
+
+        Args:
+            user_id: ID пользователя
+            seeded: Нужен thread со стартовым сообщением пула
+        """
+        if self.pool is not None and self.pool.seeded == seeded:
+            thread_id = await self.pool.acquire()
+        elif seeded:
+            raise ValueError("Пул thread создан без стартового сообщения")
+        else:
+            thread_id = (await self.client.beta.threads.create()).id
+        previous = self._live.pop(user_id, None)
+        if previous is not None and previous[0] != thread_id:
+            self._schedule_delete(previous[0])
+        await self.threads.set(user_id, thread_id)
+        self.created += 1
+        await self._touch(user_id, thread_id)
+        logger.info(f"Создан новый thread {thread_id} для пользователя {user_id}")
+        return thread_id
+
+    @asynccontextmanager
+    async def use(self, user_id: int):
+        """Выдает thread пользователя и защищает его от вытеснения на время run"""
+        self._busy[user_id] = self._busy.get(user_id, 0) + 1
+        try:
+            yield await self.get_or_create(user_id)
+        finally:
+            count = self._busy.pop(user_id) - 1
+            if count:
+                self._busy[user_id] = count
+            elif user_id in self._live:
+                # Простой отсчитывается от конца run, а не от его начала
+                await self._touch(user_id, self._live[user_id][0])
+
+    async def release(self, user_id: int) -> bool:
+        """
+        Отвязывает thread от пользователя и ставит его в очередь на удаление
+
+        Returns:
+            bool: True, если у пользователя был thread
+        """
+        entry = self._live.pop(user_id, None)
+        thread_id = entry[0] if entry else await self.threads.get(user_id)
+        if thread_id is None:
+            return False
+        await self.threads.delete(user_id)
+        if self.last_used is not None:
+            await self.last_used.delete(user_id)
+        self.reset += 1
+        self._schedule_delete(thread_id)
+        return True
+
+    async def _touch(self, user_id: int, thread_id: str) -> None:
+        self._live[user_id] = (thread_id, time.monotonic())
+        self._live.move_to_end(user_id)
+        # Привязка из _live в хранилище не читается: перезаписываем ее, чтобы
+        # SESSION_TTL не истек у активного пользователя. Записи буферизуются
+        # хранилищем и уходят одной пачкой
+        await self.threads.set(user_id, thread_id)
+        if self.last_used is not None:
+            await self.last_used.set(user_id, time.time())
+        if len(self._live) > self.max_threads:
+            await self._evict_lru()
+
+    async def restore(self) -> int:
+        """
+        Берет под учет thread из хранилища сессий (после перезапуска)
+
+        Без этого thread прошлых запусков не попадают в _live и никогда не
+        вытесняются и не удаляются на сервере. Время простоя восстанавливается
+        из last_used; thread без отметки считаются использованными сейчас.
+
+        Returns:
+            int: Сколько thread восстановлено
+        """
+        stored = await self.threads.items()
+        used = await self.last_used.items() if self.last_used is not None else {}
+        now_wall, now = time.time(), time.monotonic()
+        restored = []
+        for key, thread_id in stored.items():
+            user_id = int(key) if key.lstrip('-').isdigit() else key
+            if user_id in self._live or not thread_id:
+                continue
+            idle = max(0.0, now_wall - used.get(key, now_wall))
+            restored.append((user_id, (thread_id, now - idle)))
+        if restored:
+            # Порядок _live — от давних к свежим, вместе с уже выданными в этом запуске
+            merged = sorted([*restored, *self._live.items()], key=lambda item: item[1][1])
+            self._live = OrderedDict(merged)
+            self.restored += len(restored)
+            logger.info(f"🧵 Восстановлено thread из хранилища: {len(restored)}")
+            if len(self._live) > self.max_threads:
+                await self._evict_lru()
+        return len(restored)
+
+    # --- Вытеснение ---
+
+    async def _evict(self, user_id: int, thread_id: str) -> bool:
+        """
+        Отвязывает thread от пользователя и ставит его в очередь на удаление
+
+        Хранилище может быть общим для процессов (воркеры webhook): если привязку
+        уже сменил другой процесс, удалять нечего.
+        """
+        if await self.threads.get(user_id) != thread_id:
+            return False
+        await self.threads.delete(user_id)
+        if self.last_used is not None:
+            await self.last_used.delete(user_id)
+        self._schedule_delete(thread_id)
+        return True
+
+    async def _evict_lru(self) -> None:
+        for user_id, (thread_id, _) in list(self._live.items()):
+            if len(self._live) <= self.max_threads:
+                return
+            if user_id in self._busy:
+                continue
+            if self._live.pop(user_id, None) is None:
+                continue
+            if await self._evict(user_id, thread_id):
+                self.evicted_lru += 1
+
+    async def evict_idle(self) -> int:
+        """
+        Вытесняет thread, простаивающие дольше idle_ttl
+
+        Returns:
+            int: Сколько thread вытеснено
+        """
+        if not self.idle_ttl:
+            return 0
+        deadline = time.monotonic() - self.idle_ttl
+        candidates = []
+        # Словарь упорядочен по времени использования — идем от самых давних
+        for user_id, (thread_id, last_used) in self._live.items():
+            if last_used > deadline:
+                break
+            if user_id not in self._busy:
+                candidates.append((user_id, thread_id))
+        if not candidates:
+            return 0
+        # Другой процесс с тем же хранилищем мог пользоваться thread позже нас
+        stored = await self.last_used.get_many(u for u, _ in candidates) if self.last_used is not None else {}
+        now_wall, now = time.time(), time.monotonic()
+        evicted = 0
+        for user_id, thread_id in candidates:
+            entry = self._live.get(user_id)
+            if entry is None or entry[0] != thread_id or user_id in self._busy:
+                continue
+            idle = now_wall - stored.get(user_id, 0.0)
+            if idle < self.idle_ttl:
+                self._live[user_id] = (thread_id, now - idle)
+                self._live.move_to_end(user_id)
+                continue
+            del self._live[user_id]
+            if await self._evict(user_id, thread_id):
+                evicted += 1
+        self.evicted_idle += evicted
+        return evicted
+
+    # --- Удаление на сервере ---
+
+    def _schedule_delete(self, thread_id: str, attempt: int = 0) -> None:
+        self._delete_queue.append((thread_id, attempt))
+        if len(self._delete_queue) >= self.delete_batch:
+            self._wakeup.set()
+
+    async def delete_pending(self) -> int:
+        """
+        Удаляет на сервере все thread из очереди пачками по delete_batch
+
+        Returns:
+            int: Сколько thread удалено
+        """
+        deleted = 0
+        while self._delete_queue:
+            batch = [self._delete_queue.popleft()
+                     for _ in range(min(self.delete_batch, len(self._delete_queue)))]
+            results = await asyncio.gather(
+                *(self.client.beta.threads.delete(thread_id) for thread_id, _ in batch),
+                return_exceptions=True
+            )
+            retry, done = [], 0
+            for (thread_id, attempt), result in zip(batch, results):
+                if not isinstance(result, Exception) or isinstance(result, openai.NotFoundError):
+                    done += 1
+                elif attempt + 1 < self.delete_attempts:
+                    retry.append((thread_id, attempt + 1))
+                else:
+                    self.delete_failed += 1
+                    logger.warning(f"⚠️ Не удалось удалить thread {thread_id}: {result}")
+            deleted += done
+            self.deleted += done
+            if retry:
+                # Повторим при следующей проверке, чтобы не крутиться на недоступном API
+                self._delete_queue.extend(retry)
+                break
+        if deleted:
+            logger.info(f"🧹 Удалено thread на сервере: {deleted}")
+        return deleted
+
+    def start(self) -> None:
+        """Запускает фоновое вытеснение, удаление и пополнение пула"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        if self.pool is not None:
+            self.pool.start()
+
+    async def stop(self, drain_timeout: float = 5.0) -> None:
+        """Останавливает фоновые задачи, стараясь дослать удаления"""
+        if self.pool is not None:
+            # Неиспользованные thread пула тоже удаляем, чтобы не оставлять их на сервере
+            for thread_id in await self.pool.stop():
+                self._schedule_delete(thread_id)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if drain_timeout > 0 and self._delete_queue:
+            try:
+                await asyncio.wait_for(self.delete_pending(), timeout=drain_timeout)
+            except Exception as e:
+                logger.warning(f"⚠️ Не все thread удалены при остановке: {e}")
+
+    async def _run(self) -> None:
+        try:
+            await self.restore()
+        except Exception as e:
+            logger.error(f"❌ Не удалось восстановить thread из хранилища: {e}")
+        while True:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.sweep_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                evicted = await self.evict_idle()
+                if evicted:
+                    logger.info(f"💤 Вытеснено простаивающих thread: {evicted}")
+                await self.delete_pending()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка очистки thread: {e}")
+
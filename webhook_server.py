@@ -0,0 +1,398 @@
+"""
+Модуль режима webhook для горизонтального масштабирования бота
+ASGI-приложение принимает обновления Telegram и раскладывает их по процессам-воркерам
+по консистентному хешу user_id, сохраняя порядок сообщений каждого диалога
+"""
+
+import asyncio
+import bisect
+import hashlib
+import hmac
+import json
+import logging
+import multiprocessing
+import signal
+import time
+from typing import Dict, List, Optional
+
+from config import Config
+from metrics import REGISTRY
+
+WEBHOOK_UPDATES = REGISTRY.counter('synaplink_webhook_updates', 'Обновления, принятые webhook', ('worker',))
+WORKER_RESTARTS = REGISTRY.counter('synaplink_webhook_worker_restarts', 'Перезапуски упавших воркеров', ('worker',))
+
+logger = logging.getLogger(__name__)
+
+# Где в обновлении Telegram искать отправителя
+_USER_FIELDS = (
+    'message',
+    'edited_message',
+    'callback_query',
+    'inline_query',
+    'chosen_inline_result',
+    'my_chat_member',
+    'chat_member',
+    'chat_join_request',
+    'pre_checkout_query',
+    'shipping_query',
+)
+
+
+def extract_routing_key(update: dict) -> int:
+    """
+    Возвращает ключ маршрутизации обновления: user_id, иначе chat_id, иначе update_id
+
+    Args:
+        update: Обновление Telegram в виде JSON-словаря
+
+    Returns:
+        int: Ключ для выбора воркера
+    """
+    for field in _USER_FIELDS:
+        payload = update.get(field)
+        if not payload:
+            continue
+        sender = payload.get('from')
+        if sender and 'id' in sender:
+            return sender['id']
+        chat = payload.get('chat')
+        if chat and 'id' in chat:
+            return chat['id']
+    for field in ('channel_post', 'edited_channel_post'):
+        chat = (update.get(field) or {}).get('chat')
+        if chat and 'id' in chat:
+            return chat['id']
+    return update.get('update_id', 0)
+
+
+class ConsistentHashRing:
+    """Кольцо консистентного хеширования с виртуальными узлами"""
+
+    def __init__(self, nodes: List[int], replicas: int = 100):
+        """
+        Args:
+            nodes: Идентификаторы узлов (номера воркеров)
+            replicas: Число виртуальных узлов на один реальный
+        """
+        self.replicas = replicas
+        self._ring: List[int] = []
+        self._owners: Dict[int, int] = {}
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+    def add_node(self, node: int) -> None:
+        """Добавляет узел в кольцо"""
+        for i in range(self.replicas):
+            point = self._hash(f"{node}#{i}")
+            self._owners[point] = node
+            bisect.insort(self._ring, point)
+
+    def remove_node(self, node: int) -> None:
+        """Удаляет узел из кольца"""
+        for i in range(self.replicas):
+            point = self._hash(f"{node}#{i}")
+            if self._owners.pop(point, None) is not None:
+                self._ring.remove(point)
+
+    def get_node(self, key) -> int:
+        """Возвращает узел, отвечающий за ключ"""
+        if not self._ring:
+            raise ValueError("Кольцо пустое — нет ни одного воркера")
+        index = bisect.bisect(self._ring, self._hash(str(key))) % len(self._ring)
+        return self._owners[self._ring[index]]
+
+
+class WorkerUnavailable(Exception):
+    """Воркер, отвечающий за пользователя, не работает и пока не перезапущен"""
+
+
+class UpdateRouter:
+    """Раскладывает обновления по очередям воркеров"""
+
+    def __init__(self, queues: List, ring: Optional[ConsistentHashRing] = None,
+                 processes: Optional[List] = None, restart=None, restart_interval: float = 5.0):
+        """
+        Args:
+            queues: Очереди воркеров (multiprocessing.Queue или совместимые)
+            ring: Кольцо хеширования (по умолчанию — по числу очередей)
+            processes: Процессы воркеров для проверки is_alive() (None — не проверять)
+            restart: Функция index -> новый процесс для упавшего воркера (None — не перезапускать)
+            restart_interval: Минимальный интервал между перезапусками одного воркера, секунд
+        """
+        self.queues = queues
+        self.ring = ring or ConsistentHashRing(list(range(len(queues))))
+        self.processes = processes
+        self.restart = restart
+        self.restart_interval = restart_interval
+        self.routed = [0] * len(queues)
+        self.restarts = [0] * len(queues)
+        self._restarted_at = [float('-inf')] * len(queues)
+        self._routed_metric = [WEBHOOK_UPDATES.labels(index) for index in range(len(queues))]
+
+    def dispatch(self, update: dict) -> int:
+        """
+        Отправляет обновление воркеру и возвращает его номер
+
+        Raises:
+            WorkerUnavailable: Воркер упал и не перезапущен — обновление не принято
+        """
+        worker = self.ring.get_node(extract_routing_key(update))
+        if not self.ensure_alive(worker):
+            raise WorkerUnavailable(f"Воркер {worker} не работает")
+        self.queues[worker].put_nowait(update)
+        self.routed[worker] += 1
+        self._routed_metric[worker].inc()
+        return worker
+
+    def ensure_alive(self, worker: int) -> bool:
+        """
+        Проверяет, что воркер жив, и перезапускает упавший
+
+        Очередь остается прежней, поэтому новый процесс дорабатывает накопленные
+        обновления. Перезапуски одного воркера не чаще restart_interval: между ними
+        воркер считается недоступным, и в цикле падений Telegram доставит обновления позже.
+
+        Returns:
+            bool: Воркер работает (или только что перезапущен)
+        """
+        if self.processes is None or self.processes[worker].is_alive():
+            return True
+        now = time.monotonic()
+        if self.restart is None or now - self._restarted_at[worker] < self.restart_interval:
+            return False
+        self._restarted_at[worker] = now
+        exitcode = self.processes[worker].exitcode
+        logger.error(f"❌ Воркер {worker} завершился с кодом {exitcode}, перезапускаем")
+        try:
+            self.processes[worker] = self.restart(worker)
+        except Exception as e:
+            logger.error(f"❌ Не удалось перезапустить воркер {worker}: {e}")
+            return False
+        self.restarts[worker] += 1
+        WORKER_RESTARTS.labels(worker).inc()
+        return True
+
+    def workers_alive(self) -> List[bool]:
+        """Состояние воркеров (упавшие по возможности перезапускаются)"""
+        return [self.ensure_alive(index) for index in range(len(self.queues))]
+
+
+class WebhookApp:
+    """ASGI-приложение, принимающее webhook-обновления Telegram"""
+
+    def __init__(self, router: UpdateRouter, path: str = '/webhook', secret_token: Optional[str] = None,
+                 processed=None, on_startup=None):
+        """
+        Args:
+            router: Маршрутизатор обновлений
+            path: Путь webhook
+            secret_token: Секрет из заголовка X-Telegram-Bot-Api-Secret-Token
+            processed: Счетчики обработанных воркерами обновлений (для /stats)
+            on_startup: Корутина, выполняемая при старте сервера (например, set_webhook)
+        """
+        self.router = router
+        self.path = path
+        self.secret_token = secret_token
+        self.processed = processed
+        self.on_startup = on_startup
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        method, path = scope['method'], scope['path']
+        if method == 'POST' and path == self.path:
+            await self._handle_update(scope, receive, send)
+        elif method == 'GET' and path == '/healthz':
+            alive = self.router.workers_alive()
+            await self._respond(send, 200 if all(alive) else 503, {'ok': all(alive), 'workers': alive})
+        elif method == 'GET' and path == '/stats':
+            await self._respond(send, 200, self.stats())
+        elif method == 'GET' and path == '/metrics':
+            # Метрики процесса-маршрутизатора; у каждого воркера свой /metrics на METRICS_PORT + 1 + номер
+            body = REGISTRY.render().encode()
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [(b'content-type', b'text/plain; version=0.0.4; charset=utf-8'),
+                            (b'content-length', str(len(body)).encode())],
+            })
+            await send({'type': 'http.response.body', 'body': body})
+        else:
+            await self._respond(send, 404, {'ok': False})
+
+    def stats(self) -> dict:
+        """Счетчики маршрутизации и обработки по воркерам"""
+        processed = [counter.value for counter in self.processed] if self.processed else []
+        return {'routed': list(self.router.routed), 'processed': processed, 'restarts': list(self.router.restarts)}
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if self.on_startup:
+                    try:
+                        await self.on_startup()
+                    except Exception as e:
+                        logger.error(f"❌ Ошибка при старте webhook-сервера: {e}")
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _handle_update(self, scope, receive, send):
+        if self.secret_token:
+            headers = dict(scope.get('headers') or [])
+            received = headers.get(b'x-telegram-bot-api-secret-token', b'').decode()
+            if not hmac.compare_digest(received, self.secret_token):
+                await self._respond(send, 403, {'ok': False})
+                return
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        try:
+            update = json.loads(body)
+        except ValueError:
+            await self._respond(send, 400, {'ok': False})
+            return
+
+        try:
+            self.router.dispatch(update)
+        except WorkerUnavailable as e:
+            # Не 200: Telegram повторит доставку, когда воркер поднимется
+            logger.warning(f"⚠️ {e}, обновление вернется от Telegram повторно")
+            await self._respond(send, 503, {'ok': False})
+            return
+        # Отвечаем сразу: обработка идет в воркере, Telegram не ждет ответа бота
+        await self._respond(send, 200, {'ok': True})
+
+    @staticmethod
+    async def _respond(send, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+def _worker_main(index: int, queue, processed) -> None:
+    """Точка входа процесса-воркера: свой экземпляр бота, обновления из очереди"""
+    from run_bot import setup_logging
+    # У каждого воркера свой файл: ротация одного файла из нескольких процессов небезопасна
+    setup_logging(filename=f"bot-worker-{index}.log")
+    from bot import SynaplinkBot
+
+    # Сигналы остановки обрабатывает главный процесс: он шлет воркерам None после
+    # приема последних обновлений, и воркер дорабатывает диалоги (SynaplinkBot.drain)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logger.info(f"👷 Воркер {index} запускается...")
+    if Config.METRICS_PORT:
+        Config.METRICS_PORT += 1 + index
+    bot = SynaplinkBot()
+    asyncio.run(bot.process_update_queue(queue, processed))
+
+
+def start_workers(count: int):
+    """
+    Запускает процессы-воркеры
+
+    Returns:
+        tuple: (процессы, очереди, счетчики обработанных обновлений)
+    """
+    ctx = multiprocessing.get_context('spawn')
+    queues = [ctx.Queue() for _ in range(count)]
+    processed = [ctx.Value('q', 0) for _ in range(count)]
+    processes = [spawn_worker(index, queues[index], processed[index]) for index in range(count)]
+    logger.info(f"✅ Запущено воркеров: {count}")
+    return processes, queues, processed
+
+
+def spawn_worker(index: int, queue, processed):
+    """Запускает процесс-воркер с номером index на его очереди (при старте и после падения)"""
+    process = multiprocessing.get_context('spawn').Process(
+        target=_worker_main,
+        args=(index, queue, processed),
+        name=f"synaplink-worker-{index}",
+        daemon=True
+    )
+    process.start()
+    return process
+
+
+def stop_workers(processes, queues, timeout: Optional[float] = None) -> None:
+    """
+    Просит воркеры доработать очередь и завершиться
+
+    Args:
+        timeout: Общий предел ожидания (по умолчанию SHUTDOWN_TIMEOUT с запасом)
+    """
+    if timeout is None:
+        timeout = Config.SHUTDOWN_TIMEOUT + 5.0
+    for queue in queues:
+        queue.put(None)
+    # Воркеры останавливаются параллельно, поэтому дедлайн общий, а не на каждого
+    deadline = time.monotonic() + timeout
+    for process in processes:
+        process.join(max(0.0, deadline - time.monotonic()))
+        if process.is_alive():
+            logger.warning(f"⚠️ Воркер {process.name} не завершился вовремя, останавливаем")
+            process.terminate()
+
+
+def run_webhook(workers: Optional[int] = None) -> None:
+    """Запускает webhook-сервер с пулом воркеров (блокирующий вызов)"""
+    try:
+        import uvicorn
+    except ImportError:
+        raise RuntimeError("Для режима webhook установите uvicorn: pip install uvicorn")
+
+    workers = workers or Config.WEBHOOK_WORKERS
+    processes, queues, processed = start_workers(workers)
+
+    async def register_webhook():
+        if not Config.WEBHOOK_URL:
+            logger.warning("⚠️ WEBHOOK_URL не задан — webhook в Telegram не регистрируется")
+            return
+        from telegram import Bot, Update
+        from http_transport import telegram_request
+        async with Bot(Config.TELEGRAM_BOT_TOKEN, request=telegram_request('telegram_webhook', pool_size=1)) as bot:
+            await bot.set_webhook(
+                url=Config.WEBHOOK_URL.rstrip('/') + Config.WEBHOOK_PATH,
+                secret_token=Config.WEBHOOK_SECRET or None,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=Config.DROP_PENDING_UPDATES
+            )
+        logger.info(f"✅ Webhook зарегистрирован: {Config.WEBHOOK_URL}")
+
+    router = UpdateRouter(
+        queues,
+        processes=processes,
+        restart=lambda index: spawn_worker(index, queues[index], processed[index])
+    )
+    app = WebhookApp(
+        router,
+        path=Config.WEBHOOK_PATH,
+        secret_token=Config.WEBHOOK_SECRET or None,
+        processed=processed,
+        on_startup=register_webhook
+    )
+    logger.info(f"🌐 Webhook-сервер на {Config.WEBHOOK_LISTEN}:{Config.WEBHOOK_PORT}{Config.WEBHOOK_PATH}")
+    try:
+        uvicorn.run(app, host=Config.WEBHOOK_LISTEN, port=Config.WEBHOOK_PORT, log_level='warning')
+    finally:
+        stop_workers(processes, queues)